@@ -332,19 +332,12 @@ def _get_proxy_net_location(proxy_settings):
 
 
 def _send_data_part(data, connection):
-    if isinstance(data, (str, bytes)):
-        connection.send(data)
-        return
-    # Check to see if data is a file-like object that has a read method.
-    elif hasattr(data, 'read'):
-        # Read the file and send it a chunk at a time.
-        while 1:
-            binarydata = data.read(100000)
-            if binarydata == '': break
-            connection.send(binarydata)
-        return
+    if (isinstance(data, (str, bytes, bytearray, memoryview))
+            or hasattr(data, 'read')):
+        # Strings are encoded, and regular files are sent without copying
+        # them through Python where possible.
+        atom.http_core._send_data_part(data, connection)
     else:
         # The data object was not a file.
         # Try to convert to a string and send the data.
-        connection.send(str(data))
-        return
+        atom.http_core._send_data_part(str(data), connection)
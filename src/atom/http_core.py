@@ -23,7 +23,9 @@
 
 import http.client
 import io
+import mmap
 import os
+import stat
 import urllib.error
 import urllib.parse
 import urllib.parse
@@ -50,6 +52,9 @@ class ProxyError(Error):
 
 MIME_BOUNDARY = 'END_OF_PART'
 
+# Largest block sent at once from a file-like body part.
+SEND_BLOCK_SIZE = 1048576
+
 
 def get_headers(http_response):
     """Retrieves all HTTP headers from an HTTP response from the server.
@@ -110,12 +115,15 @@ class HttpRequest(object):
         in RFC 1341.
 
         Args:
-          data: str or a file-like object containing a part of the request body.
+          data: str, a bytes-like object (bytes, bytearray or memoryview) or a
+                file-like object containing a part of the request body.
           mime_type: str The MIME type describing the data
           size: int Required if the data is a file like object. If the data is a
                 string, the size is calculated so this parameter is ignored.
         """
-        if hasattr(data, '__len__'):
+        if isinstance(data, memoryview):
+            size = data.nbytes
+        elif hasattr(data, '__len__'):
             size = len(data)
         if size is None:
             # TODO: support chunked transfer if some of the body is of unknown size.
@@ -214,6 +222,8 @@ class HttpRequest(object):
         for part in self._body_parts:
             if isinstance(part, str):
                 output += '    %s: %s\n' % (i, part)
+            elif isinstance(part, (bytes, bytearray, memoryview)):
+                output += '    %s: <%s bytes>\n' % (i, memoryview(part).nbytes)
             else:
                 output += '    %s: <file like object>\n' % i
             i += 1
@@ -505,12 +515,18 @@ def _send_data_part(data, connection):
     if isinstance(data, str):
         # I might want to just allow str, not unicode.
         connection.send(data.encode())
+    elif isinstance(data, (bytes, bytearray, memoryview)):
+        connection.send(data)
     # Check to see if data is a file-like object that has a read method.
     elif hasattr(data, 'read'):
+        if _send_file(data, connection):
+            return
         # Read the file and send it a chunk at a time.
         while 1:
-            binarydata = data.read(100000)
-            if binarydata == b'': break
+            binarydata = data.read(SEND_BLOCK_SIZE)
+            if not binarydata: break
+            if isinstance(binarydata, str):
+                binarydata = binarydata.encode()
             connection.send(binarydata)
     else:
         # The data object was not a file.
@@ -518,6 +534,48 @@ def _send_data_part(data, connection):
         connection.send(data)
 
 
+def _send_file(file_handle, connection):
+    """Sends the rest of a regular binary file without copying it in Python.
+
+    Plain sockets hand the file to the kernel with sendfile. TLS has to
+    encrypt in user space, so for TLS (or when the socket is not available)
+    the file is memory mapped and sent as memoryview slices.
+
+    Returns:
+      False, having sent nothing, if file_handle is not a regular binary file.
+    """
+    if isinstance(file_handle, io.TextIOBase):
+        return False
+    try:
+        fileno = file_handle.fileno()
+        offset = file_handle.tell()
+        file_stat = os.fstat(fileno)
+    except (AttributeError, OSError, ValueError):
+        return False
+    if not stat.S_ISREG(file_stat.st_mode):
+        return False
+    size = file_stat.st_size
+    if offset >= size:
+        return True
+
+    sock = getattr(connection, 'sock', None)
+    if (sock is not None and hasattr(sock, 'sendfile') and
+            not (ssl and isinstance(sock, ssl.SSLSocket))):
+        sock.sendfile(file_handle, offset, size - offset)
+        return True
+
+    with mmap.mmap(fileno, 0, access=mmap.ACCESS_READ) as mapped:
+        view = memoryview(mapped)
+        try:
+            for start in range(offset, size, SEND_BLOCK_SIZE):
+                with view[start:min(start + SEND_BLOCK_SIZE, size)] as block:
+                    connection.send(block)
+        finally:
+            view.release()
+    file_handle.seek(size)
+    return True
+
+
 class ProxiedHttpClient(HttpClient):
     def _get_connection(self, uri, headers=None):
         # Check to see if there are proxy settings required for this request.
@@ -308,6 +308,17 @@ class MockHttpResponse(atom.http_core.HttpResponse):
                 self._body = body.read()
             else:
                 self._body = body
-
-    def read(self):
-        return self._body
+        self._position = 0
+
+    def read(self, amt=None):
+        # Reading the whole body can be repeated, partial reads advance
+        # through the body like a real response and start over once the end
+        # of the body has been returned.
+        if amt is None or self._body is None:
+            return self._body
+        chunk = self._body[self._position:self._position + amt]
+        if chunk:
+            self._position += len(chunk)
+        else:
+            self._position = 0
+        return chunk
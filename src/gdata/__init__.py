@@ -53,11 +53,12 @@ class MediaSource(object):
 
         Args:
           file_handle: A file handle pointing to the file to be encapsulated in the
-                       MediaSource
+                       MediaSource, or a bytes-like object (bytes, bytearray or
+                       memoryview) holding the media itself.
           content_type: string The MIME type of the file. Required if a file_handle
                         is given.
           content_length: int The size of the file. Required if a file_handle is
-                          given.
+                          given, unless it is a bytes-like object.
           file_path: string (optional) A full path name to the file. Used in
                         place of a file_handle.
           file_name: string The name of the file without any path information.
@@ -65,6 +66,9 @@ class MediaSource(object):
         """
         self.file_handle = file_handle
         self.content_type = content_type
+        if (content_length is None and
+                isinstance(file_handle, (bytes, bytearray, memoryview))):
+            content_length = memoryview(file_handle).nbytes
         self.content_length = content_length
         self.file_name = file_name
 
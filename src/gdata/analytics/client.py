@@ -66,6 +66,42 @@ class AnalyticsClient(gdata.client.GDClient):
 
     GetDataFeed = get_data_feed
 
+    def get_data_columns(self, feed_uri, columns=None, auth_token=None,
+                         **kwargs):
+        """Reads every page of a data feed query column by column.
+
+        The feed is streamed page by page into a
+        gdata.analytics.data.DataColumns, no DataFeed or DataEntry objects
+        are created.
+
+        Args:
+          feed_uri: str or gdata.analytics.client.DataFeedQuery The Analytics
+              Data Feed uri to define what data to retrieve from the API.
+          columns: gdata.analytics.data.DataColumns (optional) Receives the
+              rows, after those it already holds. A new one is created if
+              None.
+
+        Returns:
+          The gdata.analytics.data.DataColumns holding the rows, the totals
+          from the feed's aggregates and whether the data was sampled.
+        """
+        if columns is None:
+            columns = gdata.analytics.data.DataColumns()
+
+        def read_page(response):
+            return gdata.analytics.data.read_data_rows(response, columns)
+
+        next_uri = self.request(method='GET', uri=feed_uri,
+                                auth_token=auth_token, converter=read_page,
+                                **kwargs)
+        while next_uri is not None:
+            next_uri = self.request(method='GET', uri=next_uri,
+                                    auth_token=auth_token, converter=read_page,
+                                    **kwargs)
+        return columns
+
+    GetDataColumns = get_data_columns
+
     def get_management_feed(self, feed_uri, auth_token=None, **kwargs):
         """Makes a request to the Google Analytics Management API.
 
@@ -15,6 +15,11 @@ data class.
 
 # __author__ = 'api.nickm@google.com (Nick Mihailovski)'
 
+import array
+import sys
+
+import lxml.etree as ElementTree
+
 import atom.core
 import atom.data
 import gdata.data
@@ -365,3 +370,290 @@ class ManagementFeed(gdata.data.GDFeed):
     _qname = atom.data.ATOM_TEMPLATE % 'feed'
     entry = [ManagementEntry]
     kind = GD_NS % 'kind'
+
+
+# Metric types stored as 64 bit integers by DataColumns, the other types
+# (float, percent, time, currency) are stored as doubles.
+INTEGER_METRIC_TYPES = ('integer',)
+
+
+def parse_metric_value(metric_type, text):
+    """Converts the value of a <dxp:metric> to an int or a float."""
+    if metric_type in INTEGER_METRIC_TYPES:
+        try:
+            return int(text)
+        except ValueError:
+            return int(float(text))
+    return float(text)
+
+
+ParseMetricValue = parse_metric_value
+
+
+class DataColumns(object):
+    """Holds the rows of a data feed column by column.
+
+    Each dimension is kept in a list of interned strings, so a value which
+    repeats over many rows is stored once. Each metric is parsed once into
+    an array, of 64 bit integers for integer metrics and of doubles for the
+    other types. No DataEntry, Dimension or Metric objects are kept.
+
+    The dimension and metric names, and the metric types, are taken from
+    the first row which is read.
+
+    Attributes:
+      dimension_names: list of the dimension names, in feed order.
+      metric_names: list of the metric names, in feed order.
+      metric_types: dict mapping each metric name to its type.
+      dimensions: dict mapping each dimension name to its list of values.
+      metrics: dict mapping each metric name to its array of values.
+      aggregates: dict mapping each metric name to its total over the whole
+          query, from <dxp:aggregates>.
+      total_results: int The number of rows of the query, or None.
+      contains_sampled_data: boolean Whether any page read was sampled.
+      start_date: str The first day of the query.
+      end_date: str The last day of the query.
+    """
+
+    def __init__(self):
+        self.dimension_names = None
+        self.metric_names = None
+        self.metric_types = {}
+        self.dimensions = {}
+        self.metrics = {}
+        self.aggregates = {}
+        self.total_results = None
+        self.contains_sampled_data = False
+        self.start_date = None
+        self.end_date = None
+        self.row_count = 0
+        self._dimension_indexes = None
+        self._metric_indexes = None
+
+    def __len__(self):
+        return self.row_count
+
+    def _set_names(self, dimensions, metrics):
+        self.dimension_names = [name for name, _ in dimensions]
+        self.metric_names = [name for name, _, _ in metrics]
+        self._dimension_indexes = dict(
+            (name, index) for index, name in enumerate(self.dimension_names))
+        self._metric_indexes = dict(
+            (name, index) for index, name in enumerate(self.metric_names))
+        for name in self.dimension_names:
+            self.dimensions[name] = []
+        for name, metric_type, _ in metrics:
+            self.metric_types[name] = metric_type
+            if metric_type in INTEGER_METRIC_TYPES:
+                self.metrics[name] = array.array('q')
+            else:
+                self.metrics[name] = array.array('d')
+
+    def add_row(self, dimensions, metrics):
+        """Adds one row.
+
+        Args:
+          dimensions: list of (name, value) pairs.
+          metrics: list of (name, type, value) tuples, with the value as the
+              text found in the feed.
+
+        Raises:
+          ValueError if the row does not have the dimensions and metrics of
+          the first row.
+        """
+        if self.dimension_names is None:
+            self._set_names(dimensions, metrics)
+        if (len(dimensions) != len(self.dimension_names)
+                or len(metrics) != len(self.metric_names)):
+            raise ValueError('Row %s does not have the columns of the first '
+                             'row' % self.row_count)
+        intern = sys.intern
+        try:
+            for name, value in dimensions:
+                self.dimensions[name].append(intern(value))
+            for name, metric_type, value in metrics:
+                self.metrics[name].append(
+                    parse_metric_value(self.metric_types[name], value))
+        except KeyError as error:
+            raise ValueError('Row %s has the unknown column %s' % (
+                self.row_count, error))
+        self.row_count += 1
+
+    AddRow = add_row
+
+    def copy_layout(self):
+        """Returns an empty DataColumns with the same columns as this one."""
+        columns = DataColumns()
+        if self.dimension_names is not None:
+            columns._set_names(
+                [(name, None) for name in self.dimension_names],
+                [(name, self.metric_types[name], None)
+                 for name in self.metric_names])
+        return columns
+
+    CopyLayout = copy_layout
+
+    def add_values(self, dimension_values, metric_values):
+        """Adds one row of values which are already parsed, in column order.
+
+        Args:
+          dimension_values: sequence of str, one per dimension name.
+          metric_values: sequence of numbers, one per metric name.
+        """
+        for name, value in zip(self.dimension_names, dimension_values):
+            self.dimensions[name].append(value)
+        for name, value in zip(self.metric_names, metric_values):
+            self.metrics[name].append(value)
+        self.row_count += 1
+
+    AddValues = add_values
+
+    def sort_rows(self, sort):
+        """Reorders the rows like the sort parameter of a data feed query.
+
+        Args:
+          sort: str Comma separated column names, each one prefixed with -
+              for a descending order, for example '-ga:visits,ga:country'.
+        """
+        order = list(range(self.row_count))
+        # Stable sorts from the last key to the first give the combined order.
+        for key in reversed([key.strip() for key in sort.split(',')
+                             if key.strip()]):
+            descending = key.startswith('-')
+            column = self.get_column(key.lstrip('-'))
+            order.sort(key=column.__getitem__, reverse=descending)
+        for name in self.dimension_names or []:
+            values = self.dimensions[name]
+            self.dimensions[name] = [values[index] for index in order]
+        for name in self.metric_names or []:
+            values = self.metrics[name]
+            self.metrics[name] = array.array(
+                values.typecode, [values[index] for index in order])
+
+    SortRows = sort_rows
+
+    def get_column(self, name):
+        """Returns the list of values of a dimension or the array of a metric."""
+        if name in self.dimensions:
+            return self.dimensions[name]
+        return self.metrics[name]
+
+    GetColumn = get_column
+
+    def get_row(self, index):
+        """Returns one row as a tuple of dimension values then metric values."""
+        return tuple(
+            [self.dimensions[name][index] for name in self.dimension_names]
+            + [self.metrics[name][index] for name in self.metric_names])
+
+    GetRow = get_row
+
+    def iter_rows(self):
+        """Yields each row as a tuple of dimension values then metric values."""
+        if self.dimension_names is None:
+            return iter(())
+        return zip(*([self.dimensions[name] for name in self.dimension_names]
+                     + [self.metrics[name] for name in self.metric_names]))
+
+    IterRows = iter_rows
+
+    def get_total(self, name):
+        """Returns the aggregate of a metric over the whole query, or None."""
+        return self.aggregates.get(name)
+
+    GetTotal = get_total
+
+    def to_numpy(self, name=None):
+        """Exports columns as NumPy arrays, importing NumPy on demand.
+
+        Metrics become int64 or float64 arrays and dimensions object arrays.
+
+        Args:
+          name: str (optional) The column to export. If None, a dict mapping
+              every column name to its array is returned.
+        """
+        import numpy
+        if name is None:
+            return dict((column, self.to_numpy(column))
+                        for column in (self.dimension_names or [])
+                        + (self.metric_names or []))
+        if name in self.dimensions:
+            return numpy.array(self.dimensions[name], dtype=object)
+        column = self.metrics[name]
+        return numpy.array(column, dtype=column.typecode)
+
+    ToNumpy = to_numpy
+
+
+_ATOM_ENTRY = '{http://www.w3.org/2005/Atom}entry'
+_ATOM_LINK = '{http://www.w3.org/2005/Atom}link'
+_ATOM_FEED = '{http://www.w3.org/2005/Atom}feed'
+_DIMENSION = DXP_NS % 'dimension'
+_METRIC = DXP_NS % 'metric'
+_TOTAL_RESULTS = (gdata.data.OPENSEARCH_TEMPLATE_V1 % 'totalResults',
+                  gdata.data.OPENSEARCH_TEMPLATE_V2 % 'totalResults')
+
+
+def _drop(element):
+    """Frees a parsed element and the siblings parsed before it."""
+    element.clear()
+    parent = element.getparent()
+    while element.getprevious() is not None:
+        del parent[0]
+
+
+def read_data_rows(stream, columns):
+    """Streams the rows of one data feed page into a DataColumns.
+
+    Each entry is discarded as soon as its dimensions and metrics have been
+    copied, no DataEntry objects are built.
+
+    Args:
+      stream: file-like object with the XML of a data feed.
+      columns: DataColumns which receives the rows.
+
+    Returns:
+      The href of the feed's next link, or None if this is the last page.
+    """
+    next_link = None
+    for _, element in ElementTree.iterparse(
+            stream, events=('end',),
+            tag=(_ATOM_ENTRY, _ATOM_LINK, DXP_NS % 'aggregates',
+                 DXP_NS % 'containsSampledData', DXP_NS % 'startDate',
+                 DXP_NS % 'endDate') + _TOTAL_RESULTS):
+        tag = element.tag
+        if tag == _ATOM_ENTRY:
+            dimensions = []
+            metrics = []
+            for child in element:
+                if child.tag == _DIMENSION:
+                    dimensions.append((child.get('name'), child.get('value')))
+                elif child.tag == _METRIC:
+                    metrics.append((child.get('name'), child.get('type'),
+                                    child.get('value')))
+            columns.add_row(dimensions, metrics)
+            _drop(element)
+        elif tag == _ATOM_LINK:
+            if (element.get('rel') == 'next'
+                    and element.getparent().tag == _ATOM_FEED):
+                next_link = element.get('href')
+        elif tag == DXP_NS % 'aggregates':
+            # Every page repeats the totals of the whole query.
+            if not columns.aggregates:
+                for metric in element.iterchildren(_METRIC):
+                    columns.aggregates[metric.get('name')] = (
+                        parse_metric_value(metric.get('type'),
+                                           metric.get('value')))
+        elif tag == DXP_NS % 'containsSampledData':
+            if (element.text or '').strip() == 'true':
+                columns.contains_sampled_data = True
+        elif tag == DXP_NS % 'startDate':
+            columns.start_date = element.text
+        elif tag == DXP_NS % 'endDate':
+            columns.end_date = element.text
+        elif element.text:
+            columns.total_results = int(element.text)
+    return next_link
+
+
+ReadDataRows = read_data_rows
@@ -0,0 +1,356 @@
+#
+# Licensed under the Apache License 2.0;
+
+
+"""Runs large Analytics data queries as parallel date-range shards.
+
+One data feed query over a long date range has to be paged through
+max-results rows at a time, one request after the other, and Analytics
+answers it from sampled data when the range holds too many sessions. A
+QueryPlanner cuts the range of a DataFeedQuery into shards of a day or a
+week, fetches the shards from a pool of threads within a
+gdata.client.RateLimiter, and cuts every shard which still comes back with
+dxp:containsSampledData in two, until the shards are a single day.
+
+The rows of the shards are merged into one gdata.analytics.data.DataColumns
+in date order, or in the order of the query's sort parameter. Rows of
+different shards with the same dimension values, which is the case unless
+ga:date or a finer date dimension is part of the query, are combined into
+one row. Additive metrics (integer and currency types) are summed.
+Averages, ratios and counts of distinct visitors, such as ga:visitors, can
+not be rebuilt from the shards, they are NaN in combined rows; compute
+averages from additive metrics instead, for example
+ga:timeOnSite / ga:visits. The aggregates of the whole range are read
+from one more request with max-results=1, so they hold every metric.
+
+Example Usage:
+client = gdata.analytics.client.AnalyticsClient()
+query = gdata.analytics.client.DataFeedQuery({
+    'ids': 'ga:1174', 'dimensions': 'ga:date,ga:source',
+    'metrics': 'ga:visits', 'start-date': '2011-01-01',
+    'end-date': '2011-12-31', 'max-results': '10000'})
+planner = gdata.analytics.planner.QueryPlanner(client)
+result = planner.run(query)
+for row in result.columns.iter_rows():
+  print(row)
+"""
+
+import array
+import concurrent.futures
+import datetime
+
+import gdata.analytics.client
+import gdata.analytics.data
+import gdata.client
+
+DAY = 'day'
+WEEK = 'week'
+SHARD_DAYS = {DAY: 1, WEEK: 7}
+# Number of shards fetched at the same time.
+DEFAULT_MAX_WORKERS = 4
+# Requests per second allowed by the Data Export API quota.
+DEFAULT_QUERIES_PER_SECOND = 10
+DATE_FORMAT = '%Y-%m-%d'
+
+# Metric types whose values over a range are the sum of their values over
+# the parts of the range.
+ADDITIVE_METRIC_TYPES = ('integer', 'currency', 'us_currency')
+# Integer metrics which count distinct visitors, who can come back on
+# several days of the range.
+DISTINCT_COUNT_METRICS = frozenset(['ga:visitors', 'ga:newVisitors',
+                                    'ga:users', 'ga:newUsers'])
+
+
+def parse_date(value):
+    """Returns a datetime.date for a date or a 'YYYY-MM-DD' string."""
+    if isinstance(value, datetime.date):
+        return value
+    return datetime.datetime.strptime(value, DATE_FORMAT).date()
+
+
+ParseDate = parse_date
+
+
+def is_additive(metric_name, metric_type):
+    """Returns whether a metric over a range is the sum over its parts."""
+    return (metric_type in ADDITIVE_METRIC_TYPES
+            and metric_name not in DISTINCT_COUNT_METRICS)
+
+
+IsAdditive = is_additive
+
+
+def split_date_range(start_date, end_date, shard=WEEK):
+    """Cuts a date range into consecutive shards.
+
+    Args:
+      start_date: datetime.date or str The first day of the range.
+      end_date: datetime.date or str The last day of the range, included.
+      shard: str DAY or WEEK, the length of each shard. The last shard can
+          be shorter.
+
+    Returns:
+      A list of (first day, last day) pairs of datetime.dates.
+    """
+    start_date = parse_date(start_date)
+    end_date = parse_date(end_date)
+    step = datetime.timedelta(days=SHARD_DAYS[shard])
+    shards = []
+    while start_date <= end_date:
+        last = min(start_date + step - datetime.timedelta(days=1), end_date)
+        shards.append((start_date, last))
+        start_date = last + datetime.timedelta(days=1)
+    return shards
+
+
+SplitDateRange = split_date_range
+
+
+class Shard(object):
+    """The part of a query over one date range.
+
+    Attributes:
+      start_date: datetime.date The first day of the shard.
+      end_date: datetime.date The last day of the shard.
+      columns: gdata.analytics.data.DataColumns The rows of the shard, once
+          it is fetched.
+      requests: int The number of pages requested for the shard.
+    """
+
+    def __init__(self, start_date, end_date):
+        self.start_date = start_date
+        self.end_date = end_date
+        self.columns = None
+        self.requests = 0
+
+    def __repr__(self):
+        return 'Shard(%s, %s)' % (self.start_date, self.end_date)
+
+    def get_days(self):
+        return (self.end_date - self.start_date).days + 1
+
+    GetDays = get_days
+
+    def is_sampled(self):
+        return self.columns is not None and self.columns.contains_sampled_data
+
+    IsSampled = is_sampled
+
+    def split(self):
+        """Returns the two halves of the shard, which must be over a day."""
+        middle = self.start_date + datetime.timedelta(
+            days=(self.get_days() - 1) // 2)
+        return [Shard(self.start_date, middle),
+                Shard(middle + datetime.timedelta(days=1), self.end_date)]
+
+    Split = split
+
+
+class PlanResult(object):
+    """The merged outcome of a QueryPlanner run.
+
+    Attributes:
+      columns: gdata.analytics.data.DataColumns The merged rows, with the
+          aggregates of the whole range.
+      shards: list of the Shards the rows came from, in date order.
+      requests: int The number of pages requested, split shards and the
+          aggregates request included.
+      splits: int The number of sampled shards which were cut in two.
+    """
+
+    def __init__(self, columns, shards, requests, splits):
+        self.columns = columns
+        self.shards = shards
+        self.requests = requests
+        self.splits = splits
+
+    def is_sampled(self):
+        """Returns whether a one day shard still came back sampled."""
+        return self.columns.contains_sampled_data
+
+    IsSampled = is_sampled
+
+
+class QueryPlanner(object):
+    """Fetches a data feed query as date-range shards in parallel."""
+
+    def __init__(self, client, shard=WEEK, max_workers=DEFAULT_MAX_WORKERS,
+                 limiter=None, split_sampled=True):
+        """Creates a planner.
+
+        Args:
+          client: gdata.analytics.client.AnalyticsClient used from several
+              threads.
+          shard: str (optional) DAY or WEEK, the length of the first shards.
+          max_workers: int (optional) Number of pages requested at once.
+          limiter: gdata.client.RateLimiter (optional) Paces every page
+              request, by default to DEFAULT_QUERIES_PER_SECOND.
+          split_sampled: boolean (optional) Whether sampled shards are cut
+              in two and fetched again.
+        """
+        self.client = client
+        self.shard = shard
+        self.max_workers = max_workers
+        if limiter is None:
+            limiter = gdata.client.RateLimiter(DEFAULT_QUERIES_PER_SECOND)
+        self.limiter = limiter
+        self.split_sampled = split_sampled
+
+    def plan(self, query):
+        """Returns the first Shards of a DataFeedQuery or dict of parameters."""
+        parameters = self._get_parameters(query)
+        return [Shard(start_date, end_date) for start_date, end_date in
+                split_date_range(parameters['start-date'],
+                                 parameters['end-date'], self.shard)]
+
+    Plan = plan
+
+    def run(self, query, progress=None, **kwargs):
+        """Fetches every shard of a query and merges them.
+
+        The max-results parameter of the query sets the page size of each
+        shard, every shard is read to its last page. The aggregates are
+        fetched for the whole range alongside the shards.
+
+        Args:
+          query: gdata.analytics.client.DataFeedQuery or dict of query
+              parameters, including start-date and end-date.
+          progress: (optional) function called as progress(shard) when a
+              shard is done, split or not, from the calling thread.
+          kwargs: Other parameters to pass to client.request().
+
+        Returns:
+          A PlanResult.
+        """
+        parameters = self._get_parameters(query)
+        done = []
+        requests = 0
+        splits = 0
+        with concurrent.futures.ThreadPoolExecutor(
+                max_workers=self.max_workers) as executor:
+            totals = executor.submit(self._fetch_aggregates, parameters,
+                                     kwargs)
+            pending = set(executor.submit(self._fetch, shard, parameters,
+                                          kwargs)
+                          for shard in self.plan(parameters))
+            while pending:
+                finished, pending = concurrent.futures.wait(
+                    pending, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in finished:
+                    shard = future.result()
+                    requests += shard.requests
+                    if (self.split_sampled and shard.is_sampled()
+                            and shard.get_days() > 1):
+                        splits += 1
+                        for half in shard.split():
+                            pending.add(executor.submit(
+                                self._fetch, half, parameters, kwargs))
+                    else:
+                        done.append(shard)
+                    if progress is not None:
+                        progress(shard)
+            totals = totals.result()
+        requests += 1
+        done.sort(key=lambda shard: shard.start_date)
+        columns = merge_shards(done, parameters.get('sort'))
+        columns.aggregates = dict(totals.aggregates)
+        columns.start_date = str(parameters['start-date'])
+        columns.end_date = str(parameters['end-date'])
+        return PlanResult(columns, done, requests, splits)
+
+    Run = run
+
+    def _get_parameters(self, query):
+        if isinstance(query, gdata.analytics.client.DataFeedQuery):
+            return dict(query.query)
+        return dict(query)
+
+    def _fetch(self, shard, parameters, kwargs):
+        parameters = dict(parameters)
+        parameters['start-date'] = shard.start_date.strftime(DATE_FORMAT)
+        parameters['end-date'] = shard.end_date.strftime(DATE_FORMAT)
+        columns = gdata.analytics.data.DataColumns()
+
+        def read_page(response):
+            return gdata.analytics.data.read_data_rows(response, columns)
+
+        next_uri = gdata.analytics.client.DataFeedQuery(parameters)
+        while next_uri is not None:
+            self.limiter.acquire()
+            shard.requests += 1
+            next_uri = self.client.request(method='GET', uri=next_uri,
+                                           converter=read_page, **kwargs)
+        shard.columns = columns
+        return shard
+
+    def _fetch_aggregates(self, parameters, kwargs):
+        """Returns a DataColumns with the aggregates of the whole range."""
+        parameters = dict(parameters)
+        parameters['max-results'] = '1'
+        parameters.pop('start-index', None)
+        columns = gdata.analytics.data.DataColumns()
+        self.limiter.acquire()
+        self.client.request(
+            method='GET',
+            uri=gdata.analytics.client.DataFeedQuery(parameters),
+            converter=lambda response: gdata.analytics.data.read_data_rows(
+                response, columns), **kwargs)
+        return columns
+
+
+def merge_shards(shards, sort=None):
+    """Merges the rows of shards into one DataColumns.
+
+    Rows with the same dimension values are combined, see the module
+    documentation. The aggregates of the additive metrics are summed.
+
+    Args:
+      shards: list of fetched Shards, in date order.
+      sort: str (optional) The sort parameter of the query. If None, rows
+          stay in date order, then in the order the server returned them.
+
+    Returns:
+      A gdata.analytics.data.DataColumns.
+    """
+    merged = gdata.analytics.data.DataColumns()
+    rows = {}
+    for shard in shards:
+        columns = shard.columns
+        if columns.dimension_names is None:
+            # The shard has no rows.
+            continue
+        if merged.dimension_names is None:
+            merged = columns.copy_layout()
+            dimension_count = len(merged.dimension_names)
+            metric_names = merged.metric_names
+            additive = [is_additive(name, merged.metric_types[name])
+                        for name in metric_names]
+            for name, summed in zip(metric_names, additive):
+                if not summed:
+                    # Holds doubles, to make room for NaN.
+                    merged.metrics[name] = array.array('d')
+        for name, total in columns.aggregates.items():
+            if is_additive(name, merged.metric_types.get(name)):
+                merged.aggregates[name] = merged.aggregates.get(name, 0) + total
+        for row in columns.iter_rows():
+            key = row[:dimension_count]
+            index = rows.get(key)
+            if index is None:
+                rows[key] = merged.row_count
+                merged.add_values(key, row[dimension_count:])
+                continue
+            for name, summed, value in zip(
+                    metric_names, additive, row[dimension_count:]):
+                if summed:
+                    merged.metrics[name][index] += value
+                else:
+                    merged.metrics[name][index] = float('nan')
+    merged.contains_sampled_data = any(
+        shard.columns.contains_sampled_data for shard in shards)
+    merged.total_results = merged.row_count
+    if sort and merged.dimension_names is not None:
+        merged.sort_rows(sort)
+    return merged
+
+
+MergeShards = merge_shards
@@ -64,14 +64,7 @@ class AppsClient(gdata.client.GDClient):
         Returns:
           desired_class: subclass of gdata.data.GDFeed.
         """
-
-        next = feed.GetNextLink()
-        while next is not None:
-            next_feed = self.GetFeed(next.href, desired_class=desired_class)
-            for a_entry in next_feed.entry:
-                feed.entry.append(a_entry)
-            next = next_feed.GetNextLink()
-        return feed
+        return self.GetAllPages(feed, desired_class=desired_class)
 
     def CreateUser(self, user_name, family_name, given_name, password,
                    suspended=False, admin=None, quota_limit=None,
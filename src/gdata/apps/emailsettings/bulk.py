@@ -0,0 +1,333 @@
+#
+# Licensed under the Apache License 2.0;
+
+
+"""Applies one email settings change to every user of a domain.
+
+Each EmailSettingsClient method changes the settings of one user with one
+blocking request, so rolling a signature out to tens of thousands of users
+one call after the other takes hours. A BulkExecutor reads users from any
+iterable, for example the entries streamed from
+gdata.apps.multidomain.client.MultiDomainProvisioningClient, and applies a
+SettingsOperation to them from a pool of threads:
+
+- the requests of each domain go through a gdata.client.RateLimiter, so
+  the executor stays within the API quota of every domain;
+- server errors and network errors are retried with exponential backoff;
+- every user done is appended to a BulkCheckpoint, so running the same
+  operation again after an interruption skips the users already done;
+- the outcome of the run is kept in a BulkResult.
+
+Example Usage:
+client = gdata.apps.emailsettings.client.EmailSettingsClient(
+    domain='example.com')
+operation = gdata.apps.emailsettings.bulk.SettingsOperation(
+    'update_signature', signature='Example Inc.')
+executor = gdata.apps.emailsettings.bulk.BulkExecutor(
+    client, checkpoint=gdata.apps.emailsettings.bulk.BulkCheckpoint(
+        'signature.log'))
+result = executor.execute(users, operation)
+print(result.get_summary())
+for username, error in result.failed.items():
+  print(username, error)
+"""
+
+import hashlib
+import http.client
+import os
+import threading
+import time
+
+import gdata.client
+
+# Number of users changed at the same time.
+DEFAULT_MAX_WORKERS = 8
+# Requests per second sent to each domain.
+DEFAULT_QUERIES_PER_SECOND = 5
+# Times a request is sent again after a server or network error.
+DEFAULT_MAX_RETRIES = 3
+# Seconds waited before the first retry, doubled for each later one.
+DEFAULT_BACKOFF = 1.0
+
+# HTTP statuses of errors which are worth retrying.
+RETRY_STATUSES = (500, 502, 503, 504)
+
+
+def get_username(user):
+    """Returns the user name or email address of a user.
+
+    Args:
+      user: A user name or email address, or a user entry of the
+          provisioning APIs: a gdata.apps.data.UserEntry, a
+          gdata.apps.multidomain.data.UserEntry or a
+          gdata.apps.organization.data.OrgUserEntry.
+    """
+    if isinstance(user, str):
+        return user
+    for name in ('email', 'user_email'):
+        value = getattr(user, name, None)
+        if value:
+            return value
+    return user.login.user_name
+
+
+GetUsername = get_username
+
+
+def get_domain(username, default_domain):
+    """Returns the domain of an email address, or default_domain."""
+    if '@' in username:
+        return username.split('@', 1)[1].lower()
+    return default_domain
+
+
+GetDomain = get_domain
+
+
+class SettingsOperation(object):
+    """A call of an EmailSettingsClient method, to apply to many users.
+
+    Attributes:
+      method: string The name of the EmailSettingsClient method, which takes
+          the user name as its first argument.
+      args: list The other positional arguments of the method.
+      kwargs: dict The keyword arguments of the method.
+      key: string Identifies the operation in a BulkCheckpoint. Unless it is
+          given, it is derived from the method and its arguments, so
+          changing the arguments starts over with every user.
+    """
+
+    def __init__(self, method, *args, **kwargs):
+        """Creates an operation.
+
+        Args:
+          method: string The name of the EmailSettingsClient method.
+          args: The other positional arguments of the method.
+          kwargs: The keyword arguments of the method. key=string sets the
+              key of the operation instead.
+        """
+        self.method = method
+        self.key = kwargs.pop('key', None)
+        self.args = args
+        self.kwargs = kwargs
+        if self.key is None:
+            digest = hashlib.sha1(repr(
+                (args, sorted(kwargs.items()))).encode('utf-8')).hexdigest()
+            self.key = '%s:%s' % (method, digest[:12])
+
+    def __repr__(self):
+        return 'SettingsOperation(%r)' % self.key
+
+    def apply(self, client, username):
+        """Calls the method for one user, returning its result."""
+        return getattr(client, self.method)(username, *self.args,
+                                            **self.kwargs)
+
+    Apply = apply
+
+
+class BulkCheckpoint(object):
+    """The users an operation was already applied to.
+
+    Each user done is appended to the file as one line holding the key of
+    the operation and the user name, so nothing is lost if the process
+    stops, and earlier lines are never rewritten. The checkpoint is safe to
+    use from several threads.
+    """
+
+    def __init__(self, path=None):
+        """Reads a checkpoint.
+
+        Args:
+          path: string (optional) The file the checkpoint is kept in. If None,
+              the checkpoint only lives in memory.
+        """
+        self.path = path
+        self.done = set()
+        if path is not None and os.path.exists(path):
+            with open(path) as checkpoint_file:
+                for line in checkpoint_file:
+                    key, sep, username = line.rstrip('\n').partition('\t')
+                    if sep:
+                        self.done.add((key, username))
+        self._lock = threading.Lock()
+        self._file = None
+
+    def is_done(self, operation_key, username):
+        return (operation_key, username) in self.done
+
+    IsDone = is_done
+
+    def record(self, operation_key, username):
+        """Marks a user as done for an operation."""
+        with self._lock:
+            self.done.add((operation_key, username))
+            if self.path is None:
+                return
+            if self._file is None:
+                self._file = open(self.path, 'a')
+            self._file.write('%s\t%s\n' % (operation_key, username))
+            self._file.flush()
+
+    Record = record
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    Close = close
+
+
+class BulkResult(object):
+    """The outcome of a BulkExecutor run.
+
+    Attributes:
+      succeeded: int The number of users the operation was applied to.
+      skipped: int The number of users the checkpoint had as done.
+      failed: dict mapping the user names which failed to the exception of
+          their last attempt.
+      retries: int The number of requests sent again after an error.
+      elapsed: float Seconds spent in the run.
+    """
+
+    def __init__(self):
+        self.succeeded = 0
+        self.skipped = 0
+        self.failed = {}
+        self.retries = 0
+        self.elapsed = 0.0
+
+    def __len__(self):
+        return self.succeeded + self.skipped + len(self.failed)
+
+    def get_summary(self):
+        """Returns a one line description of the run."""
+        return ('%d succeeded, %d skipped, %d failed, %d retries in %.1fs'
+                % (self.succeeded, self.skipped, len(self.failed),
+                   self.retries, self.elapsed))
+
+    GetSummary = get_summary
+
+
+class BulkExecutor(object):
+    """Applies a SettingsOperation to many users in parallel."""
+
+    def __init__(self, client, checkpoint=None,
+                 max_workers=DEFAULT_MAX_WORKERS,
+                 queries_per_second=DEFAULT_QUERIES_PER_SECOND,
+                 limiters=None, max_retries=DEFAULT_MAX_RETRIES,
+                 backoff=DEFAULT_BACKOFF, sleep=time.sleep):
+        """Creates an executor.
+
+        Args:
+          client: gdata.apps.emailsettings.client.EmailSettingsClient used
+              from several threads.
+          checkpoint: BulkCheckpoint (optional) The users already done, by
+              default an empty checkpoint in memory.
+          max_workers: int (optional) Number of users changed at once.
+          queries_per_second: float (optional) The rate limit of the domains
+              which have no limiter in limiters.
+          limiters: dict (optional) mapping domain names to the
+              gdata.client.RateLimiter their requests go through.
+          max_retries: int (optional) Times a request failing with a server or
+              network error is sent again.
+          backoff: float (optional) Seconds to wait before the first retry.
+          sleep: (optional) function used to wait between retries.
+        """
+        self.client = client
+        if checkpoint is None:
+            checkpoint = BulkCheckpoint()
+        self.checkpoint = checkpoint
+        self.max_workers = max_workers
+        self.queries_per_second = queries_per_second
+        self.limiters = dict(limiters or {})
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.sleep = sleep
+        self._lock = threading.Lock()
+
+    def get_limiter(self, domain):
+        """Returns the RateLimiter of a domain, creating it if needed."""
+        with self._lock:
+            limiter = self.limiters.get(domain)
+            if limiter is None:
+                limiter = gdata.client.RateLimiter(self.queries_per_second)
+                self.limiters[domain] = limiter
+            return limiter
+
+    GetLimiter = get_limiter
+
+    def execute(self, users, operation, progress=None):
+        """Applies an operation to every user and waits for the results.
+
+        Users are read from the iterable as requests finish. A failed user
+        does not stop the others; it is not recorded in the checkpoint, so
+        it is tried again by the next run.
+
+        Args:
+          users: iterable of user names, email addresses or user entries, see
+              get_username.
+          operation: SettingsOperation The change to apply.
+          progress: (optional) function called as progress(result, username,
+              error) after each user is done, error being None on success,
+              from the calling thread.
+
+        Returns:
+          A BulkResult.
+        """
+        started = time.monotonic()
+        result = BulkResult()
+
+        def collect(outcome):
+            username, error, retries = outcome
+            result.retries += retries
+            if error is None:
+                result.succeeded += 1
+            else:
+                result.failed[username] = error
+            if progress is not None:
+                progress(result, username, error)
+
+        try:
+            with gdata.client.BoundedExecutor(self.max_workers,
+                                              collect) as executor:
+                for user in users:
+                    username = get_username(user)
+                    if self.checkpoint.is_done(operation.key, username):
+                        result.skipped += 1
+                        continue
+                    executor.submit(self._apply, username, operation)
+        finally:
+            self.checkpoint.close()
+            result.elapsed = time.monotonic() - started
+        return result
+
+    Execute = execute
+
+    def _apply(self, username, operation):
+        """Applies the operation to one user, retrying transient errors.
+
+        Returns:
+          A (username, error, retries) tuple, error being None on success.
+        """
+        limiter = self.get_limiter(get_domain(username, self.client.domain))
+        retries = 0
+        for attempt in range(self.max_retries + 1):
+            if attempt:
+                retries += 1
+                self.sleep(self.backoff * 2 ** (attempt - 1))
+            limiter.acquire()
+            try:
+                operation.apply(self.client, username)
+            except gdata.client.RequestError as error:
+                if (getattr(error, 'status', None) not in RETRY_STATUSES
+                        or attempt == self.max_retries):
+                    return username, error, retries
+            except (http.client.HTTPException, OSError) as error:
+                if attempt == self.max_retries:
+                    return username, error, retries
+            else:
+                self.checkpoint.record(operation.key, username)
+                return username, None, retries
@@ -117,14 +117,7 @@ class GroupsProvisioningClient(gdata.client.GDClient):
         Returns:
           desired_class: subclass of gdata.data.GDFeed.
         """
-
-        next = feed.GetNextLink()
-        while next is not None:
-            next_feed = self.GetFeed(next.href, desired_class=desired_class)
-            for a_entry in next_feed.entry:
-                feed.entry.append(a_entry)
-            next = next_feed.GetNextLink()
-        return feed
+        return self.GetAllPages(feed, desired_class=desired_class)
 
     def retrieve_page_of_groups(self, **kwargs):
         """Retrieves first page of groups for the given domain.
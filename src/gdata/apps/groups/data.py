@@ -17,6 +17,7 @@
 
 # __author__ = 'Shraddha gupta <shraddhag@google.com>'
 
+import gdata.apps.apps_property_entry
 import gdata.data
 
 # This is required to work around a naming conflict between the Google
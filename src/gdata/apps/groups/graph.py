@@ -0,0 +1,345 @@
+#
+# Licensed under the Apache License 2.0;
+
+
+"""Answers nested group membership questions from a local copy of a domain.
+
+GroupsProvisioningClient.retrieve_all_members and retrieve_groups answer one
+group or one member at a time, paging through the server's feeds on every
+call. A MembershipGraph loads the groups of a domain and their direct
+members once, fetching the member feeds of many groups at the same time,
+and keeps them as two adjacency maps: the direct members of each group and
+the groups each member belongs to directly.
+
+The effective members of a group, who are in it directly or through nested
+groups, and the effective groups of a member are computed on first use and
+cached, and groups cached earlier are reused rather than walked again.
+Cycles between groups are allowed. A change to one group only drops the
+cached answers it can affect, so a graph can be kept current with
+refresh_groups, or with add_member and remove_member as changes are made.
+
+The graph can be queried from several threads.
+
+Example Usage:
+client = gdata.apps.groups.client.GroupsProvisioningClient(
+    domain='example.com')
+graph = gdata.apps.groups.graph.MembershipGraph()
+graph.load(client)
+if graph.is_member('liz@example.com', 'admins@example.com'):
+  grant_access()
+graph.refresh_groups(client, ['admins@example.com'])
+"""
+
+import concurrent.futures
+import threading
+
+import gdata.apps.groups.data
+import gdata.client
+
+# Number of member feeds fetched at the same time.
+DEFAULT_MAX_WORKERS = 8
+
+# The memberType values of a group member entry.
+USER = 'User'
+GROUP = 'Group'
+
+NOT_FOUND = 404
+
+
+def normalize_id(member_id):
+    """Returns the lower case form under which an id is kept in the graph."""
+    return member_id.strip().lower()
+
+
+NormalizeId = normalize_id
+
+
+def retrieve_direct_members(client, group_id, **kwargs):
+    """Returns the direct members of a group, following every page.
+
+    Args:
+      client: gdata.apps.groups.client.GroupsProvisioningClient
+      group_id: string groupId of the group.
+      kwargs: The other parameters to pass to client.get_feed().
+
+    Returns:
+      A list of (member id, member type) pairs.
+    """
+    return [(entry.member_id, entry.member_type) for entry in
+            client.get_all_entries(
+                client.MakeGroupMembersUri(group_id=group_id),
+                desired_class=gdata.apps.groups.data.GroupMemberFeed,
+                **kwargs)]
+
+
+RetrieveDirectMembers = retrieve_direct_members
+
+
+class MembershipGraph(object):
+    """The groups of a domain and their members, with transitive lookups.
+
+    Attributes:
+      members: dict mapping each group id to the set of its direct member ids.
+      parents: dict mapping each member id to the set of the groups it is a
+          direct member of.
+      member_types: dict mapping member ids to their memberType.
+    """
+
+    def __init__(self):
+        self.members = {}
+        self.parents = {}
+        self.member_types = {}
+        self._effective_members = {}
+        self._effective_groups = {}
+        self._lock = threading.RLock()
+
+    def __contains__(self, group_id):
+        return normalize_id(group_id) in self.members
+
+    def __len__(self):
+        return len(self.members)
+
+    def is_group(self, member_id):
+        """Returns whether an id is a group of the graph."""
+        return normalize_id(member_id) in self.members
+
+    IsGroup = is_group
+
+    def load(self, client, max_workers=DEFAULT_MAX_WORKERS, **kwargs):
+        """Replaces the graph with every group of the client's domain.
+
+        The list of groups is paged through first, then the member feeds of
+        the groups are fetched max_workers at a time.
+
+        Args:
+          client: gdata.apps.groups.client.GroupsProvisioningClient used from
+              several threads.
+          max_workers: int (optional) Number of member feeds fetched at once.
+          kwargs: The other parameters to pass to client.get_feed().
+        """
+        group_ids = [entry.group_id for entry in client.get_all_entries(
+            client.MakeGroupProvisioningUri(),
+            desired_class=gdata.apps.groups.data.GroupFeed, **kwargs)]
+        fetched = self._fetch(client, group_ids, max_workers, kwargs)
+        with self._lock:
+            self.members = {}
+            self.parents = {}
+            self.member_types = {}
+            self._clear_caches()
+            for group_id, members in fetched.items():
+                if members is not None:
+                    self._set_members(group_id, members)
+
+    Load = load
+
+    def refresh_groups(self, client, group_ids,
+                       max_workers=DEFAULT_MAX_WORKERS, **kwargs):
+        """Fetches the members of some groups again.
+
+        A group which no longer exists is removed from the graph; a group
+        which is not in the graph yet is added.
+
+        Args:
+          client: gdata.apps.groups.client.GroupsProvisioningClient used from
+              several threads.
+          group_ids: iterable of the groupIds to fetch.
+          max_workers: int (optional) Number of member feeds fetched at once.
+          kwargs: The other parameters to pass to client.get_feed().
+        """
+        fetched = self._fetch(client, group_ids, max_workers, kwargs)
+        with self._lock:
+            for group_id, members in fetched.items():
+                if members is None:
+                    self.remove_group(group_id)
+                else:
+                    self.set_members(group_id, members)
+
+    RefreshGroups = refresh_groups
+
+    def _fetch(self, client, group_ids, max_workers, kwargs):
+        """Returns a dict of group id to members, None for missing groups."""
+
+        def fetch(group_id):
+            try:
+                return group_id, retrieve_direct_members(client, group_id,
+                                                         **kwargs)
+            except gdata.client.RequestError as error:
+                if getattr(error, 'status', None) == NOT_FOUND:
+                    return group_id, None
+                raise
+
+        with concurrent.futures.ThreadPoolExecutor(
+                max_workers=max_workers) as executor:
+            return dict(executor.map(fetch, group_ids))
+
+    def set_members(self, group_id, members):
+        """Replaces the direct members of a group, adding it if needed.
+
+        Args:
+          group_id: string groupId of the group.
+          members: iterable of (member id, member type) pairs.
+        """
+        group_id = normalize_id(group_id)
+        with self._lock:
+            self._invalidate(group_id)
+            for member_id in list(self.members.get(group_id, ())):
+                self._unlink(group_id, member_id)
+            self._set_members(group_id, members)
+            self._invalidate(group_id)
+
+    SetMembers = set_members
+
+    def _set_members(self, group_id, members):
+        group_id = normalize_id(group_id)
+        self.members[group_id] = set()
+        self.member_types[group_id] = GROUP
+        for member_id, member_type in members:
+            self._link(group_id, normalize_id(member_id), member_type)
+
+    def add_member(self, group_id, member_id, member_type=USER):
+        """Records that a member was added to a group."""
+        group_id = normalize_id(group_id)
+        member_id = normalize_id(member_id)
+        with self._lock:
+            self.members.setdefault(group_id, set())
+            self.member_types[group_id] = GROUP
+            self._link(group_id, member_id, member_type)
+            self._invalidate(group_id)
+
+    AddMember = add_member
+
+    def remove_member(self, group_id, member_id):
+        """Records that a member was removed from a group."""
+        group_id = normalize_id(group_id)
+        member_id = normalize_id(member_id)
+        with self._lock:
+            if member_id not in self.members.get(group_id, ()):
+                return
+            self._invalidate(group_id)
+            self._unlink(group_id, member_id)
+
+    RemoveMember = remove_member
+
+    def remove_group(self, group_id):
+        """Records that a group was deleted, with its memberships."""
+        group_id = normalize_id(group_id)
+        with self._lock:
+            if group_id not in self.members:
+                return
+            self._invalidate(group_id)
+            for member_id in list(self.members[group_id]):
+                self._unlink(group_id, member_id)
+            for parent_id in list(self.parents.get(group_id, ())):
+                self._unlink(parent_id, group_id)
+            del self.members[group_id]
+            self.member_types.pop(group_id, None)
+            self._effective_groups.pop(group_id, None)
+
+    RemoveGroup = remove_group
+
+    def _link(self, group_id, member_id, member_type):
+        self.members[group_id].add(member_id)
+        self.parents.setdefault(member_id, set()).add(group_id)
+        if member_id not in self.members and member_type:
+            self.member_types[member_id] = member_type
+
+    def _unlink(self, group_id, member_id):
+        self.members[group_id].discard(member_id)
+        parents = self.parents.get(member_id)
+        if parents is not None:
+            parents.discard(group_id)
+            if not parents:
+                del self.parents[member_id]
+                if member_id not in self.members:
+                    self.member_types.pop(member_id, None)
+
+    def _clear_caches(self):
+        self._effective_members = {}
+        self._effective_groups = {}
+
+    def _invalidate(self, group_id):
+        """Drops the cached answers a change to a group's members can affect.
+
+        The effective members of the group and of the groups above it
+        change, and so do the effective groups of the ids below it. Called
+        before members are removed and after they are added, so both the
+        old and the new members are covered.
+        """
+        for ancestor in self._walk(group_id, self.parents, {}):
+            self._effective_members.pop(ancestor, None)
+        self._effective_members.pop(group_id, None)
+        for descendant in self._walk(group_id, self.members, {}):
+            self._effective_groups.pop(descendant, None)
+
+    def _walk(self, start, edges, cache):
+        """Returns every id reachable from start, start itself excluded.
+
+        Ids with an entry in cache are not walked again, their cached set is
+        used instead.
+        """
+        found = set()
+        stack = [start]
+        while stack:
+            node = stack.pop()
+            for neighbour in edges.get(node, ()):
+                if neighbour in found:
+                    continue
+                found.add(neighbour)
+                known = cache.get(neighbour)
+                if known is not None:
+                    found.update(known)
+                else:
+                    stack.append(neighbour)
+        found.discard(start)
+        return found
+
+    def get_members(self, group_id, include_groups=False):
+        """Returns the effective members of a group.
+
+        Args:
+          group_id: string groupId of the group.
+          include_groups: bool (optional) Whether to include the nested groups
+              the members came through.
+
+        Returns:
+          A frozenset of member ids, empty for a group not in the graph.
+        """
+        group_id = normalize_id(group_id)
+        with self._lock:
+            members = self._effective_members.get(group_id)
+            if members is None:
+                members = frozenset(self._walk(group_id, self.members,
+                                               self._effective_members))
+                self._effective_members[group_id] = members
+            if include_groups:
+                return members
+            return frozenset(member_id for member_id in members
+                             if self.member_types.get(member_id) != GROUP)
+
+    GetMembers = get_members
+
+    def get_groups(self, member_id):
+        """Returns every group a user or group belongs to, directly or not.
+
+        Args:
+          member_id: string The member's email address.
+
+        Returns:
+          A frozenset of group ids.
+        """
+        member_id = normalize_id(member_id)
+        with self._lock:
+            groups = self._effective_groups.get(member_id)
+            if groups is None:
+                groups = frozenset(self._walk(member_id, self.parents,
+                                              self._effective_groups))
+                self._effective_groups[member_id] = groups
+        return groups
+
+    GetGroups = get_groups
+
+    def is_member(self, member_id, group_id):
+        """Returns whether a user or group belongs to a group, directly or not."""
+        return normalize_id(group_id) in self.get_groups(member_id)
+
+    IsMember = is_member
@@ -7,12 +7,15 @@
 """Contains the methods to import mail via Google Apps Email Migration API.
 
   MigrationService: Provides methods to import mail.
+  MailEntriesFromMbox: Lazily reads the messages of an mbox file.
 """
 
 # __author__ = ('google-apps-apis@googlegroups.com',
-              'pti@google.com (Prashant Tiwari)')
+#               'pti@google.com (Prashant Tiwari)')
 
 import base64
+import mailbox
+import queue
 import threading
 import time
 
@@ -24,6 +27,13 @@ from gdata.apps.migration import MailEntryProperties
 
 API_VER = '2.0'
 
+# Upper bound, in seconds, of the delay the import workers wait before each
+# request while the server keeps answering 503.
+MAX_THROTTLE_DELAY = 60
+
+# HTTP statuses which are worth retrying a message for.
+RETRY_STATUSES = (500, 503)
+
 
 class MigrationService(gdata.apps.service.AppsService):
     """Client for the EMAPI migration service.  Use either ImportMail to import
@@ -60,6 +70,8 @@ class MigrationService(gdata.apps.service.AppsService):
           AppsForYourDomainException: An error occurred importing the message.
         """
         uri = '%s/%s/mail' % (self._BaseURL(), user_name)
+        if isinstance(mail_message, str):
+            mail_message = mail_message.encode('utf-8')
 
         mail_entry = migration.MailEntry()
         mail_entry.rfc822_msg = migration.Rfc822Msg(text=(base64.b64encode(
@@ -151,53 +163,163 @@ class MigrationService(gdata.apps.service.AppsService):
         self.mail_entries.append(mail_entry_properties)
         return len(self.mail_entries)
 
-    def ImportMultipleMails(self, user_name, threads_per_batch=20):
-        """Launches separate threads to import every message added by AddMailEntry.
+    def ImportMultipleMails(self, user_name, threads_per_batch=20,
+                            mail_entries=None,
+                            num_retries=gdata.service.DEFAULT_NUM_RETRIES,
+                            delay=gdata.service.DEFAULT_DELAY,
+                            backoff=gdata.service.DEFAULT_BACKOFF,
+                            max_delay=MAX_THROTTLE_DELAY):
+        """Imports messages with a bounded pool of worker threads.
+
+        The messages are pulled from mail_entries as the workers become free,
+        so an iterator (for example MailEntriesFromMbox) is consumed lazily and
+        only a few messages are held in memory at a time. A message which fails
+        with a 500 or 503, or with a network error, is retried. Every 503 also
+        raises a delay shared by all workers, which shrinks again as imports
+        succeed.
+
+        Messages which could not be imported are listed, with the exception
+        raised by their last attempt, in self.failed_mail_entries.
 
         Args:
           user_name: The user account name to import messages to.
-          threads_per_batch: Number of messages to import at a time.
+          threads_per_batch: Number of messages to import concurrently.
+          mail_entries: Iterable of MailEntryProperties to import. If None, the
+              messages added by AddMailEntry are imported and then cleared.
+          num_retries: Integer; the number of retries for each message.
+          delay: Integer; the initial delay, in seconds, before retrying.
+          backoff: Integer; how much the delay lengthens after each failure.
+          max_delay: Integer; the longest delay the workers wait on 503s.
 
         Returns:
           The number of email messages that were successfully migrated.
-
-        Raises:
-          Exception: An error occurred while importing mails.
         """
-        num_entries = len(self.mail_entries)
-
-        if not num_entries:
-            return 0
-
-        threads = []
-        for mail_entry_properties in self.mail_entries:
-            t = threading.Thread(name=mail_entry_properties.identifier,
-                                 target=self.ImportMail,
-                                 args=(user_name, mail_entry_properties.mail_message,
-                                       mail_entry_properties.mail_item_properties,
-                                       mail_entry_properties.mail_labels))
-            threads.append(t)
+        if mail_entries is None:
+            mail_entries, self.mail_entries = self.mail_entries, []
+        self.failed_mail_entries = []
+
+        throttle = _Throttle(delay, backoff, max_delay)
+        pending = queue.Queue(maxsize=2 * threads_per_batch)
+        lock = threading.Lock()
+        imported = [0]
+
+        def Worker():
+            while True:
+                mail_entry_properties = pending.get()
+                if mail_entry_properties is None:
+                    return
+                try:
+                    error = self._ImportMailWithRetries(
+                        user_name, mail_entry_properties, throttle, num_retries)
+                except Exception as e:
+                    error = e
+                with lock:
+                    if error is None:
+                        imported[0] += 1
+                    else:
+                        self.failed_mail_entries.append(
+                            (mail_entry_properties, error))
+
+        workers = [threading.Thread(target=Worker)
+                   for i in range(threads_per_batch)]
+        for worker in workers:
+            worker.start()
         try:
-            # Determine the number of batches needed with threads_per_batch in each
-            batches = num_entries / threads_per_batch + (
-                0 if num_entries % threads_per_batch == 0 else 1)
-            batch_min = 0
-            # Start the threads, one batch at a time
-            for batch in range(batches):
-                batch_max = ((batch + 1) * threads_per_batch
-                             if (batch + 1) * threads_per_batch < num_entries
-                             else num_entries)
-                for i in range(batch_min, batch_max):
-                    threads[i].start()
-                    time.sleep(1)
-
-                for i in range(batch_min, batch_max):
-                    threads[i].join()
-
-                batch_min = batch_max
-
-            self.mail_entries = []
-        except Exception as e:
-            raise Exception(e.args[0])
-        else:
-            return num_entries - self.exceptions
+            for mail_entry_properties in mail_entries:
+                pending.put(mail_entry_properties)
+        finally:
+            for worker in workers:
+                pending.put(None)
+            for worker in workers:
+                worker.join()
+
+        return imported[0]
+
+    def _ImportMailWithRetries(self, user_name, mail_entry_properties,
+                               throttle, num_retries):
+        """Imports one message, retrying transient errors.
+
+        Returns:
+          None on success, otherwise the exception of the last attempt.
+        """
+        for attempt in range(num_retries + 1):
+            throttle.Wait()
+            try:
+                self.ImportMail(user_name, mail_entry_properties.mail_message,
+                                mail_entry_properties.mail_item_properties,
+                                mail_entry_properties.mail_labels)
+            except gdata.apps.service.AppsForYourDomainException as e:
+                status = e.args[0].get('status')
+                if status not in RETRY_STATUSES or attempt == num_retries:
+                    return e
+                if status == 503:
+                    throttle.Slower()
+                else:
+                    throttle.Pause(attempt)
+            except OSError as e:
+                if attempt == num_retries:
+                    return e
+                throttle.Pause(attempt)
+            else:
+                throttle.Faster()
+                return None
+
+
+class _Throttle(object):
+    """Delay shared by the import workers, adapted to the server's load."""
+
+    def __init__(self, delay, backoff, max_delay):
+        if backoff <= 1:
+            raise ValueError("backoff must be greater than 1")
+        self.initial_delay = delay
+        self.backoff = backoff
+        self.max_delay = max_delay
+        self.delay = 0
+        self._lock = threading.Lock()
+
+    def Wait(self):
+        """Sleeps for the current shared delay, if any."""
+        with self._lock:
+            delay = self.delay
+        if delay:
+            time.sleep(delay)
+
+    def Pause(self, attempt):
+        """Sleeps before retrying a single message."""
+        time.sleep(min(self.max_delay,
+                       self.initial_delay * self.backoff ** attempt))
+
+    def Slower(self):
+        with self._lock:
+            self.delay = min(self.max_delay,
+                             max(self.initial_delay, self.delay * self.backoff))
+
+    def Faster(self):
+        with self._lock:
+            self.delay /= self.backoff
+            if self.delay < self.initial_delay:
+                self.delay = 0
+
+
+def MailEntriesFromMbox(mbox_path, mail_item_properties=None,
+                        mail_labels=None):
+    """Yields the messages of an mbox file one at a time.
+
+    Args:
+      mbox_path: The path of the mbox file.
+      mail_item_properties: List of Gmail properties to apply to each message.
+      mail_labels: List of Gmail labels to apply to each message.
+
+    Yields:
+      A MailEntryProperties per message, identified by its mbox key.
+    """
+    mbox = mailbox.mbox(mbox_path, create=False)
+    try:
+        for key in mbox.iterkeys():
+            yield MailEntryProperties(
+                mail_message=mbox.get_bytes(key),
+                mail_item_properties=mail_item_properties,
+                mail_labels=mail_labels,
+                identifier=str(key))
+    finally:
+        mbox.close()
@@ -153,23 +153,14 @@ class MultiDomainProvisioningClient(gdata.client.GDClient):
         Args:
           uri: The uri where the first page is.
           desired_class: Type of feed that is retrieved.
-          kwargs: The other parameters to pass to gdata.client.GDClient.GetFeed()
+          kwargs: The other parameters to pass to
+              gdata.client.GDClient.GetAllPages(), such as progress and
+              checkpoint callbacks, or to GetFeed().
 
         Returns:
           A desired_class feed object.
         """
-        feed = self.GetFeed(
-            uri,
-            desired_class=desired_class,
-            **kwargs)
-        next_link = feed.GetNextLink()
-        while next_link is not None:
-            uri = next_link.href
-            temp_feed = self.GetFeed(
-                uri, desired_class=desired_class, **kwargs)
-            feed.entry = feed.entry + temp_feed.entry
-            next_link = temp_feed.GetNextLink()
-        return feed
+        return self.GetAllPages(uri, desired_class=desired_class, **kwargs)
 
     RetrieveAllPages = retrieve_all_pages
 
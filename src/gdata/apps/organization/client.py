@@ -302,22 +302,15 @@ class OrganizationUnitProvisioningClient(gdata.client.GDClient):
 
         Args:
           uri: string The uri from where to get the orgunits.
+          kwargs: The other parameters to pass to
+              gdata.client.GDClient.GetAllPages(), such as progress and
+              checkpoint callbacks.
 
         Returns:
           gdata.apps.organisation.data.OrgUnitFeed object
         """
-        orgunit_feed = gdata.apps.organization.data.OrgUnitFeed()
-        temp_feed = self.RetrieveFeedFromUri(
-            uri, gdata.apps.organization.data.OrgUnitFeed)
-        orgunit_feed.entry = temp_feed.entry
-        next_link = temp_feed.GetNextLink()
-        while next_link is not None:
-            uri = next_link.GetAttributes()[0].value
-            temp_feed = self.GetFeed(
-                uri, desired_class=gdata.apps.organization.data.OrgUnitFeed, **kwargs)
-            orgunit_feed.entry[0:0] = temp_feed.entry
-            next_link = temp_feed.GetNextLink()
-        return orgunit_feed
+        return self.GetAllPages(
+            uri, desired_class=gdata.apps.organization.data.OrgUnitFeed, **kwargs)
 
     RetrieveAllOrgUnitsFromUri = retrieve_all_org_units_from_uri
 
@@ -443,22 +436,15 @@ class OrganizationUnitProvisioningClient(gdata.client.GDClient):
 
         Args:
           uri: string The uri from where to get the orgusers.
+          kwargs: The other parameters to pass to
+              gdata.client.GDClient.GetAllPages(), such as progress and
+              checkpoint callbacks.
 
         Returns:
           gdata.apps.organisation.data.OrgUserFeed object
         """
-        orguser_feed = gdata.apps.organization.data.OrgUserFeed()
-        temp_feed = self.RetrieveFeedFromUri(
-            uri, gdata.apps.organization.data.OrgUserFeed)
-        orguser_feed.entry = temp_feed.entry
-        next_link = temp_feed.GetNextLink()
-        while next_link is not None:
-            uri = next_link.GetAttributes()[0].value
-            temp_feed = self.GetFeed(
-                uri, desired_class=gdata.apps.organization.data.OrgUserFeed, **kwargs)
-            orguser_feed.entry[0:0] = temp_feed.entry
-            next_link = temp_feed.GetNextLink()
-        return orguser_feed
+        return self.GetAllPages(
+            uri, desired_class=gdata.apps.organization.data.OrgUserFeed, **kwargs)
 
     RetrieveAllOrgUsersFromUri = retrieve_all_org_users_from_uri
 
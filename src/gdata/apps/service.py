@@ -116,7 +116,22 @@ class AppsService(gdata.service.GDataService):
                                                    delay=delay,
                                                    backoff=backoff)
         return self.GetGeneratorFromLinkFinder(
-            first_page, gdata.apps.EmailListRecipientFeedFromString,
+            first_page, gdata.apps.EmailListFeedFromString,
+            num_retries=num_retries, delay=delay, backoff=backoff)
+
+    def GetEntryGeneratorForAllEmailLists(
+            self, num_retries=gdata.service.DEFAULT_NUM_RETRIES,
+            delay=gdata.service.DEFAULT_DELAY, backoff=gdata.service.DEFAULT_BACKOFF):
+        """Retrieve a generator of all email list entries in this domain.
+
+        Pages are streamed: the next page is fetched while the entries of the
+        current one are consumed, so at most two pages are held in memory.
+        """
+        first_page = self.RetrievePageOfEmailLists(num_retries=num_retries,
+                                                   delay=delay,
+                                                   backoff=backoff)
+        return self.GetEntryGeneratorFromLinkFinder(
+            first_page, gdata.apps.EmailListFeedFromString,
             num_retries=num_retries, delay=delay, backoff=backoff)
 
     def RetrieveAllEmailLists(self):
@@ -269,6 +284,21 @@ class AppsService(gdata.service.GDataService):
             first_page, gdata.apps.NicknameFeedFromString, num_retries=num_retries,
             delay=delay, backoff=backoff)
 
+    def GetEntryGeneratorForAllNicknames(
+            self, num_retries=gdata.service.DEFAULT_NUM_RETRIES,
+            delay=gdata.service.DEFAULT_DELAY, backoff=gdata.service.DEFAULT_BACKOFF):
+        """Retrieve a generator of all nickname entries in this domain.
+
+        Pages are streamed: the next page is fetched while the entries of the
+        current one are consumed, so at most two pages are held in memory.
+        """
+        first_page = self.RetrievePageOfNicknames(num_retries=num_retries,
+                                                  delay=delay,
+                                                  backoff=backoff)
+        return self.GetEntryGeneratorFromLinkFinder(
+            first_page, gdata.apps.NicknameFeedFromString, num_retries=num_retries,
+            delay=delay, backoff=backoff)
+
     def RetrieveAllNicknames(self):
         """Retrieve all nicknames in the domain"""
 
@@ -430,8 +460,26 @@ class AppsService(gdata.service.GDataService):
             first_page, gdata.apps.UserFeedFromString, num_retries=num_retries,
             delay=delay, backoff=backoff)
 
+    def GetEntryGeneratorForAllUsers(
+            self, num_retries=gdata.service.DEFAULT_NUM_RETRIES,
+            delay=gdata.service.DEFAULT_DELAY, backoff=gdata.service.DEFAULT_BACKOFF):
+        """Retrieve a generator of all user entries in this domain.
+
+        Pages are streamed: the next page is fetched while the entries of the
+        current one are consumed, so at most two pages are held in memory.
+        """
+        first_page = self.RetrievePageOfUsers(num_retries=num_retries, delay=delay,
+                                              backoff=backoff)
+        return self.GetEntryGeneratorFromLinkFinder(
+            first_page, gdata.apps.UserFeedFromString, num_retries=num_retries,
+            delay=delay, backoff=backoff)
+
     def RetrieveAllUsers(self):
-        """Retrieve all users in this domain. OBSOLETE"""
+        """Retrieve all users in this domain. OBSOLETE
+
+        Use GetEntryGeneratorForAllUsers, which does not build the whole
+        domain into a single feed.
+        """
 
         ret = self.RetrievePageOfUsers()
         # pagination
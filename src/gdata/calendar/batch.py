@@ -0,0 +1,337 @@
+#
+# Licensed under the Apache License 2.0;
+
+
+"""Writes large numbers of events to many calendars with batch requests.
+
+CalendarClient.execute_batch posts one batch feed which the caller has to
+build and keep under the server's limits. A BatchExecutor takes any
+iterable of EventOperations (inserts, updates and deletes, for any
+calendar), groups them by the batch URL of their calendar, cuts each group
+into feeds of at most max_operations entries and max_bytes of XML, and
+posts the feeds from a pool of threads. A feed is sent as soon as it is
+full, while later operations are still being read from the iterable. The
+groups still filling up are bounded too: once more than max_open_groups are
+open, or they hold more than max_open_bytes, the oldest is sent as it is.
+Operations of one calendar should therefore come together in the iterable,
+so that few feeds are sent before they are full.
+
+Updates and deletes carry the ETag of their entry. When the server refuses
+one with 409 Conflict or 412 Precondition Failed because the event changed,
+the executor fetches the current event and sends the operation again with
+the fresh ETag, up to max_retries times.
+
+Example Usage:
+client = gdata.calendar.client.CalendarClient()
+executor = gdata.calendar.batch.BatchExecutor(client)
+operations = (gdata.calendar.batch.EventOperation(
+                  gdata.data.BATCH_INSERT, make_holiday(), calendar_id)
+              for calendar_id in calendar_ids)
+result = executor.execute(operations)
+for operation in result.failed:
+  print(operation.calendar_id, operation.status, operation.reason)
+"""
+
+import urllib.parse
+
+import atom.core
+import gdata.client
+import gdata.data
+import gdata.calendar.data
+
+# Largest number of operations the server accepts in one batch feed.
+MAX_BATCH_OPERATIONS = 50
+# Largest batch request body, in bytes, the server accepts.
+MAX_BATCH_BYTES = 1024 * 1024
+# Bytes of the feed element around the entries of a batch request.
+FEED_OVERHEAD = 512
+# Number of batch requests sent at the same time.
+DEFAULT_MAX_WORKERS = 8
+# Times an operation refused because its event changed is sent again.
+DEFAULT_MAX_RETRIES = 2
+# Number of calendars whose feeds may be filling up at the same time.
+DEFAULT_MAX_OPEN_GROUPS = 1000
+# Bytes of operations which may wait in feeds which are not full yet.
+DEFAULT_MAX_OPEN_BYTES = 32 * MAX_BATCH_BYTES
+
+CONFLICT = 409
+PRECONDITION_FAILED = 412
+RETRY_STATUSES = (CONFLICT, PRECONDITION_FAILED)
+
+
+def get_batch_url(client, calendar_id='default'):
+    """Returns the batch URL of the private event feed of a calendar."""
+    return client.get_calendar_event_feed_uri(
+        calendar=urllib.parse.quote(calendar_id, safe='@'),
+        projection='full/batch')
+
+
+GetBatchUrl = get_batch_url
+
+
+class EventOperation(object):
+    """An insert, update or delete of one event.
+
+    Attributes:
+      operation: str One of gdata.data.BATCH_INSERT, BATCH_UPDATE or
+          BATCH_DELETE.
+      entry: CalendarEventEntry The event to write. Updates and deletes need
+          its atom id and the ETag it was read with.
+      calendar_id: str The calendar the event belongs to.
+      batch_url: str (optional) The batch URL to post to, by default the one
+          of calendar_id.
+      merge: (optional) function called as merge(operation, current) when
+          the event changed on the server, returning the entry to send
+          instead. By default the operation's entry is sent again with the
+          current ETag, overwriting the change.
+      status: int The batch status code of the last attempt, None until the
+          operation is sent.
+      reason: str The batch status reason of the last attempt.
+      result: CalendarEventEntry The entry returned by the server, for
+          successful inserts and updates.
+      attempts: int The number of times the operation was sent.
+    """
+
+    def __init__(self, operation, entry, calendar_id='default',
+                 batch_url=None, merge=None):
+        self.operation = operation
+        self.entry = entry
+        self.calendar_id = calendar_id
+        self.batch_url = batch_url
+        self.merge = merge
+        self.status = None
+        self.reason = None
+        self.result = None
+        self.attempts = 0
+        self._xml = None
+
+    def __repr__(self):
+        return 'EventOperation(%r, %r, %r)' % (self.operation,
+                                               self.calendar_id, self.status)
+
+    def succeeded(self):
+        return self.status is not None and self.status < 300
+
+    Succeeded = succeeded
+
+    def get_xml(self):
+        """Returns the XML sent for the operation, as bytes."""
+        if self._xml is None:
+            entry = self.entry
+            if self.operation == gdata.data.BATCH_DELETE:
+                # A delete only needs the id and the ETag.
+                entry = gdata.calendar.data.CalendarEventEntry(id=entry.id)
+                entry.etag = self.entry.etag
+            self._xml = entry.to_string().encode('utf-8')
+        return self._xml
+
+    GetXml = get_xml
+
+    def get_size(self):
+        return len(self.get_xml())
+
+    GetSize = get_size
+
+    def get_request_entry(self):
+        """Returns a copy of the entry to add to a batch feed."""
+        return atom.core.parse(self.get_xml(),
+                               gdata.calendar.data.CalendarEventEntry)
+
+    GetRequestEntry = get_request_entry
+
+    def refresh(self, current):
+        """Takes the ETag, and the merged content, of the current event."""
+        if self.merge is not None:
+            self.entry = self.merge(self, current)
+        else:
+            self.entry.etag = current.etag
+        self._xml = None
+
+    Refresh = refresh
+
+
+class BatchResult(object):
+    """The outcome of a BatchExecutor run.
+
+    Attributes:
+      succeeded: list of EventOperations which were applied.
+      failed: list of EventOperations which were not, with their status.
+      requests: int The number of batch requests sent, retries included.
+      retried: int The number of operations sent again with a fresh ETag.
+    """
+
+    def __init__(self):
+        self.succeeded = []
+        self.failed = []
+        self.requests = 0
+        self.retried = 0
+
+    def __len__(self):
+        return len(self.succeeded) + len(self.failed)
+
+
+class BatchExecutor(object):
+    """Groups, chunks and sends event operations in parallel."""
+
+    def __init__(self, client, max_workers=DEFAULT_MAX_WORKERS,
+                 max_operations=MAX_BATCH_OPERATIONS,
+                 max_bytes=MAX_BATCH_BYTES, max_retries=DEFAULT_MAX_RETRIES,
+                 max_open_groups=DEFAULT_MAX_OPEN_GROUPS,
+                 max_open_bytes=DEFAULT_MAX_OPEN_BYTES):
+        """Creates an executor.
+
+        Args:
+          client: gdata.calendar.client.CalendarClient used for every
+              request, from several threads.
+          max_workers: int (optional) Number of batch requests sent at once.
+          max_operations: int (optional) Largest number of operations in a
+              batch feed.
+          max_bytes: int (optional) Largest size of a batch feed.
+          max_retries: int (optional) Times an operation refused with 409 or
+              412 is sent again with a fresh ETag.
+          max_open_groups: int (optional) Largest number of calendars whose
+              feeds are filling up, the oldest feed is sent beyond it.
+          max_open_bytes: int (optional) Largest size of the operations in
+              feeds which are filling up, the oldest feed is sent beyond it.
+        """
+        self.client = client
+        self.max_workers = max_workers
+        self.max_operations = max_operations
+        self.max_bytes = max_bytes
+        self.max_retries = max_retries
+        self.max_open_groups = max_open_groups
+        self.max_open_bytes = max_open_bytes
+
+    def execute(self, operations, progress=None, **kwargs):
+        """Sends every operation and waits for the results.
+
+        Feeds are sent through a gdata.client.BoundedExecutor, so at most
+        twice max_workers full feeds are held in memory, besides the feeds
+        filling up which max_open_groups and max_open_bytes bound.
+
+        Args:
+          operations: iterable of EventOperations.
+          progress: (optional) function called as progress(result, chunk)
+              after each batch feed, with its EventOperations, is done.
+          kwargs: Other parameters to pass to client.execute_batch().
+
+        Returns:
+          A BatchResult.
+        """
+        result = BatchResult()
+        # The feeds filling up by batch URL, oldest first.
+        groups = {}
+        open_bytes = 0
+
+        def collect(outcome):
+            chunk, requests, retried = outcome
+            result.requests += requests
+            result.retried += retried
+            for operation in chunk:
+                if operation.succeeded():
+                    result.succeeded.append(operation)
+                else:
+                    result.failed.append(operation)
+            if progress is not None:
+                progress(result, chunk)
+
+        with gdata.client.BoundedExecutor(self.max_workers,
+                                          collect) as executor:
+            for operation in operations:
+                url = operation.batch_url or get_batch_url(
+                    self.client, operation.calendar_id)
+                size = operation.get_size()
+                chunk, chunk_size = groups.get(url, ([], FEED_OVERHEAD))
+                if chunk and (len(chunk) >= self.max_operations
+                              or chunk_size + size > self.max_bytes):
+                    del groups[url]
+                    open_bytes -= chunk_size - FEED_OVERHEAD
+                    executor.submit(self._send, url, chunk, kwargs)
+                    chunk, chunk_size = [], FEED_OVERHEAD
+                chunk.append(operation)
+                groups[url] = (chunk, chunk_size + size)
+                open_bytes += size
+                while (len(groups) > self.max_open_groups
+                       or open_bytes > self.max_open_bytes):
+                    oldest_url = next(iter(groups))
+                    chunk, chunk_size = groups.pop(oldest_url)
+                    open_bytes -= chunk_size - FEED_OVERHEAD
+                    executor.submit(self._send, oldest_url, chunk, kwargs)
+            for url, (chunk, chunk_size) in groups.items():
+                executor.submit(self._send, url, chunk, kwargs)
+        return result
+
+    Execute = execute
+
+    def _send(self, url, chunk, kwargs):
+        requests = 0
+        retried = 0
+        to_send = chunk
+        while True:
+            requests += 1
+            conflicts = self._post(url, to_send, kwargs)
+            if not conflicts:
+                break
+            to_send = []
+            for operation in conflicts:
+                if (operation.attempts <= self.max_retries
+                        and self._refresh(operation)):
+                    to_send.append(operation)
+            if not to_send:
+                break
+            retried += len(to_send)
+        return chunk, requests, retried
+
+    def _post(self, url, operations, kwargs):
+        """Sends one batch feed, returning the operations to retry."""
+        request_feed = gdata.calendar.data.CalendarEventFeed()
+        for index, operation in enumerate(operations):
+            operation.attempts += 1
+            request_feed.add_batch_entry(
+                operation.get_request_entry(), batch_id_string=str(index),
+                operation_string=operation.operation)
+        try:
+            response_feed = self.client.execute_batch(
+                request_feed, url,
+                desired_class=gdata.calendar.data.CalendarEventFeed, **kwargs)
+        except gdata.client.Error as error:
+            for operation in operations:
+                operation.status = getattr(error, 'status', None)
+                operation.reason = str(error)
+            return []
+        for operation in operations:
+            operation.status = None
+            operation.reason = 'Missing from the batch response'
+        for entry in response_feed.entry:
+            if entry.batch_id is None or entry.batch_status is None:
+                continue
+            operation = operations[int(entry.batch_id.text)]
+            operation.status = int(entry.batch_status.code)
+            operation.reason = entry.batch_status.reason
+            if operation.succeeded() and operation.operation != (
+                    gdata.data.BATCH_DELETE):
+                entry.batch_id = None
+                entry.batch_operation = None
+                entry.batch_status = None
+                operation.result = entry
+        return [operation for operation in operations
+                if operation.status in RETRY_STATUSES
+                and operation.operation != gdata.data.BATCH_INSERT]
+
+    def _refresh(self, operation):
+        """Fetches the current event, returning whether to send again."""
+        # The id of an event is not a URL it can be fetched from.
+        uri = (operation.entry.find_self_link()
+               or operation.entry.find_edit_link())
+        if uri is None:
+            operation.reason = 'The event has no self or edit link'
+            return False
+        try:
+            current = self.client.get_entry(
+                uri, desired_class=gdata.calendar.data.CalendarEventEntry)
+        except gdata.client.Error as error:
+            operation.status = getattr(error, 'status', None)
+            operation.reason = str(error)
+            return False
+        operation.refresh(current)
+        return True
@@ -0,0 +1,461 @@
+#
+# Licensed under the Apache License 2.0;
+
+
+"""Computes the common free time of many calendars and rooms.
+
+Looking for a meeting slot means reading the events of every attendee and
+of every candidate room. A FreeBusyAggregator fetches these event feeds
+concurrently, asking the server only for the gd:when, gd:transparency and
+gd:eventStatus of each event (the fields parameter) and letting it expand
+recurring events in the window (singleevents).
+
+The busy time of a calendar is kept as a BusyVector: two sorted arrays of
+start and end times, in seconds since the epoch, of non overlapping
+intervals. The busy time of several calendars is merged with a single sweep
+over their vectors, and free slots are read from the gaps between the
+merged intervals.
+
+Vectors are cached in a BusyCache with the ETag of the feed they were read
+from. Later requests for the same calendar and window send the ETag in
+If-None-Match, and the server answers 304 Not Modified, without a body, for
+calendars which did not change.
+
+Example Usage:
+client = gdata.calendar.client.CalendarClient()
+aggregator = gdata.calendar.freebusy.FreeBusyAggregator(
+    client, cache=gdata.calendar.freebusy.BusyCache('busy.json'))
+slots = aggregator.find_free_slots(
+    ['liz@example.com', 'jack@example.com'], start, end,
+    datetime.timedelta(minutes=30), count=3,
+    rooms=['example.com_room1@resource.calendar.google.com'])
+for slot in slots:
+  print(slot.start, slot.end, slot.room)
+aggregator.cache.save()
+"""
+
+import array
+import bisect
+import concurrent.futures
+import datetime
+import heapq
+import json
+import os
+import threading
+import urllib.parse
+
+import atom.http_core
+import gdata.client
+import gdata.data
+import gdata.calendar.client
+import gdata.calendar.data
+import gdata.calendar.recurrence
+
+UTC = datetime.timezone.utc
+
+# Number of event feeds fetched at the same time.
+DEFAULT_MAX_WORKERS = 8
+# Events requested per page, large enough for most calendars to fit one.
+DEFAULT_PAGE_SIZE = 1000
+# Only the parts of the feed needed to know when a calendar is busy.
+BUSY_FIELDS = ('@gd:etag,link[@rel="next"],'
+               'entry(gd:when,gd:transparency,gd:eventStatus)')
+
+
+def to_timestamp(moment):
+    """Returns the seconds since the epoch of a datetime, naive meaning UTC."""
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=UTC)
+    return moment.timestamp()
+
+
+ToTimestamp = to_timestamp
+
+
+def from_timestamp(value):
+    """Returns the aware UTC datetime of seconds since the epoch."""
+    return datetime.datetime.fromtimestamp(value, UTC)
+
+
+FromTimestamp = from_timestamp
+
+
+def _format_time(moment):
+    return from_timestamp(to_timestamp(moment)).strftime('%Y-%m-%dT%H:%M:%SZ')
+
+
+class BusyVector(object):
+    """Sorted, non overlapping busy intervals of a calendar.
+
+    Attributes:
+      starts: array.array of float start times in seconds since the epoch.
+      ends: array.array of float end times, ends[i] belonging to starts[i].
+    """
+
+    __slots__ = ('starts', 'ends')
+
+    def __init__(self, starts=(), ends=()):
+        self.starts = array.array('d', starts)
+        self.ends = array.array('d', ends)
+
+    def __len__(self):
+        return len(self.starts)
+
+    def __iter__(self):
+        return zip(self.starts, self.ends)
+
+    def __eq__(self, other):
+        return (isinstance(other, BusyVector) and self.starts == other.starts
+                and self.ends == other.ends)
+
+    def __repr__(self):
+        return 'BusyVector(%r)' % list(self)
+
+    @staticmethod
+    def from_sorted(intervals):
+        """Builds a vector from (start, end) pairs sorted by start.
+
+        Overlapping and touching intervals are joined and empty ones are
+        dropped.
+        """
+        vector = BusyVector()
+        starts = vector.starts
+        ends = vector.ends
+        for start, end in intervals:
+            if end <= start:
+                continue
+            if ends and start <= ends[-1]:
+                if end > ends[-1]:
+                    ends[-1] = end
+            else:
+                starts.append(start)
+                ends.append(end)
+        return vector
+
+    FromSorted = from_sorted
+
+    @staticmethod
+    def from_intervals(intervals):
+        """Builds a vector from (start, end) pairs in any order."""
+        return BusyVector.from_sorted(sorted(intervals))
+
+    FromIntervals = from_intervals
+
+    @staticmethod
+    def union(vectors):
+        """Merges the busy time of several vectors in one sweep.
+
+        The vectors are each sorted already, so their intervals are merged
+        by start time with a heap instead of being sorted again.
+        """
+        return BusyVector.from_sorted(heapq.merge(*vectors))
+
+    Union = union
+
+    def is_free(self, start, end):
+        """Whether no busy interval overlaps [start, end)."""
+        position = bisect.bisect_right(self.ends, start)
+        return position == len(self.starts) or self.starts[position] >= end
+
+    IsFree = is_free
+
+    def iter_gaps(self, start, end):
+        """Yields the (start, end) free intervals within [start, end)."""
+        position = bisect.bisect_right(self.ends, start)
+        cursor = start
+        for position in range(position, len(self.starts)):
+            if self.starts[position] >= end:
+                break
+            if self.starts[position] > cursor:
+                yield cursor, self.starts[position]
+            cursor = max(cursor, self.ends[position])
+        if cursor < end:
+            yield cursor, end
+
+    IterGaps = iter_gaps
+
+    def to_dict(self):
+        return {'starts': list(self.starts), 'ends': list(self.ends)}
+
+    ToDict = to_dict
+
+    @staticmethod
+    def from_dict(data):
+        return BusyVector(data['starts'], data['ends'])
+
+    FromDict = from_dict
+
+
+class BusyCache(object):
+    """Busy vectors by feed query, with the ETag they were read with.
+
+    The cache is shared by the threads of an aggregator. It can be saved to
+    a JSON file so ETags are revalidated across runs.
+    """
+
+    def __init__(self, path=None):
+        """Creates a cache, loading path if it exists.
+
+        Args:
+          path: str (optional) The JSON file used by save().
+        """
+        self.path = path
+        self.records = {}
+        self._lock = threading.Lock()
+        if path is not None and os.path.exists(path):
+            with open(path) as cache_file:
+                for key, record in json.load(cache_file).items():
+                    self.records[key] = (record['etag'],
+                                         BusyVector.from_dict(record))
+
+    def __len__(self):
+        return len(self.records)
+
+    def get(self, key):
+        """Returns the (etag, BusyVector) stored under key, or None."""
+        with self._lock:
+            return self.records.get(key)
+
+    Get = get
+
+    def put(self, key, etag, vector):
+        with self._lock:
+            self.records[key] = (etag, vector)
+
+    Put = put
+
+    def save(self, path=None):
+        """Writes the cache to a JSON file, replacing it atomically."""
+        path = path or self.path
+        with self._lock:
+            data = {}
+            for key, (etag, vector) in self.records.items():
+                data[key] = vector.to_dict()
+                data[key]['etag'] = etag
+        gdata.client.save_json(path, data)
+
+    Save = save
+
+
+class FreeSlot(object):
+    """A period when every calendar is free.
+
+    Attributes:
+      start: datetime The aware UTC start.
+      end: datetime The aware UTC end.
+      room: str (optional) The id of a room which is free as well.
+    """
+
+    __slots__ = ('start', 'end', 'room')
+
+    def __init__(self, start, end, room=None):
+        self.start = start
+        self.end = end
+        self.room = room
+
+    def __repr__(self):
+        return 'FreeSlot(%s, %s, %r)' % (self.start.isoformat(),
+                                         self.end.isoformat(), self.room)
+
+
+def get_busy_intervals(feed, start=None, end=None, default_tz=None):
+    """Yields the (start, end) timestamps when the events of a feed are busy.
+
+    Canceled and transparent events are skipped and intervals are clipped
+    to [start, end) when these are given as timestamps.
+    """
+    for event in feed.entry:
+        if gdata.calendar.recurrence._is_canceled(event):
+            continue
+        for instance in gdata.calendar.recurrence.get_when_instances(
+                event, default_tz):
+            if instance.is_transparent():
+                continue
+            busy_start = instance.start.timestamp()
+            busy_end = instance.end.timestamp()
+            if start is not None:
+                busy_start = max(busy_start, start)
+            if end is not None:
+                busy_end = min(busy_end, end)
+            if busy_start < busy_end:
+                yield busy_start, busy_end
+
+
+GetBusyIntervals = get_busy_intervals
+
+
+class FreeBusyAggregator(object):
+    """Fetches busy time of many calendars and finds common free slots."""
+
+    def __init__(self, client, cache=None, max_workers=DEFAULT_MAX_WORKERS,
+                 page_size=DEFAULT_PAGE_SIZE, default_tz=None):
+        """Creates an aggregator.
+
+        Args:
+          client: gdata.calendar.client.CalendarClient used for every
+              request, from several threads.
+          cache: BusyCache (optional) Where vectors and ETags are kept, a new
+              in memory cache if None.
+          max_workers: int (optional) Number of feeds fetched at once.
+          page_size: int (optional) The max-results of each request.
+          default_tz: tzinfo (optional) The time zone of all day events, UTC
+              if None.
+        """
+        self.client = client
+        self.cache = BusyCache() if cache is None else cache
+        self.max_workers = max_workers
+        self.page_size = page_size
+        self.default_tz = default_tz
+
+    def get_feed_uri(self, calendar_id):
+        return self.client.get_calendar_event_feed_uri(
+            calendar=urllib.parse.quote(calendar_id, safe='@'))
+
+    GetFeedUri = get_feed_uri
+
+    def get_busy(self, calendar_id, start, end):
+        """Returns the BusyVector of one calendar between start and end.
+
+        A cached vector for the same window is revalidated with its ETag and
+        reused if the server answers Not Modified.
+        """
+        uri = self.get_feed_uri(calendar_id)
+        start_min = _format_time(start)
+        start_max = _format_time(end)
+        key = '%s %s %s' % (uri, start_min, start_max)
+        cached = self.cache.get(key)
+        http_request = atom.http_core.HttpRequest()
+        if cached is not None and cached[0]:
+            http_request.headers['If-None-Match'] = cached[0]
+        # start-min and start-max select the events which end after start
+        # and begin before end.
+        query = gdata.calendar.client.CalendarEventQuery(
+            start_min=start_min, start_max=start_max, singleevents='true',
+            fields=BUSY_FIELDS, max_results=self.page_size)
+        try:
+            feed = self.client.get_calendar_event_feed(
+                uri, q=query, http_request=http_request)
+        except gdata.client.NotModified:
+            return cached[1]
+        window_start = to_timestamp(start)
+        window_end = to_timestamp(end)
+        intervals = []
+        pager = gdata.client.FeedPager(
+            self.client, feed,
+            desired_class=gdata.calendar.data.CalendarEventFeed)
+        for page in pager.iter_pages():
+            intervals.extend(get_busy_intervals(
+                page, window_start, window_end, self.default_tz))
+        vector = BusyVector.from_intervals(intervals)
+        self.cache.put(key, feed.etag, vector)
+        return vector
+
+    GetBusy = get_busy
+
+    def fetch(self, calendar_ids, start, end):
+        """Fetches the busy time of many calendars concurrently.
+
+        Returns:
+          A tuple of a dict of BusyVectors by calendar id, and a dict of the
+          exceptions raised for the calendars which could not be read.
+        """
+        vectors = {}
+        errors = {}
+        with concurrent.futures.ThreadPoolExecutor(
+                max_workers=self.max_workers) as executor:
+            futures = dict(
+                (executor.submit(self.get_busy, calendar_id, start, end),
+                 calendar_id)
+                for calendar_id in set(calendar_ids))
+            for future in concurrent.futures.as_completed(futures):
+                calendar_id = futures[future]
+                try:
+                    vectors[calendar_id] = future.result()
+                except gdata.client.Error as error:
+                    errors[calendar_id] = error
+        return vectors, errors
+
+    Fetch = fetch
+
+    def get_common_busy(self, calendar_ids, start, end):
+        """Returns the merged BusyVector of all the calendars.
+
+        Raises:
+          The error of the first calendar which could not be read.
+        """
+        vectors, errors = self.fetch(calendar_ids, start, end)
+        for calendar_id in calendar_ids:
+            if calendar_id in errors:
+                raise errors[calendar_id]
+        return BusyVector.union(vectors.values())
+
+    GetCommonBusy = get_common_busy
+
+    def find_free_slots(self, calendar_ids, start, end, duration, count=1,
+                        step=None, rooms=None):
+        """Finds the first periods when all the calendars are free.
+
+        Args:
+          calendar_ids: list of str The calendars of the attendees.
+          start: datetime The beginning of the search window.
+          end: datetime The end of the search window.
+          duration: datetime.timedelta The length of a slot.
+          count: int (optional) The largest number of slots returned.
+          step: datetime.timedelta (optional) If given, slots start at start
+              plus a multiple of step and several slots may be taken from one
+              free period. Otherwise each free period gives one slot, at its
+              beginning.
+          rooms: list of str (optional) Calendars of rooms, one of which must
+              be free as well. Rooms which cannot be read are ignored.
+
+        Returns:
+          A list of up to count FreeSlots, earliest first.
+        """
+        vectors, errors = self.fetch(list(calendar_ids) + list(rooms or ()),
+                                     start, end)
+        for calendar_id in calendar_ids:
+            if calendar_id in errors:
+                raise errors[calendar_id]
+        busy = BusyVector.union(vectors[calendar_id]
+                                for calendar_id in set(calendar_ids))
+        room_vectors = [(room, vectors[room]) for room in rooms or ()
+                        if room in vectors]
+        length = duration.total_seconds()
+        window_start = to_timestamp(start)
+        increment = step.total_seconds() if step else None
+        slots = []
+        for gap_start, gap_end in busy.iter_gaps(window_start,
+                                                 to_timestamp(end)):
+            slot_start = gap_start
+            if increment:
+                steps = -(-(gap_start - window_start) // increment)
+                slot_start = window_start + steps * increment
+            while slot_start + length <= gap_end and len(slots) < count:
+                room = None
+                if rooms:
+                    room = next((room_id for room_id, vector in room_vectors
+                                 if vector.is_free(slot_start,
+                                                   slot_start + length)),
+                                None)
+                if room is not None or not rooms:
+                    slots.append(FreeSlot(from_timestamp(slot_start),
+                                          from_timestamp(slot_start + length),
+                                          room))
+                    if not increment:
+                        break
+                elif not increment:
+                    if not room_vectors:
+                        break
+                    # Every room is busy during the slot, so try again when
+                    # the first of them becomes free.
+                    slot_start = min(
+                        vector.ends[bisect.bisect_right(vector.ends,
+                                                        slot_start)]
+                        for room_id, vector in room_vectors)
+                    continue
+                slot_start += increment
+            if len(slots) >= count:
+                break
+        return slots
+
+    FindFreeSlots = find_free_slots
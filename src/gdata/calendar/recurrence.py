@@ -0,0 +1,1089 @@
+#
+# Licensed under the Apache License 2.0;
+
+
+"""Expands recurring calendar events locally.
+
+The gd:recurrence element of an event holds RFC 2445 text (DTSTART, DTEND
+or DURATION, RRULE, RDATE, EXRULE, EXDATE and VTIMEZONE components). The
+Calendar server can expand it (CalendarEventQuery with singleevents or
+recurrence_expansion_start and recurrence_expansion_end), but then every
+new time window needs a new request. This module expands the text on the
+client instead, so master events are fetched once:
+
+  RecurrenceSet.parse(event.recurrence.text).iter_instances(start, end)
+
+yields the (start, end) times of the instances in a window, lazily and in
+order. expand_events does this for a list of events, replacing the
+instances changed or canceled by exceptions (gd:recurrenceException or
+events with a gd:originalEvent). The instances of many calendars can then
+be put in an IntervalTree to find those overlapping a period quickly.
+
+All times are returned as timezone aware datetimes in UTC. Dates and
+floating times, which have no time zone, are read in the default_tz given
+to the parsing functions, UTC if None.
+
+Supported rule parts are FREQ, INTERVAL, COUNT, UNTIL, BYMONTH, BYMONTHDAY,
+BYDAY, BYSETPOS and WKST, which cover the rules written by Google Calendar.
+"""
+
+import bisect
+import calendar
+import datetime
+import heapq
+import re
+
+try:
+    import zoneinfo
+except ImportError:
+    zoneinfo = None
+
+import atom.core
+import gdata.data
+import gdata.calendar.data
+
+UTC = datetime.timezone.utc
+CANCELED_EVENT = 'http://schemas.google.com/g/2005#event.canceled'
+TRANSPARENT_EVENT = 'http://schemas.google.com/g/2005#event.transparent'
+
+WEEKDAYS = ('MO', 'TU', 'WE', 'TH', 'FR', 'SA', 'SU')
+# Frequencies and the length of their period, for those which have a
+# fixed one.
+FIXED_PERIODS = {
+    'SECONDLY': datetime.timedelta(seconds=1),
+    'MINUTELY': datetime.timedelta(minutes=1),
+    'HOURLY': datetime.timedelta(hours=1),
+    'DAILY': datetime.timedelta(days=1),
+}
+FREQUENCIES = ('SECONDLY', 'MINUTELY', 'HOURLY', 'DAILY', 'WEEKLY',
+               'MONTHLY', 'YEARLY')
+# An unbounded rule is abandoned after this many periods without an
+# instance, for example FREQ=YEARLY;BYMONTHDAY=30;BYMONTH=2. Rules with a
+# fixed period skip the days and months which can not match in one go, so
+# a sparse rule such as FREQ=MINUTELY;BYMONTH=12 counts one empty period
+# per skipped month rather than one per minute.
+MAX_EMPTY_PERIODS = 1000
+
+_DURATION_PATTERN = re.compile(
+    r'^([+-])?P(?:(\d+)W)?(?:(\d+)D)?'
+    r'(?:T(?:(\d+)H)?(?:(\d+)M)?(?:(\d+)S)?)?$')
+_BY_DAY_PATTERN = re.compile(r'^([+-]?\d{1,2})?(MO|TU|WE|TH|FR|SA|SU)$')
+_RFC3339_PATTERN = re.compile(
+    r'^(\d{4})-(\d\d)-(\d\d)'
+    r'(?:T(\d\d):(\d\d):(\d\d)(?:\.\d+)?(Z|[+-]\d\d:\d\d)?)?$')
+
+
+class Error(Exception):
+    pass
+
+
+class RecurrenceError(Error):
+    """Raised for recurrence text which can not be parsed or expanded."""
+    pass
+
+
+def parse_duration(value):
+    """Parses an RFC 2445 duration such as 'PT1H30M' into a timedelta."""
+    match = _DURATION_PATTERN.match(value.strip())
+    if match is None:
+        raise RecurrenceError('Invalid duration %r' % value)
+    sign, weeks, days, hours, minutes, seconds = match.groups()
+    duration = datetime.timedelta(
+        weeks=int(weeks or 0), days=int(days or 0), hours=int(hours or 0),
+        minutes=int(minutes or 0), seconds=int(seconds or 0))
+    if sign == '-':
+        return -duration
+    return duration
+
+
+ParseDuration = parse_duration
+
+
+def parse_rfc3339(value, default_tz=None):
+    """Parses a gd:when time such as '2012-03-01T10:00:00.000-08:00'.
+
+    Args:
+      value: str A date (all day) or date and time.
+      default_tz: tzinfo (optional) The time zone of dates and of times
+          without an offset, UTC if None.
+
+    Returns:
+      A tuple of the time as a datetime in UTC, and whether it was a date.
+    """
+    match = _RFC3339_PATTERN.match(value.strip())
+    if match is None:
+        raise RecurrenceError('Invalid time %r' % value)
+    year, month, day, hour, minute, second, offset = match.groups()
+    moment = datetime.datetime(int(year), int(month), int(day),
+                               int(hour or 0), int(minute or 0),
+                               int(second or 0))
+    if offset == 'Z':
+        moment = moment.replace(tzinfo=UTC)
+    elif offset:
+        sign = -1 if offset[0] == '-' else 1
+        moment = moment.replace(tzinfo=datetime.timezone(
+            sign * datetime.timedelta(hours=int(offset[1:3]),
+                                      minutes=int(offset[4:6]))))
+    else:
+        moment = moment.replace(tzinfo=default_tz or UTC)
+    return moment.astimezone(UTC), hour is None
+
+
+ParseRfc3339 = parse_rfc3339
+
+
+def _parse_value(value, is_date=False):
+    """Parses an RFC 2445 DATE or DATE-TIME value.
+
+    Returns:
+      A tuple of a naive datetime, whether the value is in UTC and whether
+      it is a date.
+    """
+    value = value.strip()
+    try:
+        if is_date or len(value) == 8:
+            return (datetime.datetime.strptime(value[:8], '%Y%m%d'), False,
+                    True)
+        moment = datetime.datetime.strptime(value[:15], '%Y%m%dT%H%M%S')
+    except ValueError:
+        raise RecurrenceError('Invalid date or time %r' % value)
+    return moment, value.endswith('Z'), False
+
+
+def _unfold(text):
+    """Returns the content lines of RFC 2445 text, joining folded lines."""
+    lines = []
+    for line in text.replace('\r\n', '\n').replace('\r', '\n').split('\n'):
+        if line[:1] in (' ', '\t') and lines:
+            lines[-1] += line[1:]
+        elif line.strip():
+            lines.append(line.strip())
+    return lines
+
+
+def _parse_line(line):
+    """Splits 'NAME;PARAM=VALUE:VALUE' into the name, params and value."""
+    head, separator, value = line.partition(':')
+    if not separator:
+        raise RecurrenceError('Invalid content line %r' % line)
+    parts = head.split(';')
+    params = {}
+    for part in parts[1:]:
+        key, _, param_value = part.partition('=')
+        params[key.upper()] = param_value.strip('"')
+    return parts[0].upper(), params, value
+
+
+class RecurrenceRule(object):
+    """An RRULE or EXRULE, expanded in local (naive) time."""
+
+    def __init__(self, freq, interval=1, count=None, until=None,
+                 by_month=None, by_month_day=None, by_day=None,
+                 by_set_pos=None, week_start=0):
+        """Creates a rule.
+
+        Args:
+          freq: str One of FREQUENCIES.
+          interval: int The number of periods between two repetitions.
+          count: int (optional) The number of instances.
+          until: datetime (optional) The last possible instance, naive in
+              the local time of the event.
+          by_month: list of ints (optional) Months, 1 to 12.
+          by_month_day: list of ints (optional) Days of the month, negative
+              values counting from the end of the month.
+          by_day: list of (ordinal, weekday) tuples (optional) Weekdays,
+              0 for Monday, with an ordinal which is None for every such
+              weekday of the period.
+          by_set_pos: list of ints (optional) Positions in the instances of
+              a period of those to keep.
+          week_start: int The first day of the week, 0 for Monday.
+        """
+        if freq not in FREQUENCIES:
+            raise RecurrenceError('Unsupported frequency %r' % freq)
+        self.freq = freq
+        self.interval = interval
+        self.count = count
+        self.until = until
+        self.by_month = by_month
+        self.by_month_day = by_month_day
+        self.by_day = by_day
+        self.by_set_pos = by_set_pos
+        self.week_start = week_start
+
+    @staticmethod
+    def parse(value, tz=None):
+        """Parses the value of an RRULE or EXRULE.
+
+        Args:
+          value: str For example 'FREQ=WEEKLY;BYDAY=MO,WE;UNTIL=20121231'.
+          tz: tzinfo (optional) The local time zone, used to convert an
+              UNTIL time given in UTC.
+        """
+        parts = {}
+        for part in value.strip().split(';'):
+            if part:
+                key, _, part_value = part.partition('=')
+                parts[key.upper()] = part_value.upper()
+
+        def numbers(key):
+            if key not in parts:
+                return None
+            return [int(number) for number in parts.pop(key).split(',')]
+
+        freq = parts.pop('FREQ', None)
+        interval = int(parts.pop('INTERVAL', 1))
+        count = parts.pop('COUNT', None)
+        until = parts.pop('UNTIL', None)
+        if until is not None:
+            until, in_utc, is_date = _parse_value(until)
+            if is_date:
+                until += datetime.timedelta(days=1, microseconds=-1)
+            elif in_utc and tz is not None:
+                until = until.replace(tzinfo=UTC).astimezone(tz).replace(
+                    tzinfo=None)
+        by_day = None
+        if 'BYDAY' in parts:
+            by_day = []
+            for day in parts.pop('BYDAY').split(','):
+                match = _BY_DAY_PATTERN.match(day)
+                if match is None:
+                    raise RecurrenceError('Invalid BYDAY %r' % day)
+                ordinal = match.group(1)
+                by_day.append((int(ordinal) if ordinal else None,
+                               WEEKDAYS.index(match.group(2))))
+        week_start = WEEKDAYS.index(parts.pop('WKST', 'MO'))
+        rule = RecurrenceRule(
+            freq, interval=interval,
+            count=int(count) if count is not None else None, until=until,
+            by_month=numbers('BYMONTH'), by_month_day=numbers('BYMONTHDAY'),
+            by_day=by_day, by_set_pos=numbers('BYSETPOS'),
+            week_start=week_start)
+        if parts:
+            raise RecurrenceError('Unsupported rule parts %s' % ', '.join(
+                sorted(parts)))
+        return rule
+
+    Parse = parse
+
+    def _month_days(self, year, month, dtstart):
+        days_in_month = calendar.monthrange(year, month)[1]
+        month_days = None
+        if self.by_month_day:
+            month_days = set()
+            for day in self.by_month_day:
+                if day < 0:
+                    day += days_in_month + 1
+                if 1 <= day <= days_in_month:
+                    month_days.add(day)
+        week_days = None
+        if self.by_day:
+            week_days = set()
+            first_weekday = calendar.monthrange(year, month)[0]
+            for ordinal, weekday in self.by_day:
+                matching = list(range(1 + (weekday - first_weekday) % 7,
+                                      days_in_month + 1, 7))
+                if ordinal is None:
+                    week_days.update(matching)
+                elif -len(matching) <= ordinal <= len(matching) and ordinal:
+                    week_days.add(matching[ordinal - 1 if ordinal > 0
+                                           else ordinal])
+        if month_days is not None and week_days is not None:
+            days = month_days & week_days
+        elif month_days is not None:
+            days = month_days
+        elif week_days is not None:
+            days = week_days
+        elif dtstart.day <= days_in_month:
+            days = {dtstart.day}
+        else:
+            days = set()
+        return [datetime.date(year, month, day) for day in sorted(days)]
+
+    def _year_days(self, year, dtstart):
+        if self.by_month:
+            dates = []
+            for month in sorted(self.by_month):
+                dates.extend(self._month_days(year, month, dtstart))
+            return dates
+        if self.by_day and not self.by_month_day:
+            first = datetime.date(year, 1, 1)
+            days_in_year = 366 if calendar.isleap(year) else 365
+            dates = set()
+            for ordinal, weekday in self.by_day:
+                offset = (weekday - first.weekday()) % 7
+                matching = [first + datetime.timedelta(days=day)
+                            for day in range(offset, days_in_year, 7)]
+                if ordinal is None:
+                    dates.update(matching)
+                elif -len(matching) <= ordinal <= len(matching) and ordinal:
+                    dates.add(matching[ordinal - 1 if ordinal > 0
+                                       else ordinal])
+            return sorted(dates)
+        if self.by_month_day or self.by_day:
+            dates = []
+            for month in range(1, 13):
+                dates.extend(self._month_days(year, month, dtstart))
+            return dates
+        return self._month_days(year, dtstart.month, dtstart)
+
+    def _matches(self, moment):
+        """Applies the BY parts which limit a fixed period frequency."""
+        if self.by_month and moment.month not in self.by_month:
+            return False
+        if self.by_month_day:
+            days_in_month = calendar.monthrange(moment.year, moment.month)[1]
+            if (moment.day not in self.by_month_day
+                    and moment.day - days_in_month - 1
+                    not in self.by_month_day):
+                return False
+        if self.by_day and moment.weekday() not in [
+                weekday for ordinal, weekday in self.by_day]:
+            return False
+        return True
+
+    def _next_candidate(self, moment):
+        """Returns the start of the next month or day which can match.
+
+        Called with a moment _matches rejected: no other moment of its
+        month, or of its day, matches either.
+        """
+        if self.by_month and moment.month not in self.by_month:
+            year, month = divmod(moment.year * 12 + moment.month, 12)
+            return datetime.datetime(year, month + 1, 1)
+        return datetime.datetime.combine(
+            moment.date() + datetime.timedelta(days=1), datetime.time())
+
+    def _periods(self, dtstart):
+        """Yields the sorted candidate instances of each period."""
+        if self.freq in FIXED_PERIODS:
+            step = FIXED_PERIODS[self.freq] * self.interval
+            moment = dtstart
+            while True:
+                if self._matches(moment):
+                    yield [moment]
+                    moment += step
+                    continue
+                yield []
+                # Every step before the next candidate is rejected as well.
+                gap = self._next_candidate(moment) - moment
+                moment += step * max(1, -(-gap // step))
+        start_time = dtstart.time()
+        period = 0
+        while True:
+            if self.freq == 'WEEKLY':
+                week = (dtstart.date()
+                        - datetime.timedelta(
+                            days=(dtstart.weekday() - self.week_start) % 7)
+                        + datetime.timedelta(weeks=period * self.interval))
+                weekdays = ([weekday for ordinal, weekday in self.by_day]
+                            if self.by_day else [dtstart.weekday()])
+                dates = sorted(
+                    week + datetime.timedelta(
+                        days=(weekday - self.week_start) % 7)
+                    for weekday in set(weekdays))
+                if self.by_month:
+                    dates = [date for date in dates
+                             if date.month in self.by_month]
+            elif self.freq == 'MONTHLY':
+                months = (dtstart.year * 12 + dtstart.month - 1
+                          + period * self.interval)
+                year, month = divmod(months, 12)
+                month += 1
+                if self.by_month and month not in self.by_month:
+                    dates = []
+                else:
+                    dates = self._month_days(year, month, dtstart)
+            else:
+                year = dtstart.year + period * self.interval
+                dates = self._year_days(year, dtstart)
+            if dates and dates[-1].year >= datetime.MAXYEAR:
+                return
+            moments = [datetime.datetime.combine(date, start_time)
+                       for date in dates]
+            if self.by_set_pos:
+                moments = sorted(set(
+                    moments[position - 1 if position > 0 else position]
+                    for position in self.by_set_pos
+                    if moments and -len(moments) <= position <= len(moments)
+                    and position))
+            yield moments
+            period += 1
+
+    def iter_from(self, dtstart):
+        """Yields the instances of the rule from dtstart on, in order.
+
+        Args:
+          dtstart: datetime The naive local start of the first instance.
+        """
+        emitted = 0
+        empty_periods = 0
+        try:
+            for moments in self._periods(dtstart):
+                found = False
+                for moment in moments:
+                    if moment < dtstart:
+                        continue
+                    if self.until is not None and moment > self.until:
+                        return
+                    found = True
+                    yield moment
+                    emitted += 1
+                    if self.count is not None and emitted >= self.count:
+                        return
+                if found:
+                    empty_periods = 0
+                else:
+                    empty_periods += 1
+                    if empty_periods > MAX_EMPTY_PERIODS:
+                        return
+        except (OverflowError, ValueError):
+            # Past the largest year datetime supports.
+            return
+
+    IterFrom = iter_from
+
+
+class VTimezone(datetime.tzinfo):
+    """A time zone defined by a VTIMEZONE component."""
+
+    def __init__(self, tzid, observances):
+        """Creates a time zone.
+
+        Args:
+          tzid: str The TZID of the component.
+          observances: list of dicts, one per STANDARD or DAYLIGHT
+              sub-component, with the keys 'name', 'dtstart' (naive local
+              datetime), 'offset_from', 'offset_to' (timedeltas), 'rule' (a
+              RecurrenceRule or None), 'rdates' and 'tzname'.
+        """
+        self.tzid = tzid
+        self.observances = observances
+        self._years = {}
+        first = min(observances, key=lambda observance: observance['dtstart'])
+        self._initial = dict(first, offset_to=first['offset_from'])
+
+    def __repr__(self):
+        return 'VTimezone(%r)' % self.tzid
+
+    def _transitions(self, year):
+        """Returns the (UTC onset, observance) pairs starting in a year."""
+        transitions = self._years.get(year)
+        if transitions is not None:
+            return transitions
+        transitions = []
+        year_start = datetime.datetime(year, 1, 1)
+        year_end = datetime.datetime(year + 1, 1, 1)
+        for observance in self.observances:
+            onsets = [onset for onset in observance['rdates']
+                      if year_start <= onset < year_end]
+            if observance['dtstart'] < year_end:
+                if observance['rule'] is None:
+                    onsets.append(observance['dtstart'])
+                else:
+                    for onset in observance['rule'].iter_from(
+                            observance['dtstart']):
+                        if onset >= year_end:
+                            break
+                        if onset >= year_start:
+                            onsets.append(onset)
+            transitions.extend(
+                (onset - observance['offset_from'], observance)
+                for onset in onsets
+                if year_start <= onset < year_end)
+        transitions.sort(key=lambda transition: transition[0])
+        self._years[year] = transitions
+        return transitions
+
+    def _at_utc(self, moment):
+        """Returns the observance in effect at a naive UTC time."""
+        current = None
+        for year in (moment.year - 1, moment.year):
+            for onset, observance in self._transitions(year):
+                if onset <= moment:
+                    current = observance
+        if current is None:
+            for year in range(moment.year - 2,
+                              self._initial['dtstart'].year - 1, -1):
+                transitions = self._transitions(year)
+                if transitions:
+                    return transitions[-1][1]
+            return self._initial
+        return current
+
+    def _at_local(self, moment):
+        """Returns the observance in effect at a naive local time."""
+        current = None
+        for year in (moment.year - 1, moment.year):
+            for onset, observance in self._transitions(year):
+                if onset + observance['offset_from'] <= moment:
+                    current = observance
+        if current is None:
+            return self._at_utc(moment)
+        return current
+
+    def utcoffset(self, moment):
+        if moment is None:
+            return None
+        return self._at_local(moment.replace(tzinfo=None))['offset_to']
+
+    def dst(self, moment):
+        if moment is None:
+            return None
+        observance = self._at_local(moment.replace(tzinfo=None))
+        if observance['name'] == 'DAYLIGHT':
+            return observance['offset_to'] - observance['offset_from']
+        return datetime.timedelta(0)
+
+    def tzname(self, moment):
+        if moment is None:
+            return self.tzid
+        return self._at_local(moment.replace(tzinfo=None))['tzname']
+
+    def fromutc(self, moment):
+        observance = self._at_utc(moment.replace(tzinfo=None))
+        return moment + observance['offset_to']
+
+    @staticmethod
+    def parse(lines):
+        """Creates a VTimezone from the content lines between BEGIN:VTIMEZONE
+        and END:VTIMEZONE."""
+        tzid = None
+        observances = []
+        observance = None
+        rule_value = None
+        for line in lines:
+            name, params, value = _parse_line(line)
+            if name == 'TZID':
+                tzid = value
+            elif name == 'BEGIN':
+                observance = {'name': value.upper(), 'rule': None,
+                              'rdates': [], 'tzname': None}
+                rule_value = None
+            elif name == 'END' and observance is not None:
+                if rule_value is not None:
+                    observance['rule'] = RecurrenceRule.parse(rule_value)
+                observances.append(observance)
+                observance = None
+            elif observance is not None:
+                if name == 'DTSTART':
+                    observance['dtstart'] = _parse_value(value)[0]
+                elif name in ('TZOFFSETFROM', 'TZOFFSETTO'):
+                    sign = -1 if value.startswith('-') else 1
+                    digits = value.lstrip('+-')
+                    offset = sign * datetime.timedelta(
+                        hours=int(digits[:2]), minutes=int(digits[2:4]))
+                    observance['offset_from' if name == 'TZOFFSETFROM'
+                               else 'offset_to'] = offset
+                elif name == 'RRULE':
+                    rule_value = value
+                elif name == 'RDATE':
+                    observance['rdates'].extend(
+                        _parse_value(part)[0] for part in value.split(','))
+                elif name == 'TZNAME':
+                    observance['tzname'] = value
+        if not observances:
+            raise RecurrenceError('VTIMEZONE %s has no observances' % tzid)
+        return VTimezone(tzid, observances)
+
+    Parse = parse
+
+
+def get_time_zone(tzid, timezones=None):
+    """Returns the tzinfo for a TZID.
+
+    Args:
+      tzid: str
+      timezones: dict (optional) VTimezones by TZID, from the VTIMEZONE
+          components of the recurrence. Other ids are looked up in the
+          system's time zone database.
+    """
+    if timezones and tzid in timezones:
+        return timezones[tzid]
+    if zoneinfo is not None:
+        try:
+            return zoneinfo.ZoneInfo(tzid)
+        except (KeyError, ValueError, OSError):
+            pass
+    raise RecurrenceError('Unknown time zone %r' % tzid)
+
+
+GetTimeZone = get_time_zone
+
+
+class RecurrenceSet(object):
+    """The instances described by the text of a gd:recurrence element.
+
+    Attributes:
+      dtstart: datetime The naive local start of the first instance.
+      duration: timedelta The length of each instance.
+      tz: tzinfo The time zone of the local times.
+      all_day: bool Whether the instances are dates.
+      rules: list of RecurrenceRules (RRULE).
+      exrules: list of RecurrenceRules (EXRULE).
+      rdates: list of naive local datetimes (RDATE).
+      exdates: set of naive local datetimes (EXDATE).
+    """
+
+    def __init__(self, dtstart, duration=None, tz=None, all_day=False,
+                 rules=None, exrules=None, rdates=None, exdates=None):
+        self.dtstart = dtstart
+        self.duration = duration or datetime.timedelta(0)
+        self.tz = tz or UTC
+        self.all_day = all_day
+        self.rules = rules or []
+        self.exrules = exrules or []
+        self.rdates = sorted(rdates or [])
+        self.exdates = set(exdates or [])
+
+    @staticmethod
+    def parse(text, default_tz=None):
+        """Parses the text of a gd:recurrence element.
+
+        Args:
+          text: str RFC 2445 recurrence properties.
+          default_tz: tzinfo (optional) The time zone of dates and floating
+              times, UTC if None.
+
+        Returns:
+          A RecurrenceSet.
+        """
+        lines = _unfold(text)
+        timezones = {}
+        properties = []
+        position = 0
+        while position < len(lines):
+            name, params, value = _parse_line(lines[position])
+            if name == 'BEGIN' and value.upper() == 'VTIMEZONE':
+                end = position + 1
+                while end < len(lines) and lines[end].upper() != \
+                        'END:VTIMEZONE':
+                    end += 1
+                timezone = VTimezone.parse(lines[position + 1:end])
+                timezones[timezone.tzid] = timezone
+                position = end + 1
+                continue
+            properties.append((name, params, value))
+            position += 1
+
+        dtstart = None
+        tz = None
+        for name, params, value in properties:
+            if name == 'DTSTART':
+                dtstart, in_utc, all_day = _parse_value(
+                    value, params.get('VALUE') == 'DATE')
+                if 'TZID' in params:
+                    tz = get_time_zone(params['TZID'], timezones)
+                elif in_utc:
+                    tz = UTC
+                else:
+                    tz = default_tz or UTC
+        if dtstart is None:
+            raise RecurrenceError('Recurrence without DTSTART')
+
+        def local_times(name, params, value):
+            moments = []
+            for part in value.split(','):
+                # The start of a PERIOD value.
+                part = part.split('/')[0]
+                moment, in_utc, is_date = _parse_value(
+                    part, params.get('VALUE') == 'DATE')
+                if is_date:
+                    moment = datetime.datetime.combine(moment.date(),
+                                                       dtstart.time())
+                elif in_utc:
+                    moment = moment.replace(tzinfo=UTC).astimezone(
+                        tz).replace(tzinfo=None)
+                elif 'TZID' in params:
+                    moment = moment.replace(
+                        tzinfo=get_time_zone(params['TZID'], timezones)
+                    ).astimezone(tz).replace(tzinfo=None)
+                moments.append(moment)
+            return moments
+
+        recurrence = RecurrenceSet(dtstart, tz=tz, all_day=all_day)
+        if all_day:
+            recurrence.duration = datetime.timedelta(days=1)
+        for name, params, value in properties:
+            if name == 'DTEND':
+                recurrence.duration = (local_times(name, params, value)[0]
+                                       - dtstart)
+            elif name == 'DURATION':
+                recurrence.duration = parse_duration(value)
+            elif name == 'RRULE':
+                recurrence.rules.append(RecurrenceRule.parse(value, tz))
+            elif name == 'EXRULE':
+                recurrence.exrules.append(RecurrenceRule.parse(value, tz))
+            elif name == 'RDATE':
+                recurrence.rdates.extend(local_times(name, params, value))
+            elif name == 'EXDATE':
+                recurrence.exdates.update(local_times(name, params, value))
+        recurrence.rdates.sort()
+        return recurrence
+
+    Parse = parse
+
+    def iter_starts(self):
+        """Yields the naive local start of every instance, in order.
+
+        The result may be infinite.
+        """
+        sources = [rule.iter_from(self.dtstart) for rule in self.rules]
+        if not self.rules:
+            sources.append(iter([self.dtstart]))
+        sources.append(iter(self.rdates))
+        excluded = [rule.iter_from(self.dtstart) for rule in self.exrules]
+        next_excluded = [next(rule, None) for rule in excluded]
+        previous = None
+        for moment in heapq.merge(*sources):
+            if moment == previous:
+                continue
+            previous = moment
+            if moment in self.exdates:
+                continue
+            skip = False
+            for position, rule in enumerate(excluded):
+                while (next_excluded[position] is not None
+                       and next_excluded[position] < moment):
+                    next_excluded[position] = next(rule, None)
+                if next_excluded[position] == moment:
+                    skip = True
+            if not skip:
+                yield moment
+
+    IterStarts = iter_starts
+
+    def to_utc(self, moment):
+        """Converts a naive local time to an aware UTC datetime."""
+        return moment.replace(tzinfo=self.tz).astimezone(UTC)
+
+    ToUtc = to_utc
+
+    def iter_instances(self, start=None, end=None):
+        """Yields the (start, end) UTC datetimes of the instances in a window.
+
+        Instances are generated lazily and in order, and the generation
+        stops at the end of the window, so unbounded rules can be expanded.
+
+        Args:
+          start: datetime (optional) Instances ending at or before this aware
+              time are skipped.
+          end: datetime (optional) Instances starting at or after this aware
+              time, and all later ones, are left out.
+        """
+        for moment in self.iter_starts():
+            instance_start = self.to_utc(moment)
+            if end is not None and instance_start >= end:
+                return
+            instance_end = self.to_utc(moment + self.duration)
+            if start is not None and instance_end <= start and not (
+                    instance_start == instance_end == start):
+                continue
+            yield instance_start, instance_end
+
+    IterInstances = iter_instances
+
+
+class EventInstance(object):
+    """One occurrence of an event.
+
+    Attributes:
+      event: CalendarEventEntry The event, or the exception which replaced
+          the occurrence.
+      start: datetime The aware UTC start.
+      end: datetime The aware UTC end.
+      all_day: bool Whether the occurrence lasts whole days.
+      original_start: datetime (optional) The UTC start the occurrence had
+          in its recurring event, for occurrences of recurring events.
+    """
+
+    __slots__ = ('event', 'start', 'end', 'all_day', 'original_start')
+
+    def __init__(self, event, start, end, all_day=False, original_start=None):
+        self.event = event
+        self.start = start
+        self.end = end
+        self.all_day = all_day
+        self.original_start = original_start
+
+    def __repr__(self):
+        return 'EventInstance(%s, %s)' % (self.start.isoformat(),
+                                          self.end.isoformat())
+
+    def is_transparent(self):
+        """Whether the occurrence leaves its time free."""
+        transparency = getattr(self.event, 'transparency', None)
+        return (transparency is not None
+                and transparency.value == TRANSPARENT_EVENT)
+
+    IsTransparent = is_transparent
+
+
+def _event_key(href_or_id):
+    return href_or_id.rstrip('/').split('/')[-1]
+
+
+def _is_canceled(event):
+    return (event.event_status is not None
+            and event.event_status.value == CANCELED_EVENT)
+
+
+def get_when_instances(event, default_tz=None):
+    """Returns the EventInstances of the gd:when elements of an event."""
+    instances = []
+    for when in event.when:
+        if not when.start:
+            continue
+        start, all_day = parse_rfc3339(when.start, default_tz)
+        if when.end:
+            end = parse_rfc3339(when.end, default_tz)[0]
+        elif all_day:
+            end = start + datetime.timedelta(days=1)
+        else:
+            end = start
+        instances.append(EventInstance(event, start, end, all_day))
+    return instances
+
+
+GetWhenInstances = get_when_instances
+
+
+def get_overrides(events, default_tz=None):
+    """Finds the exceptions to recurring events.
+
+    Exceptions are either events with a gd:originalEvent element, or
+    gd:recurrenceException elements nested in the recurring event.
+
+    Returns:
+      A dict mapping the id of each recurring event to a dict which maps
+      the original UTC start of an occurrence to the CalendarEventEntry
+      replacing it.
+    """
+    overrides = {}
+
+    def add(original_event, exception):
+        if original_event is None or original_event.when is None:
+            return
+        key = original_event.id or _event_key(original_event.href or '')
+        original_start = parse_rfc3339(original_event.when.start,
+                                       default_tz)[0]
+        overrides.setdefault(key, {})[original_start] = exception
+
+    for event in events:
+        if event.original_event is not None:
+            add(event.original_event, event)
+        for exception in event.recurrence_exception:
+            if exception.entry_link is None or \
+                    exception.entry_link.entry is None:
+                continue
+            nested = atom.core.parse(
+                exception.entry_link.entry.to_string().encode('utf-8'),
+                gdata.calendar.data.CalendarEventEntry)
+            add(nested.original_event or exception.original_event, nested)
+    return overrides
+
+
+GetOverrides = get_overrides
+
+
+def expand_events(events, start, end, default_tz=None):
+    """Yields the occurrences of events which overlap a window.
+
+    Recurring events are expanded locally. Occurrences replaced by an
+    exception are returned with the exception's event and times, and
+    canceled ones are left out.
+
+    Args:
+      events: list of CalendarEventEntry objects, for example the entries of
+          a feed requested without singleevents.
+      start: datetime The aware start of the window.
+      end: datetime The aware end of the window.
+      default_tz: tzinfo (optional) The time zone of dates and floating
+          times, UTC if None.
+    """
+    events = list(events)
+    overrides = get_overrides(events, default_tz)
+    masters = set()
+    for event in events:
+        if event.recurrence is not None and event.id is not None:
+            masters.add(_event_key(event.id.text))
+
+    def overlaps(instance):
+        return instance.start < end and (
+            instance.end > start or instance.start == instance.end >= start)
+
+    for event in events:
+        if _is_canceled(event):
+            continue
+        if event.original_event is not None:
+            key = (event.original_event.id
+                   or _event_key(event.original_event.href or ''))
+            if key in masters:
+                # Returned with the occurrences of its recurring event.
+                continue
+        if event.recurrence is None:
+            for instance in get_when_instances(event, default_tz):
+                if overlaps(instance):
+                    yield instance
+            continue
+        recurrence = RecurrenceSet.parse(event.recurrence.text, default_tz)
+        replaced = overrides.get(_event_key(event.id.text), {}) \
+            if event.id is not None else {}
+        for instance_start, instance_end in recurrence.iter_instances(
+                start, end):
+            if instance_start in replaced:
+                continue
+            yield EventInstance(event, instance_start, instance_end,
+                                recurrence.all_day, instance_start)
+        for original_start, exception in sorted(
+                replaced.items(), key=lambda item: item[0]):
+            if _is_canceled(exception):
+                continue
+            for instance in get_when_instances(exception, default_tz):
+                instance.original_start = original_start
+                if overlaps(instance):
+                    yield instance
+
+
+ExpandEvents = expand_events
+
+
+class IntervalTree(object):
+    """Intervals indexed for overlap queries.
+
+    The intervals are kept sorted by start in arrays, which form an implicit
+    balanced binary tree: the middle of any range of positions is the root
+    of the range. Each node also stores the largest end in its subtree, so
+    a query skips every subtree which ends before the queried period and
+    takes O(log n + k) for k results. Adding intervals marks the tree for a
+    rebuild on the next query.
+
+    Intervals are half open: [start, end). Any comparable values, such as
+    aware datetimes or numbers, can be used as bounds.
+    """
+
+    def __init__(self, intervals=()):
+        """Creates a tree.
+
+        Args:
+          intervals: iterable of (start, end, value) tuples.
+        """
+        self._intervals = list(intervals)
+        self._sorted = False
+        self._starts = []
+        self._ends = []
+        self._values = []
+        self._max_ends = []
+
+    def __len__(self):
+        return len(self._intervals)
+
+    def __iter__(self):
+        self._build()
+        return iter(zip(self._starts, self._ends, self._values))
+
+    def add(self, start, end, value=None):
+        """Adds an interval."""
+        self._intervals.append((start, end, value))
+        self._sorted = False
+
+    Add = add
+
+    def _build(self):
+        if self._sorted:
+            return
+        self._intervals.sort(key=lambda interval: (interval[0], interval[1]))
+        self._starts = [interval[0] for interval in self._intervals]
+        self._ends = [interval[1] for interval in self._intervals]
+        self._values = [interval[2] for interval in self._intervals]
+        self._max_ends = list(self._ends)
+        # Computes the largest end of each range bottom up.
+        ranges = []
+        pending = [(0, len(self._intervals))]
+        while pending:
+            low, high = pending.pop()
+            if low >= high:
+                continue
+            middle = (low + high) // 2
+            ranges.append((low, middle, high))
+            pending.append((low, middle))
+            pending.append((middle + 1, high))
+        for low, middle, high in reversed(ranges):
+            if low < middle:
+                left = (low + middle) // 2
+                if self._max_ends[left] > self._max_ends[middle]:
+                    self._max_ends[middle] = self._max_ends[left]
+            if middle + 1 < high:
+                right = (middle + 1 + high) // 2
+                if self._max_ends[right] > self._max_ends[middle]:
+                    self._max_ends[middle] = self._max_ends[right]
+        self._sorted = True
+
+    def _search(self, low, high, start, end, results):
+        if low >= high:
+            return
+        middle = (low + high) // 2
+        if not self._max_ends[middle] > start:
+            return
+        self._search(low, middle, start, end, results)
+        if self._starts[middle] < end:
+            if self._ends[middle] > start:
+                results.append((self._starts[middle], self._ends[middle],
+                                self._values[middle]))
+            self._search(middle + 1, high, start, end, results)
+
+    def overlapping(self, start, end):
+        """Returns the intervals overlapping [start, end), sorted by start.
+
+        Returns:
+          A list of (start, end, value) tuples.
+        """
+        self._build()
+        results = []
+        self._search(0, len(self._starts), start, end, results)
+        return results
+
+    Overlapping = overlapping
+
+    def containing(self, point):
+        """Returns the intervals which contain a point, sorted by start."""
+        self._build()
+        results = []
+        # Only intervals starting at or before the point may contain it.
+        limit = bisect.bisect_right(self._starts, point)
+        self._search_point(0, len(self._starts), limit, point, results)
+        return results
+
+    Containing = containing
+
+    def _search_point(self, low, high, limit, point, results):
+        if low >= high or low >= limit:
+            return
+        middle = (low + high) // 2
+        if not self._max_ends[middle] > point:
+            return
+        self._search_point(low, middle, limit, point, results)
+        if middle < limit:
+            if self._ends[middle] > point:
+                results.append((self._starts[middle], self._ends[middle],
+                                self._values[middle]))
+            self._search_point(middle + 1, high, limit, point, results)
+
+
+def build_instance_tree(instances_by_calendar):
+    """Puts the occurrences of many calendars in one IntervalTree.
+
+    Args:
+      instances_by_calendar: dict mapping a calendar id to an iterable of
+          EventInstances, for example from expand_events.
+
+    Returns:
+      An IntervalTree whose values are (calendar id, EventInstance) tuples.
+    """
+    tree = IntervalTree()
+    for calendar_id, instances in instances_by_calendar.items():
+        for instance in instances:
+            tree.add(instance.start, instance.end, (calendar_id, instance))
+    return tree
+
+
+BuildInstanceTree = build_instance_tree
@@ -20,6 +20,14 @@ in this module is GDClient.
 
 # __author__ = 'j.s@google.com (Jeff Scudder)'
 
+import concurrent.futures
+import io
+import json
+import mmap
+import os
+import threading
+import time
+
 import atom.client
 import atom.core
 import atom.http_core
@@ -662,6 +670,50 @@ class GDClient(atom.client.AtomPubClient):
 
     GetNext = get_next
 
+    def get_all_pages(self, uri_or_feed, desired_class=gdata.data.GDFeed,
+                      progress=None, checkpoint=None, **kwargs):
+        """Fetches every page of a feed and merges the entries into one feed.
+
+        Entries are appended to the first page in feed order, so the cost is
+        linear in the total number of entries.
+
+        Args:
+          uri_or_feed: The URI of the first page, or a feed which has already
+              been fetched and whose next links should be followed.
+          desired_class: The feed class used to parse each page.
+          progress: (optional) See FeedPager.
+          checkpoint: (optional) See FeedPager.
+          kwargs: Other parameters to pass to self.get_feed().
+
+        Returns:
+          A desired_class feed holding the entries of all pages.
+        """
+        return FeedPager(self, uri_or_feed, desired_class=desired_class,
+                         progress=progress, checkpoint=checkpoint,
+                         **kwargs).get_all()
+
+    GetAllPages = get_all_pages
+
+    def get_all_entries(self, uri_or_feed, desired_class=gdata.data.GDFeed,
+                        progress=None, checkpoint=None, **kwargs):
+        """Returns a generator over the entries of every page of a feed.
+
+        Unlike get_all_pages, only the current page is kept in memory.
+
+        Args:
+          uri_or_feed: The URI of the first page, or a feed which has already
+              been fetched and whose next links should be followed.
+          desired_class: The feed class used to parse each page.
+          progress: (optional) See FeedPager.
+          checkpoint: (optional) See FeedPager.
+          kwargs: Other parameters to pass to self.get_feed().
+        """
+        return FeedPager(self, uri_or_feed, desired_class=desired_class,
+                         progress=progress, checkpoint=checkpoint,
+                         **kwargs).iter_entries()
+
+    GetAllEntries = get_all_entries
+
     # TODO: add a refresh method to re-fetch the entry/feed from the server
     # if it has been updated.
 
@@ -890,6 +942,407 @@ class GDQuery(atom.http_core.Uri):
                           doc='The q parameter for searching for an exact text match on content')
 
 
+class FeedPager(object):
+    """Follows the next links of a feed, one page at a time.
+
+    The pager keeps the URI of the next page which has not been fetched yet
+    in next_uri. A checkpoint callback receives this URI once a page has been
+    consumed, so an interrupted enumeration can be resumed by creating a new
+    pager with the saved URI instead of starting over.
+    """
+
+    def __init__(self, client, uri_or_feed, desired_class=gdata.data.GDFeed,
+                 progress=None, checkpoint=None, **kwargs):
+        """Creates a pager for a feed.
+
+        Args:
+          client: gdata.client.GDClient used to fetch each page.
+          uri_or_feed: The URI of the first page (or a saved checkpoint), or a
+              feed which has already been fetched.
+          desired_class: The feed class used to parse each page.
+          progress: (optional) function called as progress(pager, feed) after
+              each page is fetched. pager.pages and pager.entries hold the
+              running totals.
+          checkpoint: (optional) function called as checkpoint(next_uri) after
+              each page has been consumed. next_uri is None once the last page
+              has been processed.
+          kwargs: Other parameters to pass to client.get_feed().
+        """
+        self.client = client
+        self.desired_class = desired_class
+        self.progress = progress
+        self.checkpoint = checkpoint
+        self.kwargs = kwargs
+        self.pages = 0
+        self.entries = 0
+        if isinstance(uri_or_feed, (str, atom.http_core.Uri)):
+            self._first_page = None
+            self.next_uri = uri_or_feed
+        else:
+            self._first_page = uri_or_feed
+            self.next_uri = None
+
+    def iter_pages(self):
+        """Yields each page of the feed, fetching them as needed."""
+        while self._first_page is not None or self.next_uri is not None:
+            if self._first_page is not None:
+                feed = self._first_page
+                self._first_page = None
+            else:
+                feed = self.client.get_feed(
+                    self.next_uri, desired_class=self.desired_class,
+                    **self.kwargs)
+            self.next_uri = feed.find_next_link()
+            self.pages += 1
+            self.entries += len(feed.entry)
+            if self.progress is not None:
+                self.progress(self, feed)
+            yield feed
+            if self.checkpoint is not None:
+                self.checkpoint(self.next_uri)
+
+    IterPages = iter_pages
+
+    def iter_entries(self):
+        """Yields the entries of each page of the feed, in feed order."""
+        for feed in self.iter_pages():
+            for entry in feed.entry:
+                yield entry
+
+    IterEntries = iter_entries
+
+    def get_all(self):
+        """Returns the first page with the entries of all later pages appended.
+
+        Returns None if there was nothing left to fetch.
+        """
+        result = None
+        for feed in self.iter_pages():
+            if result is None:
+                result = feed
+            else:
+                result.entry.extend(feed.entry)
+        return result
+
+    GetAll = get_all
+
+
+class RateLimiter(object):
+    """Shares a rate limit between threads, as a token bucket.
+
+    Each caller reserves an amount, one request or a number of bytes, from
+    the bucket before it goes ahead. When the bucket runs dry, the caller
+    sleeps until the amount has been earned back, so the callers together
+    never go faster than rate per second for longer than the burst.
+    """
+
+    def __init__(self, rate, burst=None, clock=time.monotonic,
+                 sleep=time.sleep):
+        """Creates a limiter.
+
+        Args:
+          rate: float The sustained amount per second shared by every caller.
+          burst: float (optional) The amount which can be used at once after
+              an idle period, by default one second's worth.
+          clock: (optional) function returning the current time in seconds.
+          sleep: (optional) function called to wait, in seconds.
+        """
+        self.rate = float(rate)
+        self.burst = float(burst or rate)
+        self._clock = clock
+        self._sleep = sleep
+        self._available = self.burst
+        self._stamp = clock()
+        self._lock = threading.Lock()
+
+    def acquire(self, amount=1):
+        """Waits until amount may be used, returning the seconds waited.
+
+        Reservations are made in the order of the calls, so a large amount
+        is not starved by smaller ones.
+        """
+        with self._lock:
+            now = self._clock()
+            self._available = min(
+                self.burst, self._available + (now - self._stamp) * self.rate)
+            self._stamp = now
+            self._available -= amount
+            delay = 0
+            if self._available < 0:
+                delay = -self._available / self.rate
+        if delay > 0:
+            self._sleep(delay)
+        return delay
+
+    Acquire = acquire
+
+
+class BoundedExecutor(object):
+    """A thread pool which holds its caller back when too much is pending.
+
+    submit blocks while max_pending tasks are queued or running, handing the
+    results of the tasks which finished to collect(result), so a caller
+    feeding tasks from a generator pauses while the threads catch up and
+    memory stays bounded. collect is always called from the thread which
+    submits, so it needs no locking.
+
+    Used as a context manager, the executor waits for every task on exit.
+    If the block raised, the results of the tasks which still succeed are
+    collected before the exception goes on, so work already done is not
+    lost.
+    """
+
+    def __init__(self, max_workers, collect, max_pending=None):
+        """Creates an executor.
+
+        Args:
+          max_workers: int Number of tasks run at the same time.
+          collect: function called as collect(result) with the return value
+              of each task. An exception raised by a task is raised again
+              from submit or join instead.
+          max_pending: int (optional) Number of tasks queued or running
+              before submit blocks, by default twice max_workers.
+        """
+        self.max_workers = max_workers
+        self.max_pending = max_pending or 2 * max_workers
+        self._collect = collect
+        self._pending = set()
+        self._executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=max_workers)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        try:
+            if exc_type is None:
+                self.join()
+            else:
+                self._drain()
+        finally:
+            self._executor.shutdown(wait=True)
+        return False
+
+    def submit(self, function, *args, **kwargs):
+        """Runs function(*args, **kwargs) once the pending tasks allow it."""
+        if len(self._pending) >= self.max_pending:
+            done, _ = concurrent.futures.wait(
+                self._pending, return_when=concurrent.futures.FIRST_COMPLETED)
+            self._collect_futures(done)
+        self._pending.add(self._executor.submit(function, *args, **kwargs))
+
+    Submit = submit
+
+    def join(self):
+        """Waits for every pending task, collecting them as they finish."""
+        try:
+            self._collect_futures(
+                list(concurrent.futures.as_completed(self._pending)))
+        except BaseException:
+            self._drain()
+            raise
+
+    Join = join
+
+    def _collect_futures(self, futures):
+        for future in futures:
+            self._pending.discard(future)
+            self._collect(future.result())
+
+    def _drain(self):
+        for future in concurrent.futures.as_completed(list(self._pending)):
+            self._pending.discard(future)
+            if future.exception() is None:
+                try:
+                    self._collect(future.result())
+                except Exception:
+                    # The exception which stopped the block takes precedence.
+                    pass
+
+
+def save_json(path, data, **kwargs):
+    """Writes data to a JSON file, replacing the file atomically.
+
+    The data is written to path + '.tmp' first, so a crash leaves either the
+    old file or the new one, never a truncated file.
+
+    Args:
+      path: str The file to write.
+      data: The object to serialize.
+      kwargs: Other parameters to pass to json.dump().
+    """
+    temp_path = path + '.tmp'
+    with open(temp_path, 'w') as json_file:
+        json.dump(data, json_file, **kwargs)
+    os.replace(temp_path, path)
+
+
+SaveJson = save_json
+
+
+def upload_session_key(file_handle, total_file_size, resumable_media_link):
+    """Identifies a resumable upload by its source file and destination.
+
+    Open files are identified by device, inode and modification time, other
+    file-like objects by their name. If the file handle carries neither, the
+    upload can not be recognized again and None is returned.
+    """
+    try:
+        stat = os.fstat(file_handle.fileno())
+        identity = '%s:%s:%s' % (stat.st_dev, stat.st_ino, stat.st_mtime_ns)
+    except (AttributeError, OSError):
+        identity = getattr(file_handle, 'name', None)
+        if not isinstance(identity, str):
+            return None
+        identity = os.path.abspath(identity)
+    return '%s %s %s' % (resumable_media_link, identity, total_file_size)
+
+
+class UploadSessionStore(object):
+    """Keeps the upload URIs of unfinished resumable uploads in memory.
+
+    Subclasses can persist the sessions elsewhere by overriding get, put and
+    delete.
+    """
+
+    def __init__(self, sessions=None):
+        self._sessions = sessions or {}
+
+    def get(self, key):
+        """Returns the upload URI stored for key, or None."""
+        return self._sessions.get(key)
+
+    def put(self, key, upload_uri):
+        self._sessions[key] = upload_uri
+
+    def delete(self, key):
+        self._sessions.pop(key, None)
+
+
+class FileUploadSessionStore(UploadSessionStore):
+    """Persists resumable upload sessions in a JSON file.
+
+    The file is rewritten atomically whenever a session starts or finishes, so
+    an upload interrupted by a crash can be resumed by a later process.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        sessions = {}
+        if os.path.exists(path):
+            with open(path) as session_file:
+                sessions = json.load(session_file)
+        UploadSessionStore.__init__(self, sessions)
+
+    def put(self, key, upload_uri):
+        with self._lock:
+            UploadSessionStore.put(self, key, upload_uri)
+            self._save()
+
+    def delete(self, key):
+        with self._lock:
+            if key in self._sessions:
+                UploadSessionStore.delete(self, key)
+                self._save()
+
+    def _save(self):
+        save_json(self.path, self._sessions)
+
+
+def _next_byte_from_range(headers):
+    """Reads the first missing byte from the Range header of a 308 response."""
+    if hasattr(headers, 'items'):
+        headers = headers.items()
+    for pair in headers:
+        if pair[0].capitalize() == 'Range':
+            return int(pair[1].split('-')[1]) + 1
+    # No Range header means the server has not stored any bytes yet.
+    return 0
+
+
+def _map_file(file_handle):
+    """Maps a regular binary file into memory, or returns None."""
+    if isinstance(file_handle, io.TextIOBase):
+        return None
+    try:
+        return mmap.mmap(file_handle.fileno(), 0, access=mmap.ACCESS_READ)
+    except (AttributeError, OSError, ValueError):
+        return None
+
+
+class _ReadAheadChunks(object):
+    """Reads upload chunks from a file-like object one chunk ahead."""
+
+    def __init__(self, file_handle, base, position):
+        self.file_handle = file_handle
+        # The file position of upload byte 0, and the upload byte the file
+        # handle is currently at.
+        self.base = base
+        self.position = position
+        self._reader = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        self._pending = None
+        self._pending_offset = None
+
+    def prefetch(self, offset, size):
+        if self._pending is None and offset == self.position:
+            self._pending_offset = offset
+            self._pending = self._reader.submit(self.file_handle.read, size)
+
+    def get(self, offset, size):
+        if self._pending is not None:
+            chunk = self._pending.result()
+            self._pending = None
+            self.position = self._pending_offset + len(chunk)
+            if self._pending_offset == offset:
+                return chunk
+        if offset != self.position:
+            self.file_handle.seek(self.base + offset)
+        chunk = self.file_handle.read(size)
+        self.position = offset + len(chunk)
+        return chunk
+
+    def close(self):
+        self._reader.shutdown(wait=True)
+
+
+class _MappedChunks(object):
+    """Serves upload chunks as memoryview slices of a memory mapped file."""
+
+    def __init__(self, mapped, base):
+        self.mapped = mapped
+        self.base = base
+        self._view = memoryview(mapped)
+        self._chunk = None
+
+    def prefetch(self, offset, size):
+        # Ask the kernel to start reading the next chunk from disk.
+        if not hasattr(self.mapped, 'madvise') or not hasattr(
+                mmap, 'MADV_WILLNEED'):
+            return
+        start = self.base + offset
+        start -= start % mmap.PAGESIZE
+        length = min(self.base + offset + size, len(self.mapped)) - start
+        if length > 0:
+            self.mapped.madvise(mmap.MADV_WILLNEED, start, length)
+
+    def get(self, offset, size):
+        self._release_chunk()
+        start = self.base + offset
+        self._chunk = self._view[start:start + size]
+        return self._chunk
+
+    def _release_chunk(self):
+        if self._chunk is not None:
+            self._chunk.release()
+            self._chunk = None
+
+    def close(self):
+        self._release_chunk()
+        self._view.release()
+        self.mapped.close()
+
+
 class ResumableUploader(object):
     """Resumable upload helper for the Google Data protocol."""
 
@@ -897,9 +1350,13 @@ class ResumableUploader(object):
     # Initial chunks which are smaller than 256KB might be dropped. The last
     # chunk for a file can be smaller tan this.
     MIN_CHUNK_SIZE = 262144  # 256KB
+    # Bounds and goal used when the chunk size adapts to the throughput.
+    MAX_CHUNK_SIZE = 134217728  # 128MB
+    TARGET_CHUNK_SECONDS = 10
 
     def __init__(self, client, file_handle, content_type, total_file_size,
-                 chunk_size=None, desired_class=None):
+                 chunk_size=None, desired_class=None, session_store=None,
+                 adapt_chunk_size=False):
         """Starts a resumable upload to a service that supports the protocol.
 
         Args:
@@ -911,6 +1368,12 @@ class ResumableUploader(object):
               DEFAULT_CHUNK_SIZE will be used.
           desired_class: object (optional) The type of gdata.data.GDEntry to parse
               the completed entry as. This should be specific to the API.
+          session_store: UploadSessionStore (optional) Where upload_file keeps
+              the upload URI of an unfinished upload. A later upload_file call
+              for the same file and link resumes that session instead of
+              starting over. The file handle must then be seekable.
+          adapt_chunk_size: boolean (optional) If True, upload_file resizes the
+              chunks so that each one takes about TARGET_CHUNK_SECONDS to send.
         """
         self.client = client
         self.file_handle = file_handle
@@ -921,6 +1384,10 @@ class ResumableUploader(object):
             self.chunk_size = self.MIN_CHUNK_SIZE
         self.desired_class = desired_class or gdata.data.GDEntry
         self.upload_uri = None
+        self.session_store = session_store
+        self.adapt_chunk_size = adapt_chunk_size
+        # First byte the server is missing, as of the last chunk sent.
+        self.next_byte = 0
 
         # Send the entire file if the chunk size is less than fize's total size.
         if self.total_file_size <= self.chunk_size:
@@ -1005,14 +1472,11 @@ class ResumableUploader(object):
         if self.upload_uri is None:
             raise RequestError('Resumable upload request not initialized.')
 
-        # Adjustment if last byte range is less than defined chunk size.
-        chunk_size = self.chunk_size
-        if len(content_bytes) <= chunk_size:
-            chunk_size = len(content_bytes)
+        chunk_size = len(content_bytes)
 
         http_request = atom.http_core.HttpRequest()
         http_request.add_body_part(content_bytes, self.content_type,
-                                   size=len(content_bytes))
+                                   size=chunk_size)
         http_request.headers['Content-Range'] = ('bytes %s-%s/%s'
                                                  % (start_byte,
                                                     start_byte + chunk_size - 1,
@@ -1022,9 +1486,11 @@ class ResumableUploader(object):
             response = self.client.request(method='PUT', uri=self.upload_uri,
                                            http_request=http_request,
                                            desired_class=self.desired_class)
+            self.next_byte = self.total_file_size
             return response
         except RequestError as error:
             if error.status == 308:
+                self.next_byte = _next_byte_from_range(error.headers)
                 return None
             else:
                 raise error
@@ -1060,21 +1526,92 @@ class ResumableUploader(object):
           RequestError if anything other than a HTTP 308 is returned
           when the request raises an exception.
         """
-        self._init_session(resumable_media_link, headers=headers,
-                           auth_token=auth_token, entry=entry, **kwargs)
-
-        start_byte = 0
-        entry = None
-
-        while not entry:
-            entry = self.upload_chunk(
-                start_byte, self.file_handle.read(self.chunk_size))
-            start_byte += self.chunk_size
-
+        session_key = None
+        if self.session_store is not None:
+            session_key = upload_session_key(
+                self.file_handle, self.total_file_size, resumable_media_link)
+
+        start_byte = None
+        if session_key is not None:
+            self.upload_uri = self.session_store.get(session_key)
+            if self.upload_uri is not None:
+                try:
+                    start_byte, uploaded_entry = self._query_upload_progress()
+                except RequestError:
+                    # The session expired or was cancelled; start a new one.
+                    start_byte = None
+                else:
+                    if uploaded_entry is not None:
+                        self.session_store.delete(session_key)
+                        return uploaded_entry
+                    self.file_handle.seek(start_byte)
+
+        if start_byte is None:
+            self._init_session(resumable_media_link, headers=headers,
+                               auth_token=auth_token, entry=entry, **kwargs)
+            start_byte = 0
+            if session_key is not None:
+                self.session_store.put(session_key, self.upload_uri)
+
+        entry = self._upload_from(start_byte)
+        if session_key is not None:
+            self.session_store.delete(session_key)
         return entry
 
     UploadFile = upload_file
 
+    def _upload_from(self, start_byte):
+        """Sends the rest of the file, starting at start_byte.
+
+        Regular binary files are memory mapped and sent as memoryview slices,
+        so chunks are never copied into Python byte strings. Other file-like
+        objects are read one chunk ahead on a background thread, so reading
+        overlaps the network transfer.
+        """
+        # The file position of the first byte of the upload.
+        try:
+            base = self.file_handle.tell() - start_byte
+        except (AttributeError, OSError):
+            base = 0
+        mapped = _map_file(self.file_handle)
+        if mapped is None:
+            chunks = _ReadAheadChunks(self.file_handle, base, start_byte)
+        else:
+            chunks = _MappedChunks(mapped, base)
+        try:
+            chunk = chunks.get(start_byte, self.chunk_size)
+            while True:
+                if not len(chunk) and self.total_file_size:
+                    raise RequestError(
+                        'Reached the end of the file at byte %s of %s before the '
+                        'upload completed.' % (start_byte, self.total_file_size))
+                chunks.prefetch(start_byte + len(chunk), self.chunk_size)
+                started = time.time()
+                entry = self.upload_chunk(start_byte, chunk)
+                if entry is not None:
+                    return entry
+                if self.adapt_chunk_size:
+                    self._adapt_chunk_size(len(chunk), time.time() - started)
+                if self.next_byte <= start_byte:
+                    raise RequestError(
+                        'Server did not store any bytes of the chunk starting at '
+                        '%s.' % start_byte)
+                # If only part of the chunk was stored, the rest is sent again.
+                start_byte = self.next_byte
+                chunk = chunks.get(start_byte, self.chunk_size)
+        finally:
+            chunks.close()
+
+    def _adapt_chunk_size(self, sent_bytes, elapsed):
+        """Resizes chunks to take about TARGET_CHUNK_SECONDS at the last rate."""
+        if elapsed <= 0:
+            return
+        desired = int(sent_bytes / elapsed * self.TARGET_CHUNK_SECONDS)
+        desired = min(desired, 2 * self.chunk_size, self.MAX_CHUNK_SIZE)
+        # Every chunk but the last must be a multiple of MIN_CHUNK_SIZE.
+        self.chunk_size = max(self.MIN_CHUNK_SIZE,
+                              desired - desired % self.MIN_CHUNK_SIZE)
+
     def update_file(self, entry_or_resumable_edit_link, headers=None, force=False,
                     auth_token=None, update_metadata=False, uri_params=None):
         """Updates the contents of an existing file using the resumable protocol.
@@ -1153,6 +1690,20 @@ class ResumableUploader(object):
           RequestError if anything other than a HTTP 308 is returned
           when the request raises an exception.
         """
+        next_byte, entry = self._query_upload_progress(uri)
+        if entry is not None:
+            return True
+        return next_byte
+
+    QueryUploadStatus = query_upload_status
+
+    def _query_upload_progress(self, uri=None):
+        """Asks the server how much of the file it has stored.
+
+        Returns:
+          A (next_byte, entry) tuple. entry is the uploaded entry, parsed as
+          self.desired_class, once the upload is complete and None otherwise.
+        """
         # Override object's unique upload uri.
         if uri is None:
             uri = self.upload_uri
@@ -1162,19 +1713,11 @@ class ResumableUploader(object):
         http_request.headers['Content-Range'] = 'bytes */%s' % self.total_file_size
 
         try:
-            response = self.client.request(
-                method='POST', uri=uri, http_request=http_request)
-            if response.status == 201:
-                return True
-            else:
-                raise error_from_response(
-                    '%s returned by server' % response.status, response, RequestError)
+            entry = self.client.request(
+                method='POST', uri=uri, http_request=http_request,
+                desired_class=self.desired_class)
         except RequestError as error:
             if error.status == 308:
-                for pair in error.headers:
-                    if pair[0].capitalize() == 'Range':
-                        return int(pair[1].split('-')[1]) + 1
-            else:
-                raise error
-
-    QueryUploadStatus = query_upload_status
+                return _next_byte_from_range(error.headers), None
+            raise error
+        return self.total_file_size, entry
@@ -0,0 +1,385 @@
+#
+# Licensed under the Apache License 2.0;
+
+
+"""Finds and merges duplicate contacts in large address books.
+
+A ContactIndex reads a feed of contacts once and files every contact under
+normalized keys: lower-cased email addresses, phone numbers in an E.164
+like form and the sorted tokens of the name. Contacts sharing a key are
+candidate duplicates, so only those pairs are compared instead of every
+pair of contacts.
+
+Candidate pairs above a score are grouped into clusters, and each cluster
+becomes a MergePlan which keeps one contact, copies the other contacts'
+addresses, numbers and groups into it and deletes the others. The plans are
+turned into batch feeds for ContactsClient.execute_batch.
+
+Example Usage:
+index = gdata.contacts.index.ContactIndex(default_country_code='1')
+index.add_feed(client.get_contacts())
+plans = index.plan_merges()
+for feed in gdata.contacts.index.build_batch_feeds(plans):
+  client.execute_batch(feed)
+"""
+
+import re
+import unicodedata
+
+import gdata.contacts.data
+import gdata.contacts.sync
+
+EMAIL_KEY = 'email'
+PHONE_KEY = 'phone'
+NAME_KEY = 'name'
+
+# Score added to a pair of contacts for each kind of key they share.
+DEFAULT_WEIGHTS = {EMAIL_KEY: 3, PHONE_KEY: 2, NAME_KEY: 1}
+# Pairs scoring less than this are not merged.
+DEFAULT_MIN_SCORE = 2
+# Keys shared by more contacts than this, like a switchboard number, are
+# ignored as they say little about duplicates and give many pairs.
+DEFAULT_MAX_BUCKET = 50
+
+
+def normalize_phone(number, default_country_code=None):
+    """Returns a phone number in an E.164 like form.
+
+    Formatting and extensions are dropped. An international prefix of 00
+    becomes '+', and if default_country_code is given, national numbers get
+    it with their leading trunk 0 removed.
+
+    Args:
+      number: str The phone number as typed.
+      default_country_code: str (optional) The country code, without '+',
+          of numbers which have none.
+    """
+    phone = gdata.contacts.sync.normalize_phone(number)
+    if phone.startswith('00'):
+        return '+' + phone[2:]
+    if phone and not phone.startswith('+') and default_country_code:
+        if phone.startswith('0'):
+            phone = phone[1:]
+        return '+%s%s' % (default_country_code, phone)
+    return phone
+
+
+NormalizePhone = normalize_phone
+
+
+def name_tokens(name):
+    """Returns the sorted, lower-cased tokens of a name without accents.
+
+    'José  García-Pérez' and 'garcia perez jose' give the same tokens.
+    """
+    decomposed = unicodedata.normalize('NFKD', name)
+    ascii_name = ''.join(character for character in decomposed
+                         if not unicodedata.combining(character))
+    return tuple(sorted(re.findall(r'\w+', ascii_name.lower())))
+
+
+NameTokens = name_tokens
+
+
+def get_contact_name(contact):
+    """Returns the full name of a contact, or its title, or None."""
+    name = contact.name
+    if name is not None:
+        if name.full_name is not None and name.full_name.text:
+            return name.full_name.text
+        parts = [part.text for part in (name.given_name, name.family_name)
+                 if part is not None and part.text]
+        if parts:
+            return ' '.join(parts)
+    if contact.title is not None and contact.title.text:
+        return contact.title.text
+    return None
+
+
+GetContactName = get_contact_name
+
+
+class CandidatePair(object):
+    """Two contacts which share at least one normalized key.
+
+    Attributes:
+      first_id: str The smaller of the two atom ids.
+      second_id: str The larger of the two atom ids.
+      score: int The sum of the weights of the shared kinds of keys.
+      reasons: set of the shared kinds of keys, for example {'email'}.
+    """
+
+    def __init__(self, first_id, second_id, score=0, reasons=None):
+        self.first_id = first_id
+        self.second_id = second_id
+        self.score = score
+        self.reasons = reasons or set()
+
+    def __repr__(self):
+        return 'CandidatePair(%r, %r, %r, %r)' % (
+            self.first_id, self.second_id, self.score, sorted(self.reasons))
+
+
+class MergePlan(object):
+    """How a cluster of duplicates is merged.
+
+    Attributes:
+      primary: ContactEntry The contact which is kept, as stored.
+      duplicates: list of ContactEntry objects which are deleted.
+      merged: ContactEntry A copy of the primary with the duplicates' email
+          addresses, phone numbers and group memberships added.
+    """
+
+    def __init__(self, primary, duplicates, merged):
+        self.primary = primary
+        self.duplicates = duplicates
+        self.merged = merged
+
+
+class ContactIndex(object):
+    """Hash indexes of contacts by normalized email, phone and name."""
+
+    def __init__(self, default_country_code=None,
+                 max_bucket=DEFAULT_MAX_BUCKET):
+        """Creates an empty index.
+
+        Args:
+          default_country_code: str (optional) Country code given to phone
+              numbers without one, see normalize_phone.
+          max_bucket: int (optional) Keys shared by more contacts are not
+              used to find candidates.
+        """
+        self.default_country_code = default_country_code
+        self.max_bucket = max_bucket
+        self.contacts = {}
+        self.indexes = {EMAIL_KEY: {}, PHONE_KEY: {}, NAME_KEY: {}}
+        self._indexed_keys = {}
+
+    def __len__(self):
+        return len(self.contacts)
+
+    def get_keys(self, contact):
+        """Returns the (kind, key) pairs of a contact."""
+        keys = set((EMAIL_KEY, gdata.contacts.sync.normalize_email(
+                        email.address))
+                   for email in contact.email if email.address)
+        keys.update((PHONE_KEY, normalize_phone(phone.text,
+                                                self.default_country_code))
+                    for phone in contact.phone_number if phone.text)
+        name = get_contact_name(contact)
+        if name:
+            tokens = name_tokens(name)
+            if tokens:
+                keys.add((NAME_KEY, ' '.join(tokens)))
+        return keys
+
+    GetKeys = get_keys
+
+    def add(self, contact):
+        """Indexes a contact, replacing an earlier version of it.
+
+        A deleted contact is removed from the index instead.
+        """
+        contact_id = contact.id.text
+        self.remove(contact_id)
+        if contact.deleted is not None:
+            return
+        self.contacts[contact_id] = contact
+        keys = self.get_keys(contact)
+        self._indexed_keys[contact_id] = keys
+        for kind, key in keys:
+            self.indexes[kind].setdefault(key, []).append(contact_id)
+
+    Add = add
+
+    def add_feed(self, feed):
+        """Indexes every contact of a ContactsFeed or iterable of entries."""
+        for contact in getattr(feed, 'entry', feed):
+            self.add(contact)
+
+    AddFeed = add_feed
+
+    def remove(self, contact_id):
+        """Removes a contact and its keys from the index, if it is there."""
+        self.contacts.pop(contact_id, None)
+        # The keys are those recorded when the contact was indexed, as the
+        # entry may have been edited in place since.
+        for kind, key in self._indexed_keys.pop(contact_id, ()):
+            contact_ids = self.indexes[kind].get(key)
+            if contact_ids is None:
+                continue
+            if contact_id in contact_ids:
+                contact_ids.remove(contact_id)
+            if not contact_ids:
+                del self.indexes[kind][key]
+
+    Remove = remove
+
+    def candidate_pairs(self, weights=None):
+        """Lists the pairs of contacts which share a key.
+
+        Args:
+          weights: dict (optional) The score of each kind of key, by default
+              DEFAULT_WEIGHTS.
+
+        Returns:
+          A list of CandidatePairs, highest score first.
+        """
+        weights = weights or DEFAULT_WEIGHTS
+        pairs = {}
+        for kind, index in self.indexes.items():
+            for contact_ids in index.values():
+                if len(contact_ids) < 2 or len(contact_ids) > self.max_bucket:
+                    continue
+                contact_ids = sorted(set(contact_ids))
+                for position, first_id in enumerate(contact_ids):
+                    for second_id in contact_ids[position + 1:]:
+                        pair = pairs.get((first_id, second_id))
+                        if pair is None:
+                            pair = CandidatePair(first_id, second_id)
+                            pairs[(first_id, second_id)] = pair
+                        if kind not in pair.reasons:
+                            pair.reasons.add(kind)
+                            pair.score += weights.get(kind, 0)
+        return sorted(pairs.values(),
+                      key=lambda pair: (-pair.score, pair.first_id,
+                                        pair.second_id))
+
+    CandidatePairs = candidate_pairs
+
+    def clusters(self, pairs=None, min_score=DEFAULT_MIN_SCORE):
+        """Groups contacts linked by pairs scoring at least min_score.
+
+        Returns:
+          A list of sorted lists of atom ids, each with two or more ids.
+        """
+        if pairs is None:
+            pairs = self.candidate_pairs()
+        parents = {}
+
+        def find(contact_id):
+            root = contact_id
+            while parents.get(root, root) != root:
+                root = parents[root]
+            while contact_id != root:
+                next_id = parents[contact_id]
+                parents[contact_id] = root
+                contact_id = next_id
+            return root
+
+        for pair in pairs:
+            if pair.score < min_score:
+                continue
+            first_root = find(pair.first_id)
+            second_root = find(pair.second_id)
+            if first_root != second_root:
+                parents[max(first_root, second_root)] = min(first_root,
+                                                            second_root)
+        groups = {}
+        for contact_id in parents:
+            groups.setdefault(find(contact_id), set()).add(contact_id)
+        for root, members in groups.items():
+            members.add(root)
+        return sorted(sorted(members) for members in groups.values())
+
+    Clusters = clusters
+
+    @staticmethod
+    def _richness(contact):
+        updated = ''
+        if contact.updated is not None and contact.updated.text:
+            updated = contact.updated.text
+        return (len(contact.email) + len(contact.phone_number)
+                + len(contact.group_membership_info)
+                + (get_contact_name(contact) is not None), updated)
+
+    def plan_merges(self, pairs=None, min_score=DEFAULT_MIN_SCORE):
+        """Plans the merge of every cluster of duplicates.
+
+        The contact with the most email addresses, phone numbers and groups
+        is kept, the most recently updated one on ties.
+
+        Returns:
+          A list of MergePlans.
+        """
+        plans = []
+        for cluster in self.clusters(pairs, min_score):
+            contacts = [self.contacts[contact_id] for contact_id in cluster]
+            primary = max(contacts, key=self._richness)
+            duplicates = [contact for contact in contacts
+                          if contact is not primary]
+            plans.append(MergePlan(primary, duplicates,
+                                   self.merge(primary, duplicates)))
+        return plans
+
+    PlanMerges = plan_merges
+
+    def merge(self, primary, duplicates):
+        """Returns a copy of primary with the duplicates' details added."""
+        merged = gdata.contacts.sync.copy_entry(primary)
+        emails = set(gdata.contacts.sync.normalize_email(email.address)
+                     for email in merged.email if email.address)
+        phones = set(normalize_phone(phone.text, self.default_country_code)
+                     for phone in merged.phone_number if phone.text)
+        groups = set(membership.href
+                     for membership in merged.group_membership_info)
+        for duplicate in duplicates:
+            # The details are moved out of a copy, leaving the indexed
+            # contacts unchanged.
+            duplicate = gdata.contacts.sync.copy_entry(duplicate)
+            for email in duplicate.email:
+                key = gdata.contacts.sync.normalize_email(email.address or '')
+                if key and key not in emails:
+                    emails.add(key)
+                    email.primary = None
+                    merged.email.append(email)
+            for phone in duplicate.phone_number:
+                key = normalize_phone(phone.text or '',
+                                      self.default_country_code)
+                if key and key not in phones:
+                    phones.add(key)
+                    phone.primary = None
+                    merged.phone_number.append(phone)
+            for membership in duplicate.group_membership_info:
+                if membership.href not in groups:
+                    groups.add(membership.href)
+                    merged.group_membership_info.append(membership)
+        return merged
+
+    Merge = merge
+
+
+def build_batch_feeds(plans,
+                      batch_size=gdata.contacts.sync.DEFAULT_BATCH_SIZE):
+    """Turns merge plans into batch request feeds.
+
+    Each plan gives an update of its merged contact and a delete of each
+    duplicate. Both carry the etag the contacts were read with, so contacts
+    changed since are not overwritten. The operations of a plan are never
+    split across two feeds.
+
+    Args:
+      plans: list of MergePlans.
+      batch_size: int (optional) The largest number of operations in a feed.
+
+    Returns:
+      A list of gdata.contacts.data.ContactsFeed objects.
+    """
+    feeds = []
+    feed = gdata.contacts.data.ContactsFeed()
+    for plan in plans:
+        operations = 1 + len(plan.duplicates)
+        if feed.entry and len(feed.entry) + operations > batch_size:
+            feeds.append(feed)
+            feed = gdata.contacts.data.ContactsFeed()
+        feed.add_update(plan.merged)
+        for duplicate in plan.duplicates:
+            delete = gdata.contacts.data.ContactEntry(id=duplicate.id)
+            delete.etag = duplicate.etag
+            feed.add_delete(entry=delete)
+    if feed.entry:
+        feeds.append(feed)
+    return feeds
+
+
+BuildBatchFeeds = build_batch_feeds
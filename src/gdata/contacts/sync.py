@@ -0,0 +1,493 @@
+#
+# Licensed under the Apache License 2.0;
+
+
+"""Keeps a local copy of a user's contacts in sync with the Contacts API.
+
+A ContactStore holds ContactEntry objects keyed by their atom id, with
+indexes by email address, phone number and group. A ContactSync reads only
+the contacts updated since the previous sync (including deletions) and
+sends local changes back as batch requests. Updates carry the etag of the
+stored entry, so an entry changed on the server since it was read is
+reported as a conflict instead of being overwritten.
+
+Example Usage:
+client = gdata.contacts.client.ContactsClient()
+store = gdata.contacts.sync.ContactStore('contacts.json')
+sync = gdata.contacts.sync.ContactSync(client, store)
+sync.pull()
+for contact in store.find_by_email('Liz@Example.com'):
+  contact.nickname = gdata.contacts.data.NickName(text='Liz')
+  store.update(contact)
+result = sync.push()
+store.save()
+"""
+
+import http.client
+import json
+import os
+import re
+
+import atom.core
+import gdata.client
+import gdata.contacts.client
+import gdata.contacts.data
+import gdata.data
+
+# Number of contacts requested per page.
+DEFAULT_PAGE_SIZE = 500
+# Number of operations per batch request, the Contacts API accepts 100.
+DEFAULT_BATCH_SIZE = 100
+
+PRECONDITION_FAILED = 412
+
+
+def normalize_email(address):
+    """Returns the email address in lower case, without spaces."""
+    return address.strip().lower()
+
+
+NormalizeEmail = normalize_email
+
+
+def normalize_phone(number):
+    """Returns the digits of a phone number, keeping a leading '+'.
+
+    Extensions and formatting are dropped, so '+1 (650) 555-0100' and
+    '+16505550100' give the same key.
+    """
+    number = number.strip()
+    if number.startswith('tel:'):
+        number = number[4:]
+    number = re.split(r'(?:ext|x|;)', number, 1)[0]
+    digits = re.sub(r'\D', '', number)
+    if number.startswith('+'):
+        return '+' + digits
+    return digits
+
+
+NormalizePhone = normalize_phone
+
+
+def copy_entry(entry):
+    """Returns a deep copy of a ContactEntry, made through its XML."""
+    return atom.core.parse(entry.to_string().encode('utf-8'),
+                           gdata.contacts.data.ContactEntry)
+
+
+CopyEntry = copy_entry
+
+
+class ContactStore(object):
+    """Contacts keyed by atom id, indexed by email, phone and group.
+
+    The store also keeps local changes which have not been pushed yet, and
+    the time up to which the server's changes have been read.
+    """
+
+    def __init__(self, path=None):
+        """Creates a store, loading it from path if the file exists.
+
+        Args:
+          path: str (optional) The JSON file in which the store is saved.
+        """
+        self.path = path
+        self.contacts = {}
+        self.updated_min = None
+        self.pending_inserts = []
+        self.pending_updates = {}
+        self.pending_deletes = {}
+        self._by_email = {}
+        self._by_phone = {}
+        self._by_group = {}
+        self._indexed_keys = {}
+        if path is not None and os.path.exists(path):
+            self.load()
+
+    def __len__(self):
+        return len(self.contacts)
+
+    def __contains__(self, contact_id):
+        return contact_id in self.contacts
+
+    def __iter__(self):
+        return iter(self.contacts.values())
+
+    @staticmethod
+    def _keys(contact):
+        """Lists the (index name, key) pairs under which a contact is kept."""
+        keys = [('_by_email', normalize_email(email.address))
+                for email in contact.email if email.address]
+        keys.extend(('_by_phone', normalize_phone(phone.text))
+                    for phone in contact.phone_number if phone.text)
+        keys.extend(('_by_group', membership.href)
+                    for membership in contact.group_membership_info
+                    if membership.href and membership.deleted != 'true')
+        return set(keys)
+
+    def _index(self, contact):
+        contact_id = contact.id.text
+        keys = self._keys(contact)
+        self._indexed_keys[contact_id] = keys
+        for index_name, key in keys:
+            getattr(self, index_name).setdefault(key, set()).add(contact_id)
+
+    def _unindex(self, contact_id):
+        # The keys are those recorded when the contact was indexed, as the
+        # entry may have been edited in place since.
+        for index_name, key in self._indexed_keys.pop(contact_id, ()):
+            index = getattr(self, index_name)
+            ids = index.get(key)
+            if ids is not None:
+                ids.discard(contact_id)
+                if not ids:
+                    del index[key]
+
+    def get(self, contact_id):
+        """Returns the stored ContactEntry with the atom id, or None."""
+        return self.contacts.get(contact_id)
+
+    Get = get
+
+    def put(self, contact):
+        """Stores a contact read from the server, replacing an older copy."""
+        self.discard(contact.id.text)
+        self.contacts[contact.id.text] = contact
+        self._index(contact)
+
+    Put = put
+
+    def discard(self, contact_id):
+        """Forgets a contact without sending a delete to the server."""
+        if self.contacts.pop(contact_id, None) is not None:
+            self._unindex(contact_id)
+
+    Discard = discard
+
+    def _find(self, index, key):
+        return [self.contacts[contact_id]
+                for contact_id in sorted(index.get(key, ()))]
+
+    def find_by_email(self, address):
+        """Returns the contacts with the email address."""
+        return self._find(self._by_email, normalize_email(address))
+
+    FindByEmail = find_by_email
+
+    def find_by_phone(self, number):
+        """Returns the contacts with the phone number."""
+        return self._find(self._by_phone, normalize_phone(number))
+
+    FindByPhone = find_by_phone
+
+    def get_group_members(self, group_id):
+        """Returns the contacts which belong to the group with the atom id."""
+        return self._find(self._by_group, group_id)
+
+    GetGroupMembers = get_group_members
+
+    def insert(self, contact):
+        """Queues a new contact to be created by the next push."""
+        self.pending_inserts.append(contact)
+
+    Insert = insert
+
+    def update(self, contact):
+        """Stores a locally changed contact and queues it for the next push.
+
+        The contact keeps the etag it was read with, which makes the update
+        conditional.
+        """
+        self.put(contact)
+        self.pending_updates[contact.id.text] = contact
+
+    Update = update
+
+    def delete(self, contact):
+        """Removes a contact and queues its deletion for the next push."""
+        contact_id = contact.id.text
+        self.discard(contact_id)
+        self.pending_updates.pop(contact_id, None)
+        self.pending_deletes[contact_id] = contact
+
+    Delete = delete
+
+    def has_pending(self):
+        return bool(self.pending_inserts or self.pending_updates
+                    or self.pending_deletes)
+
+    HasPending = has_pending
+
+    def save(self, path=None):
+        """Writes the store and its pending changes to a JSON file.
+
+        The file is replaced atomically.
+        """
+        path = path or self.path
+
+        def serialize(contacts):
+            return [contact.to_string() for contact in contacts]
+
+        gdata.client.save_json(
+            path, {'updated_min': self.updated_min,
+                   'contacts': serialize(self.contacts.values()),
+                   'pending_inserts': serialize(self.pending_inserts),
+                   'pending_updates': serialize(
+                       self.pending_updates.values()),
+                   'pending_deletes': serialize(
+                       self.pending_deletes.values())})
+
+    Save = save
+
+    def load(self, path=None):
+        """Replaces the store's content with a file written by save."""
+        path = path or self.path
+        with open(path) as store_file:
+            values = json.load(store_file)
+
+        def parse(strings):
+            return [atom.core.parse(string.encode('utf-8'),
+                                    gdata.contacts.data.ContactEntry)
+                    for string in strings]
+
+        self.contacts = {}
+        self._by_email = {}
+        self._by_phone = {}
+        self._by_group = {}
+        self._indexed_keys = {}
+        for contact in parse(values['contacts']):
+            self.put(contact)
+        self.updated_min = values['updated_min']
+        self.pending_inserts = parse(values['pending_inserts'])
+        self.pending_updates = dict(
+            (contact.id.text, contact)
+            for contact in parse(values['pending_updates']))
+        self.pending_deletes = dict(
+            (contact.id.text, contact)
+            for contact in parse(values['pending_deletes']))
+
+    Load = load
+
+
+class SyncResult(object):
+    """What a pull or push changed.
+
+    Attributes:
+      updated: list of the atom ids of contacts added or changed.
+      deleted: list of the atom ids of contacts deleted.
+      conflicts: list of the local ContactEntry objects whose update or
+          delete was refused because the contact changed on the server.
+      failures: list of (ContactEntry, status code, reason) tuples for the
+          other refused operations. The status code is None if the server
+          did not answer.
+    """
+
+    def __init__(self):
+        self.updated = []
+        self.deleted = []
+        self.conflicts = []
+        self.failures = []
+
+
+class ContactSync(object):
+    """Reads and writes the changes between a ContactStore and the server."""
+
+    def __init__(self, client, store, page_size=DEFAULT_PAGE_SIZE,
+                 batch_size=DEFAULT_BATCH_SIZE,
+                 batch_url=gdata.contacts.client.DEFAULT_BATCH_URL):
+        """Creates a sync engine.
+
+        Args:
+          client: gdata.contacts.client.ContactsClient
+          store: ContactStore The local copy of the contacts.
+          page_size: int (optional) The number of contacts per feed page.
+          batch_size: int (optional) The number of operations per batch
+              request.
+          batch_url: str (optional) The batch URL of the contacts feed.
+        """
+        self.client = client
+        self.store = store
+        self.page_size = page_size
+        self.batch_size = batch_size
+        self.batch_url = batch_url
+
+    def pull(self, **kwargs):
+        """Applies the contacts changed on the server since the last pull.
+
+        The first pull reads every contact. Later pulls ask for the contacts
+        updated after the previous pull, including deleted ones. A local
+        update of a contact which changed on the server is dropped and
+        reported as a conflict.
+
+        Args:
+          kwargs: Other parameters to pass to client.get_contacts().
+
+        Returns:
+          A SyncResult.
+        """
+        result = SyncResult()
+        query = gdata.contacts.client.ContactsQuery(
+            max_results=self.page_size, updated_min=self.store.updated_min,
+            showdeleted='true' if self.store.updated_min else None)
+        first_page = self.client.get_contacts(q=query, **kwargs)
+        server_time = None
+        if first_page.updated is not None:
+            server_time = first_page.updated.text
+        pager = gdata.client.FeedPager(
+            self.client, first_page,
+            desired_class=gdata.contacts.data.ContactsFeed, **kwargs)
+        latest = self.store.updated_min
+        for contact in pager.iter_entries():
+            contact_id = contact.id.text
+            local = self.store.pending_updates.pop(contact_id, None)
+            if local is not None:
+                if contact.deleted is None and local.etag == contact.etag:
+                    # The update was applied again on this version after
+                    # a push conflict, it is still to be sent.
+                    self.store.pending_updates[contact_id] = local
+                    contact = local
+                else:
+                    result.conflicts.append(local)
+            if contact.deleted is not None:
+                self.store.discard(contact_id)
+                self.store.pending_deletes.pop(contact_id, None)
+                result.deleted.append(contact_id)
+            else:
+                self.store.put(contact)
+                result.updated.append(contact_id)
+            if contact.updated is not None and (
+                    latest is None or contact.updated.text > latest):
+                latest = contact.updated.text
+        self.store.updated_min = server_time or latest
+        return result
+
+    Pull = pull
+
+    def _chunks(self):
+        operations = (
+            [(gdata.data.BATCH_INSERT, contact)
+             for contact in self.store.pending_inserts]
+            + [(gdata.data.BATCH_UPDATE, contact)
+               for contact in self.store.pending_updates.values()]
+            + [(gdata.data.BATCH_DELETE, contact)
+               for contact in self.store.pending_deletes.values()])
+        for start in range(0, len(operations), self.batch_size):
+            yield operations[start:start + self.batch_size]
+
+    def push(self, **kwargs):
+        """Sends the pending local changes in batch requests.
+
+        Updates and deletes carry the etag of the local entry. Operations
+        refused with 412 Precondition Failed are reported as conflicts: the
+        server's version of the contact is read and the local change stays
+        queued with its etag, so the next push applies it on top. Operations
+        which failed with a server error, got no answer or whose batch
+        request failed stay queued as well and are reported as failures.
+        Other refused operations are reported and dropped. Successful
+        inserts and updates are stored with the entry returned by the
+        server, which holds the new etag.
+
+        Args:
+          kwargs: Other parameters to pass to client.execute_batch().
+
+        Returns:
+          A SyncResult.
+        """
+        result = SyncResult()
+        for chunk in list(self._chunks()):
+            request_feed = gdata.contacts.data.ContactsFeed()
+            operations = {}
+            for index, (operation, contact) in enumerate(chunk):
+                batch_id = str(index)
+                operations[batch_id] = (operation, contact)
+                request_feed.add_batch_entry(
+                    copy_entry(contact), batch_id_string=batch_id,
+                    operation_string=operation)
+            try:
+                response_feed = self.client.execute_batch(
+                    request_feed, url=self.batch_url,
+                    desired_class=gdata.contacts.data.ContactsFeed, **kwargs)
+            except (gdata.client.Error, http.client.HTTPException,
+                    OSError) as error:
+                # The chunk stays queued, the other chunks are still sent.
+                for operation, contact in chunk:
+                    result.failures.append(
+                        (contact, getattr(error, 'status', None), str(error)))
+                continue
+            for entry in response_feed.entry:
+                if entry.batch_id is None:
+                    continue
+                operation, contact = operations.pop(entry.batch_id.text)
+                self._apply_status(operation, contact, entry, result)
+            for operation, contact in operations.values():
+                result.failures.append((contact, None, 'No response'))
+        return result
+
+    Push = push
+
+    def _dequeue(self, operation, contact):
+        if operation == gdata.data.BATCH_INSERT:
+            self.store.pending_inserts.remove(contact)
+        elif operation == gdata.data.BATCH_UPDATE:
+            del self.store.pending_updates[contact.id.text]
+        else:
+            del self.store.pending_deletes[contact.id.text]
+
+    def _apply_status(self, operation, contact, entry, result):
+        if entry.batch_status is None:
+            result.failures.append((contact, None, 'No status'))
+            return
+        code = int(entry.batch_status.code)
+        if code == PRECONDITION_FAILED and (
+                operation != gdata.data.BATCH_INSERT):
+            self._rebase(contact)
+            result.conflicts.append(contact)
+        elif code >= 500:
+            result.failures.append((contact, code, entry.batch_status.reason))
+        elif code >= 300:
+            self._dequeue(operation, contact)
+            result.failures.append((contact, code, entry.batch_status.reason))
+        elif operation == gdata.data.BATCH_DELETE:
+            self._dequeue(operation, contact)
+            result.deleted.append(contact.id.text)
+        else:
+            self._dequeue(operation, contact)
+            entry.batch_id = None
+            entry.batch_operation = None
+            entry.batch_status = None
+            self.store.put(entry)
+            result.updated.append(entry.id.text)
+
+    def _rebase(self, contact):
+        """Gives a queued change the etag of the server's version.
+
+        The change stays queued unchanged if that version cannot be read,
+        the next pull then decides what happens to it.
+        """
+        uri = contact.find_self_link() or contact.find_edit_link()
+        if uri is None:
+            return
+        try:
+            current = self.client.get_contact(uri)
+        except (gdata.client.Error, http.client.HTTPException, OSError):
+            return
+        if current.deleted is None:
+            contact.etag = current.etag
+
+    def sync(self, **kwargs):
+        """Pulls the server's changes, then pushes the local ones.
+
+        Pulling first refreshes the etags, so the pushed updates only
+        conflict with changes made between the two steps. The store is
+        saved afterwards if it has a path.
+
+        Returns:
+          A tuple of the pull's and the push's SyncResult.
+        """
+        pulled = self.pull(**kwargs)
+        pushed = self.push(**kwargs)
+        if self.store.path is not None:
+            self.store.save()
+        return pulled, pushed
+
+    Sync = sync
@@ -1077,7 +1077,8 @@ class ProductEntry(gdata.data.BatchEntry):
               then None is returned. Other wise, the gd:errors element parsed
               as a ContentForShoppingErrors object is returned.
         """
-        if self.content.type == 'application/vnd.google.gdata.error+xml':
+        if (self.content is not None and
+                self.content.type == 'application/vnd.google.gdata.error+xml'):
             errors_elements = self.content.get_elements(tag='errors',
                                                         namespace=GD_NAMESPACE)
             if len(errors_elements) == 1:
@@ -0,0 +1,480 @@
+#
+# Licensed under the Apache License 2.0;
+
+
+"""Keeps a Merchant Center catalog in step with a local product source.
+
+insert_products, update_products and delete_products send one batch feed
+built from a list, so pushing a whole catalog means building every entry
+in memory and posting them one feed after the other. A CatalogSync reads
+the products from any iterable, compares each one with a ProductSnapshot of
+what was last sent, and only sends the products which are new or changed.
+The snapshot maps the REST id of each product ('channel:language:country:id')
+to a hash of its XML, so a catalog of millions of products costs a few dozen
+bytes per product, and a day where a small part of the catalog changes
+sends only that part.
+
+The changed products are cut into batch feeds of at most chunk_size
+entries, which are posted from a pool of threads while the source is still
+being read. The snapshot is updated from the batch responses: a product the
+server refused keeps its old hash, so the next sync sends it again. Products
+in the snapshot which the source no longer has are deleted when
+delete_missing is set.
+
+Example Usage::
+
+  client = gdata.contentforshopping.client.ContentForShoppingClient(
+      account_id='1234567')
+  snapshot = gdata.contentforshopping.sync.ProductSnapshot('catalog.json')
+  sync = gdata.contentforshopping.sync.CatalogSync(client, snapshot)
+  result = sync.sync(read_products_from_feed_file(), delete_missing=True)
+  for operation in result.failed:
+    print(operation.key, operation.status, operation.reason)
+"""
+
+import hashlib
+import json
+import os
+import threading
+
+import atom.data
+import gdata.client
+import gdata.data
+from gdata.contentforshopping.data import ProductEntry
+from gdata.contentforshopping.data import ProductFeed
+
+# Number of products in each batch feed.
+DEFAULT_CHUNK_SIZE = 250
+# Number of batch requests sent at the same time.
+DEFAULT_MAX_WORKERS = 4
+# Number of products read per page by reconcile_snapshot.
+DEFAULT_PAGE_SIZE = 250
+
+NOT_FOUND = 404
+
+BATCH_INSERT = 'insert'
+BATCH_UPDATE = 'update'
+BATCH_DELETE = 'delete'
+
+
+def product_key(entry):
+    """Returns the REST id of a product entry, 'channel:language:country:id'.
+
+    :param entry: A ProductEntry with its product_id, target_country and
+                  content_language set. The channel defaults to 'online'.
+    """
+    channel = 'online'
+    if entry.channel is not None and entry.channel.text:
+        channel = entry.channel.text
+    return '%s:%s:%s:%s' % (channel, entry.content_language.text,
+                            entry.target_country.text, entry.product_id.text)
+
+
+ProductKey = product_key
+
+
+def content_hash(entry):
+    """Returns a hex digest of the content of a product entry.
+
+    The batch elements of the entry are left out, so an entry hashes the
+    same before and after it is added to a batch feed.
+
+    :param entry: A ProductEntry.
+    """
+    saved = entry.batch_operation, entry.batch_id, entry.batch_status
+    entry.batch_operation = entry.batch_id = entry.batch_status = None
+    try:
+        xml = entry.to_string()
+    finally:
+        entry.batch_operation, entry.batch_id, entry.batch_status = saved
+    return hashlib.sha1(xml.encode('utf-8')).hexdigest()
+
+
+ContentHash = content_hash
+
+
+class ProductSnapshot(object):
+    """The products last accepted by the server, keyed by product_key.
+
+    Each key maps to the content_hash of the product as it was sent, or to
+    None for a product known to exist whose content is unknown. The
+    snapshot is saved as JSON, replacing the file atomically.
+
+    :param path: The file the snapshot is read from and saved to. If None,
+                 the snapshot only lives in memory.
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self.hashes = {}
+        if path is not None and os.path.exists(path):
+            with open(path) as snapshot_file:
+                self.hashes = json.load(snapshot_file)
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.hashes)
+
+    def __contains__(self, key):
+        return key in self.hashes
+
+    def get(self, key, default=None):
+        return self.hashes.get(key, default)
+
+    Get = get
+
+    def record(self, key, digest):
+        with self._lock:
+            self.hashes[key] = digest
+
+    Record = record
+
+    def remove(self, key):
+        with self._lock:
+            self.hashes.pop(key, None)
+
+    Remove = remove
+
+    def keys(self):
+        return list(self.hashes)
+
+    Keys = keys
+
+    def save(self):
+        """Writes the snapshot to its path, replacing the file atomically."""
+        if self.path is None:
+            return
+        with self._lock:
+            gdata.client.save_json(self.path, self.hashes,
+                                   separators=(',', ':'))
+
+    Save = save
+
+
+class ProductOperation(object):
+    """An insert, update or delete of one product.
+
+    .. attribute:: operation
+
+      One of BATCH_INSERT, BATCH_UPDATE or BATCH_DELETE.
+
+    .. attribute:: key
+
+      The product_key of the product.
+
+    .. attribute:: entry
+
+      The ProductEntry to send, None for deletes.
+
+    .. attribute:: digest
+
+      The content_hash of the entry, recorded in the snapshot once the
+      server accepts it.
+
+    .. attribute:: status
+
+      The batch status code of the last attempt, None until it is sent.
+
+    .. attribute:: reason
+
+      The batch status reason of the last attempt.
+
+    .. attribute:: errors
+
+      The ContentForShoppingErrors returned for a refused product, if any.
+    """
+
+    def __init__(self, operation, key, entry=None, digest=None):
+        self.operation = operation
+        self.key = key
+        self.entry = entry
+        self.digest = digest
+        self.status = None
+        self.reason = None
+        self.errors = None
+
+    def __repr__(self):
+        return 'ProductOperation(%r, %r, %r)' % (self.operation, self.key,
+                                                 self.status)
+
+    def succeeded(self):
+        return self.status is not None and self.status < 300
+
+    Succeeded = succeeded
+
+
+def diff_products(products, snapshot, delete_missing=False, result=None):
+    """Yields the ProductOperations which bring the snapshot up to date.
+
+    Products are read one at a time, unchanged ones are skipped. Deletes are
+    yielded once the whole source has been read.
+
+    :param products: An iterable of ProductEntry objects.
+    :param snapshot: The ProductSnapshot to compare them with.
+    :param delete_missing: Whether to delete products which are in the
+                           snapshot but not in the source. Only use it with a
+                           source holding the whole catalog.
+    :param result: A SyncResult whose unchanged count is kept up to date.
+    """
+    seen = set()
+    for entry in products:
+        key = product_key(entry)
+        if key in seen:
+            raise ValueError('Product %s appears twice in the source' % key)
+        seen.add(key)
+        digest = content_hash(entry)
+        if key not in snapshot:
+            yield ProductOperation(BATCH_INSERT, key, entry, digest)
+        elif snapshot.get(key) != digest:
+            yield ProductOperation(BATCH_UPDATE, key, entry, digest)
+        elif result is not None:
+            result.unchanged += 1
+    if delete_missing:
+        for key in snapshot.keys():
+            if key not in seen:
+                yield ProductOperation(BATCH_DELETE, key)
+
+
+DiffProducts = diff_products
+
+
+class SyncResult(object):
+    """The outcome of a CatalogSync run.
+
+    .. attribute:: inserted
+
+      The number of products inserted.
+
+    .. attribute:: updated
+
+      The number of products updated.
+
+    .. attribute:: deleted
+
+      The number of products deleted.
+
+    .. attribute:: unchanged
+
+      The number of products which matched the snapshot and were not sent.
+
+    .. attribute:: failed
+
+      The list of ProductOperations the server refused, with their status.
+
+    .. attribute:: requests
+
+      The number of batch requests sent.
+    """
+
+    def __init__(self):
+        self.inserted = 0
+        self.updated = 0
+        self.deleted = 0
+        self.unchanged = 0
+        self.failed = []
+        self.requests = 0
+
+    def get_sent(self):
+        """Returns the number of products which were sent."""
+        return self.inserted + self.updated + self.deleted + len(self.failed)
+
+    GetSent = get_sent
+
+
+class CatalogSync(object):
+    """Sends the changed products of a catalog as parallel batch requests.
+
+    :param client: The ContentForShoppingClient used for every request, from
+                   several threads.
+    :param snapshot: The ProductSnapshot of the products last sent.
+    :param max_workers: Number of batch requests sent at once.
+    :param chunk_size: Number of products in each batch feed.
+    :param account_id: The Merchant Center Account ID. If ommitted the default
+                       Account ID of the client will be used.
+    :param dry_run: Flag to send the batch requests in dry-run mode; the
+                    snapshot is then left as it is.
+    """
+
+    def __init__(self, client, snapshot, max_workers=DEFAULT_MAX_WORKERS,
+                 chunk_size=DEFAULT_CHUNK_SIZE, account_id=None,
+                 dry_run=False):
+        self.client = client
+        self.snapshot = snapshot
+        self.max_workers = max_workers
+        self.chunk_size = chunk_size
+        self.account_id = account_id
+        self.dry_run = dry_run
+
+    def sync(self, products, delete_missing=False, progress=None,
+             auth_token=None):
+        """Sends every new, changed and, optionally, missing product.
+
+        The batch feeds go through a gdata.client.BoundedExecutor, which
+        stops reading the source while too many feeds are in flight. The
+        snapshot is saved when the run ends, even if it ends with an
+        exception.
+
+        :param products: An iterable of ProductEntry objects, the whole
+                         catalog or a part of it.
+        :param delete_missing: Whether to delete the products of the snapshot
+                               which the source does not have.
+        :param progress: Function called as progress(result, chunk) after
+                         each batch feed is done, from the calling thread.
+        :param auth_token: An object which sets the Authorization HTTP header
+                           in its modify_request method.
+
+        :returns: A SyncResult.
+        """
+        result = SyncResult()
+
+        def collect(outcome):
+            chunk, requests = outcome
+            result.requests += requests
+            for operation in chunk:
+                self._apply(operation, result)
+            if progress is not None:
+                progress(result, chunk)
+
+        try:
+            with gdata.client.BoundedExecutor(self.max_workers,
+                                              collect) as executor:
+                chunk = []
+                for operation in diff_products(products, self.snapshot,
+                                               delete_missing, result):
+                    chunk.append(operation)
+                    if len(chunk) >= self.chunk_size:
+                        executor.submit(self._send, chunk, auth_token)
+                        chunk = []
+                if chunk:
+                    executor.submit(self._send, chunk, auth_token)
+        finally:
+            if not self.dry_run:
+                self.snapshot.save()
+        return result
+
+    Sync = sync
+
+    def _apply(self, operation, result):
+        """Counts an operation and records it in the snapshot."""
+        if not operation.succeeded():
+            result.failed.append(operation)
+            return
+        if operation.operation == BATCH_INSERT:
+            result.inserted += 1
+        elif operation.operation == BATCH_UPDATE:
+            result.updated += 1
+        else:
+            result.deleted += 1
+        if self.dry_run:
+            return
+        if operation.operation == BATCH_DELETE:
+            self.snapshot.remove(operation.key)
+        else:
+            self.snapshot.record(operation.key, operation.digest)
+        # Only the hash is kept, the entry can be freed.
+        operation.entry = None
+
+    def _send(self, chunk, auth_token):
+        requests = 1
+        self._post(chunk, auth_token)
+        # The snapshot was out of date: the product is gone from the server,
+        # so the update is sent again as an insert.
+        missing = [operation for operation in chunk
+                   if operation.operation == BATCH_UPDATE
+                   and operation.status == NOT_FOUND]
+        if missing:
+            for operation in missing:
+                operation.operation = BATCH_INSERT
+            requests += 1
+            self._post(missing, auth_token)
+        return chunk, requests
+
+    def _post(self, operations, auth_token):
+        """Sends one batch feed and sets the status of its operations."""
+        request_feed = ProductFeed()
+        for index, operation in enumerate(operations):
+            if operation.operation == BATCH_DELETE:
+                entry = ProductEntry(id=atom.data.Id(text=self._get_uri(
+                    operation.key)))
+            else:
+                entry = operation.entry
+            entry.batch_id = gdata.data.BatchId(text=str(index))
+            entry.batch_operation = gdata.data.BatchOperation(
+                type=operation.operation)
+            entry.batch_status = None
+            request_feed.entry.append(entry)
+        try:
+            response_feed = self.client.batch(
+                request_feed, account_id=self.account_id,
+                auth_token=auth_token, dry_run=self.dry_run)
+        except gdata.client.Error as error:
+            for operation in operations:
+                operation.status = getattr(error, 'status', None)
+                operation.reason = str(error)
+            return
+        finally:
+            for entry in request_feed.entry:
+                entry.batch_id = entry.batch_operation = None
+        for operation in operations:
+            operation.status = None
+            operation.reason = 'Missing from the batch response'
+        for entry in response_feed.entry:
+            if entry.batch_id is None or entry.batch_status is None:
+                continue
+            operation = operations[int(entry.batch_id.text)]
+            operation.status = int(entry.batch_status.code)
+            operation.reason = entry.batch_status.reason
+            if not operation.succeeded():
+                operation.errors = entry.get_batch_errors()
+
+    def _get_uri(self, key):
+        return self.client._create_uri(self.account_id, 'items/products',
+                                       path=[key])
+
+
+def reconcile_snapshot(client, snapshot, account_id=None, auth_token=None,
+                       page_size=DEFAULT_PAGE_SIZE):
+    """Brings the keys of a snapshot in line with the products on the server.
+
+    Pages through the products of the account with start tokens. Products
+    the snapshot does not know are added with no hash, so the next sync
+    updates them. Products of the snapshot which the server does not have
+    are removed, so the next sync inserts them. The snapshot is saved.
+
+    :param client: The ContentForShoppingClient to read the products with.
+    :param snapshot: The ProductSnapshot to reconcile.
+    :param account_id: The Merchant Center Account ID. If ommitted the default
+                       Account ID of the client will be used.
+    :param auth_token: An object which sets the Authorization HTTP header in
+                       its modify_request method.
+    :param page_size: Number of products requested per page.
+
+    :returns: A (added, removed) tuple of the number of keys changed.
+    """
+    remote = set()
+    start_token = None
+    while True:
+        feed = client.get_products(max_results=page_size,
+                                   start_token=start_token,
+                                   account_id=account_id,
+                                   auth_token=auth_token)
+        for entry in feed.entry:
+            remote.add(product_key(entry))
+        start_token = feed.get_start_token()
+        if start_token is None:
+            break
+    added = 0
+    for key in remote:
+        if key not in snapshot:
+            snapshot.record(key, None)
+            added += 1
+    removed = 0
+    for key in snapshot.keys():
+        if key not in remote:
+            snapshot.remove(key)
+            removed += 1
+    snapshot.save()
+    return added, removed
+
+
+ReconcileSnapshot = reconcile_snapshot
@@ -426,7 +426,27 @@ class DocsClient(gdata.client.GDClient):
         Raises:
           gdata.client.RequestError: on error response from server.
         """
-        server_response = None
+        return self._get_content_response(
+            uri, auth_token=auth_token, **kwargs).read()
+
+    def _get_content_response(self, uri, auth_token=None, **kwargs):
+        """Requests the given resource's content without reading it.
+
+        The returned response can be read in chunks, which lets large files
+        be streamed to disk.
+
+        Args:
+          uri: str The full URL to download the content from.
+          auth_token: (optional) Token which authorizes this client, the
+              alternate token is used for spreadsheets if None.
+          kwargs: Other parameters to pass to self.request().
+
+        Returns:
+          The unread HTTP response.
+
+        Raises:
+          gdata.client.RequestError: on error response from server.
+        """
         token = auth_token
         if 'spreadsheets' in uri and token is None \
                 and self.alt_auth_token is not None:
@@ -437,7 +457,7 @@ class DocsClient(gdata.client.GDClient):
             raise gdata.client.RequestError({'status': server_response.status,
                                              'reason': server_response.reason,
                                              'body': server_response.read()})
-        return server_response.read()
+        return server_response
 
     def _download_file(self, uri, file_path, **kwargs):
         """Downloads a file to disk from the specified URI.
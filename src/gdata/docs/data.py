@@ -102,6 +102,11 @@ class SuggestedFilename(atom.core.XmlElement):
     _qname = DOCUMENTS_TEMPLATE % 'suggestedFilename'
 
 
+class Md5Checksum(atom.core.XmlElement):
+    """The DocList docs:md5Checksum element, only present on files."""
+    _qname = DOCUMENTS_TEMPLATE % 'md5Checksum'
+
+
 class Description(atom.core.XmlElement):
     """The DocList docs:description element."""
     _qname = DOCUMENTS_TEMPLATE % 'description'
@@ -394,6 +399,7 @@ class Resource(gdata.data.BatchEntry, CategoryFinder):
     feed_link = [gdata.data.FeedLink]
     filename = Filename
     suggested_filename = SuggestedFilename
+    md5_checksum = Md5Checksum
     description = Description
     # Only populated if you request /feeds/default/private/expandAcl
     acl_feed = AclFeed
@@ -0,0 +1,369 @@
+#
+# Licensed under the Apache License 2.0;
+
+
+"""Downloads many Documents List resources and revisions concurrently.
+
+DocsClient.download_resource fetches one item at a time and holds its whole
+content in memory. A BulkDownloader runs several downloads at once, limits
+the number of connections opened to each host, and streams every response
+to disk in chunks.
+
+A DownloadManifest, saved as JSON next to the downloads, remembers the ETag
+and MD5 checksum of every downloaded item. Items whose ETag or server
+checksum did not change since the last run are skipped, and content which
+is already on disk under another name is hard linked instead of being
+written twice.
+
+Example Usage:
+client = gdata.docs.client.DocsClient()
+manifest = gdata.docs.download.DownloadManifest('backup/manifest.json')
+downloader = gdata.docs.download.BulkDownloader(client, manifest)
+items = [gdata.docs.download.DownloadItem(
+             entry, os.path.join('backup', entry.resource_id.text))
+         for entry in client.get_all_resources()]
+stats = downloader.download(items)
+print(stats.throughput)
+"""
+
+import hashlib
+import http.client
+import json
+import os
+import threading
+import time
+import urllib.parse
+
+import gdata.client
+
+# Number of downloads running at the same time.
+DEFAULT_MAX_WORKERS = 8
+# Number of downloads running at the same time against a single host.
+DEFAULT_PER_HOST = 4
+# Number of bytes read from a response and written to disk at once.
+DEFAULT_CHUNK_SIZE = 64 * 1024
+
+# Errors which fail one item without stopping the others.
+_DOWNLOAD_ERRORS = (gdata.client.Error, http.client.HTTPException, OSError,
+                    ValueError)
+
+DOWNLOADED = 'downloaded'
+SKIPPED = 'skipped'
+LINKED = 'linked'
+FAILED = 'failed'
+
+
+class DownloadItem(object):
+    """A Resource or Revision entry to save to a file.
+
+    Attributes:
+      entry: gdata.docs.data.Resource or gdata.docs.data.Revision
+      file_path: str Where the content is saved.
+      extra_params: dict (optional) Export parameters, for example
+          {'exportFormat': 'pdf'}.
+    """
+
+    def __init__(self, entry, file_path, extra_params=None):
+        self.entry = entry
+        self.file_path = file_path
+        self.extra_params = extra_params
+
+    def get_key(self):
+        """Identifies the item and export format in the manifest."""
+        if self.entry.id is not None and self.entry.id.text:
+            key = self.entry.id.text
+        else:
+            key = self.entry.content.src
+        if self.extra_params:
+            key += '?' + urllib.parse.urlencode(sorted(
+                self.extra_params.items()))
+        return key
+
+    GetKey = get_key
+
+    def get_md5(self):
+        """Returns the checksum the server reports for the content, or None.
+
+        Only files have one, exported documents do not.
+        """
+        if self.extra_params:
+            return None
+        md5_checksum = getattr(self.entry, 'md5_checksum', None)
+        if md5_checksum is None or not md5_checksum.text:
+            return None
+        return md5_checksum.text
+
+    GetMd5 = get_md5
+
+
+class DownloadManifest(object):
+    """What earlier downloads saved, keyed by DownloadItem.get_key.
+
+    Each record holds the item's etag, the MD5 checksum of the saved
+    content and the file path. The manifest is safe to use from several
+    threads.
+    """
+
+    def __init__(self, path=None, records=None):
+        self.path = path
+        self.records = records or {}
+        if records is None and path is not None and os.path.exists(path):
+            with open(path) as manifest_file:
+                self.records = json.load(manifest_file)
+        self._lock = threading.Lock()
+        self._paths_by_md5 = {}
+        self._md5_by_path = {}
+        for record in self.records.values():
+            self._paths_by_md5[record['md5']] = record['path']
+            self._md5_by_path[record['path']] = record['md5']
+
+    def __len__(self):
+        return len(self.records)
+
+    def get(self, key):
+        """Returns the record dict for a key, or None."""
+        with self._lock:
+            return self.records.get(key)
+
+    Get = get
+
+    def record(self, key, etag, md5, file_path):
+        """Remembers a saved item."""
+        with self._lock:
+            self.records[key] = {'etag': etag, 'md5': md5,
+                                 'path': file_path}
+            # The file may have held other content before, which it can no
+            # longer provide.
+            old_md5 = self._md5_by_path.get(file_path)
+            if (old_md5 is not None and old_md5 != md5
+                    and self._paths_by_md5.get(old_md5) == file_path):
+                del self._paths_by_md5[old_md5]
+            self._paths_by_md5[md5] = file_path
+            self._md5_by_path[file_path] = md5
+
+    Record = record
+
+    def find_content(self, md5):
+        """Returns an existing file holding content with the checksum."""
+        with self._lock:
+            file_path = self._paths_by_md5.get(md5)
+            if self._md5_by_path.get(file_path) != md5:
+                return None
+        if file_path is not None and os.path.exists(file_path):
+            return file_path
+        return None
+
+    FindContent = find_content
+
+    def save(self):
+        """Writes the manifest to its path, replacing the file atomically."""
+        if self.path is None:
+            return
+        with self._lock:
+            gdata.client.save_json(self.path, self.records)
+
+    Save = save
+
+
+class DownloadStats(object):
+    """What a BulkDownloader.download call did.
+
+    Attributes:
+      results: dict mapping each item's key to DOWNLOADED, SKIPPED, LINKED
+          or FAILED.
+      errors: dict mapping the keys of failed items to their exception.
+      bytes: int The number of bytes received from the server.
+      elapsed: float Seconds spent in the call.
+    """
+
+    def __init__(self):
+        self.results = {}
+        self.errors = {}
+        self.bytes = 0
+        self.elapsed = 0.0
+
+    def count(self, result):
+        """Returns the number of items which ended with the result."""
+        return sum(1 for value in self.results.values() if value == result)
+
+    Count = count
+
+    @property
+    def throughput(self):
+        """Bytes received per second."""
+        if not self.elapsed:
+            return 0.0
+        return self.bytes / self.elapsed
+
+
+class BulkDownloader(object):
+    """Downloads DownloadItems concurrently, streaming them to disk."""
+
+    def __init__(self, client, manifest=None, max_workers=DEFAULT_MAX_WORKERS,
+                 per_host=DEFAULT_PER_HOST, chunk_size=DEFAULT_CHUNK_SIZE):
+        """Creates a downloader.
+
+        Args:
+          client: gdata.docs.client.DocsClient
+          manifest: DownloadManifest (optional) Records earlier downloads,
+              a new in-memory manifest is used if None.
+          max_workers: int (optional) The number of concurrent downloads.
+          per_host: int (optional) The number of concurrent downloads from a
+              single host.
+          chunk_size: int (optional) The number of bytes read at once.
+        """
+        self.client = client
+        if manifest is None:
+            manifest = DownloadManifest()
+        self.manifest = manifest
+        self.max_workers = max_workers
+        self.per_host = per_host
+        self.chunk_size = chunk_size
+        self._host_slots = {}
+        self._lock = threading.Lock()
+
+    def _get_host_slot(self, uri):
+        host = urllib.parse.urlparse(uri).netloc
+        with self._lock:
+            slot = self._host_slots.get(host)
+            if slot is None:
+                slot = threading.BoundedSemaphore(self.per_host)
+                self._host_slots[host] = slot
+            return slot
+
+    def _is_unchanged(self, item, key):
+        record = self.manifest.get(key)
+        if record is None or not os.path.exists(record['path']):
+            return False
+        if item.entry.etag is not None and record['etag'] == item.entry.etag:
+            return True
+        md5 = item.get_md5()
+        return md5 is not None and record['md5'] == md5
+
+    @staticmethod
+    def _link(source_path, file_path):
+        if os.path.abspath(source_path) == os.path.abspath(file_path):
+            return
+        temp_path = file_path + '.part'
+        try:
+            os.link(source_path, temp_path)
+        except OSError:
+            with open(source_path, 'rb') as source:
+                with open(temp_path, 'wb') as target:
+                    while True:
+                        chunk = source.read(DEFAULT_CHUNK_SIZE)
+                        if not chunk:
+                            break
+                        target.write(chunk)
+        os.replace(temp_path, file_path)
+
+    def _fetch(self, item, stats, **kwargs):
+        """Streams one item to a temporary file.
+
+        Returns:
+          A tuple of the MD5 checksum of the received content and the path
+          of the temporary file.
+        """
+        uri = self.client._get_download_uri(item.entry.content.src,
+                                            item.extra_params)
+        temp_path = item.file_path + '.part'
+        checksum = hashlib.md5()
+        with self._get_host_slot(uri):
+            response = self.client._get_content_response(uri, **kwargs)
+            try:
+                with open(temp_path, 'wb') as target:
+                    while True:
+                        chunk = response.read(self.chunk_size)
+                        if not chunk:
+                            break
+                        checksum.update(chunk)
+                        target.write(chunk)
+                        with self._lock:
+                            stats.bytes += len(chunk)
+            except Exception:
+                if os.path.exists(temp_path):
+                    os.remove(temp_path)
+                raise
+        return checksum.hexdigest(), temp_path
+
+    def download_one(self, item, stats, **kwargs):
+        """Downloads one item unless it is unchanged or already on disk.
+
+        Returns:
+          DOWNLOADED, SKIPPED or LINKED.
+        """
+        key = item.get_key()
+        if self._is_unchanged(item, key):
+            return SKIPPED
+        self.client._check_entry_is_not_collection(item.entry)
+        self.client._check_entry_has_content(item.entry)
+        md5 = item.get_md5()
+        if md5 is not None:
+            existing = self.manifest.find_content(md5)
+            if existing is not None:
+                self._link(existing, item.file_path)
+                self.manifest.record(key, item.entry.etag, md5,
+                                     item.file_path)
+                return LINKED
+        md5, temp_path = self._fetch(item, stats, **kwargs)
+        existing = self.manifest.find_content(md5)
+        if existing is not None and existing != item.file_path:
+            os.remove(temp_path)
+            self._link(existing, item.file_path)
+            result = LINKED
+        else:
+            os.replace(temp_path, item.file_path)
+            result = DOWNLOADED
+        self.manifest.record(key, item.entry.etag, md5, item.file_path)
+        return result
+
+    DownloadOne = download_one
+
+    def _download_item(self, item, stats, kwargs):
+        """Returns a (key, result, error) tuple, error None on success."""
+        key = item.get_key()
+        try:
+            return key, self.download_one(item, stats, **kwargs), None
+        except _DOWNLOAD_ERRORS as error:
+            return key, FAILED, error
+
+    def download(self, items, progress=None, **kwargs):
+        """Downloads every item, several at a time.
+
+        A failed item does not stop the others, its error is kept in the
+        returned stats. Items are read from the iterable as downloads
+        finish. The manifest is saved at the end, even if the run is
+        interrupted.
+
+        Args:
+          items: iterable of DownloadItems.
+          progress: (optional) function called as progress(key, result,
+              stats) after each item.
+          kwargs: Other parameters to pass to client.request().
+
+        Returns:
+          A DownloadStats.
+        """
+        stats = DownloadStats()
+        start = time.time()
+
+        def collect(outcome):
+            key, result, error = outcome
+            stats.results[key] = result
+            if error is not None:
+                stats.errors[key] = error
+            stats.elapsed = time.time() - start
+            if progress is not None:
+                progress(key, result, stats)
+
+        try:
+            with gdata.client.BoundedExecutor(self.max_workers,
+                                              collect) as executor:
+                for item in items:
+                    executor.submit(self._download_item, item, stats, kwargs)
+        finally:
+            stats.elapsed = time.time() - start
+            self.manifest.save()
+        return stats
+
+    Download = download
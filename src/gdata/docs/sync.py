@@ -0,0 +1,530 @@
+#
+# Licensed under the Apache License 2.0;
+
+
+"""Keeps a local index of Documents List resources in sync with the server.
+
+Instead of crawling every resource with DocsClient.get_all_resources, a
+ChangeSync reads the change feed starting after the largest changestamp it
+has already applied. Each change updates a ResourceIndex which holds the
+metadata of every resource (etag, title, parent collections, mime type).
+The index and the changestamp are saved together in a JSON file, so the
+next run continues where the previous one stopped.
+
+A CollectionTree answers parent, child, path and subtree questions from
+memory, and can be maintained from the results of the same syncs.
+
+Example Usage:
+client = gdata.docs.client.DocsClient()
+sync = gdata.docs.sync.ChangeSync(client, path='docs_index.json')
+result = sync.sync()
+for resource_id in result.changed:
+  print(sync.index.get(resource_id).title)
+tree = gdata.docs.sync.CollectionTree.from_index(sync.index)
+tree.apply(sync.index, sync.sync())
+print(tree.resolve('/Projects/report'))
+"""
+
+import json
+import os
+import urllib.parse
+
+import gdata.client
+import gdata.docs.client
+import gdata.docs.data
+
+# Number of changes requested per page of the change feed, the API sends at
+# most 100.
+DEFAULT_PAGE_SIZE = 100
+# Number of change feed pages applied between two saves of the index.
+DEFAULT_CHECKPOINT_PAGES = 10
+# Number of resources requested per page when building a CollectionTree.
+DEFAULT_TREE_PAGE_SIZE = 1000
+# Resource ID of the root collection, the parent of top level resources when
+# feeds are requested with showroot=true.
+ROOT_COLLECTION_ID = 'folder:root'
+# Resource feed including collections.
+ALL_RESOURCES_URI = gdata.docs.client.RESOURCE_FEED_URI + '?showfolders=true'
+
+
+def resource_id_from_link(href):
+    """Returns the resource ID at the end of a resource or collection link.
+
+    For example '.../private/full/folder%3A123' becomes 'folder:123'.
+    """
+    return urllib.parse.unquote(href.rstrip('/').split('/')[-1])
+
+
+ResourceIdFromLink = resource_id_from_link
+
+
+class IndexedResource(object):
+    """The metadata of one resource as stored in a ResourceIndex."""
+
+    __slots__ = ('resource_id', 'etag', 'title', 'parents', 'mime_type',
+                 'kind', 'changestamp', 'trashed')
+
+    def __init__(self, resource_id, etag=None, title=None, parents=None,
+                 mime_type=None, kind=None, changestamp=None, trashed=False):
+        self.resource_id = resource_id
+        self.etag = etag
+        self.title = title
+        self.parents = parents or []
+        self.mime_type = mime_type
+        self.kind = kind
+        self.changestamp = changestamp
+        self.trashed = trashed
+
+    @staticmethod
+    def from_entry(entry, changestamp=None):
+        """Extracts the indexed metadata from a Resource or Change entry."""
+        title = None
+        if entry.title is not None:
+            title = entry.title.text
+        mime_type = None
+        if entry.content is not None:
+            mime_type = entry.content.type
+        return IndexedResource(
+            entry.resource_id.text, etag=entry.etag, title=title,
+            parents=[resource_id_from_link(link.href)
+                     for link in entry.in_collections()],
+            mime_type=mime_type, kind=entry.get_resource_type(),
+            changestamp=changestamp, trashed=entry.is_trashed())
+
+    FromEntry = from_entry
+
+    def to_dict(self):
+        return dict((name, getattr(self, name)) for name in self.__slots__)
+
+    ToDict = to_dict
+
+    @staticmethod
+    def from_dict(values):
+        return IndexedResource(**values)
+
+    FromDict = from_dict
+
+
+class ResourceIndex(object):
+    """Resources keyed by resource ID, with the changestamp they are current to.
+
+    Removed resources are remembered with the changestamp of their removal so
+    that changed_since can report them.
+    """
+
+    def __init__(self, resources=None, removed=None, changestamp=None):
+        self.resources = resources or {}
+        self.removed = removed or {}
+        self.changestamp = changestamp
+
+    def __len__(self):
+        return len(self.resources)
+
+    def __contains__(self, resource_id):
+        return resource_id in self.resources
+
+    def __iter__(self):
+        return iter(self.resources.values())
+
+    def get(self, resource_id):
+        """Returns the IndexedResource for the ID, or None."""
+        return self.resources.get(resource_id)
+
+    Get = get
+
+    def put(self, resource):
+        """Adds or replaces a resource."""
+        self.resources[resource.resource_id] = resource
+        self.removed.pop(resource.resource_id, None)
+
+    Put = put
+
+    def remove(self, resource_id, changestamp=None):
+        """Drops a resource, remembering when it was removed."""
+        self.resources.pop(resource_id, None)
+        self.removed[resource_id] = changestamp
+
+    Remove = remove
+
+    def apply_change(self, change):
+        """Applies one entry of the change feed.
+
+        A change marked as removed drops the resource, any other change
+        replaces the resource's metadata, which covers renames and moves to
+        other collections.
+
+        Args:
+          change: gdata.docs.data.Change
+
+        Returns:
+          The IndexedResource now stored, or None if the resource was removed.
+        """
+        changestamp = None
+        if change.changestamp is not None:
+            changestamp = int(change.changestamp.value)
+            if self.changestamp is None or changestamp > self.changestamp:
+                self.changestamp = changestamp
+        resource_id = change.resource_id.text
+        if change.removed is not None:
+            self.remove(resource_id, changestamp)
+            return None
+        resource = IndexedResource.from_entry(change, changestamp)
+        self.put(resource)
+        return resource
+
+    ApplyChange = apply_change
+
+    def changed_since(self, changestamp):
+        """Lists what changed after the given changestamp.
+
+        Args:
+          changestamp: int The largest changestamp the caller has seen, for
+              example the index's changestamp at the time of an earlier call.
+
+        Returns:
+          A tuple of the IndexedResources changed after the changestamp,
+          ordered by changestamp, and the IDs of the resources removed after
+          it.
+        """
+        changed = [resource for resource in self.resources.values()
+                   if resource.changestamp is not None
+                   and resource.changestamp > changestamp]
+        changed.sort(key=lambda resource: resource.changestamp)
+        removed = [resource_id
+                   for resource_id, removed_at in self.removed.items()
+                   if removed_at is not None and removed_at > changestamp]
+        return changed, removed
+
+    ChangedSince = changed_since
+
+    def save(self, path):
+        """Writes the index to a JSON file, replacing the file atomically."""
+        gdata.client.save_json(
+            path, {'changestamp': self.changestamp,
+                   'removed': self.removed,
+                   'resources': [resource.to_dict()
+                                 for resource in self.resources.values()]})
+
+    Save = save
+
+    @staticmethod
+    def load(path):
+        """Reads an index written by save."""
+        with open(path) as index_file:
+            values = json.load(index_file)
+        resources = {}
+        for resource_values in values['resources']:
+            resource = IndexedResource.from_dict(resource_values)
+            resources[resource.resource_id] = resource
+        return ResourceIndex(resources, values['removed'],
+                             values['changestamp'])
+
+    Load = load
+
+
+class SyncResult(object):
+    """What one ChangeSync.sync call applied.
+
+    Attributes:
+      changed: set of the IDs of resources which were added or changed.
+      removed: set of the IDs of resources which were removed.
+      pages: int The number of change feed pages read.
+      changestamp: int The index's changestamp after the sync.
+    """
+
+    def __init__(self):
+        self.changed = set()
+        self.removed = set()
+        self.pages = 0
+        self.changestamp = None
+
+
+class ChangeSync(object):
+    """Applies the Documents List change feed to a ResourceIndex.
+
+    The first sync reads the whole change feed, later syncs only the changes
+    after the index's changestamp. If a path is given, the index is loaded
+    from it and saved back every checkpoint_pages pages and at the end of each
+    sync. Changes replace whole resources, so resuming from a checkpoint which
+    is a few pages behind simply applies those changes again.
+    """
+
+    def __init__(self, client, index=None, path=None,
+                 page_size=DEFAULT_PAGE_SIZE,
+                 checkpoint_pages=DEFAULT_CHECKPOINT_PAGES):
+        """Creates a sync engine.
+
+        Args:
+          client: gdata.docs.client.DocsClient used to read the change feed.
+          index: ResourceIndex (optional) The index to update. If None, it is
+              loaded from path, or a new empty index is used.
+          path: str (optional) JSON file in which the index is kept.
+          page_size: int (optional) The number of changes per feed page.
+          checkpoint_pages: int (optional) The number of pages applied between
+              two saves of the index.
+        """
+        self.client = client
+        self.path = path
+        self.page_size = page_size
+        self.checkpoint_pages = checkpoint_pages
+        if index is None:
+            if path is not None and os.path.exists(path):
+                index = ResourceIndex.load(path)
+            else:
+                index = ResourceIndex()
+        self.index = index
+
+    def sync(self, progress=None, **kwargs):
+        """Reads and applies every change made since the last sync.
+
+        Args:
+          progress: (optional) function called as progress(sync, result) after
+              each page has been applied.
+          kwargs: Other parameters to pass to client.get_changes().
+
+        Returns:
+          A SyncResult describing the applied changes.
+        """
+        result = SyncResult()
+        changestamp = None
+        if self.index.changestamp is not None:
+            changestamp = self.index.changestamp + 1
+        first_page = self.client.get_changes(
+            changestamp=changestamp, max_results=self.page_size,
+            show_root=True, **kwargs)
+        pager = gdata.client.FeedPager(
+            self.client, first_page, desired_class=gdata.docs.data.ChangeFeed,
+            **kwargs)
+        for feed in pager.iter_pages():
+            for change in feed.entry:
+                if self.index.apply_change(change) is None:
+                    result.removed.add(change.resource_id.text)
+                    result.changed.discard(change.resource_id.text)
+                else:
+                    result.changed.add(change.resource_id.text)
+                    result.removed.discard(change.resource_id.text)
+            result.pages += 1
+            result.changestamp = self.index.changestamp
+            if (self.path is not None
+                    and result.pages % self.checkpoint_pages == 0):
+                self.index.save(self.path)
+            if progress is not None:
+                progress(self, result)
+        if self.path is not None:
+            self.index.save(self.path)
+        return result
+
+    Sync = sync
+
+
+class CollectionTree(object):
+    """Parent and child links of resources, kept in memory.
+
+    Each resource is indexed by resource ID with its parent collections and
+    title, and each collection with the set of its children, so parent and
+    child lookups are dictionary lookups. The tree can be built with one
+    pass over the resource feed (build) or from a ResourceIndex, and kept
+    current by applying the results of ChangeSync.sync.
+
+    Paths are made of titles and start at the root collection, for example
+    '/Projects/2012/report'.
+    """
+
+    def __init__(self):
+        self.titles = {}
+        self.parents = {}
+        self.children = {}
+        self._by_title = {}
+
+    def __len__(self):
+        return len(self.titles)
+
+    def __contains__(self, resource_id):
+        return resource_id in self.titles
+
+    def add(self, resource_id, title, parents=()):
+        """Adds a resource or replaces its title and parent collections."""
+        if resource_id in self.titles:
+            self.remove(resource_id)
+        self.titles[resource_id] = title
+        self.parents[resource_id] = list(parents)
+        for parent_id in self.parents[resource_id]:
+            self.children.setdefault(parent_id, set()).add(resource_id)
+            self._by_title.setdefault(
+                (parent_id, title), set()).add(resource_id)
+
+    Add = add
+
+    def remove(self, resource_id):
+        """Removes a resource from its parent collections.
+
+        The children of a removed collection keep their link to it, so they
+        are found again if the collection comes back.
+        """
+        title = self.titles.pop(resource_id, None)
+        for parent_id in self.parents.pop(resource_id, ()):
+            siblings = self.children.get(parent_id)
+            if siblings is not None:
+                siblings.discard(resource_id)
+                if not siblings:
+                    del self.children[parent_id]
+            same_title = self._by_title.get((parent_id, title))
+            if same_title is not None:
+                same_title.discard(resource_id)
+                if not same_title:
+                    del self._by_title[(parent_id, title)]
+
+    Remove = remove
+
+    def add_resource(self, resource):
+        """Adds an IndexedResource, skipping trashed resources."""
+        if resource.trashed:
+            self.remove(resource.resource_id)
+        else:
+            self.add(resource.resource_id, resource.title, resource.parents)
+
+    AddResource = add_resource
+
+    def apply(self, index, result):
+        """Applies what a ChangeSync.sync call changed in its index.
+
+        Args:
+          index: ResourceIndex The index which was synced.
+          result: SyncResult returned by the sync.
+        """
+        for resource_id in result.removed:
+            self.remove(resource_id)
+        for resource_id in result.changed:
+            resource = index.get(resource_id)
+            if resource is not None:
+                self.add_resource(resource)
+
+    Apply = apply
+
+    def get_parents(self, resource_id):
+        """Returns the IDs of the collections containing a resource."""
+        return list(self.parents.get(resource_id, ()))
+
+    GetParents = get_parents
+
+    def get_children(self, resource_id):
+        """Returns the IDs of the resources directly in a collection."""
+        return set(self.children.get(resource_id, ()))
+
+    GetChildren = get_children
+
+    def iter_subtree(self, resource_id):
+        """Yields the IDs of every resource below a collection.
+
+        Resources found under several collections are yielded once, breadth
+        first.
+        """
+        seen = {resource_id}
+        pending = [resource_id]
+        while pending:
+            next_level = []
+            for collection_id in pending:
+                for child_id in self.children.get(collection_id, ()):
+                    if child_id not in seen:
+                        seen.add(child_id)
+                        next_level.append(child_id)
+                        yield child_id
+            pending = next_level
+
+    IterSubtree = iter_subtree
+
+    def get_paths(self, resource_id):
+        """Returns every path of a resource.
+
+        Returns:
+          A list of title tuples, one per chain of parent collections leading
+          to the root collection. Chains which do not reach the root, for
+          example those of shared resources, are left out.
+        """
+        if resource_id == ROOT_COLLECTION_ID:
+            return [()]
+        paths = []
+        pending = [(resource_id, (self.titles.get(resource_id),),
+                    {resource_id})]
+        while pending:
+            current_id, path, seen = pending.pop()
+            for parent_id in self.parents.get(current_id, ()):
+                if parent_id == ROOT_COLLECTION_ID:
+                    paths.append(path)
+                elif parent_id not in seen and parent_id in self.titles:
+                    pending.append((parent_id,
+                                    (self.titles[parent_id],) + path,
+                                    seen | {parent_id}))
+        paths.sort()
+        return paths
+
+    GetPaths = get_paths
+
+    def get_path(self, resource_id):
+        """Returns the first path of a resource as a string, or None."""
+        paths = self.get_paths(resource_id)
+        if not paths:
+            return None
+        return '/' + '/'.join(paths[0])
+
+    GetPath = get_path
+
+    def resolve(self, path):
+        """Returns the IDs of the resources at a path.
+
+        Args:
+          path: str Titles separated by '/', starting at the root collection.
+
+        Returns:
+          A set of resource IDs, as titles are not unique in a collection.
+        """
+        current = {ROOT_COLLECTION_ID}
+        for title in path.strip('/').split('/'):
+            if not title:
+                continue
+            found = set()
+            for collection_id in current:
+                found.update(self._by_title.get((collection_id, title), ()))
+            if not found:
+                return set()
+            current = found
+        return current
+
+    Resolve = resolve
+
+    @staticmethod
+    def from_index(index):
+        """Builds a tree from every resource of a ResourceIndex."""
+        tree = CollectionTree()
+        for resource in index:
+            tree.add_resource(resource)
+        return tree
+
+    FromIndex = from_index
+
+    @staticmethod
+    def build(client, uri=None, page_size=DEFAULT_TREE_PAGE_SIZE, **kwargs):
+        """Builds a tree with one pass over the resource feed.
+
+        Args:
+          client: gdata.docs.client.DocsClient
+          uri: (optional) The resource feed to read, by default every
+              resource including collections.
+          page_size: int (optional) The number of resources per feed page.
+          kwargs: Other parameters to pass to client.get_resources().
+
+        Returns:
+          A CollectionTree.
+        """
+        tree = CollectionTree()
+        first_page = client.get_resources(
+            uri=uri or ALL_RESOURCES_URI, limit=page_size, show_root=True,
+            **kwargs)
+        pager = gdata.client.FeedPager(
+            client, first_page, desired_class=gdata.docs.data.ResourceFeed,
+            **kwargs)
+        for entry in pager.iter_entries():
+            tree.add_resource(IndexedResource.from_entry(entry))
+        return tree
+
+    Build = build
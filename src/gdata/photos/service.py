@@ -114,6 +114,23 @@ class GooglePhotosException(Exception):
         self.args = [self.error_code, self.reason, self.body]
 
 
+def _MediaSourceFromHandle(file_handle, content_type):
+    """Wraps an open file in a MediaSource without reading it into memory.
+
+    Regular files are sent from their current position, and only other
+    file-like objects, whose length is not known, are read in full.
+    """
+    name = os.path.basename(str(getattr(file_handle, 'name', 'image')))
+    try:
+        length = os.fstat(file_handle.fileno()).st_size - file_handle.tell()
+    except (AttributeError, OSError, ValueError, io.UnsupportedOperation):
+        # gdata.MediaSource needs the content length, so read the whole image
+        return gdata.MediaSource(file_handle.read(), content_type,
+                                 file_name=name)
+    return gdata.MediaSource(file_handle, content_type,
+                             content_length=length, file_name=name)
+
+
 class PhotosService(gdata.service.GDataService):
     ssl = True
     userUri = '/data/feed/api/user/%s'
@@ -395,13 +412,7 @@ class PhotosService(gdata.service.GDataService):
         elif hasattr(filename_or_handle, 'read'):  # it's a file-like resource
             if hasattr(filename_or_handle, 'seek'):
                 filename_or_handle.seek(0)  # rewind pointer to the start of the file
-            # gdata.MediaSource needs the content length, so read the whole image
-            file_handle = io.StringIO(filename_or_handle.read())
-            name = 'image'
-            if hasattr(filename_or_handle, 'name'):
-                name = filename_or_handle.name
-            mediasource = gdata.MediaSource(file_handle, content_type,
-                                            content_length=file_handle.len, file_name=name)
+            mediasource = _MediaSourceFromHandle(filename_or_handle, content_type)
         else:  # filename_or_handle is not valid
             raise GooglePhotosException({'status': GPHOTOS_INVALID_ARGUMENT,
                                          'body': '`filename_or_handle` must be a path name or a file-like object',
@@ -541,18 +552,12 @@ class PhotosService(gdata.service.GDataService):
 
         if isinstance(filename_or_handle, str) and \
                 os.path.exists(filename_or_handle):  # it's a file name
-            photoblob = gdata.MediaSource()
-            photoblob.setFile(filename_or_handle, content_type)
+            mediasource = gdata.MediaSource()
+            mediasource.setFile(filename_or_handle, content_type)
         elif hasattr(filename_or_handle, 'read'):  # it's a file-like resource
             if hasattr(filename_or_handle, 'seek'):
                 filename_or_handle.seek(0)  # rewind pointer to the start of the file
-            # gdata.MediaSource needs the content length, so read the whole image
-            file_handle = io.StringIO(filename_or_handle.read())
-            name = 'image'
-            if hasattr(filename_or_handle, 'name'):
-                name = filename_or_handle.name
-            mediasource = gdata.MediaSource(file_handle, content_type,
-                                            content_length=file_handle.len, file_name=name)
+            mediasource = _MediaSourceFromHandle(filename_or_handle, content_type)
         else:  # filename_or_handle is not valid
             raise GooglePhotosException({'status': GPHOTOS_INVALID_ARGUMENT,
                                          'body': '`filename_or_handle` must be a path name or a file-like object',
@@ -565,7 +570,7 @@ class PhotosService(gdata.service.GDataService):
         elif hasattr(photo_or_uri, 'GetEditMediaLink'):
             entry_uri = photo_or_uri.GetEditMediaLink().href
         try:
-            return self.Put(photoblob, entry_uri,
+            return self.Put(mediasource, entry_uri,
                             converter=gdata.photos.PhotoEntryFromString)
         except gdata.service.RequestError as e:
             raise GooglePhotosException(e.args[0])
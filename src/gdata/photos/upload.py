@@ -0,0 +1,572 @@
+#
+# Licensed under the Apache License 2.0;
+
+
+"""Uploads many photos to an album at once.
+
+PhotosService.InsertPhoto sends one photo per blocking call. An
+AlbumUploader takes a directory or any iterable of file names or
+UploadItems and keeps several uploads running, while a separate pool of
+threads reads ahead: it computes the checksum of each file and reads its
+EXIF metadata (camera, exposure, time taken and GPS position) from the
+JPEG header, so the upload threads only send data.
+
+Each photo is posted together with its entry, in one multipart request
+which carries the title, the tags, the EXIF tags, the time taken and the
+geo location. The file itself is streamed from disk.
+
+Uploads which fail with a server error or a network error are retried
+with exponential backoff. A photo carries its SHA-1 checksum in
+gphoto:checksum, so before retrying an upload whose outcome is unknown the
+album is searched for the checksum, and a photo which did arrive is not
+uploaded twice. An UploadManifest, saved as JSON, remembers the uploaded
+files so an interrupted import can be started again.
+
+Example Usage:
+service = gdata.photos.service.PhotosService()
+service.ClientLogin(username, password)
+album = service.InsertAlbum('Archive', 'Imported photos')
+uploader = gdata.photos.upload.AlbumUploader(
+    service, gdata.photos.upload.UploadManifest('archive.json'))
+stats = uploader.Upload(album, gdata.photos.upload.IterDirectory('photos'),
+                        progress=lambda item, result, stats: print(
+                            item.path, result, stats.Count('uploaded')))
+"""
+
+import concurrent.futures
+import datetime
+import hashlib
+import http.client
+import json
+import os
+import struct
+import threading
+import time
+
+import atom
+import gdata.client
+import gdata.exif
+import gdata.geo
+import gdata.media
+import gdata.photos
+import gdata.photos.service
+
+# Number of uploads running at the same time.
+DEFAULT_MAX_WORKERS = 4
+# Number of threads reading checksums and EXIF metadata ahead of uploads.
+DEFAULT_MAX_READERS = 2
+# Times an upload is retried after a server or network error.
+DEFAULT_MAX_RETRIES = 3
+# Seconds waited before the first retry, doubled for each later one.
+DEFAULT_BACKOFF = 1.0
+# Number of bytes read at once when computing checksums.
+CHUNK_SIZE = 64 * 1024
+# Photos per page when searching an album for an uploaded checksum.
+SEARCH_PAGE_SIZE = 1000
+
+UPLOADED = 'uploaded'
+SKIPPED = 'skipped'
+FOUND = 'found'
+FAILED = 'failed'
+
+# Statuses after which an upload may or may not have been stored.
+RETRY_STATUSES = (408, 429, 500, 502, 503, 504)
+
+CONTENT_TYPES = {'bmp': 'image/bmp', 'gif': 'image/gif',
+                 'jpeg': 'image/jpeg', 'jpg': 'image/jpeg',
+                 'png': 'image/png'}
+
+# TIFF field types and their sizes in bytes.
+_TYPE_SIZES = {1: 1, 2: 1, 3: 2, 4: 4, 5: 8, 7: 1, 9: 4, 10: 8}
+_EXIF_IFD_TAG = 0x8769
+_GPS_IFD_TAG = 0x8825
+_IFD0_TAGS = {0x010F: 'make', 0x0110: 'model'}
+_EXIF_TAGS = {0x829A: 'exposure', 0x829D: 'fstop', 0x8827: 'iso',
+              0x9003: 'time', 0x9206: 'distance', 0x9209: 'flash',
+              0x920A: 'focallength', 0xA420: 'imageUniqueID'}
+_EXIF_CLASSES = {'make': gdata.exif.Make, 'model': gdata.exif.Model,
+                 'exposure': gdata.exif.Exposure, 'fstop': gdata.exif.Fstop,
+                 'iso': gdata.exif.Iso, 'time': gdata.exif.Time,
+                 'distance': gdata.exif.Distance, 'flash': gdata.exif.Flash,
+                 'focallength': gdata.exif.Focallength,
+                 'imageUniqueID': gdata.exif.ImageUniqueID}
+
+
+def _ReadIfd(tiff, offset, byte_order):
+    """Returns the tag values of one TIFF image file directory."""
+    values = {}
+    (count,) = struct.unpack_from(byte_order + 'H', tiff, offset)
+    for index in range(count):
+        tag, field_type, value_count, value_offset = struct.unpack_from(
+            byte_order + 'HHII', tiff, offset + 2 + 12 * index)
+        size = _TYPE_SIZES.get(field_type)
+        if size is None:
+            continue
+        if size * value_count <= 4:
+            value_offset = offset + 2 + 12 * index + 8
+        if value_offset + size * value_count > len(tiff):
+            continue
+        if field_type == 2:
+            value = tiff[value_offset:value_offset + value_count]
+            value = value.split(b'\x00', 1)[0].decode('latin-1').strip()
+        elif field_type == 7:
+            value = tiff[value_offset:value_offset + value_count]
+        elif field_type in (5, 10):
+            code = byte_order + ('%d%s' % (2 * value_count,
+                                          'I' if field_type == 5 else 'i'))
+            numbers = struct.unpack_from(code, tiff, value_offset)
+            value = [numerator / denominator if denominator else 0.0
+                     for numerator, denominator in zip(numbers[::2],
+                                                       numbers[1::2])]
+        else:
+            code = {1: 'B', 3: 'H', 4: 'I', 9: 'i'}[field_type]
+            value = list(struct.unpack_from(
+                byte_order + '%d%s' % (value_count, code), tiff, value_offset))
+        if isinstance(value, list) and len(value) == 1:
+            value = value[0]
+        values[tag] = value
+    return values
+
+
+def _ParseTiff(tiff):
+    byte_order = {b'II': '<', b'MM': '>'}.get(tiff[:2])
+    if byte_order is None:
+        return {}
+    (offset,) = struct.unpack_from(byte_order + 'I', tiff, 4)
+    ifd0 = _ReadIfd(tiff, offset, byte_order)
+    fields = {}
+    for tag, name in _IFD0_TAGS.items():
+        if tag in ifd0:
+            fields[name] = ifd0[tag]
+    # The IFD pointers of a broken file can hold several values.
+    if isinstance(ifd0.get(_EXIF_IFD_TAG), int):
+        exif_ifd = _ReadIfd(tiff, ifd0[_EXIF_IFD_TAG], byte_order)
+        for tag, name in _EXIF_TAGS.items():
+            if tag in exif_ifd:
+                fields[name] = exif_ifd[tag]
+    if isinstance(ifd0.get(_GPS_IFD_TAG), int):
+        gps = _ReadIfd(tiff, ifd0[_GPS_IFD_TAG], byte_order)
+        for ref_tag, tag, name, negative in ((1, 2, 'latitude', 'S'),
+                                             (3, 4, 'longitude', 'W')):
+            if isinstance(gps.get(tag), list) and len(gps[tag]) == 3:
+                degrees, minutes, seconds = gps[tag]
+                value = degrees + minutes / 60.0 + seconds / 3600.0
+                if gps.get(ref_tag) == negative:
+                    value = -value
+                fields[name] = value
+    return fields
+
+
+def ReadExif(file_handle, timezone=datetime.timezone.utc):
+    """Reads the EXIF metadata of a JPEG file.
+
+    Only the segments before the image data are read.
+
+    Args:
+      file_handle: A binary file positioned at the start of the image.
+      timezone: datetime.tzinfo (optional) The zone of the camera clock.
+          EXIF stores the time a photo was taken without a zone, so it is
+          read as UTC unless another zone is given.
+
+    Returns:
+      A dict with some of the keys make, model, exposure, fstop, iso, time
+      (milliseconds since the epoch), distance, flash (bool),
+      focallength, imageUniqueID, latitude and longitude. Empty if the file
+      is not a JPEG or has no readable EXIF segment.
+    """
+    if file_handle.read(2) != b'\xff\xd8':
+        return {}
+    while True:
+        marker = file_handle.read(2)
+        if len(marker) < 2 or marker[0] != 0xFF or marker[1] in (0xD9, 0xDA):
+            return {}
+        length_bytes = file_handle.read(2)
+        if len(length_bytes) < 2:
+            return {}
+        (length,) = struct.unpack('>H', length_bytes)
+        if marker[1] != 0xE1:
+            file_handle.seek(length - 2, os.SEEK_CUR)
+            continue
+        segment = file_handle.read(length - 2)
+        if not segment.startswith(b'Exif\x00\x00'):
+            continue
+        try:
+            fields = _ParseTiff(segment[6:])
+        except (struct.error, TypeError, ValueError, IndexError):
+            return {}
+        if 'time' in fields:
+            try:
+                taken = datetime.datetime.strptime(fields['time'],
+                                                   '%Y:%m:%d %H:%M:%S')
+            except (TypeError, ValueError):
+                del fields['time']
+            else:
+                taken = taken.replace(tzinfo=timezone)
+                fields['time'] = int(taken.timestamp()) * 1000
+        if 'flash' in fields:
+            fields['flash'] = bool(fields['flash'] & 1)
+        if isinstance(fields.get('imageUniqueID'), bytes):
+            del fields['imageUniqueID']
+        return fields
+
+
+def BuildExifTags(fields):
+    """Returns a gdata.exif.Tags element holding the fields of ReadExif."""
+    tags = gdata.exif.Tags()
+    for name, element_class in _EXIF_CLASSES.items():
+        value = fields.get(name)
+        if value is None:
+            continue
+        if isinstance(value, bool):
+            value = value and 'true' or 'false'
+        setattr(tags, name, element_class(text=str(value)))
+    return tags
+
+
+def GetText(element):
+    """Returns the text of a parsed element as str, or None."""
+    if element is None or element.text is None:
+        return None
+    text = element.text
+    if isinstance(text, bytes):
+        text = text.decode('utf-8')
+    return text
+
+
+def IterDirectory(directory, recursive=True):
+    """Yields the paths of the supported images in a directory, sorted."""
+    for root, dirs, files in os.walk(directory):
+        dirs.sort()
+        for name in sorted(files):
+            extension = os.path.splitext(name)[1][1:].lower()
+            if extension in CONTENT_TYPES:
+                yield os.path.join(root, name)
+        if not recursive:
+            break
+
+
+class UploadItem(object):
+    """A file to upload, with the metadata to give it.
+
+    Attributes:
+      path: str The file.
+      title: str (optional) The photo title, by default the file name.
+      summary: str (optional) The photo description.
+      tags: list of str (optional) Keywords of the photo.
+      location: tuple (optional) The (latitude, longitude) of the photo, by
+          default the GPS position in its EXIF metadata.
+      content_type: str (optional) By default guessed from the extension.
+    """
+
+    def __init__(self, path, title=None, summary=None, tags=None,
+                 location=None, content_type=None):
+        self.path = path
+        self.title = title
+        self.summary = summary
+        self.tags = tags
+        self.location = location
+        self.content_type = content_type
+
+    def GetKey(self):
+        return os.path.abspath(self.path)
+
+    def GetContentType(self):
+        if self.content_type:
+            return self.content_type
+        extension = os.path.splitext(self.path)[1][1:].lower()
+        return CONTENT_TYPES.get(extension, 'image/jpeg')
+
+
+class PreparedUpload(object):
+    """An UploadItem read by the reader threads, ready to be sent.
+
+    Attributes:
+      item: UploadItem
+      entry: gdata.photos.PhotoEntry The metadata posted with the file.
+      checksum: str The SHA-1 of the file, also in entry.checksum.
+      size: int The file size in bytes.
+      mtime: float The modification time of the file.
+    """
+
+    def __init__(self, item, entry, checksum, size, mtime):
+        self.item = item
+        self.entry = entry
+        self.checksum = checksum
+        self.size = size
+        self.mtime = mtime
+
+
+class UploadManifest(object):
+    """The files uploaded by earlier runs, keyed by UploadItem.GetKey.
+
+    Each record holds the size, modification time and checksum of the file
+    and the id of the photo it became. The manifest is safe to use from
+    several threads.
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self.records = {}
+        if path is not None and os.path.exists(path):
+            with open(path) as manifest_file:
+                self.records = json.load(manifest_file)
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.records)
+
+    def Get(self, key):
+        """Returns the record dict for a key, or None."""
+        with self._lock:
+            return self.records.get(key)
+
+    def Record(self, key, size, mtime, checksum, photo_id):
+        with self._lock:
+            self.records[key] = {'size': size, 'mtime': mtime,
+                                 'checksum': checksum, 'id': photo_id}
+
+    def Save(self):
+        """Writes the manifest to its path, replacing the file atomically."""
+        if self.path is None:
+            return
+        with self._lock:
+            gdata.client.save_json(self.path, self.records)
+
+
+class UploadStats(object):
+    """What an AlbumUploader.Upload call did.
+
+    Attributes:
+      results: dict mapping each item's key to UPLOADED, SKIPPED, FOUND or
+          FAILED.
+      errors: dict mapping the keys of failed items to their exception.
+      bytes: int The number of bytes of the uploaded files.
+      retries: int The number of uploads sent again after an error.
+      elapsed: float Seconds spent in the call.
+    """
+
+    def __init__(self):
+        self.results = {}
+        self.errors = {}
+        self.bytes = 0
+        self.retries = 0
+        self.elapsed = 0.0
+
+    def Count(self, result):
+        """Returns the number of items which ended with the result."""
+        return sum(1 for value in self.results.values() if value == result)
+
+    @property
+    def throughput(self):
+        """Bytes uploaded per second."""
+        if not self.elapsed:
+            return 0.0
+        return self.bytes / self.elapsed
+
+
+# Errors which fail one upload without stopping the others.
+_UPLOAD_ERRORS = (gdata.photos.service.GooglePhotosException,
+                  http.client.HTTPException, OSError, ValueError)
+
+
+def _IsRetryable(error):
+    if isinstance(error, gdata.photos.service.GooglePhotosException):
+        return error.error_code in RETRY_STATUSES
+    return isinstance(error, (http.client.HTTPException, OSError))
+
+
+class AlbumUploader(object):
+    """Uploads files to an album concurrently."""
+
+    def __init__(self, service, manifest=None,
+                 max_workers=DEFAULT_MAX_WORKERS,
+                 max_readers=DEFAULT_MAX_READERS,
+                 max_retries=DEFAULT_MAX_RETRIES, backoff=DEFAULT_BACKOFF,
+                 sleep=time.sleep, timezone=datetime.timezone.utc):
+        """Creates an uploader.
+
+        Args:
+          service: gdata.photos.service.PhotosService used for every
+              request, from several threads.
+          manifest: UploadManifest (optional) Records earlier uploads, a new
+              in-memory manifest is used if None.
+          max_workers: int (optional) The number of concurrent uploads.
+          max_readers: int (optional) The number of threads reading files
+              ahead of the uploads.
+          max_retries: int (optional) Times a failed upload is sent again.
+          backoff: float (optional) Seconds to wait before the first retry.
+          sleep: (optional) function used to wait between retries.
+          timezone: datetime.tzinfo (optional) The zone of the camera clock,
+              see ReadExif.
+        """
+        self.service = service
+        if manifest is None:
+            manifest = UploadManifest()
+        self.manifest = manifest
+        self.max_workers = max_workers
+        self.max_readers = max_readers
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.sleep = sleep
+        self.timezone = timezone
+        self._lock = threading.Lock()
+
+    def Prepare(self, item):
+        """Reads the checksum and EXIF metadata of a file.
+
+        Returns:
+          A PreparedUpload, or None if the manifest shows the file was
+          uploaded already and has not changed since.
+        """
+        file_stat = os.stat(item.path)
+        record = self.manifest.Get(item.GetKey())
+        if (record is not None and record['size'] == file_stat.st_size
+                and record['mtime'] == file_stat.st_mtime):
+            return None
+        checksum = hashlib.sha1()
+        with open(item.path, 'rb') as image:
+            exif = {}
+            if item.GetContentType() == 'image/jpeg':
+                exif = ReadExif(image, self.timezone)
+                image.seek(0)
+            while True:
+                chunk = image.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                checksum.update(chunk)
+        entry = gdata.photos.PhotoEntry()
+        entry.title = atom.Title(
+            text=item.title or os.path.basename(item.path))
+        if item.summary:
+            entry.summary = atom.Summary(text=item.summary,
+                                         summary_type='text')
+        entry.checksum = gdata.photos.Checksum(text=checksum.hexdigest())
+        if item.tags:
+            entry.media.keywords = gdata.media.Keywords(
+                text=','.join(item.tags))
+        if exif:
+            entry.exif = BuildExifTags(exif)
+            if 'time' in exif:
+                entry.timestamp = gdata.photos.Timestamp(
+                    text=str(exif['time']))
+        location = item.location
+        if location is None and 'latitude' in exif and 'longitude' in exif:
+            location = (exif['latitude'], exif['longitude'])
+        if location is not None:
+            entry.geo = gdata.geo.Where()
+            entry.geo.set_location((float(location[0]),
+                                    float(location[1])))
+        return PreparedUpload(item, entry, checksum.hexdigest(),
+                              file_stat.st_size, file_stat.st_mtime)
+
+    def FindUploaded(self, album_uri, checksum):
+        """Returns the photo of the album with the checksum, or None."""
+        start_index = 1
+        while True:
+            feed = self.service.GetFeed(
+                '%s?kind=photo' % album_uri, limit=SEARCH_PAGE_SIZE,
+                start_index=start_index)
+            for photo in feed.entry:
+                if GetText(photo.checksum) == checksum:
+                    return photo
+            if len(feed.entry) < SEARCH_PAGE_SIZE:
+                return None
+            start_index += SEARCH_PAGE_SIZE
+
+    def _Record(self, prepared, photo):
+        self.manifest.Record(prepared.item.GetKey(), prepared.size,
+                             prepared.mtime, prepared.checksum,
+                             GetText(photo.id))
+
+    def UploadOne(self, album_uri, prepared, stats):
+        """Uploads a prepared file, retrying server and network errors.
+
+        Returns:
+          UPLOADED, or FOUND if a retry found the photo already stored.
+        """
+        item = prepared.item
+        for attempt in range(self.max_retries + 1):
+            if attempt:
+                with self._lock:
+                    stats.retries += 1
+                self.sleep(self.backoff * 2 ** (attempt - 1))
+                photo = self.FindUploaded(album_uri, prepared.checksum)
+                if photo is not None:
+                    self._Record(prepared, photo)
+                    return FOUND
+            with open(item.path, 'rb') as image:
+                try:
+                    photo = self.service.InsertPhoto(
+                        album_uri, prepared.entry, image,
+                        content_type=item.GetContentType())
+                except _UPLOAD_ERRORS as error:
+                    if (not _IsRetryable(error)
+                            or attempt == self.max_retries):
+                        raise
+                    continue
+            with self._lock:
+                stats.bytes += prepared.size
+            self._Record(prepared, photo)
+            return UPLOADED
+
+    def _Run(self, album_uri, item, read_future, stats):
+        """Returns an (item, result, error) tuple, error None on success."""
+        try:
+            prepared = read_future.result()
+            if prepared is None:
+                return item, SKIPPED, None
+            return item, self.UploadOne(album_uri, prepared, stats), None
+        except _UPLOAD_ERRORS as error:
+            return item, FAILED, error
+
+    def Upload(self, album_or_uri, items, progress=None):
+        """Uploads every item, several at a time.
+
+        A failed item does not stop the others, its error is kept in the
+        returned stats. The manifest is saved at the end, even if the run
+        is interrupted.
+
+        Args:
+          album_or_uri: gdata.photos.AlbumEntry or AlbumFeed, or the URI of
+              the album feed.
+          items: iterable of UploadItems or file names, for example
+              IterDirectory(path).
+          progress: (optional) function called as progress(item, result,
+              stats) after each item.
+
+        Returns:
+          An UploadStats.
+        """
+        if isinstance(album_or_uri, str):
+            album_uri = album_or_uri
+        else:
+            album_uri = album_or_uri.GetFeedLink().href
+        stats = UploadStats()
+        start = time.time()
+
+        def Collect(outcome):
+            item, result, error = outcome
+            key = item.GetKey()
+            stats.results[key] = result
+            if error is not None:
+                stats.errors[key] = error
+            stats.elapsed = time.time() - start
+            if progress is not None:
+                progress(item, result, stats)
+
+        try:
+            with concurrent.futures.ThreadPoolExecutor(
+                    max_workers=self.max_readers) as readers, \
+                    gdata.client.BoundedExecutor(self.max_workers,
+                                                 Collect) as uploaders:
+                # Files are read at most two uploads per thread ahead.
+                for item in items:
+                    if isinstance(item, str):
+                        item = UploadItem(item)
+                    read_future = readers.submit(self.Prepare, item)
+                    uploaders.submit(self._Run, album_uri, item, read_future,
+                                     stats)
+        finally:
+            stats.elapsed = time.time() - start
+            self.manifest.Save()
+        return stats
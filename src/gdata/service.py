@@ -49,6 +49,7 @@
 
 # __author__ = 'api.jscudder (Jeffrey Scudder)'
 
+import concurrent.futures
 import re
 import urllib.error
 import urllib.parse
@@ -300,20 +301,79 @@ class GDataService(atom.service.AtomService):
         yield link_finder
         next = link_finder.GetNextLink()
         while next is not None:
-            next_feed = func(str(self.GetWithRetries(
-                next.href, num_retries=num_retries, delay=delay, backoff=backoff)))
+            next_feed = self.GetWithRetries(
+                next.href, converter=func, num_retries=num_retries, delay=delay,
+                backoff=backoff)
             yield next_feed
             next = next_feed.GetNextLink()
 
+    def GetEntryGeneratorFromLinkFinder(self, link_finder, func,
+                                        num_retries=DEFAULT_NUM_RETRIES,
+                                        delay=DEFAULT_DELAY,
+                                        backoff=DEFAULT_BACKOFF,
+                                        prefetch=True):
+        """Returns a generator which yields the entries of every page of a feed.
+
+        Each page is parsed once, by func, straight from the server's response.
+        When prefetch is True the next page is requested in a background thread
+        while the entries of the current page are being consumed. No more than
+        two pages are referenced at any time, so the whole feed is never held
+        in memory.
+
+        Args:
+          link_finder: The first page of the feed, an atom.Feed (or subclass)
+              which has already been retrieved.
+          func: function which converts the XML of a page into a feed object,
+              for example gdata.apps.UserFeedFromString.
+          num_retries: Integer; the retry count for each page.
+          delay: Integer; the initial delay for retrying.
+          backoff: Integer; how much the delay should lengthen after each
+              failure.
+          prefetch: boolean (optional) If False, each page is requested only
+              once all entries of the previous page have been consumed.
+
+        Yields:
+          The entries of each page, in feed order.
+        """
+        executor = None
+        if prefetch:
+            executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        page = link_finder
+        link_finder = None
+        pending = None
+        try:
+            while page is not None:
+                next_link = page.GetNextLink()
+                pending = None
+                if next_link is not None and executor is not None:
+                    pending = executor.submit(
+                        self.GetWithRetries, next_link.href, converter=func,
+                        num_retries=num_retries, delay=delay, backoff=backoff)
+                for entry in page.entry:
+                    yield entry
+                page = None
+                if pending is not None:
+                    page = pending.result()
+                elif next_link is not None:
+                    page = self.GetWithRetries(
+                        next_link.href, converter=func, num_retries=num_retries,
+                        delay=delay, backoff=backoff)
+        finally:
+            if executor is not None:
+                # A consumer which stops early leaves the prefetch of the
+                # next page behind: cancel it, or wait for it to finish.
+                if pending is not None:
+                    pending.cancel()
+                executor.shutdown(wait=True)
+
     def _GetElementGeneratorFromLinkFinder(self, link_finder, func,
                                            num_retries=DEFAULT_NUM_RETRIES,
                                            delay=DEFAULT_DELAY,
                                            backoff=DEFAULT_BACKOFF):
-        for element in self.GetGeneratorFromLinkFinder(link_finder, func,
-                                                       num_retries=num_retries,
-                                                       delay=delay,
-                                                       backoff=backoff).entry:
-            yield element
+        """Deprecated, use GetEntryGeneratorFromLinkFinder instead."""
+        return self.GetEntryGeneratorFromLinkFinder(
+            link_finder, func, num_retries=num_retries, delay=delay,
+            backoff=backoff)
 
     def GetOAuthInputParameters(self):
         return self._oauth_input_params
@@ -982,7 +1042,7 @@ class GDataService(atom.service.AtomService):
             except RequestError as e:
                 # Error 500 is 'internal server error' and warrants a retry
                 # Error 503 is 'service unavailable' and warrants a retry
-                if e[0]['status'] not in [500, 503]:
+                if e.args[0]['status'] not in [500, 503]:
                     raise e
                     # Else, fall through to the retry code...
             except Exception as e:
@@ -1268,6 +1328,9 @@ class GDataService(atom.service.AtomService):
                 data_str = ElementTree.tostring(data)
             else:
                 data_str = str(data)
+            # Sent as UTF-8, so non-ASCII text takes more than one byte.
+            data_length = len(data_str if isinstance(data_str, bytes)
+                              else data_str.encode('utf-8'))
 
             multipart = ['Media multipart posting\r\n--END_OF_PART\r\n' + \
                          'Content-Type: application/atom+xml\r\n\r\n', '\r\n--END_OF_PART\r\nContent-Type: ' + \
@@ -1276,7 +1339,7 @@ class GDataService(atom.service.AtomService):
             extra_headers['MIME-version'] = '1.0'
             extra_headers['Content-Length'] = str(len(multipart[0]) +
                                                   len(multipart[1]) + len(multipart[2]) +
-                                                  len(data_str) + media_source.content_length)
+                                                  data_length + media_source.content_length)
 
             extra_headers['Content-Type'] = 'multipart/related; boundary=END_OF_PART'
             server_response = self.request(verb, uri,
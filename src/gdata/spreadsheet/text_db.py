@@ -5,7 +5,12 @@
 
 
 
+import bisect
+import concurrent.futures
 import io
+import re
+import threading
+import time
 
 import gdata
 import gdata.docs
@@ -54,10 +59,24 @@ The intended use case is to allow easy storage of text data in a spreadsheet.
   Table: Represents a worksheet and interacts with records.
   RecordResultSet: A list of records in a table.
   Record: Represents a row in a worksheet allows manipulation of text data.
+  UnitOfWork: Collects changes to tables and sends them together.
+  TableReplica: A local, indexed copy of a table's rows used to answer
+      FindRecords and GetRecords without contacting the server.
+
+# Collect changes and send them together when the block ends.
+with database.BeginWork() as work:
+  table.SetFields(['name', 'email'])
+  for person in people:
+    table.AddRecord(person)
+  record.content['email'] = 'bob3@example.com'
+  record.Push()
 """
 
 # __author__ = 'api.jscudder (Jeffrey Scudder)'
 
+GD_ETAG = '{http://schemas.google.com/g/2005}etag'
+NOT_MODIFIED = 304
+
 
 class Error(Exception):
     pass
@@ -71,6 +90,10 @@ class CaptchaRequired(Error):
     pass
 
 
+class QueryError(Error):
+    pass
+
+
 class DatabaseClient(object):
     """Allows creation and finding of Google Spreadsheets databases.
 
@@ -193,6 +216,25 @@ class Database(object):
             id_parts = spreadsheet_entry.id.text.split('/')
             self.spreadsheet_key = id_parts[-1].replace('spreadsheet%3A', '')
         self.client = database_client
+        self.unit_of_work = None
+
+    def BeginWork(self, max_workers=4):
+        """Starts collecting changes to the tables of this database.
+
+        Until the returned UnitOfWork is flushed, header changes, new records
+        and pushed records of tables which belong to this database are only
+        recorded locally. Use the unit of work in a with statement to flush
+        it when the block ends.
+
+        Args:
+          max_workers: int (optional) The most list feed requests sent at once
+              when the work is flushed.
+
+        Returns:
+          The UnitOfWork which is now active for this database.
+        """
+        self.unit_of_work = UnitOfWork(owner=self, max_workers=max_workers)
+        return self.unit_of_work
 
     def CreateTable(self, name, fields=None):
         """Add a new worksheet to this spreadsheet and fill in column names.
@@ -212,7 +254,8 @@ class Database(object):
                                                                       row_count=1, col_count=len(fields), key=self.spreadsheet_key)
         return Table(name=name, worksheet_entry=worksheet,
                      database_client=self.client,
-                     spreadsheet_key=self.spreadsheet_key, fields=fields)
+                     spreadsheet_key=self.spreadsheet_key, fields=fields,
+                     database=self)
 
     def GetTables(self, worksheet_id=None, name=None):
         """Searches for a worksheet with the specified ID or name.
@@ -233,7 +276,7 @@ class Database(object):
                 self.spreadsheet_key, wksht_id=worksheet_id)
             return [Table(name=worksheet_entry.title.text,
                           worksheet_entry=worksheet_entry, database_client=self.client,
-                          spreadsheet_key=self.spreadsheet_key)]
+                          spreadsheet_key=self.spreadsheet_key, database=self)]
         else:
             matching_tables = []
             query = None
@@ -246,7 +289,8 @@ class Database(object):
             for entry in worksheet_feed.entry:
                 matching_tables.append(Table(name=entry.title.text,
                                              worksheet_entry=entry, database_client=self.client,
-                                             spreadsheet_key=self.spreadsheet_key))
+                                             spreadsheet_key=self.spreadsheet_key,
+                                             database=self))
             return matching_tables
 
     def Delete(self):
@@ -259,17 +303,64 @@ class Database(object):
 
 class Table(object):
     def __init__(self, name=None, worksheet_entry=None, database_client=None,
-                 spreadsheet_key=None, fields=None):
+                 spreadsheet_key=None, fields=None, database=None):
         self.name = name
         self.entry = worksheet_entry
         id_parts = worksheet_entry.id.text.split('/')
         self.worksheet_id = id_parts[-1]
         self.spreadsheet_key = spreadsheet_key
         self.client = database_client
+        self.database = database
+        self.unit_of_work = None
+        self.replica = None
+        # Row entries as last seen on the server, keyed by row ID.
+        self.row_cache = {}
         self.fields = fields or []
         if fields:
             self.SetFields(fields)
 
+    def BeginWork(self, max_workers=4):
+        """Starts collecting changes to this table, see Database.BeginWork."""
+        self.unit_of_work = UnitOfWork(owner=self, max_workers=max_workers)
+        return self.unit_of_work
+
+    def EnableReplica(self, refresh_interval=None):
+        """Keeps a local copy of the rows to answer queries from.
+
+        All rows are loaded once. Afterwards FindRecords and GetRecords are
+        evaluated against the local copy, and rows written or read through
+        this table update it. Changes made by other clients are picked up by
+        TableReplica.Refresh, which is called automatically before a query
+        once refresh_interval seconds have passed.
+
+        Args:
+          refresh_interval: int or float (optional) Seconds after which the
+              replica is refreshed before answering a query. If None, the
+              replica is only refreshed when Refresh is called.
+
+        Returns:
+          The TableReplica.
+        """
+        self.replica = TableReplica(self, refresh_interval=refresh_interval)
+        self.replica.Refresh(full=True)
+        return self.replica
+
+    def DisableReplica(self):
+        """Drops the local copy, queries go to the server again."""
+        self.replica = None
+
+    def _LocalResults(self, entries):
+        feed = gdata.spreadsheet.SpreadsheetsListFeed(entry=entries)
+        return RecordResultSet(feed, self.client, self.spreadsheet_key,
+                               self.worksheet_id, table=self, cache_rows=False)
+
+    def _GetUnitOfWork(self):
+        if self.unit_of_work is not None:
+            return self.unit_of_work
+        if self.database is not None:
+            return self.database.unit_of_work
+        return None
+
     def LookupFields(self):
         """Queries to find the column names in the first row of the worksheet.
 
@@ -309,12 +400,72 @@ class Table(object):
         # TODO: If the table already had fields, we might want to clear out the,
         # current column headers.
         self.fields = fields
-        i = 0
-        for column_name in fields:
-            i = i + 1
-            # TODO: speed this up by using a batch request to update cells.
-            self.client._GetSpreadsheetsClient().UpdateCell(1, i, column_name,
-                                                            self.spreadsheet_key, self.worksheet_id)
+        work = self._GetUnitOfWork()
+        if work is not None:
+            work.SetFields(self)
+        else:
+            self._WriteFields()
+
+    def _WriteFields(self):
+        """Writes the fields to the first row with a single cell batch."""
+        spreadsheets_client = self.client._GetSpreadsheetsClient()
+        query = gdata.spreadsheet.service.CellQuery()
+        query.min_row = '1'
+        query.max_row = '1'
+        query.min_col = '1'
+        query.max_col = str(len(self.fields))
+        query.return_empty = 'true'
+        cells = spreadsheets_client.GetCellsFeed(
+            self.spreadsheet_key, wksht_id=self.worksheet_id, query=query)
+        batch = gdata.spreadsheet.SpreadsheetsCellsFeed()
+        for entry in cells.entry:
+            col = int(entry.cell.col)
+            if col <= len(self.fields):
+                entry.cell.inputValue = self.fields[col - 1]
+                batch.AddUpdate(entry)
+        batch_link = cells.GetBatchLink()
+        result = spreadsheets_client.ExecuteBatch(
+            batch, url=batch_link and batch_link.href,
+            spreadsheet_key=self.spreadsheet_key, worksheet_id=self.worksheet_id)
+        for entry in result.entry:
+            if entry.batch_status is not None and (
+                    int(entry.batch_status.code) >= 300):
+                raise Error('Unable to set the field in column %s: %s' % (
+                    entry.cell and entry.cell.col, entry.batch_status.reason))
+
+    def _GetRowEntry(self, row_id):
+        """Fetches a row, reusing the cached entry if it has not changed.
+
+        A cached entry with an ETag is validated with a conditional request,
+        the server only sends the row again if it was modified.
+        """
+        spreadsheets_client = self.client._GetSpreadsheetsClient()
+        cached = self.row_cache.get(row_id)
+        etag = cached is not None and GetEtag(cached)
+        if not etag:
+            row_entry = spreadsheets_client.GetListFeed(
+                self.spreadsheet_key, wksht_id=self.worksheet_id, row_id=row_id)
+        else:
+            uri = ('https://%s/feeds/list/%s/%s/private/full/%s' % (
+                spreadsheets_client.server, self.spreadsheet_key,
+                self.worksheet_id, row_id))
+            try:
+                row_entry = spreadsheets_client.Get(
+                    uri, extra_headers={'If-None-Match': etag},
+                    converter=gdata.spreadsheet.SpreadsheetsListFromString)
+            except gdata.service.RequestError as e:
+                if e.args[0]['status'] != NOT_MODIFIED:
+                    raise
+                return cached
+        self._CacheRow(row_entry)
+        return row_entry
+
+    def _CacheRow(self, row_entry):
+        if row_entry is not None and row_entry.id is not None:
+            row_id = row_entry.id.text.split('/')[-1]
+            self.row_cache[row_id] = row_entry
+            if self.replica is not None:
+                self.replica.Update(row_id, row_entry)
 
     def Delete(self):
         """Deletes this worksheet from the spreadsheet."""
@@ -330,13 +481,23 @@ class Table(object):
           data: dict of strings Mapping of string values to column names.
 
         Returns:
-          Record which represents this row of the spreadsheet.
+          Record which represents this row of the spreadsheet. If a unit of
+          work is active, the row is only inserted when the work is flushed
+          and the record's row_id is None until then.
         """
+        work = self._GetUnitOfWork()
+        if work is not None:
+            record = Record(content=data, spreadsheet_key=self.spreadsheet_key,
+                            worksheet_id=self.worksheet_id,
+                            database_client=self.client, table=self)
+            work.AddRecord(record)
+            return record
         new_row = self.client._GetSpreadsheetsClient().InsertRow(data,
                                                                  self.spreadsheet_key, wksht_id=self.worksheet_id)
+        self._CacheRow(new_row)
         return Record(content=data, row_entry=new_row,
                       spreadsheet_key=self.spreadsheet_key, worksheet_id=self.worksheet_id,
-                      database_client=self.client)
+                      database_client=self.client, table=self)
 
     def GetRecord(self, row_id=None, row_number=None):
         """Gets a single record from the worksheet based on row ID or number.
@@ -351,11 +512,11 @@ class Table(object):
           Record for the desired row.
         """
         if row_id:
-            row_entry = self.client._GetSpreadsheetsClient().GetListFeed(
-                self.spreadsheet_key, wksht_id=self.worksheet_id, row_id=row_id)
+            row_entry = self._GetRowEntry(row_id)
             return Record(content=None, row_entry=row_entry,
                           spreadsheet_key=self.spreadsheet_key,
-                          worksheet_id=self.worksheet_id, database_client=self.client)
+                          worksheet_id=self.worksheet_id, database_client=self.client,
+                          table=self)
         else:
             row_query = gdata.spreadsheet.service.ListQuery()
             row_query.start_index = str(row_number)
@@ -363,9 +524,11 @@ class Table(object):
             row_feed = self.client._GetSpreadsheetsClient().GetListFeed(
                 self.spreadsheet_key, wksht_id=self.worksheet_id, query=row_query)
             if len(row_feed.entry) >= 1:
+                self._CacheRow(row_feed.entry[0])
                 return Record(content=None, row_entry=row_feed.entry[0],
                               spreadsheet_key=self.spreadsheet_key,
-                              worksheet_id=self.worksheet_id, database_client=self.client)
+                              worksheet_id=self.worksheet_id, database_client=self.client,
+                              table=self)
             else:
                 return None
 
@@ -381,6 +544,8 @@ class Table(object):
         """
         start_row = int(start_row)
         end_row = int(end_row)
+        if self.replica is not None:
+            return self._LocalResults(self.replica.GetRows(start_row, end_row))
         max_rows = end_row - start_row + 1
         row_query = gdata.spreadsheet.service.ListQuery()
         row_query.start_index = str(start_row)
@@ -388,7 +553,7 @@ class Table(object):
         rows_feed = self.client._GetSpreadsheetsClient().GetListFeed(
             self.spreadsheet_key, wksht_id=self.worksheet_id, query=row_query)
         return RecordResultSet(rows_feed, self.client, self.spreadsheet_key,
-                               self.worksheet_id)
+                               self.worksheet_id, table=self)
 
     def FindRecords(self, query_string):
         """Performs a query against the worksheet to find rows which match.
@@ -401,14 +566,17 @@ class Table(object):
               in the name column, '(cost < 19.50 and name != toy) or cost > 500'
 
         Returns:
-          RecordResultSet with the first group of matches.
+          RecordResultSet with the first group of matches. If the table has a
+          replica, all matches are found locally and returned at once.
         """
+        if self.replica is not None:
+            return self._LocalResults(self.replica.Find(query_string))
         row_query = gdata.spreadsheet.service.ListQuery()
         row_query.sq = query_string
         matching_feed = self.client._GetSpreadsheetsClient().GetListFeed(
             self.spreadsheet_key, wksht_id=self.worksheet_id, query=row_query)
         return RecordResultSet(matching_feed, self.client,
-                               self.spreadsheet_key, self.worksheet_id)
+                               self.spreadsheet_key, self.worksheet_id, table=self)
 
 
 class RecordResultSet(list):
@@ -420,16 +588,20 @@ class RecordResultSet(list):
     calling GetNext().
     """
 
-    def __init__(self, feed, client, spreadsheet_key, worksheet_id):
+    def __init__(self, feed, client, spreadsheet_key, worksheet_id,
+                 table=None, cache_rows=True):
         self.client = client
         self.spreadsheet_key = spreadsheet_key
         self.worksheet_id = worksheet_id
         self.feed = feed
+        self.table = table
         list(self)
         for entry in self.feed.entry:
+            if table is not None and cache_rows:
+                table._CacheRow(entry)
             self.append(Record(content=None, row_entry=entry,
                                spreadsheet_key=spreadsheet_key, worksheet_id=worksheet_id,
-                               database_client=client))
+                               database_client=client, table=table))
 
     def GetNext(self):
         """Fetches the next batch of rows in the result set.
@@ -442,7 +614,7 @@ class RecordResultSet(list):
             new_feed = self.client._GetSpreadsheetsClient().Get(next_link.href,
                                                                 converter=gdata.spreadsheet.SpreadsheetsListFeedFromString)
             return RecordResultSet(new_feed, self.client, self.spreadsheet_key,
-                                   self.worksheet_id)
+                                   self.worksheet_id, table=self.table)
 
 
 class Record(object):
@@ -454,7 +626,7 @@ class Record(object):
     """
 
     def __init__(self, content=None, row_entry=None, spreadsheet_key=None,
-                 worksheet_id=None, database_client=None):
+                 worksheet_id=None, database_client=None, table=None):
         """Constructor for a record.
 
         Args:
@@ -466,8 +638,11 @@ class Record(object):
           worksheet_id: str The ID of the worksheet in which this row belongs.
           database_client: DatabaseClient The client which can be used to talk
               the Google Spreadsheets server to edit this row.
+          table: Table (optional) The table this row belongs to. The table's
+              row cache and unit of work are used if it is given.
         """
         self.entry = row_entry
+        self.table = table
         self.spreadsheet_key = spreadsheet_key
         self.worksheet_id = worksheet_id
         if row_entry:
@@ -501,22 +676,590 @@ class Record(object):
         removed from the content may remain in the row. The content member
         of the record will not be modified so additional fields in the row
         might be absent from this local copy.
+
+        If the record's table has an active unit of work, the row is only
+        sent when the work is flushed.
         """
-        self.entry = self.client._GetSpreadsheetsClient().UpdateRow(self.entry, self.content)
+        work = self.table is not None and self.table._GetUnitOfWork()
+        if work:
+            work.UpdateRecord(self)
+        else:
+            self._Update()
+
+    def _Insert(self):
+        self.entry = self.client._GetSpreadsheetsClient().InsertRow(
+            self.content, self.spreadsheet_key, wksht_id=self.worksheet_id)
+        self.row_id = self.entry.id.text.split('/')[-1]
+        if self.table is not None:
+            self.table._CacheRow(self.entry)
+
+    def _Update(self):
+        try:
+            self.entry = self.client._GetSpreadsheetsClient().UpdateRow(
+                self.entry, self.content)
+        except Exception:
+            # UpdateRow changes the entry in place, it no longer matches the
+            # server's copy.
+            if self.table is not None:
+                self.table.row_cache.pop(self.row_id, None)
+            raise
+        if self.table is not None:
+            self.table._CacheRow(self.entry)
 
     def Pull(self):
         """Query Google Spreadsheets to get the latest data from the server.
 
         Fetches the entry for this row and repopulates the content dictionary
-        with the data found in the row.
+        with the data found in the row. If the row is cached by the record's
+        table and has not changed on the server, the cached entry is used.
         """
         if self.row_id:
-            self.entry = self.client._GetSpreadsheetsClient().GetListFeed(
-                self.spreadsheet_key, wksht_id=self.worksheet_id, row_id=self.row_id)
+            if self.table is not None:
+                self.entry = self.table._GetRowEntry(self.row_id)
+            else:
+                self.entry = self.client._GetSpreadsheetsClient().GetListFeed(
+                    self.spreadsheet_key, wksht_id=self.worksheet_id, row_id=self.row_id)
         self.ExtractContentFromEntry(self.entry)
 
     def Delete(self):
         self.client._GetSpreadsheetsClient().DeleteRow(self.entry)
+        if self.table is not None:
+            self.table.row_cache.pop(self.row_id, None)
+            if self.table.replica is not None:
+                self.table.replica.Remove(self.row_id)
+
+
+class UnitOfWork(object):
+    """Collects changes to tables so that they can be sent together.
+
+    While a unit of work is active for a Database or a Table, Table.SetFields,
+    Table.AddRecord and Record.Push only record the change. Flush writes each
+    changed header row with one cell batch request, then sends the new rows
+    in the order they were added while updated rows are sent concurrently.
+
+    A unit of work used in a with statement is flushed when the block ends
+    without an exception, and stops collecting changes either way.
+    """
+
+    def __init__(self, owner=None, max_workers=4):
+        """Constructor for a unit of work.
+
+        Args:
+          owner: Database or Table (optional) The object whose unit_of_work
+              this is. It is cleared when the with statement ends.
+          max_workers: int (optional) The most list feed requests in flight.
+        """
+        self.owner = owner
+        self.max_workers = max_workers
+        self.field_changes = []
+        self.inserts = []
+        self.updates = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        try:
+            if exc_type is None:
+                self.Flush()
+        finally:
+            if self.owner is not None and self.owner.unit_of_work is self:
+                self.owner.unit_of_work = None
+
+    def SetFields(self, table):
+        """Records that the header row of the table has to be written."""
+        if table not in self.field_changes:
+            self.field_changes.append(table)
+
+    def AddRecord(self, record):
+        """Records a new row which has to be inserted."""
+        self.inserts.append(record)
+
+    def UpdateRecord(self, record):
+        """Records a row whose content has to be sent.
+
+        Rows which are still waiting to be inserted are sent with their
+        current content anyway, so they are not queued twice.
+        """
+        if record.entry is None:
+            if record not in self.inserts:
+                self.inserts.append(record)
+        elif record not in self.updates:
+            self.updates.append(record)
+
+    def Flush(self):
+        """Sends all of the collected changes to the server.
+
+        Changes which fail are kept so that a later Flush retries them, the
+        first error is raised once all other changes have been sent.
+        """
+        field_changes, self.field_changes = self.field_changes, []
+        inserts, self.inserts = self.inserts, []
+        updates, self.updates = self.updates, []
+        errors = []
+        for table in field_changes:
+            try:
+                table._WriteFields()
+            except Exception as e:
+                self.field_changes.append(table)
+                errors.append(e)
+        if errors:
+            # The rows depend on the header, so wait until it has been written.
+            self.inserts.extend(inserts)
+            self.updates.extend(updates)
+            raise errors[0]
+
+        def InsertInOrder():
+            for index, record in enumerate(inserts):
+                try:
+                    record._Insert()
+                except Exception:
+                    self.inserts.extend(inserts[index:])
+                    raise
+
+        with concurrent.futures.ThreadPoolExecutor(self.max_workers) as executor:
+            futures = []
+            if inserts:
+                futures.append((None, executor.submit(InsertInOrder)))
+            for record in updates:
+                futures.append((record, executor.submit(record._Update)))
+            for record, future in futures:
+                error = future.exception()
+                if error is not None:
+                    if record is not None:
+                        self.updates.append(record)
+                    errors.append(error)
+        if errors:
+            raise errors[0]
+
+
+class TableReplica(object):
+    """A local copy of the rows in a table, indexed for structured queries.
+
+    Rows are kept in worksheet order. Per column indexes are built the first
+    time a column is queried and patched when a row changes: a hash index
+    answers equality tests and a sorted index answers range tests.
+
+    Comparisons follow CompareValues: two values are compared
+    as numbers if both are numbers and as text otherwise. Empty and missing
+    values are the empty string.
+    """
+
+    def __init__(self, table, refresh_interval=None):
+        self.table = table
+        self.refresh_interval = refresh_interval
+        self.row_ids = []
+        self.entries = {}
+        self.content = {}
+        self.columns = set()
+        # The feed's updated time of the last refresh, used as updated-min.
+        self.updated = None
+        self.refreshed_at = None
+        self._positions = None
+        self._hash_indexes = {}
+        self._sorted_indexes = {}
+        self._lock = threading.RLock()
+
+    def Refresh(self, full=False):
+        """Fetches the rows which changed since the last refresh.
+
+        Only rows updated since the previous refresh are fetched. Since the
+        server does not report deleted rows, the number of rows on the server
+        is checked afterwards and all rows are loaded again if it differs.
+
+        Args:
+          full: bool (optional) If True, all rows are loaded again.
+        """
+        spreadsheets_client = self.table.client._GetSpreadsheetsClient()
+        incremental = not full and self.updated is not None
+        query = gdata.spreadsheet.service.ListQuery()
+        if incremental:
+            query.updated_min = self.updated
+        feed = spreadsheets_client.GetListFeed(
+            self.table.spreadsheet_key, wksht_id=self.table.worksheet_id,
+            query=query)
+        with self._lock:
+            if not incremental:
+                self.row_ids = []
+                self.entries = {}
+                self.content = {}
+                self.columns = set()
+                self._Invalidate()
+            if feed.updated is not None:
+                self.updated = feed.updated.text
+            while feed is not None:
+                for entry in feed.entry:
+                    self.table.row_cache[RowIdFromEntry(entry)] = entry
+                    self.Update(RowIdFromEntry(entry), entry)
+                next_link = feed.GetNextLink()
+                feed = None
+                if next_link is not None and next_link.href:
+                    feed = spreadsheets_client.Get(
+                        next_link.href,
+                        converter=gdata.spreadsheet.SpreadsheetsListFeedFromString)
+            self.refreshed_at = time.time()
+        if incremental:
+            count_query = gdata.spreadsheet.service.ListQuery()
+            count_query.max_results = '1'
+            count_feed = spreadsheets_client.GetListFeed(
+                self.table.spreadsheet_key, wksht_id=self.table.worksheet_id,
+                query=count_query)
+            if (count_feed.total_results is not None
+                    and int(count_feed.total_results.text) != len(self.row_ids)):
+                self.Refresh(full=True)
+
+    def _RefreshIfStale(self):
+        if (self.refresh_interval is not None and
+                time.time() - self.refreshed_at >= self.refresh_interval):
+            self.Refresh()
+
+    def Update(self, row_id, entry):
+        """Stores the current version of a row, appending it if it is new."""
+        with self._lock:
+            if row_id not in self.entries:
+                self.row_ids.append(row_id)
+                if self._positions is not None:
+                    self._positions[row_id] = len(self.row_ids) - 1
+            else:
+                self._Unindex(row_id, self.content[row_id])
+            self.entries[row_id] = entry
+            content = {}
+            for label, custom in entry.custom.items():
+                content[label] = custom.text or ''
+            self.content[row_id] = content
+            self.columns.update(content)
+            self._Index(row_id, content)
+
+    def _Index(self, row_id, content):
+        for column, index in self._hash_indexes.items():
+            key = _ValueKey(content.get(column, ''))
+            index.setdefault(key, []).append(row_id)
+        for column, index in self._sorted_indexes.items():
+            number_keys, number_ids, text_keys, text_ids, numbers = index
+            value = content.get(column, '')
+            number = _ToNumber(value)
+            if number is not None:
+                position = bisect.bisect_right(number_keys, number)
+                number_keys.insert(position, number)
+                number_ids.insert(position, row_id)
+                numbers.add(row_id)
+            position = bisect.bisect_right(text_keys, value)
+            text_keys.insert(position, value)
+            text_ids.insert(position, row_id)
+
+    def _Unindex(self, row_id, content):
+        for column, index in self._hash_indexes.items():
+            key = _ValueKey(content.get(column, ''))
+            row_ids = index.get(key)
+            if row_ids is not None and row_id in row_ids:
+                row_ids.remove(row_id)
+                if not row_ids:
+                    del index[key]
+        for column, index in self._sorted_indexes.items():
+            number_keys, number_ids, text_keys, text_ids, numbers = index
+            value = content.get(column, '')
+            if row_id in numbers:
+                _RemoveSorted(number_keys, number_ids, _ToNumber(value), row_id)
+                numbers.discard(row_id)
+            _RemoveSorted(text_keys, text_ids, value, row_id)
+
+    def Remove(self, row_id):
+        """Drops a row which was deleted."""
+        with self._lock:
+            if row_id in self.entries:
+                self._Unindex(row_id, self.content[row_id])
+                self.row_ids.remove(row_id)
+                del self.entries[row_id]
+                del self.content[row_id]
+                self._positions = None
+
+    def _Invalidate(self):
+        self._positions = None
+        self._hash_indexes = {}
+        self._sorted_indexes = {}
+
+    def GetRows(self, start_row, end_row):
+        """Returns the entries of the rows from start_row to end_row inclusive.
+
+        Row numbers start at 1 with the first row after the header.
+        """
+        self._RefreshIfStale()
+        with self._lock:
+            return [self.entries[row_id]
+                    for row_id in self.row_ids[max(start_row, 1) - 1:end_row]]
+
+    def Find(self, query_string):
+        """Returns the entries of the rows matching a structured query.
+
+        Args:
+          query_string: str A query in the syntax of the list feed's sq
+              parameter, for example '(cost < 19.50 and name != toy)'.
+
+        Returns:
+          A list of entries in worksheet order.
+        """
+        self._RefreshIfStale()
+        with self._lock:
+            tree = ParseStructuredQuery(query_string, self.columns)
+            if self._positions is None:
+                self._positions = dict(
+                    (row_id, index) for index, row_id in enumerate(self.row_ids))
+            matches = self._Evaluate(tree)
+            return [self.entries[row_id]
+                    for row_id in sorted(matches, key=self._positions.get)]
+
+    def _Evaluate(self, tree):
+        if tree[0] == 'and':
+            return self._Evaluate(tree[1]) & self._Evaluate(tree[2])
+        elif tree[0] == 'or':
+            return self._Evaluate(tree[1]) | self._Evaluate(tree[2])
+        _, operator, left, right = tree
+        if left[0] == 'literal' and right[0] == 'column':
+            operator = _FLIPPED_OPERATORS[operator]
+            left, right = right, left
+        if left[0] == 'column' and right[0] == 'literal':
+            return self._Lookup(left[1], operator, right[1])
+        return set(row_id for row_id in self.row_ids
+                   if CompareValues(operator,
+                                    self._Operand(row_id, left),
+                                    self._Operand(row_id, right)))
+
+    def _Operand(self, row_id, operand):
+        if operand[0] == 'column':
+            return self.content[row_id].get(operand[1], '')
+        return operand[1]
+
+    def _Lookup(self, column, operator, literal):
+        if operator in ('=', '=='):
+            return set(self._HashIndex(column).get(_ValueKey(literal), ()))
+        elif operator in ('!=', '<>'):
+            return set(self.row_ids) - self._Lookup(column, '==', literal)
+        number_keys, number_ids, text_keys, text_ids, numbers = (
+            self._SortedIndex(column))
+        number = _ToNumber(literal)
+        if number is not None:
+            matches = set(_Range(number_keys, number_ids, operator, number))
+            matches.update(row_id for row_id in
+                           _Range(text_keys, text_ids, operator, literal)
+                           if row_id not in numbers)
+            return matches
+        return set(_Range(text_keys, text_ids, operator, literal))
+
+    def _HashIndex(self, column):
+        index = self._hash_indexes.get(column)
+        if index is None:
+            index = {}
+            for row_id in self.row_ids:
+                key = _ValueKey(self.content[row_id].get(column, ''))
+                index.setdefault(key, []).append(row_id)
+            self._hash_indexes[column] = index
+        return index
+
+    def _SortedIndex(self, column):
+        index = self._sorted_indexes.get(column)
+        if index is None:
+            number_pairs = []
+            text_pairs = []
+            numbers = set()
+            for row_id in self.row_ids:
+                value = self.content[row_id].get(column, '')
+                number = _ToNumber(value)
+                if number is not None:
+                    number_pairs.append((number, row_id))
+                    numbers.add(row_id)
+                text_pairs.append((value, row_id))
+            number_pairs.sort(key=lambda pair: pair[0])
+            text_pairs.sort(key=lambda pair: pair[0])
+            index = ([pair[0] for pair in number_pairs],
+                     [pair[1] for pair in number_pairs],
+                     [pair[0] for pair in text_pairs],
+                     [pair[1] for pair in text_pairs], numbers)
+            self._sorted_indexes[column] = index
+        return index
+
+
+_FLIPPED_OPERATORS = {'=': '=', '==': '==', '!=': '!=', '<>': '<>',
+                      '<': '>', '>': '<', '<=': '>=', '>=': '<='}
+
+_QUERY_TOKEN = re.compile(
+    r'\s*(?:(\()|(\))|(&&|\|\||==|!=|<>|<=|>=|=|<|>)|"([^"]*)"|([^\s()<>=!&|"]+))')
+
+
+def _ToNumber(value):
+    try:
+        return float(value)
+    except ValueError:
+        return None
+
+
+def _ValueKey(value):
+    number = _ToNumber(value)
+    if number is not None:
+        return number
+    return value
+
+
+def _Range(keys, ids, operator, value):
+    if operator == '<':
+        return ids[:bisect.bisect_left(keys, value)]
+    elif operator == '<=':
+        return ids[:bisect.bisect_right(keys, value)]
+    elif operator == '>':
+        return ids[bisect.bisect_right(keys, value):]
+    return ids[bisect.bisect_left(keys, value):]
+
+
+def _RemoveSorted(keys, ids, value, row_id):
+    start = bisect.bisect_left(keys, value)
+    end = bisect.bisect_right(keys, value)
+    position = ids.index(row_id, start, end)
+    del keys[position]
+    del ids[position]
+
+
+def CompareValues(operator, left, right):
+    """Compares two cell values the way a structured query does.
+
+    Both values are compared as numbers if they are numbers, as text
+    otherwise.
+    """
+    left_number = _ToNumber(left)
+    right_number = _ToNumber(right)
+    if left_number is not None and right_number is not None:
+        left, right = left_number, right_number
+    if operator in ('=', '=='):
+        return left == right
+    elif operator in ('!=', '<>'):
+        return left != right
+    elif operator == '<':
+        return left < right
+    elif operator == '<=':
+        return left <= right
+    elif operator == '>':
+        return left > right
+    return left >= right
+
+
+def ParseStructuredQuery(query_string, columns=None):
+    """Parses a list feed structured query (the sq parameter).
+
+    Supported are comparisons with =, ==, !=, <>, <, <=, > and >=, combined
+    with and, &&, or and || and grouped with parentheses. An operand which
+    names a column refers to that column's value, other operands, and
+    operands in double quotes, are literal values.
+
+    Args:
+      query_string: str The query, for example 'a > 1 && cd < 20'.
+      columns: collection (optional) The known column names. If None, bare
+          words on the left of a comparison are columns and bare words on
+          the right are literals unless they are also used on a left side.
+
+    Returns:
+      A tree of tuples: ('and', left, right), ('or', left, right) or
+      ('compare', operator, operand, operand) where an operand is
+      ('column', name) or ('literal', value).
+
+    Raises:
+      QueryError if the query can not be parsed.
+    """
+    tokens = []
+    position = 0
+    query_string = query_string.strip()
+    while position < len(query_string):
+        match = _QUERY_TOKEN.match(query_string, position)
+        if match is None or match.end() == position:
+            raise QueryError('Unable to parse query at: %s' %
+                             query_string[position:])
+        position = match.end()
+        open_paren, close_paren, operator, quoted, word = match.groups()
+        if open_paren or close_paren:
+            tokens.append(('paren', open_paren or close_paren))
+        elif operator in ('&&', '||'):
+            tokens.append(('bool', operator == '&&' and 'and' or 'or'))
+        elif operator:
+            tokens.append(('operator', operator))
+        elif quoted is not None:
+            tokens.append(('quoted', quoted))
+        elif word.lower() in ('and', 'or'):
+            tokens.append(('bool', word.lower()))
+        else:
+            tokens.append(('word', word))
+    if columns is None:
+        columns = set(tokens[i][1] for i in range(len(tokens) - 1)
+                      if tokens[i][0] == 'word'
+                      and tokens[i + 1][0] == 'operator')
+    parser = _QueryParser(tokens, columns)
+    tree = parser.ParseOr()
+    if parser.position != len(tokens):
+        raise QueryError('Unexpected %s in query' % tokens[parser.position][1])
+    return tree
+
+
+class _QueryParser(object):
+
+    def __init__(self, tokens, columns):
+        self.tokens = tokens
+        self.columns = columns
+        self.position = 0
+
+    def _Peek(self):
+        if self.position < len(self.tokens):
+            return self.tokens[self.position]
+        return (None, None)
+
+    def _Next(self, kind):
+        token = self._Peek()
+        if token[0] != kind:
+            raise QueryError('Expected %s in query, found %s' % (kind, token[1]))
+        self.position += 1
+        return token[1]
+
+    def ParseOr(self):
+        tree = self.ParseAnd()
+        while self._Peek() == ('bool', 'or'):
+            self.position += 1
+            tree = ('or', tree, self.ParseAnd())
+        return tree
+
+    def ParseAnd(self):
+        tree = self.ParseFactor()
+        while self._Peek() == ('bool', 'and'):
+            self.position += 1
+            tree = ('and', tree, self.ParseFactor())
+        return tree
+
+    def ParseFactor(self):
+        if self._Peek() == ('paren', '('):
+            self.position += 1
+            tree = self.ParseOr()
+            if self._Next('paren') != ')':
+                raise QueryError('Expected ) in query')
+            return tree
+        left = self.ParseOperand()
+        operator = self._Next('operator')
+        return ('compare', operator, left, self.ParseOperand())
+
+    def ParseOperand(self):
+        kind, value = self._Peek()
+        if kind == 'quoted':
+            self.position += 1
+            return ('literal', value)
+        value = self._Next('word')
+        if value in self.columns:
+            return ('column', value)
+        return ('literal', value)
+
+
+def RowIdFromEntry(entry):
+    return entry.id.text.split('/')[-1]
+
+
+def GetEtag(entry):
+    """Returns the gd:etag of an entry, or None if the server sent none."""
+    etag = entry.extension_attributes.get(GD_ETAG)
+    if isinstance(etag, bytes):
+        etag = etag.decode('utf-8')
+    return etag
 
 
 def ConvertStringsToColumnHeaders(proposed_headers):
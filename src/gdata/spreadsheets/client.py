@@ -14,6 +14,9 @@ http://code.google.com/apis/spreadsheets/
 
 # __author__ = 'j.s@google.com (Jeff Scudder)'
 
+import concurrent.futures
+import time
+
 import atom.data
 import atom.http_core
 import gdata.client
@@ -33,6 +36,13 @@ CELLS_URL = 'https://spreadsheets.google.com/feeds/cells/%s/%s/private/full'
 CELL_URL = ('https://spreadsheets.google.com/feeds/cells/%s/%s/private/full/'
             'R%sC%s')
 LISTS_URL = 'https://spreadsheets.google.com/feeds/list/%s/%s/private/full'
+CELLS_BATCH_URL = CELLS_URL + '/batch'
+
+# Number of cell updates sent in one batch request by update_cells.
+DEFAULT_CELLS_BATCH_SIZE = 1000
+# Seconds update_cells waits before sending failed cells again, doubled for
+# each later retry.
+DEFAULT_CELLS_RETRY_DELAY = 1.0
 
 
 class SpreadsheetsClient(gdata.client.GDClient):
@@ -365,6 +375,179 @@ class SpreadsheetsClient(gdata.client.GDClient):
 
     GetCells = get_cells
 
+    def get_grid(self, spreadsheet_key, worksheet_id, min_row=None,
+                 max_row=None, min_col=None, max_col=None, auth_token=None,
+                 **kwargs):
+        """Reads a range of cells into a gdata.spreadsheets.data.CellGrid.
+
+        The cells feed is streamed page by page straight into the grid's
+        arrays, no CellsFeed or CellEntry objects are created. Blank cells
+        are left empty in the grid.
+
+        Args:
+          spreadsheet_key: str, The unique ID of this containing spreadsheet. This
+                           can be the ID from the URL or as provided in a
+                           Spreadsheet entry.
+          worksheet_id: str, The unique ID of the worksheet in this spreadsheet
+                        whose cells we want. This can be obtained using
+                        WorksheetEntry's get_worksheet_id method.
+          min_row: int (optional) The first row to read, defaults to 1.
+          max_row: int (optional) The last row to read. If given, the grid is
+                   padded to this row even if the last rows are blank.
+          min_col: int (optional) The first column to read, defaults to 1.
+          max_col: int (optional) The last column to read. If given, the grid
+                   is padded to this column even if the last columns are blank.
+          auth_token: An object which sets the Authorization HTTP header in its
+                      modify_request method. Recommended classes include
+                      gdata.gauth.ClientLoginToken and gdata.gauth.AuthSubToken
+                      among others. Represents the current user. Defaults to None
+                      and if None, this method will look for a value in the
+                      auth_token member of SpreadsheetsClient.
+
+        Returns:
+          A gdata.spreadsheets.data.CellGrid whose first cell is
+          (min_row, min_col).
+        """
+        grid = gdata.spreadsheets.data.CellGrid(min_row or 1, min_col or 1)
+        query = CellQuery(min_row=min_row, max_row=max_row, min_col=min_col,
+                          max_col=max_col)
+
+        def read_page(response):
+            return gdata.spreadsheets.data.read_cells_into_grid(
+                response, grid, max_row=max_row, max_col=max_col)
+
+        next_uri = self.request(
+            method='GET', uri=CELLS_URL % (spreadsheet_key, worksheet_id),
+            auth_token=auth_token, converter=read_page, q=query, **kwargs)
+        while next_uri is not None:
+            next_uri = self.request(method='GET', uri=next_uri,
+                                    auth_token=auth_token, converter=read_page,
+                                    **kwargs)
+        row_count = grid.row_count
+        col_count = grid.col_count
+        if max_row is not None:
+            row_count = max_row - grid.min_row + 1
+        if max_col is not None:
+            col_count = max_col - grid.min_col + 1
+        grid.resize(row_count, col_count)
+        return grid
+
+    GetGrid = get_grid
+
+    def update_cells(self, spreadsheet_key, worksheet_id, rows, min_row=1,
+                     min_col=1, current=None,
+                     batch_size=DEFAULT_CELLS_BATCH_SIZE, max_workers=4,
+                     num_retries=2, retry_delay=DEFAULT_CELLS_RETRY_DELAY,
+                     auth_token=None, **kwargs):
+        """Writes a rectangle of values to the worksheet with batch requests.
+
+        The updates are split into batch feeds of at most batch_size cells
+        which are posted concurrently. Cells which come back with a failing
+        batch:status, or which are missing from the response because the
+        server interrupted the batch, are retried on their own after a
+        delay. A request which fails outright is retried as a whole.
+
+        Args:
+          spreadsheet_key: str, The unique ID of this containing spreadsheet.
+          worksheet_id: str, The unique ID of the worksheet in this spreadsheet.
+          rows: A sequence of rows, each a sequence of values, for example a
+                list of lists or a two dimensional NumPy array. A value of
+                None leaves the cell alone, other values are converted to
+                strings and written as the cell's input value.
+          min_row: int (optional) The worksheet row of the first row.
+          min_col: int (optional) The worksheet column of the first value in
+                   each row.
+          current: gdata.spreadsheets.data.CellGrid (optional) The cells as
+                   they are in the worksheet, for example from get_grid. Only
+                   values which differ from the input values in this grid are
+                   sent. The input values of written cells are updated in
+                   the grid, see CellGrid.set_input_value.
+          batch_size: int (optional) The most cells sent in one request.
+          max_workers: int (optional) The most requests in flight at once.
+          num_retries: int (optional) How many times failed cells are sent
+                       again.
+          retry_delay: float (optional) Seconds to wait before the first
+                       retry, doubled for each later one.
+          auth_token: An object which sets the Authorization HTTP header in its
+                      modify_request method. Represents the current user.
+                      Defaults to None and if None, this method will look for
+                      a value in the auth_token member of SpreadsheetsClient.
+
+        Returns:
+          A dict mapping the (row, col) of each cell which could not be
+          written to its last (code, reason) status. The dict is empty when
+          every cell was written.
+        """
+        pending = []
+        for row_index, row in enumerate(rows):
+            row_num = min_row + row_index
+            for col_index, value in enumerate(row):
+                if value is None:
+                    continue
+                col_num = min_col + col_index
+                value = str(value)
+                if (current is not None and
+                        (current.get_input_value(row_num, col_num) or '')
+                        == value):
+                    continue
+                pending.append((row_num, col_num, value))
+        failures = {}
+        attempt = 0
+        with concurrent.futures.ThreadPoolExecutor(max_workers) as executor:
+            while pending and attempt <= num_retries:
+                if attempt:
+                    time.sleep(retry_delay * 2 ** (attempt - 1))
+                attempt += 1
+                chunks = [pending[i:i + batch_size]
+                          for i in range(0, len(pending), batch_size)]
+                futures = [executor.submit(self._post_cells_batch,
+                                           spreadsheet_key, worksheet_id,
+                                           chunk, auth_token, **kwargs)
+                           for chunk in chunks]
+                pending = []
+                for chunk, future in zip(chunks, futures):
+                    statuses = future.result()
+                    for row_num, col_num, value in chunk:
+                        status = statuses.get('R%sC%s' % (row_num, col_num),
+                                              statuses.get(None))
+                        if status is not None and 200 <= status[0] < 300:
+                            failures.pop((row_num, col_num), None)
+                            if current is not None:
+                                current.set_input_value(row_num, col_num,
+                                                        value)
+                        else:
+                            failures[(row_num, col_num)] = status or (
+                                None, 'Missing from the batch response')
+                            pending.append((row_num, col_num, value))
+        return failures
+
+    UpdateCells = update_cells
+
+    def _post_cells_batch(self, spreadsheet_key, worksheet_id, cells,
+                          auth_token=None, **kwargs):
+        """Posts one batch of cell updates and returns the batch statuses.
+
+        If the request itself fails, the error is reported as the status of
+        every cell, under the key None.
+        """
+        http_request = atom.http_core.HttpRequest()
+        http_request.add_body_part(
+            gdata.spreadsheets.data.build_batch_cells_request(
+                spreadsheet_key, worksheet_id, cells),
+            'application/atom+xml')
+        http_request.headers['If-Match'] = '*'
+        try:
+            return self.request(
+                method='POST',
+                uri=CELLS_BATCH_URL % (spreadsheet_key, worksheet_id),
+                auth_token=auth_token, http_request=http_request,
+                converter=gdata.spreadsheets.data.read_batch_statuses,
+                **kwargs)
+        except gdata.client.RequestError as error:
+            return {None: (error.status, error.reason)}
+        except IOError as error:
+            return {None: (None, str(error))}
+
     def get_cell(self, spreadsheet_key, worksheet_id, row_num, col_num,
                  desired_class=gdata.spreadsheets.data.CellEntry,
                  auth_token=None, **kwargs):
@@ -439,6 +622,57 @@ class SpreadsheetsClient(gdata.client.GDClient):
 
     GetListFeed = get_list_feed
 
+    def get_list_columns(self, spreadsheet_key, worksheet_id, converters=None,
+                         sink=None, query=None, auth_token=None, **kwargs):
+        """Reads every row of the worksheet's list feed column by column.
+
+        The list feed is streamed page by page into a
+        gdata.spreadsheets.data.ListColumns, no ListsFeed or ListEntry objects
+        are created. With a sink, rows are written out as they arrive so the
+        memory used does not grow with the number of rows.
+
+        Args:
+          spreadsheet_key: str, The unique ID of this containing spreadsheet. This
+                           can be the ID from the URL or as provided in a
+                           Spreadsheet entry.
+          worksheet_id: str, The unique ID of the worksheet in this spreadsheet
+                        whose cells we want. This can be obtained using
+                        WorksheetEntry's get_worksheet_id method.
+          converters: dict (optional) mapping column names to functions which
+                      convert the text of each non empty cell, for example
+                      {'hours': float}.
+          sink: (optional) object with a writerow method, such as a
+                csv.writer, which receives the column names and then each
+                row as a list.
+          query: ListQuery (optional) Sorts or filters the rows, or sets how
+                 many rows are fetched per page with max_results.
+          auth_token: An object which sets the Authorization HTTP header in its
+                      modify_request method. Recommended classes include
+                      gdata.gauth.ClientLoginToken and gdata.gauth.AuthSubToken
+                      among others. Represents the current user. Defaults to None
+                      and if None, this method will look for a value in the
+                      auth_token member of SpreadsheetsClient.
+
+        Returns:
+          The gdata.spreadsheets.data.ListColumns holding the column names
+          and, when no sink was given, the values of each column.
+        """
+        columns = gdata.spreadsheets.data.ListColumns(converters, sink)
+
+        def read_page(response):
+            return gdata.spreadsheets.data.read_list_rows(response, columns)
+
+        next_uri = self.request(
+            method='GET', uri=LISTS_URL % (spreadsheet_key, worksheet_id),
+            auth_token=auth_token, converter=read_page, q=query, **kwargs)
+        while next_uri is not None:
+            next_uri = self.request(method='GET', uri=next_uri,
+                                    auth_token=auth_token, converter=read_page,
+                                    **kwargs)
+        return columns
+
+    GetListColumns = get_list_columns
+
     def add_list_entry(self, list_entry, spreadsheet_key, worksheet_id,
                        auth_token=None, **kwargs):
         """Adds a new row to the worksheet's list feed.
@@ -17,6 +17,11 @@ http://code.google.com/apis/spreadsheets/docs/3.0/reference.html#Elements
 
 # __author__ = 'j.s@google.com (Jeff Scudder)'
 
+import array
+from xml.sax.saxutils import escape, quoteattr
+
+import lxml.etree as ElementTree
+
 import atom.core
 import gdata.data
 
@@ -367,3 +372,450 @@ def build_batch_cells_update(spreadsheet_key, worksheet_id):
 
 
 BuildBatchCellsUpdate = build_batch_cells_update
+
+
+class CellGrid(object):
+    """A rectangle of worksheet cells held in flat, row-major arrays.
+
+    The displayed values, input values (formulas) and numeric values of the
+    cells are kept in three separate columns instead of one CellEntry per
+    cell. Values and input values are None for empty cells, numeric values
+    are stored as doubles in an array and are NaN where the cell has none.
+
+    Row and column numbers passed to the accessors are worksheet numbers,
+    starting at 1, not offsets into the grid.
+    """
+
+    def __init__(self, min_row=1, min_col=1, row_count=0, col_count=0):
+        self.min_row = min_row
+        self.min_col = min_col
+        self.row_count = 0
+        self.col_count = 0
+        self.values = []
+        self.input_values = []
+        self.numeric_values = array.array('d')
+        self.resize(row_count, col_count)
+
+    def _get_max_row(self):
+        return self.min_row + self.row_count - 1
+
+    max_row = property(_get_max_row)
+
+    def _get_max_col(self):
+        return self.min_col + self.col_count - 1
+
+    max_col = property(_get_max_col)
+
+    def resize(self, row_count, col_count):
+        """Grows the grid to at least row_count rows and col_count columns.
+
+        The grid never shrinks. Adding rows only extends the arrays, adding
+        columns copies the cells into a wider layout.
+        """
+        if col_count > self.col_count:
+            old_width = self.col_count
+            padding = col_count - old_width
+            values = []
+            input_values = []
+            numeric_values = array.array('d')
+            for row_index in range(self.row_count):
+                offset = row_index * old_width
+                values.extend(self.values[offset:offset + old_width])
+                values.extend([None] * padding)
+                input_values.extend(self.input_values[offset:offset + old_width])
+                input_values.extend([None] * padding)
+                numeric_values.extend(
+                    self.numeric_values[offset:offset + old_width])
+                numeric_values.extend(_nan_array(padding))
+            self.values = values
+            self.input_values = input_values
+            self.numeric_values = numeric_values
+            self.col_count = col_count
+        if row_count > self.row_count:
+            added = (row_count - self.row_count) * self.col_count
+            self.values.extend([None] * added)
+            self.input_values.extend([None] * added)
+            self.numeric_values.extend(_nan_array(added))
+            self.row_count = row_count
+
+    Resize = resize
+
+    def _offset(self, row, col):
+        row_index = row - self.min_row
+        col_index = col - self.min_col
+        if (row_index < 0 or row_index >= self.row_count
+                or col_index < 0 or col_index >= self.col_count):
+            return None
+        return row_index * self.col_count + col_index
+
+    def set_cell(self, row, col, value, input_value=None, numeric_value=None):
+        """Stores the contents of one cell, growing the grid if needed.
+
+        Args:
+          row: int, The worksheet row of the cell.
+          col: int, The worksheet column of the cell.
+          value: str, The displayed value.
+          input_value: str (optional), The formula or literal the user entered.
+          numeric_value: float or str (optional), The numeric value, if any.
+              A cell stored without one has no numeric value, whatever it
+              held before.
+        """
+        if row < self.min_row or col < self.min_col:
+            raise IndexError('Cell R%sC%s is outside of the grid' % (row, col))
+        self.resize(max(self.row_count, row - self.min_row + 1),
+                    max(self.col_count, col - self.min_col + 1))
+        offset = self._offset(row, col)
+        self.values[offset] = value
+        self.input_values[offset] = input_value
+        if numeric_value is None:
+            self.numeric_values[offset] = float('nan')
+        else:
+            self.numeric_values[offset] = float(numeric_value)
+
+    SetCell = set_cell
+
+    def set_input_value(self, row, col, input_value):
+        """Stores a value written to a cell, before the server evaluates it.
+
+        A literal is also the displayed value, and its number if it reads as
+        a plain float. The displayed and numeric values of a formula are not
+        known until the cell is read again, they are left empty.
+
+        Args:
+          row: int, The worksheet row of the cell.
+          col: int, The worksheet column of the cell.
+          input_value: str, The formula or literal written to the cell.
+        """
+        if input_value.startswith('='):
+            self.set_cell(row, col, None, input_value)
+            return
+        try:
+            numeric_value = float(input_value)
+        except ValueError:
+            numeric_value = None
+        self.set_cell(row, col, input_value, input_value, numeric_value)
+
+    SetInputValue = set_input_value
+
+    def get_value(self, row, col):
+        """Returns the displayed value of a cell, or None if it is empty."""
+        offset = self._offset(row, col)
+        if offset is None:
+            return None
+        return self.values[offset]
+
+    GetValue = get_value
+
+    def get_input_value(self, row, col):
+        """Returns the input value (formula) of a cell, or None."""
+        offset = self._offset(row, col)
+        if offset is None:
+            return None
+        return self.input_values[offset]
+
+    GetInputValue = get_input_value
+
+    def get_numeric_value(self, row, col):
+        """Returns the numeric value of a cell as a float, or None."""
+        offset = self._offset(row, col)
+        if offset is None:
+            return None
+        number = self.numeric_values[offset]
+        if number != number:
+            return None
+        return number
+
+    GetNumericValue = get_numeric_value
+
+    def get_row(self, row):
+        """Returns the displayed values of one row as a list."""
+        offset = self._offset(row, self.min_col)
+        if offset is None:
+            return []
+        return self.values[offset:offset + self.col_count]
+
+    GetRow = get_row
+
+    def iter_rows(self):
+        """Yields the displayed values of each row as a list."""
+        for row_index in range(self.row_count):
+            offset = row_index * self.col_count
+            yield self.values[offset:offset + self.col_count]
+
+    IterRows = iter_rows
+
+    def to_numpy(self, column='numeric'):
+        """Exports one of the columns as a two dimensional NumPy array.
+
+        NumPy is only imported when this method is called.
+
+        Args:
+          column: str, 'numeric' for a float array in which empty and non
+                  numeric cells are NaN, 'value' or 'input' for an object
+                  array of displayed values or input values.
+        """
+        import numpy
+        shape = (self.row_count, self.col_count)
+        if column == 'numeric':
+            return numpy.array(self.numeric_values, dtype=float).reshape(shape)
+        elif column == 'value':
+            return numpy.array(self.values, dtype=object).reshape(shape)
+        elif column == 'input':
+            return numpy.array(self.input_values, dtype=object).reshape(shape)
+        raise ValueError('Unknown column %s' % column)
+
+    ToNumpy = to_numpy
+
+
+def _nan_array(length):
+    return array.array('d', [float('nan')]) * length
+
+
+_ATOM_ENTRY = '{http://www.w3.org/2005/Atom}entry'
+_ATOM_LINK = '{http://www.w3.org/2005/Atom}link'
+_ATOM_FEED = '{http://www.w3.org/2005/Atom}feed'
+
+
+def read_cells_into_grid(stream, grid, max_row=None, max_col=None):
+    """Streams the cells of one cells feed page into a CellGrid.
+
+    The feed is parsed incrementally and each entry is discarded as soon as
+    its gs:cell has been copied into the grid, so no CellEntry objects are
+    built and the parsed tree never holds more than one entry.
+
+    Args:
+      stream: file-like object with the XML of a cells feed.
+      grid: CellGrid which receives the cells.
+      max_row: int (optional), Cells below this row are skipped.
+      max_col: int (optional), Cells right of this column are skipped.
+
+    Returns:
+      The href of the feed's next link, or None if this is the last page.
+    """
+    next_link = None
+    for _, element in ElementTree.iterparse(
+            stream, events=('end',),
+            tag=(GS_TEMPLATE % 'cell', GS_TEMPLATE % 'colCount', _ATOM_LINK,
+                 _ATOM_ENTRY)):
+        tag = element.tag
+        if tag == _ATOM_ENTRY:
+            element.clear()
+            parent = element.getparent()
+            while element.getprevious() is not None:
+                del parent[0]
+        elif tag == GS_TEMPLATE % 'cell':
+            row = int(element.get('row'))
+            col = int(element.get('col'))
+            if ((max_row is not None and row > max_row)
+                    or (max_col is not None and col > max_col)):
+                continue
+            value = element.text
+            input_value = element.get('inputValue')
+            if input_value == value:
+                # Share one string when the input is a literal.
+                input_value = value
+            grid.set_cell(row, col, value, input_value,
+                          element.get('numericValue'))
+        elif tag == _ATOM_LINK:
+            if (element.get('rel') == 'next'
+                    and element.getparent().tag == _ATOM_FEED):
+                next_link = element.get('href')
+        elif grid.col_count == 0 and element.text:
+            # Use the worksheet width up front so that rows arriving in order
+            # never force the grid to be laid out again.
+            width = int(element.text)
+            if max_col is not None:
+                width = min(width, max_col)
+            grid.resize(0, width - grid.min_col + 1)
+    return next_link
+
+
+ReadCellsIntoGrid = read_cells_into_grid
+
+
+BATCH_CELLS_FEED_START = (
+    '<feed xmlns="http://www.w3.org/2005/Atom"'
+    ' xmlns:batch="http://schemas.google.com/gdata/batch"'
+    ' xmlns:gs="http://schemas.google.com/spreadsheets/2006">'
+    '<id>%s</id>')
+BATCH_CELL_ENTRY = (
+    '<entry><batch:id>R%sC%s</batch:id><batch:operation type="update"/>'
+    '<id>%s</id><link rel="edit" type="application/atom+xml" href=%s/>'
+    '<gs:cell row="%s" col="%s" inputValue=%s/></entry>')
+# Keep line breaks and tabs in cell contents from being normalized away.
+_ATTRIBUTE_ENTITIES = {'\n': '&#10;', '\r': '&#13;', '\t': '&#9;'}
+
+
+def build_batch_cells_request(spreadsheet_key, worksheet_id, cells):
+    """Serializes cell updates as a batch cells feed without CellEntry objects.
+
+    The result is the same request which build_batch_cells_update and
+    CellsFeed.add_set_cell produce, written straight to a string since large
+    updates would otherwise build a full object graph for every cell. The
+    batch ID of each operation is R<row>C<col>.
+
+    Args:
+      spreadsheet_key: The ID of the spreadsheet.
+      worksheet_id: The ID of the worksheet in the spreadsheet.
+      cells: iterable of (row, col, input_value) tuples.
+
+    Returns:
+      The feed as UTF-8 encoded bytes.
+    """
+    feed_id_text = BATCH_POST_ID_TEMPLATE % (spreadsheet_key, worksheet_id)
+    parts = [BATCH_CELLS_FEED_START % escape(feed_id_text)]
+    for row, col, input_value in cells:
+        cell_id = escape(BATCH_ENTRY_ID_TEMPLATE % (feed_id_text, row, col))
+        parts.append(BATCH_CELL_ENTRY % (
+            row, col, cell_id, quoteattr(cell_id), row, col,
+            quoteattr(input_value, _ATTRIBUTE_ENTITIES)))
+    parts.append('</feed>')
+    return ''.join(parts).encode('utf-8')
+
+
+BuildBatchCellsRequest = build_batch_cells_request
+
+
+def read_batch_statuses(stream):
+    """Streams the batch:status of each entry out of a batch response feed.
+
+    Args:
+      stream: file-like object with the XML of a batch response feed.
+
+    Returns:
+      A dict mapping each batch ID to a (code, reason) tuple where code is
+      an int HTTP status.
+    """
+    statuses = {}
+    batch_id_tag = gdata.data.BATCH_TEMPLATE % 'id'
+    batch_status_tag = gdata.data.BATCH_TEMPLATE % 'status'
+    for _, element in ElementTree.iterparse(stream, events=('end',),
+                                            tag=_ATOM_ENTRY):
+        batch_id = element.findtext(batch_id_tag)
+        status = element.find(batch_status_tag)
+        if batch_id is not None and status is not None:
+            statuses[batch_id.strip()] = (int(status.get('code')),
+                                          status.get('reason'))
+        element.clear()
+        parent = element.getparent()
+        while element.getprevious() is not None:
+            del parent[0]
+    return statuses
+
+
+ReadBatchStatuses = read_batch_statuses
+
+
+class ListColumns(object):
+    """Collects list feed rows column by column.
+
+    The column names are taken from the first row which is read, every row
+    of a list feed carries all of the worksheet's gsx columns. Values are
+    None for empty cells, other values are passed through the converter for
+    their column, if any.
+
+    If a sink is given, each row is written to it as a list of values (the
+    first call writes the column names) and nothing is kept in memory, a
+    csv.writer works as a sink for CSV or TSV output. Otherwise the values
+    are appended to the list for their column in columns.
+    """
+
+    def __init__(self, converters=None, sink=None):
+        """Creates an empty set of columns.
+
+        Args:
+          converters: dict (optional) mapping column names to functions which
+                      take the text of a cell and return the value to store,
+                      for example int or float.
+          sink: (optional) object with a writerow method, such as a
+                csv.writer, which receives the header and then each row.
+        """
+        self.converters = converters or {}
+        self.sink = sink
+        self.names = None
+        self.columns = {}
+        self.row_count = 0
+        self._indexes = None
+        self._row_converters = None
+
+    def _set_names(self, names):
+        self.names = names
+        self._indexes = dict((name, index) for index, name in enumerate(names))
+        self._row_converters = [self.converters.get(name) for name in names]
+        if self.sink is None:
+            self.columns = dict((name, []) for name in names)
+        else:
+            self.sink.writerow(names)
+
+    def add_row(self, cells):
+        """Adds one row given as a list of (column name, text) pairs.
+
+        Columns which were not present in the first row are ignored.
+        """
+        if self.names is None:
+            self._set_names([name for name, _ in cells])
+        row = [None] * len(self.names)
+        indexes = self._indexes
+        for name, text in cells:
+            index = indexes.get(name)
+            if index is None or not text:
+                continue
+            converter = self._row_converters[index]
+            if converter is None:
+                row[index] = text
+            else:
+                row[index] = converter(text)
+        if self.sink is None:
+            for name, value in zip(self.names, row):
+                self.columns[name].append(value)
+        else:
+            self.sink.writerow(row)
+        self.row_count += 1
+
+    AddRow = add_row
+
+    def to_numpy(self, name, dtype=None):
+        """Exports one column as a NumPy array, importing NumPy on demand."""
+        import numpy
+        return numpy.array(self.columns[name], dtype=dtype)
+
+    ToNumpy = to_numpy
+
+
+_GSX_PREFIX = '{%s}' % GSX_NAMESPACE
+
+
+def read_list_rows(stream, columns):
+    """Streams the rows of one list feed page into a ListColumns.
+
+    Each entry is discarded as soon as its gsx values have been copied, no
+    ListEntry objects are built.
+
+    Args:
+      stream: file-like object with the XML of a list feed.
+      columns: ListColumns which receives the rows.
+
+    Returns:
+      The href of the feed's next link, or None if this is the last page.
+    """
+    next_link = None
+    prefix_length = len(_GSX_PREFIX)
+    for _, element in ElementTree.iterparse(stream, events=('end',),
+                                            tag=(_ATOM_LINK, _ATOM_ENTRY)):
+        if element.tag == _ATOM_LINK:
+            if (element.get('rel') == 'next'
+                    and element.getparent().tag == _ATOM_FEED):
+                next_link = element.get('href')
+            continue
+        columns.add_row([(child.tag[prefix_length:], child.text)
+                         for child in element
+                         if isinstance(child.tag, str)
+                         and child.tag.startswith(_GSX_PREFIX)])
+        element.clear()
+        parent = element.getparent()
+        while element.getprevious() is not None:
+            del parent[0]
+    return next_link
+
+
+ReadListRows = read_list_rows
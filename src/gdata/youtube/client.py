@@ -18,6 +18,7 @@ import atom.data
 import atom.http_core
 import gdata.client
 import gdata.youtube.data
+import gdata.youtube.upload
 
 # Constants
 # -----------------------------------------------------------------------------
@@ -152,6 +153,64 @@ class YouTubeClient(gdata.client.GDClient):
 
     GetVideoEntry = get_video_entry
 
+    def upload_video(self, entry, filename_or_handle,
+                     content_type='video/quicktime', username='default',
+                     session_store=None, limiter=None, chunk_size=None):
+        """Uploads a video using the resumable upload protocol.
+
+        Args:
+          entry: gdata.youtube.data.VideoEntry The metadata of the video.
+          filename_or_handle: A binary file-like object or file name where the
+              video will be read from.
+          content_type: str (optional) The mime type of the video.
+          username: str (optional) The account the video is uploaded to.
+          session_store: gdata.client.UploadSessionStore (optional) Keeps the
+              upload URI until the upload is complete, so that calling this
+              method again resumes an interrupted upload.
+          limiter: gdata.youtube.upload.BandwidthLimiter (optional) Budget the
+              chunks are sent within.
+          chunk_size: int (optional) The size of each chunk.
+
+        Returns:
+          The uploaded gdata.youtube.data.VideoEntry.
+        """
+        return gdata.youtube.upload.upload_video(
+            self, entry, filename_or_handle, content_type, username=username,
+            session_store=session_store, limiter=limiter,
+            chunk_size=chunk_size)
+
+    UploadVideo = upload_video
+
+    def check_upload_status(self, video_entry=None, video_id=None):
+        """Checks the upload status of a recently uploaded video.
+
+        Either video_entry or video_id must be provided.
+
+        Returns:
+          A tuple containing (video_upload_state, detailed_message) or None if
+              no status information is found, once the video is published.
+        """
+        if video_entry is None and video_id is None:
+            raise YouTubeError('You must provide at least a video_entry or a '
+                               'video_id to the check_upload_status() method')
+        elif video_entry is None:
+            video_entry = self.get_video_entry(video_id=video_id)
+
+        control = video_entry.control
+        if control is None or control.draft is None:
+            return None
+        if control.draft.text != 'yes':
+            return None
+        states = control.get_elements('state')
+        if not states:
+            return None
+        names = states[0].get_attributes('name')
+        if not names:
+            return None
+        return names[0].value, states[0].text or ''
+
+    CheckUploadStatus = check_upload_status
+
     def get_caption_feed(self, uri):
         """Retrieve a Caption feed of tracks.
 
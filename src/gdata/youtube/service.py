@@ -18,8 +18,10 @@ import os
 
 import atom
 import gdata
+import gdata.client
 import gdata.service
 import gdata.youtube
+import gdata.youtube.upload
 
 YOUTUBE_SERVER = 'gdata.youtube.com'
 YOUTUBE_SERVICE = 'youtube'
@@ -645,6 +647,54 @@ class YouTubeService(gdata.service.GDataService):
         finally:
             del (self.additional_headers['Slug'])
 
+    def InsertVideoEntryResumable(self, video_entry, filename_or_handle,
+                                  youtube_username='default',
+                                  content_type='video/quicktime',
+                                  session_store=None, limiter=None,
+                                  chunk_size=None):
+        """Upload a new video to YouTube using the resumable upload mechanism.
+
+        Needs authentication. The video is sent in chunks, and an upload
+        interrupted by an error can be resumed by calling this method again
+        with the same session_store.
+
+        Args:
+          video_entry: The YouTubeVideoEntry to upload.
+          filename_or_handle: A binary file-like object or file name where the
+              video will be read from.
+          youtube_username: An optional string representing the username into
+              whose account this video is to be uploaded to. Defaults to the
+              currently authenticated user.
+          content_type: An optional string representing internet media type
+              (a.k.a. mime type) of the media object.
+          session_store: An optional gdata.client.UploadSessionStore keeping
+              the upload URI until the upload is complete.
+          limiter: An optional gdata.youtube.upload.BandwidthLimiter the chunks
+              are sent within.
+          chunk_size: An optional int, the size of each chunk.
+
+        Returns:
+          The newly created YouTubeVideoEntry if successful.
+
+        Raises:
+          YouTubeError: An error occurred trying to upload the video to the API
+              server.
+        """
+        if not isinstance(video_entry, gdata.youtube.YouTubeVideoEntry):
+            raise YouTubeError({'status': YOUTUBE_INVALID_ARGUMENT,
+                                'body': '`video_entry` must be a gdata.youtube.VideoEntry instance',
+                                'reason': 'Found %s, not VideoEntry' % type(video_entry)
+                                })
+        try:
+            return gdata.youtube.upload.upload_video(
+                self, video_entry, filename_or_handle, content_type,
+                username=youtube_username, session_store=session_store,
+                limiter=limiter, chunk_size=chunk_size)
+        except gdata.client.RequestError as e:
+            raise YouTubeError({'status': getattr(e, 'status', UNKOWN_ERROR),
+                                'reason': getattr(e, 'reason', str(e)),
+                                'body': getattr(e, 'body', str(e))})
+
     def CheckUploadStatus(self, video_entry=None, video_id=None):
         """Check upload status on a recently uploaded video entry.
 
@@ -673,7 +723,7 @@ class YouTubeService(gdata.service.GDataService):
         if control is not None:
             draft = control.draft
             if draft is not None:
-                if draft.text == 'yes':
+                if draft.text in (b'yes', 'yes'):
                     yt_state = control.extension_elements[0]
                     if yt_state is not None:
                         state_value = yt_state.attributes['name']
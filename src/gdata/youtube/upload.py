@@ -0,0 +1,364 @@
+#
+# Licensed under the Apache License 2.0;
+
+
+"""Resumable and parallel video uploads to YouTube.
+
+YouTubeService.InsertVideoEntry posts a video as one direct upload, so a
+dropped connection means sending the whole file again. upload_video uses
+the resumable upload protocol instead: the video is sent in chunks through
+a VideoUploader, the upload URI of each session is kept in a
+gdata.client.UploadSessionStore, and an interrupted upload, even one
+started by another process, carries on from the first byte the server is
+missing. Each chunk is read while the previous one is on the wire.
+
+upload_video works with the v1 gdata.youtube.service.YouTubeService as well
+as the v2 gdata.youtube.client.YouTubeClient, which also offer it as
+InsertVideoEntryResumable and upload_video.
+
+A ParallelVideoUploader uploads many videos from a pool of threads, all
+sharing one BandwidthLimiter, and polls CheckUploadStatus until YouTube
+has processed them.
+
+Example Usage:
+service = gdata.youtube.service.YouTubeService()
+uploader = gdata.youtube.upload.ParallelVideoUploader(
+    service, session_store=gdata.client.FileUploadSessionStore(
+        'sessions.json'),
+    limiter=gdata.youtube.upload.BandwidthLimiter(2 * 1024 * 1024))
+uploads = [gdata.youtube.upload.VideoUpload(make_entry(path), path)
+           for path in paths]
+uploader.upload(uploads)
+uploader.wait_for_processing(uploads)
+for upload in uploads:
+  print(upload.path, upload.video_id, upload.state, upload.error)
+"""
+
+import concurrent.futures
+import os
+import re
+import time
+
+import gdata.client
+import gdata.service
+import gdata.youtube
+import gdata.youtube.data
+
+# Takes a YouTube user name, 'default' for the authenticated user.
+RESUMABLE_UPLOAD_URI = ('https://uploads.gdata.youtube.com/resumable/feeds/'
+                        'api/users/%s/uploads')
+# Number of videos uploaded at the same time.
+DEFAULT_MAX_WORKERS = 4
+# Seconds between two rounds of upload status checks.
+DEFAULT_POLL_INTERVAL = 30
+
+# Upload states reported by CheckUploadStatus. A processed video has no
+# upload state, PUBLISHED stands for it.
+PROCESSING = 'processing'
+PUBLISHED = 'published'
+
+
+class BandwidthLimiter(gdata.client.RateLimiter):
+    """Shares a bandwidth budget, in bytes per second, between uploads.
+
+    Each chunk reserves its size before it is sent, see
+    gdata.client.RateLimiter.
+    """
+
+    def __init__(self, bytes_per_second, burst=None, **kwargs):
+        """Creates a limiter.
+
+        Args:
+          bytes_per_second: int The sustained rate shared by every sender.
+          burst: int (optional) Bytes which can be sent at once after an
+              idle period, by default one second's worth.
+          kwargs: The clock and sleep functions of gdata.client.RateLimiter.
+        """
+        gdata.client.RateLimiter.__init__(self, bytes_per_second, burst,
+                                          **kwargs)
+
+    @property
+    def bytes_per_second(self):
+        """The sustained rate, the rate of the underlying RateLimiter."""
+        return self.rate
+
+
+class VideoUploader(gdata.client.ResumableUploader):
+    """A ResumableUploader which sends its chunks within a bandwidth budget."""
+
+    def __init__(self, client, file_handle, content_type, total_file_size,
+                 limiter=None, **kwargs):
+        """Starts a resumable upload.
+
+        Args:
+          limiter: BandwidthLimiter (optional) Budget the chunks are sent
+              within, shared with other uploads.
+          kwargs: Other parameters to pass to ResumableUploader.
+        """
+        gdata.client.ResumableUploader.__init__(
+            self, client, file_handle, content_type, total_file_size, **kwargs)
+        self.limiter = limiter
+
+    def upload_chunk(self, start_byte, content_bytes):
+        if self.limiter is not None:
+            self.limiter.acquire(len(content_bytes))
+        return gdata.client.ResumableUploader.upload_chunk(
+            self, start_byte, content_bytes)
+
+    UploadChunk = upload_chunk
+
+
+class ServiceTransport(object):
+    """Sends the requests of a ResumableUploader through a v1 service.
+
+    ResumableUploader talks to a gdata.client.GDClient. This object offers
+    the part of that interface it uses on top of a gdata.service.GDataService,
+    so requests carry the service's credentials and headers, and raises
+    gdata.client.RequestError for responses other than 200 and 201.
+    """
+
+    def __init__(self, service, converter=None):
+        """Wraps a service.
+
+        Args:
+          service: gdata.service.GDataService used for every request.
+          converter: (optional) function which parses the XML of the created
+              entry, by default as a gdata.youtube.YouTubeVideoEntry.
+        """
+        self.service = service
+        self.converter = converter or gdata.youtube.YouTubeVideoEntryFromString
+
+    def request(self, method=None, uri=None, auth_token=None,
+                http_request=None, desired_class=None, **kwargs):
+        headers = dict(http_request.headers)
+        data = None
+        if http_request._body_parts:
+            data = http_request._body_parts[0]
+            if isinstance(data, str):
+                data = data.encode('utf-8')
+                headers['Content-Length'] = str(len(data))
+        response = self.service.request(method, str(uri), data=data,
+                                        headers=headers)
+        if response.status not in (200, 201):
+            raise gdata.client.error_from_response(
+                'Server responded with', response, gdata.client.RequestError)
+        if desired_class is None:
+            return response
+        return self.converter(response.read())
+
+
+def get_video_id(entry):
+    """Returns the YouTube id of an uploaded video entry."""
+    text = entry.id.text
+    if isinstance(text, bytes):
+        text = text.decode('utf-8')
+    return re.split('[/:]', text)[-1]
+
+
+GetVideoId = get_video_id
+
+
+def upload_video(client, entry, filename_or_handle, content_type,
+                 username='default', session_store=None, limiter=None,
+                 chunk_size=None, headers=None):
+    """Uploads a video with the resumable upload protocol.
+
+    Args:
+      client: gdata.youtube.service.YouTubeService or
+          gdata.youtube.client.YouTubeClient used for the requests.
+      entry: The YouTubeVideoEntry (v1) or gdata.youtube.data.VideoEntry (v2)
+          with the metadata of the video.
+      filename_or_handle: The path of the video, or a binary file object
+          positioned at its start.
+      content_type: str The mime type of the video, for example
+          'video/quicktime'.
+      username: str (optional) The account the video is uploaded to.
+      session_store: gdata.client.UploadSessionStore (optional) Where the
+          upload URI is kept until the video is complete. An unfinished
+          upload of the same file is resumed.
+      limiter: BandwidthLimiter (optional) Budget the chunks are sent within.
+      chunk_size: int (optional) Size of each chunk.
+      headers: dict (optional) Additional headers for the request which
+          starts the upload.
+
+    Returns:
+      The uploaded video entry, of the entry class of the client.
+
+    Raises:
+      gdata.client.RequestError: The server refused the upload.
+    """
+    if isinstance(client, gdata.client.GDClient):
+        transport = client
+        desired_class = gdata.youtube.data.VideoEntry
+    else:
+        transport = ServiceTransport(client)
+        desired_class = gdata.youtube.YouTubeVideoEntry
+
+    if isinstance(filename_or_handle, str):
+        file_handle = open(filename_or_handle, 'rb')
+    else:
+        file_handle = filename_or_handle
+    try:
+        try:
+            total_file_size = os.fstat(file_handle.fileno()).st_size
+            total_file_size -= file_handle.tell()
+        except (AttributeError, OSError, ValueError):
+            start = file_handle.tell()
+            total_file_size = file_handle.seek(0, os.SEEK_END) - start
+            file_handle.seek(start)
+        custom_headers = {'Slug': os.path.basename(
+            getattr(file_handle, 'name', None) or 'video')}
+        if headers is not None:
+            custom_headers.update(headers)
+        uploader = VideoUploader(
+            transport, file_handle, content_type, total_file_size,
+            limiter=limiter, chunk_size=chunk_size,
+            desired_class=desired_class, session_store=session_store)
+        return uploader.upload_file(RESUMABLE_UPLOAD_URI % username,
+                                    entry=entry, headers=custom_headers)
+    finally:
+        if file_handle is not filename_or_handle:
+            file_handle.close()
+
+
+UploadVideo = upload_video
+
+
+class VideoUpload(object):
+    """One video of a ParallelVideoUploader run.
+
+    Attributes:
+      entry: The video entry with the metadata of the video.
+      path: str The path of the video file.
+      content_type: str The mime type of the video.
+      username: str The account the video is uploaded to.
+      result: The uploaded video entry, None until the upload succeeds.
+      video_id: str The YouTube id of the uploaded video.
+      state: str PROCESSING, PUBLISHED or the failure state reported by
+          CheckUploadStatus, None until the status is checked.
+      message: str The detail of the state, if any.
+      error: The exception which stopped the upload or the status check.
+    """
+
+    def __init__(self, entry, path, content_type='video/quicktime',
+                 username='default'):
+        self.entry = entry
+        self.path = path
+        self.content_type = content_type
+        self.username = username
+        self.result = None
+        self.video_id = None
+        self.state = None
+        self.message = None
+        self.error = None
+
+    def __repr__(self):
+        return 'VideoUpload(%r, %r, %r)' % (self.path, self.video_id,
+                                            self.state)
+
+
+class ParallelVideoUploader(object):
+    """Uploads many videos at once and waits for YouTube to process them."""
+
+    def __init__(self, client, session_store=None, limiter=None,
+                 max_workers=DEFAULT_MAX_WORKERS, chunk_size=None,
+                 poll_interval=DEFAULT_POLL_INTERVAL, sleep=time.sleep):
+        """Creates an uploader.
+
+        Args:
+          client: gdata.youtube.service.YouTubeService or
+              gdata.youtube.client.YouTubeClient used from several threads.
+          session_store: gdata.client.UploadSessionStore (optional) Keeps the
+              upload URIs, so a later run resumes unfinished videos.
+          limiter: BandwidthLimiter (optional) Bandwidth budget shared by all
+              the uploads.
+          max_workers: int (optional) Number of videos uploaded at once.
+          chunk_size: int (optional) Size of each chunk.
+          poll_interval: int (optional) Seconds between status checks.
+          sleep: (optional) function called to wait between status checks.
+        """
+        self.client = client
+        self.session_store = session_store
+        self.limiter = limiter
+        self.max_workers = max_workers
+        self.chunk_size = chunk_size
+        self.poll_interval = poll_interval
+        self._sleep = sleep
+
+    def upload(self, uploads, progress=None):
+        """Uploads every video, returning the list of VideoUploads.
+
+        A failed upload does not stop the others; its error is kept in the
+        VideoUpload.
+
+        Args:
+          uploads: iterable of VideoUploads.
+          progress: (optional) function called as progress(upload) when a
+              video is done, from the calling thread.
+        """
+        uploads = list(uploads)
+        with concurrent.futures.ThreadPoolExecutor(
+                max_workers=self.max_workers) as executor:
+            futures = [executor.submit(self._upload_one, upload)
+                       for upload in uploads]
+            for future in concurrent.futures.as_completed(futures):
+                upload = future.result()
+                if progress is not None:
+                    progress(upload)
+        return uploads
+
+    Upload = upload
+
+    def _upload_one(self, upload):
+        try:
+            upload.result = upload_video(
+                self.client, upload.entry, upload.path, upload.content_type,
+                username=upload.username, session_store=self.session_store,
+                limiter=self.limiter, chunk_size=self.chunk_size)
+        except (gdata.client.Error, OSError) as error:
+            upload.error = error
+        else:
+            upload.video_id = get_video_id(upload.result)
+        return upload
+
+    def wait_for_processing(self, uploads, timeout=None):
+        """Polls CheckUploadStatus until the uploaded videos are processed.
+
+        Args:
+          uploads: list of VideoUploads, those which failed to upload are
+              skipped.
+          timeout: int (optional) Seconds after which to stop polling, with
+              some videos possibly still PROCESSING.
+
+        Returns:
+          The VideoUploads which are still PROCESSING.
+        """
+        started = time.monotonic()
+        pending = [upload for upload in uploads
+                   if upload.video_id is not None and upload.error is None
+                   and upload.state in (None, PROCESSING)]
+        with concurrent.futures.ThreadPoolExecutor(
+                max_workers=self.max_workers) as executor:
+            while pending:
+                list(executor.map(self._check_status, pending))
+                pending = [upload for upload in pending
+                           if upload.state == PROCESSING]
+                if not pending or (timeout is not None and
+                                   time.monotonic() - started >= timeout):
+                    break
+                self._sleep(self.poll_interval)
+        return pending
+
+    WaitForProcessing = wait_for_processing
+
+    def _check_status(self, upload):
+        try:
+            status = self.client.CheckUploadStatus(video_id=upload.video_id)
+        except (gdata.client.Error, gdata.service.Error) as error:
+            upload.error = error
+            upload.state = None
+            return
+        if status is None:
+            upload.state, upload.message = PUBLISHED, None
+        else:
+            upload.state, upload.message = status
@@ -21,6 +21,10 @@
 # __author__ = 'j.s@google.com (Jeff Scudder)'
 
 import io
+import os
+import socket
+import tempfile
+import threading
 import unittest
 
 import atom.http_core
@@ -147,9 +151,85 @@ class HttpRequestTest(unittest.TestCase):
         self.assertTrue(request._body_parts != copied._body_parts)
 
 
+class RecordingConnection(object):
+    """Collects what is sent, keeping track of the types of the blocks."""
+
+    def __init__(self, sock=None):
+        self.sock = sock
+        self.sent = []
+        self.types = set()
+
+    def send(self, data):
+        self.sent.append(bytes(data))
+        self.types.add(type(data))
+
+
+class SendDataPartTest(unittest.TestCase):
+    def setUp(self):
+        self.content = os.urandom(atom.http_core.SEND_BLOCK_SIZE + 1000)
+        handle, self.path = tempfile.mkstemp()
+        os.write(handle, self.content)
+        os.close(handle)
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def test_send_buffers(self):
+        connection = RecordingConnection()
+        for part in ('abc', b'def', bytearray(b'ghi'), memoryview(b'jkl')):
+            atom.http_core._send_data_part(part, connection)
+        self.assertEqual(b''.join(connection.sent), b'abcdefghijkl')
+
+    def test_send_mapped_file(self):
+        connection = RecordingConnection()
+        with open(self.path, 'rb') as file_handle:
+            file_handle.seek(10)
+            atom.http_core._send_data_part(file_handle, connection)
+            self.assertEqual(file_handle.tell(), len(self.content))
+        self.assertEqual(b''.join(connection.sent), self.content[10:])
+        self.assertEqual(connection.types, set([memoryview]))
+
+    def test_sendfile(self):
+        sender, receiver = socket.socketpair()
+        received = []
+
+        def Receive():
+            data = receiver.recv(65536)
+            while data:
+                received.append(data)
+                data = receiver.recv(65536)
+
+        reader = threading.Thread(target=Receive)
+        reader.start()
+        connection = RecordingConnection(sock=sender)
+        try:
+            with open(self.path, 'rb') as file_handle:
+                file_handle.seek(10)
+                atom.http_core._send_data_part(file_handle, connection)
+            sender.shutdown(socket.SHUT_WR)
+            reader.join()
+        finally:
+            sender.close()
+            receiver.close()
+        # Nothing went through connection.send, the socket sent the file.
+        self.assertEqual(connection.sent, [])
+        self.assertEqual(b''.join(received), self.content[10:])
+
+    def test_send_stream(self):
+        connection = RecordingConnection()
+        atom.http_core._send_data_part(io.BytesIO(self.content), connection)
+        self.assertEqual(b''.join(connection.sent), self.content)
+
+    def test_add_memoryview_body_part(self):
+        request = atom.http_core.HttpRequest()
+        request.add_body_part(memoryview(b'abcdef')[1:4], 'text/plain')
+        self.assertEqual(request.headers['Content-Length'], '3')
+
+
 def suite():
     return unittest.TestSuite((unittest.makeSuite(UriTest, 'test'),
-                               unittest.makeSuite(HttpRequestTest, 'test')))
+                               unittest.makeSuite(HttpRequestTest, 'test'),
+                               unittest.makeSuite(SendDataPartTest, 'test')))
 
 
 if __name__ == '__main__':
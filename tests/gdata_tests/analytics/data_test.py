@@ -20,9 +20,12 @@ ManagementFeedAdvSegTest: Unit tests for ManagementFeed class.
 
 # __author__ = 'api.nickm@google.com (Nick Mihailovski)'
 
+import io
 import unittest
 
 import atom.core
+import atom.http_core
+import gdata.analytics.client
 import gdata.analytics.data
 import gdata.test_config as conf
 from gdata import test_data
@@ -433,6 +436,104 @@ class ManagementFeedAdvSegTest(unittest.TestCase):
         self.assertEqual(definition.text, 'ga:source=~^\Qgoogle\E')
 
 
+DATA_PAGE = """<feed xmlns='http://www.w3.org/2005/Atom'
+    xmlns:openSearch='http://a9.com/-/spec/opensearch/1.1/'
+    xmlns:dxp='http://schemas.google.com/analytics/2009'>
+  %s
+  <openSearch:totalResults>3</openSearch:totalResults>
+  <dxp:aggregates>
+    <dxp:metric name='ga:visits' type='integer' value='60'/>
+    <dxp:metric name='ga:avgTimeOnSite' type='time' value='12.5'/>
+  </dxp:aggregates>
+  <dxp:containsSampledData>%s</dxp:containsSampledData>
+  %s
+</feed>"""
+DATA_ROW = """<entry>
+    <link rel='alternate' href='http://www.google.com/analytics'/>
+    <dxp:dimension name='ga:country' value='%s'/>
+    <dxp:metric name='ga:visits' type='integer' value='%s'/>
+    <dxp:metric name='ga:avgTimeOnSite' type='time' value='%s'/>
+  </entry>"""
+NEXT_LINK = "<link rel='next' href='https://www.google.com/analytics/feeds/data?start-index=3'/>"
+
+
+class FakeDataServer(object):
+    """Serves the pages of a data feed, the next one for each request."""
+
+    def __init__(self, pages):
+        self.pages = list(pages)
+        self.uris = []
+
+    def request(self, http_request):
+        self.uris.append(str(http_request.uri))
+        return atom.http_core.HttpResponse(
+            200, 'OK', {}, io.BytesIO(self.pages.pop(0).encode('utf-8')))
+
+
+class DataColumnsTest(unittest.TestCase):
+    """Unit tests for reading Data Feed rows into DataColumns."""
+
+    def testReadDataRows(self):
+        """Tests streaming the test Data Feed into columns."""
+
+        columns = gdata.analytics.data.DataColumns()
+        next_link = gdata.analytics.data.read_data_rows(
+            io.BytesIO(test_data.ANALYTICS_DATA_FEED.encode('utf-8')), columns)
+        self.assertTrue(next_link.startswith(
+            'http://www.google.com/analytics/feeds/data?start-index=6'))
+        self.assertEqual(len(columns), 1)
+        self.assertEqual(columns.dimension_names, ['ga:source', 'ga:medium'])
+        self.assertEqual(columns.metric_names, ['ga:visits', 'ga:bounces'])
+        self.assertEqual(columns.get_row(0),
+                         ('blogger.com', 'referral', 68140, 61095))
+        self.assertEqual(columns.metrics['ga:visits'].typecode, 'q')
+        self.assertEqual(columns.aggregates,
+                         {'ga:visits': 136540, 'ga:bounces': 101535})
+        self.assertEqual(columns.total_results, 6451)
+        self.assertTrue(columns.contains_sampled_data)
+        self.assertEqual(columns.start_date, '2008-10-01')
+        self.assertEqual(columns.end_date, '2008-10-31')
+
+    def testGetDataColumns(self):
+        """Tests paging through a query with AnalyticsClient."""
+
+        server = FakeDataServer([
+            DATA_PAGE % (NEXT_LINK, 'false',
+                         DATA_ROW % ('France', '10', '1.5')
+                         + DATA_ROW % ('Chile', '20', '20.25')),
+            DATA_PAGE % ('', 'false', DATA_ROW % ('France', '30', '0')),
+        ])
+        client = gdata.analytics.client.AnalyticsClient()
+        client.http_client = server
+        query = gdata.analytics.client.DataFeedQuery({
+            'ids': 'ga:1174', 'dimensions': 'ga:country',
+            'metrics': 'ga:visits,ga:avgTimeOnSite'})
+        columns = client.get_data_columns(query)
+        self.assertEqual(len(server.uris), 2)
+        self.assertTrue(server.uris[1].endswith('start-index=3'))
+        self.assertEqual(list(columns.iter_rows()),
+                         [('France', 10, 1.5), ('Chile', 20, 20.25),
+                          ('France', 30, 0.0)])
+        country = columns.get_column('ga:country')
+        # Repeated dimension values share one string.
+        self.assertTrue(country[0] is country[2])
+        self.assertEqual(columns.get_column('ga:avgTimeOnSite').typecode, 'd')
+        self.assertEqual(columns.get_total('ga:visits'), 60)
+        self.assertEqual(columns.get_total('ga:avgTimeOnSite'), 12.5)
+        self.assertFalse(columns.contains_sampled_data)
+
+    def testMismatchedRow(self):
+        """Tests that a row with other columns is refused."""
+
+        columns = gdata.analytics.data.DataColumns()
+        columns.add_row([('ga:country', 'France')],
+                        [('ga:visits', 'integer', '1')])
+        self.assertRaises(ValueError, columns.add_row,
+                          [('ga:city', 'Paris')],
+                          [('ga:visits', 'integer', '1')])
+        self.assertEqual(len(columns), 1)
+
+
 def suite():
     """Test Account Feed, Data Feed and Management API Feeds."""
     return conf.build_suite([
@@ -440,7 +541,8 @@ def suite():
         DataFeedTest,
         ManagementFeedProfileTest,
         ManagementFeedGoalTest,
-        ManagementFeedAdvSegTest])
+        ManagementFeedAdvSegTest,
+        DataColumnsTest])
 
 
 if __name__ == '__main__':
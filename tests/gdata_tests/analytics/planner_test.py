@@ -0,0 +1,228 @@
+#
+# Licensed under the Apache License 2.0;
+
+
+import datetime
+import io
+import math
+import threading
+import unittest
+
+import atom.http_core
+import gdata.analytics.client
+import gdata.analytics.data
+import gdata.analytics.planner
+import gdata.client
+import gdata.test_config as conf
+
+FEED = """<feed xmlns='http://www.w3.org/2005/Atom'
+    xmlns:openSearch='http://a9.com/-/spec/opensearch/1.1/'
+    xmlns:dxp='http://schemas.google.com/analytics/2009'>
+  %s
+  <openSearch:totalResults>%s</openSearch:totalResults>
+  <dxp:aggregates>
+    <dxp:metric name='ga:visits' type='integer' value='%s'/>
+    <dxp:metric name='ga:avgTimeOnSite' type='time' value='9.5'/>
+  </dxp:aggregates>
+  <dxp:containsSampledData>%s</dxp:containsSampledData>
+  %s
+</feed>"""
+NEXT_LINK = ("<link rel='next' href='https://www.google.com/analytics/feeds/"
+             "data?%s'/>")
+FIRST_DAY = datetime.date(2011, 1, 1)
+
+
+class FakeAnalyticsServer(object):
+    """Answers data feed queries over a made up history of visits.
+
+    On day number n from FIRST_DAY, google sends n + 1 visits and bing
+    sends 2 visits on even days. Ranges longer than max_unsampled_days are
+    reported as sampled.
+    """
+
+    def __init__(self, max_unsampled_days=3):
+        self.max_unsampled_days = max_unsampled_days
+        self.queries = []
+        self.lock = threading.Lock()
+
+    def get_rows(self, start_date, end_date, by_date):
+        rows = []
+        totals = {}
+        day = start_date
+        while day <= end_date:
+            number = (day - FIRST_DAY).days
+            visits = [('google', number + 1)]
+            if number % 2 == 0:
+                visits.append(('bing', 2))
+            for source, count in visits:
+                if by_date:
+                    rows.append((day.strftime('%Y%m%d'), source, count))
+                else:
+                    totals[source] = totals.get(source, 0) + count
+            day += datetime.timedelta(days=1)
+        if not by_date:
+            rows = sorted((None, source, count)
+                          for source, count in totals.items())
+        return rows
+
+    def request(self, http_request):
+        query = dict(http_request.uri.query)
+        with self.lock:
+            self.queries.append(query)
+        start_date = gdata.analytics.planner.parse_date(query['start-date'])
+        end_date = gdata.analytics.planner.parse_date(query['end-date'])
+        by_date = query['dimensions'].startswith('ga:date')
+        rows = self.get_rows(start_date, end_date, by_date)
+        first = int(query.get('start-index', 1))
+        size = int(query['max-results'])
+        entries = []
+        for date, source, count in rows[first - 1:first - 1 + size]:
+            dimensions = "<dxp:dimension name='ga:source' value='%s'/>" % (
+                source)
+            if by_date:
+                dimensions = ("<dxp:dimension name='ga:date' value='%s'/>"
+                              % date) + dimensions
+            entries.append(
+                "<entry>%s<dxp:metric name='ga:visits' type='integer' "
+                "value='%s'/><dxp:metric name='ga:avgTimeOnSite' "
+                "type='time' value='%s'/></entry>" % (dimensions, count,
+                                                      count / 2.0))
+        link = ''
+        if first - 1 + size < len(rows):
+            next_query = dict(query)
+            next_query['start-index'] = str(first + size)
+            link = NEXT_LINK % '&amp;'.join(
+                '%s=%s' % pair for pair in sorted(next_query.items()))
+        sampled = (end_date - start_date).days + 1 > self.max_unsampled_days
+        feed = FEED % (link, len(rows), sum(row[2] for row in rows),
+                       'true' if sampled else 'false', ''.join(entries))
+        return atom.http_core.HttpResponse(
+            200, 'OK', {}, io.BytesIO(feed.encode('utf-8')))
+
+
+class SplitDateRangeTest(unittest.TestCase):
+    def testWeeksAndDays(self):
+        self.assertEqual(
+            gdata.analytics.planner.split_date_range('2011-01-01',
+                                                     '2011-01-16'),
+            [(datetime.date(2011, 1, 1), datetime.date(2011, 1, 7)),
+             (datetime.date(2011, 1, 8), datetime.date(2011, 1, 14)),
+             (datetime.date(2011, 1, 15), datetime.date(2011, 1, 16))])
+        self.assertEqual(
+            len(gdata.analytics.planner.split_date_range(
+                datetime.date(2011, 1, 30), '2011-02-02',
+                gdata.analytics.planner.DAY)), 4)
+        self.assertEqual(gdata.analytics.planner.split_date_range(
+            '2011-01-02', '2011-01-01'), [])
+
+
+class QueryPlannerTest(unittest.TestCase):
+    def setUp(self):
+        self.server = FakeAnalyticsServer()
+        self.client = gdata.analytics.client.AnalyticsClient()
+        self.client.http_client = self.server
+        self.now = [0.0]
+        self.waits = []
+        self.limiter = gdata.client.RateLimiter(
+            10, clock=lambda: self.now[0], sleep=self.waits.append)
+
+    def query(self, dimensions, sort=None):
+        parameters = {'ids': 'ga:1174', 'dimensions': dimensions,
+                      'metrics': 'ga:visits,ga:avgTimeOnSite',
+                      'start-date': '2011-01-01', 'end-date': '2011-01-16',
+                      'max-results': '1'}
+        if sort:
+            parameters['sort'] = sort
+        return gdata.analytics.client.DataFeedQuery(parameters)
+
+    def testSplitsSampledShardsAndCombinesRows(self):
+        planner = gdata.analytics.planner.QueryPlanner(
+            self.client, max_workers=3, limiter=self.limiter)
+        done = []
+        result = planner.run(self.query('ga:source', sort='-ga:visits'),
+                             progress=done.append)
+        # Both full weeks are cut into 4 + 3 days, then 2 + 2 + 3 days.
+        self.assertEqual(result.splits, 4)
+        self.assertEqual(len(done), 11)
+        self.assertEqual([(shard.start_date.day, shard.end_date.day)
+                          for shard in result.shards],
+                         [(1, 2), (3, 4), (5, 7), (8, 9), (10, 11),
+                          (12, 14), (15, 16)])
+        self.assertFalse(result.is_sampled())
+        self.assertEqual(result.requests, len(self.server.queries))
+        # Every page waited for the limiter, after the first burst.
+        self.assertEqual(len(self.waits), result.requests - 10)
+
+        columns = result.columns
+        self.assertEqual(columns.get_column('ga:source'), ['google', 'bing'])
+        self.assertEqual(list(columns.get_column('ga:visits')), [136, 16])
+        self.assertTrue(all(math.isnan(value) for value in
+                            columns.get_column('ga:avgTimeOnSite')))
+        # The aggregates come from one request over the whole range.
+        self.assertEqual(columns.aggregates,
+                         {'ga:visits': 152, 'ga:avgTimeOnSite': 9.5})
+        whole = [query for query in self.server.queries
+                 if query['end-date'] == '2011-01-16'
+                 and query['start-date'] == '2011-01-01']
+        self.assertEqual(len(whole), 1)
+        self.assertEqual(whole[0]['max-results'], '1')
+        self.assertEqual(columns.total_results, 2)
+        self.assertEqual(columns.start_date, '2011-01-01')
+
+    def testDateDimensionKeepsRowsInOrder(self):
+        self.server.max_unsampled_days = 0
+        planner = gdata.analytics.planner.QueryPlanner(
+            self.client, shard=gdata.analytics.planner.DAY,
+            limiter=self.limiter)
+        result = planner.run(self.query('ga:date,ga:source'))
+        self.assertEqual(result.splits, 0)
+        # One day can not be split further.
+        self.assertTrue(result.is_sampled())
+        columns = result.columns
+        self.assertEqual(len(columns), 24)
+        self.assertEqual(columns.get_row(0), ('20110101', 'google', 1, 0.5))
+        self.assertEqual(columns.get_row(1), ('20110101', 'bing', 2, 1.0))
+        self.assertEqual(columns.get_row(23),
+                         ('20110116', 'google', 16, 8.0))
+        self.assertEqual(sorted(columns.get_column('ga:date')),
+                         columns.get_column('ga:date'))
+
+    def testMergeSorts(self):
+        shards = []
+        for rows in ([('b', '1'), ('a', '5')], [('c', '3'), ('a', '1')]):
+            shard = gdata.analytics.planner.Shard(FIRST_DAY, FIRST_DAY)
+            shard.columns = gdata.analytics.data.DataColumns()
+            for source, visits in rows:
+                shard.columns.add_row([('ga:source', source)],
+                                      [('ga:visits', 'integer', visits)])
+            shards.append(shard)
+        merged = gdata.analytics.planner.merge_shards(shards,
+                                                      '-ga:visits,ga:source')
+        self.assertEqual(list(merged.iter_rows()),
+                         [('a', 6), ('c', 3), ('b', 1)])
+        merged = gdata.analytics.planner.merge_shards(shards, 'ga:source')
+        self.assertEqual(merged.get_column('ga:source'), ['a', 'b', 'c'])
+
+    def testDistinctCountsAreNotSummed(self):
+        shards = []
+        for visitors in ('3', '4'):
+            shard = gdata.analytics.planner.Shard(FIRST_DAY, FIRST_DAY)
+            shard.columns = gdata.analytics.data.DataColumns()
+            shard.columns.add_row([('ga:source', 'a')],
+                                  [('ga:visits', 'integer', '5'),
+                                   ('ga:visitors', 'integer', visitors)])
+            shard.columns.aggregates = {'ga:visits': 5,
+                                        'ga:visitors': int(visitors)}
+            shards.append(shard)
+        merged = gdata.analytics.planner.merge_shards(shards)
+        self.assertEqual(merged.get_row(0)[:2], ('a', 10))
+        self.assertTrue(math.isnan(merged.get_row(0)[2]))
+        self.assertEqual(merged.aggregates, {'ga:visits': 10})
+
+
+def suite():
+    return conf.build_suite([SplitDateRangeTest, QueryPlannerTest])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,184 @@
+#
+# Licensed under the Apache License 2.0;
+
+
+import http.client
+import io
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+import atom.http_core
+import gdata.apps.emailsettings.bulk
+import gdata.apps.emailsettings.client
+import gdata.apps.multidomain.data
+import gdata.client
+import gdata.test_config as conf
+
+
+class FakeSettingsServer(object):
+    """Stores the signature of each user.
+
+    failures maps a user name to the statuses to answer its next requests
+    with, or to exceptions to raise instead.
+    """
+
+    def __init__(self):
+        self.signatures = {}
+        self.requests = []
+        self.failures = {}
+        self.lock = threading.Lock()
+
+    def request(self, http_request):
+        domain, username, setting = http_request.uri.path.split('/')[-3:]
+        body = http_request._body_parts[0]
+        with self.lock:
+            self.requests.append((domain, username))
+            statuses = self.failures.get(username)
+            if statuses:
+                status = statuses.pop(0)
+                if isinstance(status, Exception):
+                    raise status
+                return atom.http_core.HttpResponse(
+                    status, 'Error', {}, io.BytesIO(b'Server error'))
+            self.signatures['%s@%s' % (username, domain)] = body
+        return atom.http_core.HttpResponse(200, 'OK', {},
+                                           io.BytesIO(body.encode('utf-8')))
+
+
+class CountingLimiter(gdata.client.RateLimiter):
+    def __init__(self):
+        gdata.client.RateLimiter.__init__(self, 1000)
+        self.acquired = 0
+
+    def acquire(self, amount=1):
+        with self._lock:
+            self.acquired += amount
+        return 0
+
+
+class BulkExecutorTest(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.temp_dir, 'signature.log')
+        self.server = FakeSettingsServer()
+        self.client = gdata.apps.emailsettings.client.EmailSettingsClient(
+            domain='example.com')
+        self.client.http_client = self.server
+        self.sleeps = []
+        self.limiters = {'example.com': CountingLimiter(),
+                         'example.org': CountingLimiter()}
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def execute(self, users, signature='Example Inc.', executor=None):
+        if executor is None:
+            executor = self.make_executor()
+        operation = gdata.apps.emailsettings.bulk.SettingsOperation(
+            'update_signature', signature=signature)
+        return executor.execute(users, operation)
+
+    def make_executor(self):
+        return gdata.apps.emailsettings.bulk.BulkExecutor(
+            self.client, gdata.apps.emailsettings.bulk.BulkCheckpoint(
+                self.path), max_workers=3, limiters=self.limiters,
+            sleep=self.sleeps.append)
+
+    def testRetriesAndCheckpoint(self):
+        users = ['user%s' % number for number in range(10)]
+        users.append(gdata.apps.multidomain.data.UserEntry(
+            email='ann@example.org'))
+        self.server.failures = {'user3': [503, 500],
+                                'user5': [403],
+                                'user7': [503] * 4}
+        result = self.execute(iter(users))
+        self.assertEqual(result.succeeded, 9)
+        self.assertEqual(sorted(result.failed), ['user5', 'user7'])
+        self.assertEqual(result.failed['user5'].status, 403)
+        self.assertEqual(result.retries, 5)
+        self.assertEqual(sorted(self.sleeps), [1.0, 1.0, 2.0, 2.0, 4.0])
+        self.assertEqual(len(self.server.signatures), 9)
+        self.assertTrue('Example Inc.' in
+                        self.server.signatures['ann@example.org'])
+        # Every attempt went through the limiter of its domain.
+        self.assertEqual(self.limiters['example.com'].acquired, 15)
+        self.assertEqual(self.limiters['example.org'].acquired, 1)
+        self.assertTrue(result.get_summary().startswith(
+            '9 succeeded, 0 skipped, 2 failed, 5 retries in '))
+
+        # A rerun only sends the users which failed.
+        self.server.failures = {}
+        self.server.requests = []
+        result = self.execute(users)
+        self.assertEqual((result.succeeded, result.skipped), (2, 9))
+        self.assertEqual(sorted(self.server.requests),
+                         [('example.com', 'user5'), ('example.com', 'user7')])
+
+        # Another signature is a new operation.
+        result = self.execute(users, signature='Example Ltd.')
+        self.assertEqual((result.succeeded, result.skipped), (11, 0))
+
+    def testClientErrorsAreNotRetried(self):
+        self.server.failures = {'ann': [400], 'bob': [404], 'cat': [409]}
+        result = self.execute(['ann', 'bob', 'cat', 'dan'])
+        self.assertEqual(result.succeeded, 1)
+        self.assertEqual(dict((username, error.status) for username, error
+                              in result.failed.items()),
+                         {'ann': 400, 'bob': 404, 'cat': 409})
+        self.assertEqual(result.retries, 0)
+        self.assertEqual(self.sleeps, [])
+        self.assertEqual(len(self.server.requests), 4)
+
+    def testTransportErrorsAreRetried(self):
+        self.server.failures = {
+            'ann': [http.client.IncompleteRead(b'partial')],
+            'bob': [ConnectionResetError()] * 4}
+        result = self.execute(['ann', 'bob'])
+        self.assertEqual(result.succeeded, 1)
+        self.assertTrue(isinstance(result.failed['bob'],
+                                   ConnectionResetError))
+        self.assertEqual(result.retries, 4)
+        self.assertTrue('Example Inc.' in
+                        self.server.signatures['ann@example.com'])
+
+    def testLimiterPerDomain(self):
+        executor = self.make_executor()
+        users = ['ann', 'bob@example.com', 'cat@Example.ORG',
+                 'dan@example.org', 'eve@example.net', 'fay@example.net',
+                 'gus@example.net']
+        result = self.execute(users, executor=executor)
+        self.assertEqual(result.succeeded, 7)
+        self.assertEqual(self.limiters['example.com'].acquired, 2)
+        self.assertEqual(self.limiters['example.org'].acquired, 2)
+        # A domain without a limiter gets its own.
+        limiter = executor.get_limiter('example.net')
+        self.assertFalse(limiter in self.limiters.values())
+        self.assertEqual(limiter.rate,
+                         gdata.apps.emailsettings.bulk
+                         .DEFAULT_QUERIES_PER_SECOND)
+        self.assertTrue(executor.get_limiter('example.net') is limiter)
+        self.assertEqual(sorted(executor.limiters),
+                         ['example.com', 'example.net', 'example.org'])
+
+    def testOperationKey(self):
+        first = gdata.apps.emailsettings.bulk.SettingsOperation(
+            'update_vacation', True, subject='Away', message='Back soon')
+        second = gdata.apps.emailsettings.bulk.SettingsOperation(
+            'update_vacation', True, message='Back soon', subject='Away')
+        self.assertEqual(first.key, second.key)
+        self.assertTrue(first.key.startswith('update_vacation:'))
+        named = gdata.apps.emailsettings.bulk.SettingsOperation(
+            'update_vacation', False, key='vacation-off')
+        self.assertEqual(named.key, 'vacation-off')
+        self.assertEqual(named.kwargs, {})
+
+
+def suite():
+    return conf.build_suite([BulkExecutorTest])
+
+
+if __name__ == '__main__':
+    unittest.main()
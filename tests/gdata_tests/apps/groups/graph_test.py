@@ -0,0 +1,155 @@
+#
+# Licensed under the Apache License 2.0;
+
+
+import io
+import threading
+import unittest
+
+import atom.http_core
+import gdata.apps.groups.client
+import gdata.apps.groups.graph
+import gdata.test_config as conf
+
+FEED = """<feed xmlns='http://www.w3.org/2005/Atom'
+    xmlns:apps='http://schemas.google.com/apps/2006'>%s%s</feed>"""
+NEXT_LINK = "<link rel='next' href='%s?start=%s'/>"
+GROUP_ENTRY = "<entry><apps:property name='groupId' value='%s'/></entry>"
+MEMBER_ENTRY = ("<entry><apps:property name='memberId' value='%s'/>"
+                "<apps:property name='memberType' value='%s'/></entry>")
+PATH = '/a/feeds/group/2.0/example.com'
+
+
+class FakeGroupsServer(object):
+    """Serves the group and member feeds of a domain, two entries a page.
+
+    groups maps each group id to its list of (member id, member type).
+    """
+
+    def __init__(self, groups):
+        self.groups = groups
+        self.requests = []
+        self.lock = threading.Lock()
+
+    def request(self, http_request):
+        path = http_request.uri.path
+        with self.lock:
+            self.requests.append(path)
+        start = int(dict(http_request.uri.query).get('start', 0))
+        if path == PATH:
+            entries = [GROUP_ENTRY % group_id
+                       for group_id in sorted(self.groups)]
+        else:
+            group_id = path.split('/')[-2]
+            if group_id not in self.groups:
+                return atom.http_core.HttpResponse(
+                    404, 'Not Found', {}, io.BytesIO(b'Group not found'))
+            entries = [MEMBER_ENTRY % member
+                       for member in self.groups[group_id]]
+        link = ''
+        if start + 2 < len(entries):
+            link = NEXT_LINK % ('https://apps-apis.google.com' + path,
+                                start + 2)
+        feed = FEED % (link, ''.join(entries[start:start + 2]))
+        return atom.http_core.HttpResponse(200, 'OK', {},
+                                           io.BytesIO(feed.encode('utf-8')))
+
+
+class MembershipGraphTest(unittest.TestCase):
+    def setUp(self):
+        self.server = FakeGroupsServer({
+            'all@example.com': [('eng@example.com', 'Group'),
+                                ('sales@example.com', 'Group'),
+                                ('ceo@example.com', 'User')],
+            'eng@example.com': [('web@example.com', 'Group'),
+                                ('Ann@Example.com', 'User'),
+                                ('bob@example.com', 'User')],
+            'web@example.com': [('cat@example.com', 'User'),
+                                ('all@example.com', 'Group')],
+            'sales@example.com': [('dan@example.com', 'User'),
+                                  ('partners@other.com', 'Group')],
+        })
+        self.client = gdata.apps.groups.client.GroupsProvisioningClient(
+            domain='example.com')
+        self.client.http_client = self.server
+        self.graph = gdata.apps.groups.graph.MembershipGraph()
+        self.graph.load(self.client, max_workers=3)
+
+    def testLoad(self):
+        self.assertEqual(len(self.graph), 4)
+        # Two pages of groups, then two member feeds of two pages and two
+        # of one.
+        self.assertEqual(len(self.server.requests), 2 + 2 * 2 + 2)
+        self.assertEqual(self.graph.members['eng@example.com'],
+                         set(['web@example.com', 'ann@example.com',
+                              'bob@example.com']))
+        self.assertTrue(self.graph.is_group('Web@example.com'))
+        self.assertFalse(self.graph.is_group('partners@other.com'))
+
+    def testTransitiveLookups(self):
+        requests = len(self.server.requests)
+        # web and all contain each other.
+        self.assertEqual(self.graph.get_members('web@example.com'),
+                         frozenset(['cat@example.com', 'ceo@example.com',
+                                    'ann@example.com', 'bob@example.com',
+                                    'dan@example.com']))
+        self.assertEqual(self.graph.get_members('eng@example.com'),
+                         self.graph.get_members('all@example.com'))
+        self.assertEqual(
+            self.graph.get_members('sales@example.com', include_groups=True),
+            frozenset(['dan@example.com', 'partners@other.com']))
+        self.assertEqual(self.graph.get_groups('cat@example.com'),
+                         frozenset(['web@example.com', 'eng@example.com',
+                                    'all@example.com']))
+        self.assertEqual(self.graph.get_groups('dan@example.com'),
+                         frozenset(['sales@example.com', 'all@example.com',
+                                    'web@example.com', 'eng@example.com']))
+        self.assertTrue(self.graph.is_member('ANN@example.com',
+                                             'web@example.com'))
+        self.assertFalse(self.graph.is_member('eve@example.com',
+                                              'all@example.com'))
+        self.assertEqual(self.graph.get_members('missing@example.com'),
+                         frozenset())
+        # Every answer came from the local graph.
+        self.assertEqual(len(self.server.requests), requests)
+
+    def testIncrementalChanges(self):
+        self.assertTrue(self.graph.is_member('dan@example.com',
+                                             'eng@example.com'))
+        self.assertIn('ann@example.com',
+                      self.graph.get_members('all@example.com'))
+        # Breaking the cycle takes sales out of eng.
+        self.graph.remove_member('web@example.com', 'all@example.com')
+        self.assertFalse(self.graph.is_member('dan@example.com',
+                                              'eng@example.com'))
+        self.assertEqual(self.graph.get_members('web@example.com'),
+                         frozenset(['cat@example.com']))
+        self.assertIn('ann@example.com',
+                      self.graph.get_members('all@example.com'))
+
+        self.graph.add_member('web@example.com', 'eve@example.com')
+        self.assertTrue(self.graph.is_member('eve@example.com',
+                                             'all@example.com'))
+
+        # eng is deleted and sales gains a member on the server.
+        del self.server.groups['eng@example.com']
+        self.server.groups['sales@example.com'].append(('fay@example.com',
+                                                        'User'))
+        self.graph.refresh_groups(self.client, ['eng@example.com',
+                                                'sales@example.com'])
+        self.assertFalse('eng@example.com' in self.graph)
+        self.assertEqual(self.graph.get_groups('ann@example.com'),
+                         frozenset())
+        self.assertEqual(self.graph.get_members('all@example.com'),
+                         frozenset(['ceo@example.com', 'dan@example.com',
+                                    'fay@example.com']))
+        self.assertEqual(self.graph.get_groups('eve@example.com'),
+                         frozenset(['web@example.com']))
+
+
+def suite():
+    return conf.build_suite([MembershipGraphTest])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -9,9 +9,13 @@
 # __author__ = 'google-apps-apis@googlegroups.com'
 
 import getpass
+import os
+import tempfile
+import threading
 import unittest
 
 import gdata.apps.migration.service
+import gdata.apps.service
 
 domain = ''
 admin_email = ''
@@ -49,6 +53,64 @@ class MigrationTest(unittest.TestCase):
         self.ms.ImportMultipleMails(user_name=username)
 
 
+class ImportMultipleMailsTest(unittest.TestCase):
+    """Tests the worker pool of ImportMultipleMails without a server."""
+
+    def setUp(self):
+        self.ms = gdata.apps.migration.service.MigrationService(domain='example.com')
+        self.imported = []
+        self.attempts = {}
+        self.lock = threading.Lock()
+
+        def ImportMail(user_name, mail_message, mail_item_properties,
+                       mail_labels):
+            with self.lock:
+                self.attempts[mail_message] = self.attempts.get(mail_message, 0) + 1
+                attempts = self.attempts[mail_message]
+            if mail_message.startswith('busy') and attempts == 1:
+                raise gdata.apps.service.AppsForYourDomainException(
+                    {'status': 503, 'reason': 'Service Unavailable', 'body': ''})
+            if mail_message.startswith('bad'):
+                raise gdata.apps.service.AppsForYourDomainException(
+                    {'status': 400, 'reason': 'Bad Request', 'body': ''})
+            with self.lock:
+                self.imported.append(mail_message)
+
+        self.ms.ImportMail = ImportMail
+
+    def testImportsAddedEntries(self):
+        for i in range(25):
+            self.ms.AddMailEntry(mail_message='message %d' % i)
+        self.assertEqual(self.ms.ImportMultipleMails('user', threads_per_batch=4), 25)
+        self.assertEqual(len(self.imported), 25)
+        self.assertEqual(self.ms.mail_entries, [])
+
+    def testRetriesBusyAndReportsFailures(self):
+        entries = (gdata.apps.migration.MailEntryProperties(mail_message=message)
+                   for message in ['ok', 'busy', 'bad'])
+        imported = self.ms.ImportMultipleMails('user', threads_per_batch=2,
+                                               mail_entries=entries, delay=0.01)
+        self.assertEqual(imported, 2)
+        self.assertEqual(sorted(self.imported), ['busy', 'ok'])
+        self.assertEqual(self.attempts['busy'], 2)
+        self.assertEqual(self.attempts['bad'], 1)
+        self.assertEqual(len(self.ms.failed_mail_entries), 1)
+        self.assertEqual(self.ms.failed_mail_entries[0][0].mail_message, 'bad')
+
+    def testMailEntriesFromMbox(self):
+        mbox_path = os.path.join(tempfile.mkdtemp(), 'test.mbox')
+        with open(mbox_path, 'w') as mbox_file:
+            for i in range(3):
+                mbox_file.write('From joe@blow.com Mon Sep 29 20:00:34 2008\n')
+                mbox_file.write(MESSAGE % ('Subject %d' % i, 'Body') + '\n\n')
+        entries = list(gdata.apps.migration.service.MailEntriesFromMbox(
+            mbox_path, mail_labels=['Imported']))
+        self.assertEqual(len(entries), 3)
+        self.assertTrue(b'Subject: Subject 2' in entries[2].mail_message)
+        self.assertEqual(entries[0].mail_labels, ['Imported'])
+        os.remove(mbox_path)
+
+
 if __name__ == '__main__':
     print("Google Apps Email Migration Service Tests\n\n"
           "NOTE: Please run these tests only with a test user account.\n")
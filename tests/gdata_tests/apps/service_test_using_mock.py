@@ -97,6 +97,14 @@ class AppsServiceTestForGetGeneratorForAllEmailLists(AppsServiceBaseTest,
                 i = i + 1
         self.assertTrue(i == 105)
 
+    def testGetEntryGeneratorForAllEmailLists(self):
+        """Tests GetEntryGeneratorForAllEmailLists method"""
+        generator = self.apps_client.GetEntryGeneratorForAllEmailLists()
+        i = 0
+        for a_emaillist in generator:
+            i = i + 1
+        self.assertTrue(i == 105)
+
 
 class AppsServiceTestForGetGeneratorForAllNicknames(AppsServiceBaseTest,
                                                     unittest.TestCase):
@@ -111,6 +119,14 @@ class AppsServiceTestForGetGeneratorForAllNicknames(AppsServiceBaseTest,
                 i = i + 1
         self.assertTrue(i == 102)
 
+    def testGetEntryGeneratorForAllNicknames(self):
+        """Tests GetEntryGeneratorForAllNicknames method"""
+        generator = self.apps_client.GetEntryGeneratorForAllNicknames()
+        i = 0
+        for a_nickname in generator:
+            i = i + 1
+        self.assertTrue(i == 102)
+
 
 class AppsServiceTestForGetGeneratorForAllUsers(AppsServiceBaseTest,
                                                 unittest.TestCase):
@@ -125,6 +141,14 @@ class AppsServiceTestForGetGeneratorForAllUsers(AppsServiceBaseTest,
                 i = i + 1
         self.assertTrue(i == 102)
 
+    def testGetEntryGeneratorForAllUsers(self):
+        """Tests GetEntryGeneratorForAllUsers method"""
+        generator = self.apps_client.GetEntryGeneratorForAllUsers()
+        i = 0
+        for a_user in generator:
+            i = i + 1
+        self.assertTrue(i == 102)
+
 
 if __name__ == '__main__':
     print('The tests may delete or update your data.')
@@ -0,0 +1,251 @@
+#
+# Licensed under the Apache License 2.0;
+
+
+import io
+import threading
+import unittest
+
+import atom.core
+import atom.data
+import atom.http_core
+import gdata.data
+import gdata.calendar.batch
+import gdata.calendar.client
+import gdata.calendar.data
+import gdata.test_config as conf
+
+FEEDS_URI = 'https://www.google.com/calendar/feeds/'
+
+
+class FakeBatchServer(object):
+    """Executes calendar batch requests and serves single events."""
+
+    def __init__(self):
+        self.events = {}
+        self.batches = []
+        self.clock = 0
+        self.lock = threading.Lock()
+
+    def save(self, calendar_id, name, title='', etag=None):
+        with self.lock:
+            self.clock += 1
+            event_id = '%s%s/events/%s' % (FEEDS_URI, calendar_id, name)
+            event = gdata.calendar.data.CalendarEventEntry(
+                id=atom.data.Id(text=event_id),
+                title=atom.data.Title(text=title),
+                link=[atom.data.Link(rel='self', href=(
+                    '%s%s/private/full/%s' % (FEEDS_URI, calendar_id,
+                                              name)))])
+            event.etag = etag or '"%s"' % self.clock
+            self.events[event_id] = event
+            return event
+
+    def _response(self, element, status=200):
+        return atom.http_core.HttpResponse(
+            status, 'OK', {}, io.BytesIO(element.to_string().encode('utf-8')))
+
+    def request(self, http_request):
+        uri = str(http_request.uri)
+        if http_request.method == 'GET':
+            event = self.events.get(uri.replace('/private/full/', '/events/'))
+            if event is None:
+                return atom.http_core.HttpResponse(
+                    404, 'Not Found', {}, io.BytesIO(b'Not Found'))
+            return self._response(event)
+        calendar_id = http_request.uri.path.split('/')[3]
+        request_feed = atom.core.parse(
+            http_request._body_parts[0].encode('utf-8'),
+            gdata.calendar.data.CalendarEventFeed)
+        with self.lock:
+            self.batches.append((calendar_id, len(request_feed.entry),
+                                 len(http_request._body_parts[0])))
+        response_feed = gdata.calendar.data.CalendarEventFeed()
+        for entry in request_feed.entry:
+            operation = entry.batch_operation.type
+            current = None
+            if entry.id is not None:
+                current = self.events.get(entry.id.text)
+            if operation == 'insert':
+                saved = self.save(calendar_id, 'new%s' % len(self.events),
+                                  entry.title.text)
+                saved.batch_id = entry.batch_id
+                entry = saved
+                code = 201
+            elif current is None:
+                code = 404
+            elif current.etag != entry.etag:
+                code = 412 if operation == 'update' else 409
+            elif operation == 'delete':
+                del self.events[entry.id.text]
+                code = 200
+            else:
+                saved = self.save(calendar_id, entry.id.text.split('/')[-1],
+                                  entry.title.text)
+                saved.batch_id = entry.batch_id
+                entry = saved
+                code = 200
+            entry.batch_status = gdata.data.BatchStatus(
+                code=str(code), reason='reason %s' % code)
+            response_feed.entry.append(entry)
+        return self._response(response_feed)
+
+
+class BatchExecutorTest(unittest.TestCase):
+    def setUp(self):
+        self.server = FakeBatchServer()
+        self.client = gdata.calendar.client.CalendarClient()
+        self.client.http_client = self.server
+
+    def insert(self, calendar_id, title):
+        return gdata.calendar.batch.EventOperation(
+            gdata.data.BATCH_INSERT,
+            gdata.calendar.data.CalendarEventEntry(
+                title=atom.data.Title(text=title)),
+            calendar_id)
+
+    def testGroupsAndChunks(self):
+        executor = gdata.calendar.batch.BatchExecutor(
+            self.client, max_workers=3, max_operations=4)
+        chunks = []
+        operations = (self.insert('cal%s@example.com' % (i % 3), 'e%s' % i)
+                      for i in range(20))
+        result = executor.execute(
+            operations, progress=lambda result, chunk: chunks.append(chunk))
+        self.assertEqual(len(result.succeeded), 20)
+        self.assertEqual(result.failed, [])
+        self.assertEqual(sorted(size for calendar_id, size, length
+                                in self.server.batches),
+                         [2, 3, 3, 4, 4, 4])
+        self.assertEqual(sorted(len(chunk) for chunk in chunks),
+                         [2, 3, 3, 4, 4, 4])
+        for operation in result.succeeded:
+            self.assertEqual(operation.status, 201)
+            self.assertEqual(operation.result.title.text,
+                             operation.entry.title.text)
+            self.assertTrue(operation.result.id.text.startswith(
+                '%s%s/events/' % (FEEDS_URI, operation.calendar_id)))
+            self.assertTrue(operation.result.batch_id is None)
+        self.assertEqual(set(calendar_id for calendar_id, size, length
+                             in self.server.batches),
+                         set(['cal0@example.com', 'cal1@example.com',
+                              'cal2@example.com']))
+
+    def testByteLimit(self):
+        executor = gdata.calendar.batch.BatchExecutor(
+            self.client, max_operations=100, max_bytes=2000)
+        operations = [self.insert('default', 'x' * 200) for i in range(10)]
+        size = operations[0].get_size()
+        executor.execute(operations)
+        per_feed = (2000 - gdata.calendar.batch.FEED_OVERHEAD) // size
+        self.assertEqual(self.server.batches[0][1], per_feed)
+        self.assertEqual(sum(count for calendar_id, count, length
+                             in self.server.batches), 10)
+
+    def testOpenGroupsAreBounded(self):
+        executor = gdata.calendar.batch.BatchExecutor(
+            self.client, max_open_groups=4)
+        # Five calendars take turns, so a group is sent before it fills up.
+        operations = (self.insert('cal%s' % (i % 5), 'e%s' % i)
+                      for i in range(20))
+        result = executor.execute(operations)
+        self.assertEqual(len(result.succeeded), 20)
+        self.assertEqual(len(self.server.batches), 20)
+
+        del self.server.batches[:]
+        operations = (self.insert('cal%s' % (i // 5), 'e%s' % i)
+                      for i in range(20))
+        executor.execute(operations)
+        self.assertEqual(sorted(count for calendar_id, count, length
+                                in self.server.batches), [5, 5, 5, 5])
+
+    def testOpenBytesAreBounded(self):
+        operations = [self.insert('default', 'e%s' % i) for i in range(10)]
+        size = operations[0].get_size()
+        executor = gdata.calendar.batch.BatchExecutor(
+            self.client, max_open_bytes=3 * size)
+        result = executor.execute(operations)
+        self.assertEqual(len(result.succeeded), 10)
+        self.assertEqual(sorted(count for calendar_id, count, length
+                                in self.server.batches), [2, 4, 4])
+
+    def testRetriesConflictsWithFreshEtags(self):
+        stale = self.server.save('default', 'standup', 'Standup', '"old"')
+        deleted = self.server.save('default', 'lunch', 'Lunch', '"old"')
+        gone = self.server.save('default', 'gone', 'Gone', '"old"')
+        renamed = gdata.calendar.data.CalendarEventEntry(
+            id=stale.id, link=stale.link,
+            title=atom.data.Title(text='Daily standup'))
+        renamed.etag = '"old"'
+        # Someone else edits the events before the batch is sent.
+        self.server.save('default', 'standup', 'Standup (moved)')
+        self.server.save('default', 'lunch', 'Lunch')
+        self.server.save('default', 'gone', 'Gone')
+
+        def merge(operation, current):
+            current.title.text += ' [merged]'
+            return current
+
+        operations = [
+            gdata.calendar.batch.EventOperation(gdata.data.BATCH_UPDATE,
+                                                renamed, merge=merge),
+            gdata.calendar.batch.EventOperation(gdata.data.BATCH_DELETE,
+                                                deleted),
+            gdata.calendar.batch.EventOperation(gdata.data.BATCH_DELETE,
+                                                gone),
+        ]
+        del self.server.events[gone.id.text]
+        executor = gdata.calendar.batch.BatchExecutor(self.client)
+        result = executor.execute(operations)
+        self.assertEqual(result.requests, 2)
+        self.assertEqual(result.retried, 2)
+        self.assertEqual([operation.attempts for operation in operations],
+                         [2, 2, 1])
+        self.assertEqual(operations[0].status, 200)
+        self.assertEqual(self.server.events[stale.id.text].title.text,
+                         'Standup (moved) [merged]')
+        self.assertFalse(deleted.id.text in self.server.events)
+        self.assertEqual(result.failed, [operations[2]])
+        self.assertEqual(operations[2].status, 404)
+
+    def testGivesUpAfterMaxRetries(self):
+        event = self.server.save('default', 'busy', 'Busy')
+        operation = gdata.calendar.batch.EventOperation(
+            gdata.data.BATCH_UPDATE, event)
+
+        def merge(operation, current):
+            # The event keeps changing between the fetch and the update.
+            self.server.save('default', 'busy', 'Busier')
+            return current
+
+        operation.merge = merge
+        self.server.save('default', 'busy', 'Busy')
+        executor = gdata.calendar.batch.BatchExecutor(self.client,
+                                                      max_retries=2)
+        result = executor.execute([operation])
+        self.assertEqual(operation.attempts, 3)
+        self.assertEqual(operation.status, 412)
+        self.assertEqual(result.failed, [operation])
+
+    def testConflictWithoutLinkIsNotRetried(self):
+        event = self.server.save('default', 'busy', 'Busy', '"old"')
+        self.server.save('default', 'busy', 'Busy')
+        unlinked = gdata.calendar.data.CalendarEventEntry(
+            id=event.id, title=atom.data.Title(text='Free'))
+        unlinked.etag = '"old"'
+        operation = gdata.calendar.batch.EventOperation(
+            gdata.data.BATCH_UPDATE, unlinked)
+        result = gdata.calendar.batch.BatchExecutor(self.client).execute(
+            [operation])
+        self.assertEqual(operation.attempts, 1)
+        self.assertEqual(result.failed, [operation])
+        self.assertEqual(operation.reason,
+                         'The event has no self or edit link')
+
+
+def suite():
+    return conf.build_suite([BatchExecutorTest])
+
+
+if __name__ == '__main__':
+    unittest.main()
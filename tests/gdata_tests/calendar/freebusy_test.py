@@ -0,0 +1,201 @@
+#
+# Licensed under the Apache License 2.0;
+
+
+import datetime
+import io
+import os
+import shutil
+import tempfile
+import unittest
+
+import atom.data
+import atom.http_core
+import gdata.data
+import gdata.calendar.client
+import gdata.calendar.data
+import gdata.calendar.freebusy
+import gdata.calendar.recurrence
+import gdata.test_config as conf
+
+UTC = datetime.timezone.utc
+ROOM = 'example.com_room@resource.calendar.google.com'
+OTHER_ROOM = 'example.com_other@resource.calendar.google.com'
+
+
+def utc(*args):
+    return datetime.datetime(*args, tzinfo=UTC)
+
+
+class FakeCalendarServer(object):
+    """Serves the event feed of each calendar, with an ETag."""
+
+    def __init__(self):
+        self.calendars = {}
+        self.versions = {}
+        self.requests = []
+
+    def add(self, calendar_id, start, end, transparent=False,
+            canceled=False):
+        event = gdata.calendar.data.CalendarEventEntry()
+        event.when.append(gdata.calendar.data.When(start=start, end=end))
+        if transparent:
+            event.transparency = gdata.data.Transparency(
+                value=gdata.calendar.recurrence.TRANSPARENT_EVENT)
+        if canceled:
+            event.event_status = gdata.data.EventStatus(
+                value=gdata.calendar.recurrence.CANCELED_EVENT)
+        self.calendars.setdefault(calendar_id, []).append(event)
+        self.versions[calendar_id] = self.versions.get(calendar_id, 0) + 1
+
+    def request(self, http_request):
+        uri = http_request.uri
+        calendar_id = uri.path.split('/')[3].replace('%40', '@')
+        self.requests.append((calendar_id, dict(uri.query),
+                              http_request.headers.get('If-None-Match')))
+        if calendar_id not in self.calendars:
+            return atom.http_core.HttpResponse(
+                404, 'Not Found', {}, io.BytesIO(b'Not Found'))
+        etag = '"%s"' % self.versions[calendar_id]
+        if http_request.headers.get('If-None-Match') == etag:
+            return atom.http_core.HttpResponse(
+                304, 'Not Modified', {}, io.BytesIO(b''))
+        events = self.calendars[calendar_id]
+        first = int(uri.query.get('start-index', 1))
+        size = int(uri.query['max-results'])
+        feed = gdata.calendar.data.CalendarEventFeed(
+            entry=events[first - 1:first - 1 + size])
+        feed.etag = etag
+        if first - 1 + size < len(events):
+            feed.link.append(atom.data.Link(
+                rel='next', href='https://www.google.com%s?start-index=%s'
+                                 '&max-results=%s' % (uri.path, first + size,
+                                                      size)))
+        return atom.http_core.HttpResponse(
+            200, 'OK', {}, io.BytesIO(feed.to_string().encode('utf-8')))
+
+
+class BusyVectorTest(unittest.TestCase):
+    def testUnionAndGaps(self):
+        first = gdata.calendar.freebusy.BusyVector.from_intervals(
+            [(5, 8), (1, 3), (2, 4), (8, 9), (12, 12)])
+        self.assertEqual(list(first), [(1, 4), (5, 9)])
+        second = gdata.calendar.freebusy.BusyVector.from_intervals(
+            [(10, 11), (0, 1)])
+        union = gdata.calendar.freebusy.BusyVector.union([first, second])
+        self.assertEqual(list(union), [(0, 4), (5, 9), (10, 11)])
+        self.assertEqual(list(union.iter_gaps(2, 20)),
+                         [(4, 5), (9, 10), (11, 20)])
+        self.assertEqual(list(union.iter_gaps(-3, 0)), [(-3, 0)])
+        self.assertTrue(union.is_free(4, 5))
+        self.assertTrue(union.is_free(11, 30))
+        self.assertFalse(union.is_free(3.5, 4.5))
+        self.assertFalse(union.is_free(4.5, 5.5))
+
+
+class FreeBusyAggregatorTest(unittest.TestCase):
+    def setUp(self):
+        self.server = FakeCalendarServer()
+        self.server.add('liz@example.com', '2012-01-02T09:00:00Z',
+                        '2012-01-02T10:00:00Z')
+        self.server.add('liz@example.com', '2012-01-02T10:00:00Z',
+                        '2012-01-02T10:30:00Z')
+        self.server.add('liz@example.com', '2012-01-02T11:00:00Z',
+                        '2012-01-02T12:00:00Z', transparent=True)
+        self.server.add('jack@example.com', '2012-01-02T06:00:00-08:00',
+                        '2012-01-02T07:00:00-08:00')
+        self.server.add('jack@example.com', '2012-01-02T12:00:00Z',
+                        '2012-01-02T13:00:00Z', canceled=True)
+        self.server.add(ROOM, '2012-01-02T11:00:00Z', '2012-01-02T12:00:00Z')
+        self.server.add(OTHER_ROOM, '2012-01-02T11:30:00Z',
+                        '2012-01-02T12:30:00Z')
+        self.client = gdata.calendar.client.CalendarClient()
+        self.client.http_client = self.server
+        self.temp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.temp_dir, 'busy.json')
+        self.aggregator = gdata.calendar.freebusy.FreeBusyAggregator(
+            self.client, gdata.calendar.freebusy.BusyCache(self.path),
+            page_size=2)
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def testCommonBusyAndProjection(self):
+        busy = self.aggregator.get_common_busy(
+            ['liz@example.com', 'jack@example.com'], utc(2012, 1, 2, 9, 30),
+            utc(2012, 1, 3))
+        self.assertEqual(
+            [(gdata.calendar.freebusy.from_timestamp(start),
+              gdata.calendar.freebusy.from_timestamp(end))
+             for start, end in busy],
+            [(utc(2012, 1, 2, 9, 30), utc(2012, 1, 2, 10, 30)),
+             (utc(2012, 1, 2, 14), utc(2012, 1, 2, 15))])
+        calendar_id, query, etag = self.server.requests[0]
+        self.assertEqual(query['fields'],
+                         gdata.calendar.freebusy.BUSY_FIELDS)
+        self.assertEqual(query['singleevents'], 'true')
+        self.assertEqual(query['start-min'], '2012-01-02T09:30:00Z')
+        # Liz's three events take two pages.
+        self.assertEqual(len(self.server.requests), 3)
+
+    def testFreeSlots(self):
+        slots = self.aggregator.find_free_slots(
+            ['liz@example.com', 'jack@example.com'], utc(2012, 1, 2, 8),
+            utc(2012, 1, 2, 16), datetime.timedelta(hours=1), count=3)
+        self.assertEqual([(slot.start, slot.room) for slot in slots],
+                         [(utc(2012, 1, 2, 8), None),
+                          (utc(2012, 1, 2, 10, 30), None),
+                          (utc(2012, 1, 2, 15), None)])
+
+        slots = self.aggregator.find_free_slots(
+            ['liz@example.com', 'jack@example.com'], utc(2012, 1, 2, 10),
+            utc(2012, 1, 2, 14), datetime.timedelta(hours=1), count=3,
+            step=datetime.timedelta(minutes=45),
+            rooms=[ROOM, OTHER_ROOM, 'missing@example.com'])
+        # Both rooms are taken from 10:45 to 12:30.
+        self.assertEqual([(slot.start, slot.room) for slot in slots],
+                         [(utc(2012, 1, 2, 12, 15), ROOM),
+                          (utc(2012, 1, 2, 13), ROOM)])
+
+        # Without a step, the search skips to when a room is free again.
+        slots = self.aggregator.find_free_slots(
+            ['liz@example.com'], utc(2012, 1, 2, 10, 30),
+            utc(2012, 1, 2, 14), datetime.timedelta(minutes=90), count=1,
+            rooms=[ROOM, OTHER_ROOM])
+        self.assertEqual([(slot.start, slot.room) for slot in slots],
+                         [(utc(2012, 1, 2, 12), ROOM)])
+
+    def testMissingAttendeeRaises(self):
+        self.assertRaises(
+            gdata.client.RequestError, self.aggregator.find_free_slots,
+            ['liz@example.com', 'missing@example.com'], utc(2012, 1, 2),
+            utc(2012, 1, 3), datetime.timedelta(hours=1))
+
+    def testEtagRevalidation(self):
+        calendars = ['liz@example.com', 'jack@example.com']
+        window = (utc(2012, 1, 2), utc(2012, 1, 3))
+        first = self.aggregator.get_common_busy(calendars, *window)
+        self.aggregator.cache.save()
+        self.server.requests = []
+        self.server.add('jack@example.com', '2012-01-02T20:00:00Z',
+                        '2012-01-02T21:00:00Z')
+
+        aggregator = gdata.calendar.freebusy.FreeBusyAggregator(
+            self.client, gdata.calendar.freebusy.BusyCache(self.path))
+        second = aggregator.get_common_busy(calendars, *window)
+        requests = dict((calendar_id, etag)
+                        for calendar_id, query, etag in self.server.requests)
+        self.assertEqual(requests, {'liz@example.com': '"3"',
+                                    'jack@example.com': '"2"'})
+        self.assertEqual(len(second), len(first) + 1)
+        key = '%s 2012-01-02T00:00:00Z 2012-01-03T00:00:00Z' % (
+            aggregator.get_feed_uri('jack@example.com'))
+        self.assertEqual(aggregator.cache.get(key)[0], '"3"')
+
+
+def suite():
+    return conf.build_suite([BusyVectorTest, FreeBusyAggregatorTest])
+
+
+if __name__ == '__main__':
+    unittest.main()
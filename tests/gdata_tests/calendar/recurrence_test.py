@@ -0,0 +1,244 @@
+#
+# Licensed under the Apache License 2.0;
+
+
+import datetime
+import itertools
+import random
+import unittest
+
+import atom.data
+import gdata.data
+import gdata.calendar.data
+import gdata.calendar.recurrence
+import gdata.test_config as conf
+
+UTC = datetime.timezone.utc
+EVENT_URI = 'https://www.google.com/calendar/feeds/default/private/full/'
+
+LOS_ANGELES = """BEGIN:VTIMEZONE
+TZID:America/Los_Angeles
+BEGIN:STANDARD
+TZOFFSETFROM:-0700
+TZOFFSETTO:-0800
+TZNAME:PST
+DTSTART:19701101T020000
+RRULE:FREQ=YEARLY;BYMONTH=11;BYDAY=1SU
+END:STANDARD
+BEGIN:DAYLIGHT
+TZOFFSETFROM:-0800
+TZOFFSETTO:-0700
+TZNAME:PDT
+DTSTART:19700308T020000
+RRULE:FREQ=YEARLY;BYMONTH=3;BYDAY=2SU
+END:DAYLIGHT
+END:VTIMEZONE
+"""
+
+
+def utc(*args):
+    return datetime.datetime(*args, tzinfo=UTC)
+
+
+def starts(text, limit=None):
+    recurrence = gdata.calendar.recurrence.RecurrenceSet.parse(text)
+    return list(itertools.islice(recurrence.iter_starts(), limit))
+
+
+class RecurrenceSetTest(unittest.TestCase):
+    def testWeeklyAcrossDaylightSaving(self):
+        recurrence = gdata.calendar.recurrence.RecurrenceSet.parse(
+            'DTSTART;TZID=America/Los_Angeles:20120302T090000\n'
+            'DTEND;TZID=America/Los_Angeles:20120302T100000\n'
+            'RRULE:FREQ=WEEKLY;BYDAY=FR;COUNT=3\n' + LOS_ANGELES)
+        self.assertEqual(list(recurrence.iter_instances()), [
+            (utc(2012, 3, 2, 17), utc(2012, 3, 2, 18)),
+            (utc(2012, 3, 9, 17), utc(2012, 3, 9, 18)),
+            (utc(2012, 3, 16, 16), utc(2012, 3, 16, 17))])
+        self.assertEqual(
+            datetime.datetime(2012, 11, 4, 12).replace(
+                tzinfo=recurrence.tz).tzname(), 'PST')
+
+    def testMonthlyYearlyAndSetPosition(self):
+        self.assertEqual(
+            starts('DTSTART:20120131T100000Z\n'
+                   'RRULE:FREQ=MONTHLY;BYDAY=-1FR', 3),
+            [datetime.datetime(2012, 2, 24, 10),
+             datetime.datetime(2012, 3, 30, 10),
+             datetime.datetime(2012, 4, 27, 10)])
+        self.assertEqual(
+            starts('DTSTART:20120131T100000Z\n'
+                   'RRULE:FREQ=MONTHLY;BYMONTHDAY=31;COUNT=3'),
+            [datetime.datetime(2012, 1, 31, 10),
+             datetime.datetime(2012, 3, 31, 10),
+             datetime.datetime(2012, 5, 31, 10)])
+        self.assertEqual(
+            starts('DTSTART;VALUE=DATE:20120229\nRRULE:FREQ=YEARLY', 2),
+            [datetime.datetime(2012, 2, 29), datetime.datetime(2016, 2, 29)])
+        self.assertEqual(
+            starts('DTSTART:20120601T090000\n'
+                   'RRULE:FREQ=MONTHLY;BYDAY=MO,TU,WE,TH,FR;BYSETPOS=-1;'
+                   'COUNT=2'),
+            [datetime.datetime(2012, 6, 29, 9),
+             datetime.datetime(2012, 7, 31, 9)])
+        self.assertEqual(
+            starts('DTSTART:20120101T090000\n'
+                   'RRULE:FREQ=YEARLY;BYDAY=20MO;COUNT=1'),
+            [datetime.datetime(2012, 5, 14, 9)])
+
+    def testSparseFixedPeriodRules(self):
+        # Whole months and days which can not match are skipped, so these
+        # rules are not abandoned as empty.
+        self.assertEqual(
+            starts('DTSTART:20121231T235800\n'
+                   'RRULE:FREQ=MINUTELY;BYMONTH=12', 4),
+            [datetime.datetime(2012, 12, 31, 23, 58),
+             datetime.datetime(2012, 12, 31, 23, 59),
+             datetime.datetime(2013, 12, 1, 0, 0),
+             datetime.datetime(2013, 12, 1, 0, 1)])
+        self.assertEqual(
+            starts('DTSTART:20120301T000000\n'
+                   'RRULE:FREQ=MINUTELY;INTERVAL=7;BYMONTH=2;BYMONTHDAY=29',
+                   2),
+            [datetime.datetime(2016, 2, 29, 0, 1),
+             datetime.datetime(2016, 2, 29, 0, 8)])
+        self.assertEqual(
+            starts('DTSTART:20120101T000000\n'
+                   'RRULE:FREQ=SECONDLY;BYMONTH=2;BYMONTHDAY=30'), [])
+
+    def testUntilRdateAndExdate(self):
+        self.assertEqual(
+            starts('DTSTART:20120102T090000Z\n'
+                   'RRULE:FREQ=DAILY;INTERVAL=2;UNTIL=20120108T090000Z\n'
+                   'EXDATE:20120104T090000Z\n'
+                   'RDATE:20120105T090000Z,20120106T090000Z/PT1H\n'),
+            [datetime.datetime(2012, 1, 2, 9),
+             datetime.datetime(2012, 1, 5, 9),
+             datetime.datetime(2012, 1, 6, 9),
+             datetime.datetime(2012, 1, 8, 9)])
+        self.assertEqual(
+            starts('DTSTART:20120102T090000Z\n'
+                   'RRULE:FREQ=DAILY;COUNT=5\n'
+                   'EXRULE:FREQ=DAILY;INTERVAL=2\n'),
+            [datetime.datetime(2012, 1, 3, 9),
+             datetime.datetime(2012, 1, 5, 9)])
+
+    def testLazyWindowOfUnboundedRule(self):
+        recurrence = gdata.calendar.recurrence.RecurrenceSet.parse(
+            'DTSTART;VALUE=DATE:20000101\nRRULE:FREQ=DAILY\n')
+        instances = list(recurrence.iter_instances(
+            utc(2012, 1, 1, 12), utc(2012, 1, 3)))
+        self.assertEqual(instances, [(utc(2012, 1, 1), utc(2012, 1, 2)),
+                                     (utc(2012, 1, 2), utc(2012, 1, 3))])
+
+    def testErrors(self):
+        self.assertRaises(gdata.calendar.recurrence.RecurrenceError,
+                          starts, 'RRULE:FREQ=DAILY')
+        self.assertRaises(gdata.calendar.recurrence.RecurrenceError,
+                          starts, 'DTSTART:20120101\nRRULE:FREQ=DAILY;'
+                                  'BYWEEKNO=1')
+
+
+def make_event(name, recurrence=None, start=None, end=None,
+               original=None, canceled=False):
+    event = gdata.calendar.data.CalendarEventEntry(
+        id=atom.data.Id(text=EVENT_URI + name))
+    if recurrence:
+        event.recurrence = gdata.data.Recurrence(text=recurrence)
+    if start:
+        event.when.append(gdata.calendar.data.When(start=start, end=end))
+    if original:
+        event.original_event = gdata.data.OriginalEvent(
+            id=original[0], href=EVENT_URI + original[0],
+            when=gdata.data.When(start=original[1]))
+    if canceled:
+        event.event_status = gdata.data.EventStatus(
+            value=gdata.calendar.recurrence.CANCELED_EVENT)
+    return event
+
+
+class ExpandEventsTest(unittest.TestCase):
+    def testOverrides(self):
+        standup = make_event(
+            'standup', 'DTSTART:20120102T090000Z\nDTEND:20120102T091500Z\n'
+                       'RRULE:FREQ=DAILY;COUNT=5\n')
+        # A nested exception cancels the third occurrence.
+        canceled = make_event('standup_3', canceled=True,
+                              original=('standup', '2012-01-04T09:00:00Z'))
+        standup.recurrence_exception.append(gdata.data.RecurrenceException(
+            entry_link=gdata.data.EntryLink(entry=canceled)))
+        events = [
+            standup,
+            # The second occurrence moved to the afternoon.
+            make_event('standup_2', start='2012-01-03T14:00:00.000Z',
+                       end='2012-01-03T14:15:00.000Z',
+                       original=('standup', '2012-01-03T09:00:00.000Z')),
+            make_event('lunch', start='2012-01-05T04:00:00.000-08:00',
+                       end='2012-01-05T05:00:00.000-08:00'),
+            make_event('holiday', start='2012-01-06'),
+        ]
+        instances = sorted(
+            gdata.calendar.recurrence.expand_events(
+                events, utc(2012, 1, 3), utc(2012, 1, 7)),
+            key=lambda instance: instance.start)
+        self.assertEqual(
+            [(instance.event.id.text[len(EVENT_URI):], instance.start)
+             for instance in instances],
+            [('standup_2', utc(2012, 1, 3, 14)),
+             ('standup', utc(2012, 1, 5, 9)),
+             ('lunch', utc(2012, 1, 5, 12)),
+             ('holiday', utc(2012, 1, 6)),
+             ('standup', utc(2012, 1, 6, 9))])
+        self.assertEqual(instances[0].original_start, utc(2012, 1, 3, 9))
+        self.assertTrue(instances[3].all_day)
+        self.assertEqual(instances[3].end, utc(2012, 1, 7))
+
+
+class IntervalTreeTest(unittest.TestCase):
+    def testMatchesLinearScan(self):
+        generator = random.Random(4)
+        intervals = []
+        for value in range(500):
+            start = generator.randint(0, 10000)
+            intervals.append((start, start + generator.randint(1, 300),
+                              value))
+        tree = gdata.calendar.recurrence.IntervalTree(intervals[:250])
+        for interval in intervals[250:]:
+            tree.add(*interval)
+        self.assertEqual(len(tree), 500)
+        for _ in range(100):
+            start = generator.randint(-100, 10100)
+            end = start + generator.randint(1, 500)
+            expected = sorted(interval for interval in intervals
+                              if interval[0] < end and interval[1] > start)
+            self.assertEqual(sorted(tree.overlapping(start, end)), expected)
+            self.assertEqual(
+                sorted(tree.containing(start)),
+                sorted(interval for interval in intervals
+                       if interval[0] <= start < interval[1]))
+
+    def testInstanceTree(self):
+        events = {
+            'room1': [make_event('a', start='2012-01-02T09:00:00Z',
+                                 end='2012-01-02T10:00:00Z')],
+            'room2': [make_event('b', 'DTSTART:20120102T093000Z\n'
+                                      'DURATION:PT1H\n'
+                                      'RRULE:FREQ=DAILY')],
+        }
+        tree = gdata.calendar.recurrence.build_instance_tree(dict(
+            (calendar_id, gdata.calendar.recurrence.expand_events(
+                calendar_events, utc(2012, 1, 1), utc(2012, 2, 1)))
+            for calendar_id, calendar_events in events.items()))
+        self.assertEqual(len(tree), 31)
+        found = tree.overlapping(utc(2012, 1, 2, 9, 45), utc(2012, 1, 2, 11))
+        self.assertEqual(sorted(value[0] for start, end, value in found),
+                         ['room1', 'room2'])
+
+
+def suite():
+    return conf.build_suite([RecurrenceSetTest, ExpandEventsTest,
+                             IntervalTreeTest])
+
+
+if __name__ == '__main__':
+    unittest.main()
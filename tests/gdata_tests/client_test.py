@@ -11,8 +11,15 @@
 
 # __author__ = 'j.s@google.com (Jeff Scudder)'
 
+import json
+import os
+import shutil
+import tempfile
+import threading
 import unittest
 
+import atom.data
+import atom.http_core
 import atom.mock_http_core
 import gdata.client
 import gdata.data
@@ -354,6 +361,109 @@ class UpdateTest(unittest.TestCase):
                          'https://example.com/test')
 
 
+class FeedPagerTest(unittest.TestCase):
+    def setUp(self):
+        self.client = gdata.client.GDClient()
+        self.client.http_client = atom.mock_http_core.MockHttpClient()
+        for i in range(3):
+            feed = gdata.data.GDFeed(entry=[
+                gdata.data.GDEntry(id=atom.data.Id('%d-%d' % (i, j)))
+                for j in range(2)])
+            if i < 2:
+                feed.link.append(atom.data.Link(
+                    rel='next', href='http://example.com/%d' % (i + 1)))
+            self.client.http_client.add_response(
+                atom.http_core.HttpRequest('http://example.com/%d' % i, 'GET'),
+                200, 'OK', body=feed.to_string().encode('utf-8'))
+
+    def test_get_all_pages(self):
+        feed = self.client.get_all_pages('http://example.com/0')
+        self.assertTrue(isinstance(feed, gdata.data.GDFeed))
+        self.assertEqual([entry.id.text for entry in feed.entry],
+                         ['0-0', '0-1', '1-0', '1-1', '2-0', '2-1'])
+
+    def test_get_all_pages_from_feed(self):
+        first_page = self.client.get_feed('http://example.com/0')
+        feed = self.client.get_all_pages(first_page)
+        self.assertTrue(feed is first_page)
+        self.assertEqual(len(feed.entry), 6)
+
+    def test_progress_and_checkpoint(self):
+        totals = []
+        checkpoints = []
+        entries = self.client.get_all_entries(
+            'http://example.com/0',
+            progress=lambda pager, feed: totals.append(pager.entries),
+            checkpoint=checkpoints.append)
+        self.assertEqual(next(entries).id.text, '0-0')
+        self.assertEqual(totals, [2])
+        self.assertEqual(checkpoints, [])
+        self.assertEqual(len(list(entries)), 5)
+        self.assertEqual(totals, [2, 4, 6])
+        self.assertEqual(checkpoints, ['http://example.com/1',
+                                       'http://example.com/2', None])
+
+    def test_resume_from_checkpoint(self):
+        pager = gdata.client.FeedPager(self.client, 'http://example.com/2')
+        self.assertEqual([entry.id.text for entry in pager.iter_entries()],
+                         ['2-0', '2-1'])
+        self.assertEqual(pager.pages, 1)
+        self.assertTrue(pager.next_uri is None)
+
+
+class BoundedExecutorTest(unittest.TestCase):
+    def test_holds_back_submissions(self):
+        release = threading.Event()
+        collected = []
+
+        def task(number):
+            release.wait()
+            return number
+
+        executor = gdata.client.BoundedExecutor(2, collected.append,
+                                                max_pending=3)
+        with executor:
+            for number in range(3):
+                executor.submit(task, number)
+            # The fourth task waits for one of the first three, which is
+            # collected first.
+            release.set()
+            executor.submit(task, 3)
+            self.assertTrue(collected)
+        self.assertEqual(sorted(collected), [0, 1, 2, 3])
+
+    def test_collects_finished_work_on_error(self):
+        collected = []
+
+        def task(number):
+            if number == 2:
+                raise ValueError('bad item')
+            return number
+
+        try:
+            with gdata.client.BoundedExecutor(2, collected.append) as executor:
+                for number in range(4):
+                    executor.submit(task, number)
+            self.fail('The error of the task should be raised')
+        except ValueError:
+            pass
+        self.assertEqual(sorted(collected), [0, 1, 3])
+
+
+class SaveJsonTest(unittest.TestCase):
+    def test_replaces_file(self):
+        temp_dir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(temp_dir, 'state.json')
+            gdata.client.save_json(path, {'a': 1})
+            gdata.client.save_json(path, {'b': [2]})
+            with open(path) as state_file:
+                self.assertEqual(json.load(state_file), {'b': [2]})
+            self.assertEqual(os.listdir(temp_dir), ['state.json'])
+        finally:
+            shutil.rmtree(temp_dir)
+
+
 def suite():
     return unittest.TestSuite((unittest.makeSuite(ClientLoginTest, 'test'),
                                unittest.makeSuite(AuthSubTest, 'test'),
@@ -361,7 +471,10 @@ def suite():
                                unittest.makeSuite(RequestTest, 'test'),
                                unittest.makeSuite(VersionConversionTest, 'test'),
                                unittest.makeSuite(QueryTest, 'test'),
-                               unittest.makeSuite(UpdateTest, 'test')))
+                               unittest.makeSuite(UpdateTest, 'test'),
+                               unittest.makeSuite(FeedPagerTest, 'test'),
+                               unittest.makeSuite(BoundedExecutorTest, 'test'),
+                               unittest.makeSuite(SaveJsonTest, 'test')))
 
 
 if __name__ == '__main__':
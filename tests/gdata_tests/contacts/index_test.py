@@ -0,0 +1,156 @@
+#
+# Licensed under the Apache License 2.0;
+
+
+import unittest
+
+import atom.data
+import gdata.contacts.data
+import gdata.contacts.index
+import gdata.data
+import gdata.test_config as conf
+
+FEED_URI = 'https://www.google.com/m8/feeds/contacts/default/full/'
+
+
+def make_contact(contact_id, name=None, emails=(), phones=(), groups=(),
+                 etag=None):
+    contact = gdata.contacts.data.ContactEntry(
+        id=atom.data.Id(text=FEED_URI + contact_id))
+    contact.etag = etag or '"%s"' % contact_id
+    if name:
+        contact.name = gdata.data.Name(
+            full_name=gdata.data.FullName(text=name))
+    for address in emails:
+        contact.email.append(gdata.data.Email(address=address))
+    for number in phones:
+        contact.phone_number.append(gdata.data.PhoneNumber(text=number))
+    for group in groups:
+        contact.group_membership_info.append(
+            gdata.contacts.data.GroupMembershipInfo(href=group))
+    return contact
+
+
+class NormalizeTest(unittest.TestCase):
+    def testPhone(self):
+        normalize = gdata.contacts.index.normalize_phone
+        self.assertEqual(normalize('(650) 555-0100', '1'), '+16505550100')
+        self.assertEqual(normalize('+1 650 555 0100'), '+16505550100')
+        self.assertEqual(normalize('0044 20 7946 0000'), '+442079460000')
+        self.assertEqual(normalize('020 7946 0000', '44'), '+442079460000')
+        self.assertEqual(normalize('650-555-0100'), '6505550100')
+
+    def testNameTokens(self):
+        self.assertEqual(
+            gdata.contacts.index.name_tokens('José  García-Pérez'),
+            gdata.contacts.index.name_tokens('garcia PEREZ jose'))
+
+
+class ContactIndexTest(unittest.TestCase):
+    def setUp(self):
+        self.index = gdata.contacts.index.ContactIndex(
+            default_country_code='1', max_bucket=3)
+        self.index.add_feed(gdata.contacts.data.ContactsFeed(entry=[
+            make_contact('a', 'Liz Lemon', ['Liz@Example.com'],
+                         ['(650) 555-0100'], ['groups/work']),
+            make_contact('b', 'Lemon, Liz', ['liz@example.com'], [],
+                         ['groups/friends']),
+            make_contact('c', 'Elizabeth Lemon', ['liz@home.example.com'],
+                         ['+1 650 555 0100', '+1 650 555 0199']),
+            make_contact('d', 'Jack', ['jack@example.com'],
+                         ['+1 800 555 0000']),
+            make_contact('e', 'Jenna', [], ['+1 800 555 0000']),
+            make_contact('f', 'Kenneth', [], ['+1 800 555 0000']),
+            make_contact('g', 'Tracy', [], ['+1 800 555 0000']),
+            make_contact('h', 'Pete', ['pete@example.com']),
+        ]))
+
+    def testCandidatePairs(self):
+        pairs = self.index.candidate_pairs()
+        found = dict(((pair.first_id[-1], pair.second_id[-1]),
+                      (pair.score, pair.reasons)) for pair in pairs)
+        # The switchboard number is shared by too many contacts.
+        self.assertEqual(sorted(found), [('a', 'b'), ('a', 'c')])
+        self.assertEqual(found[('a', 'b')], (4, {'email', 'name'}))
+        self.assertEqual(found[('a', 'c')], (2, {'phone'}))
+
+    def testReaddingReplacesKeys(self):
+        # b changes its address and name, and is no longer a duplicate of a.
+        self.index.add(make_contact('b', 'Pat Smith', ['pat@example.com']))
+        self.assertEqual(len(self.index), 8)
+        found = [(pair.first_id[-1], pair.second_id[-1])
+                 for pair in self.index.candidate_pairs()]
+        self.assertEqual(found, [('a', 'c')])
+        self.assertEqual(self.index.indexes['email']['liz@example.com'],
+                         [FEED_URI + 'a'])
+        deleted = make_contact('c')
+        deleted.deleted = gdata.data.Deleted()
+        self.index.add(deleted)
+        self.assertEqual(len(self.index), 7)
+        self.assertEqual(self.index.candidate_pairs(), [])
+        self.assertFalse('+16505550199' in self.index.indexes['phone'])
+
+    def testReaddingContactEditedInPlace(self):
+        contact = self.index.contacts[FEED_URI + 'b']
+        contact.email[0].address = 'pat@example.com'
+        contact.name.full_name.text = 'Pat Smith'
+        self.index.add(contact)
+        self.assertEqual(self.index.indexes['email']['liz@example.com'],
+                         [FEED_URI + 'a'])
+        self.assertEqual(self.index.indexes['email']['pat@example.com'],
+                         [FEED_URI + 'b'])
+        self.assertFalse('lemon liz' in self.index.indexes['name'] and
+                         FEED_URI + 'b' in self.index.indexes['name'][
+                             'lemon liz'])
+        self.index.remove(FEED_URI + 'b')
+        self.assertFalse('pat@example.com' in self.index.indexes['email'])
+        self.assertEqual(len(self.index), 7)
+
+    def testPlanMergesAndBatchFeeds(self):
+        plans = self.index.plan_merges()
+        self.assertEqual(len(plans), 1)
+        plan = plans[0]
+        self.assertEqual(plan.primary.id.text, FEED_URI + 'a')
+        self.assertEqual(sorted(c.id.text for c in plan.duplicates),
+                         [FEED_URI + 'b', FEED_URI + 'c'])
+        self.assertEqual([e.address for e in plan.merged.email],
+                         ['Liz@Example.com', 'liz@home.example.com'])
+        self.assertEqual([p.text for p in plan.merged.phone_number],
+                         ['(650) 555-0100', '+1 650 555 0199'])
+        self.assertEqual(
+            sorted(m.href for m in plan.merged.group_membership_info),
+            ['groups/friends', 'groups/work'])
+        # The indexed contacts are left as they were.
+        self.assertEqual(len(plan.primary.email), 1)
+        self.assertEqual(len(plan.duplicates[0].email), 1)
+
+        feeds = gdata.contacts.index.build_batch_feeds(plans)
+        self.assertEqual(len(feeds), 1)
+        operations = [(entry.batch_operation.type, entry.id.text[-1],
+                       entry.etag) for entry in feeds[0].entry]
+        self.assertEqual(operations, [('update', 'a', '"a"'),
+                                      ('delete', 'b', '"b"'),
+                                      ('delete', 'c', '"c"')])
+
+    def testBatchFeedsKeepPlansTogether(self):
+        plans = [gdata.contacts.index.MergePlan(
+                     make_contact('p%s' % i),
+                     [make_contact('d%s' % i)], make_contact('p%s' % i))
+                 for i in range(5)]
+        feeds = gdata.contacts.index.build_batch_feeds(plans, batch_size=5)
+        self.assertEqual([len(feed.entry) for feed in feeds], [4, 4, 2])
+
+    def testMinScore(self):
+        self.assertEqual(len(self.index.clusters(min_score=3)), 1)
+        self.assertEqual(self.index.clusters(min_score=5), [])
+        self.assertEqual(
+            self.index.clusters(min_score=2),
+            [[FEED_URI + 'a', FEED_URI + 'b', FEED_URI + 'c']])
+
+
+def suite():
+    return conf.build_suite([NormalizeTest, ContactIndexTest])
+
+
+if __name__ == '__main__':
+    unittest.main()
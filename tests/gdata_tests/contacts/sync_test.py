@@ -0,0 +1,281 @@
+#
+# Licensed under the Apache License 2.0;
+
+
+import io
+import os
+import shutil
+import tempfile
+import unittest
+
+import atom.core
+import atom.data
+import atom.http_core
+import gdata.contacts.client
+import gdata.contacts.data
+import gdata.contacts.sync
+import gdata.data
+import gdata.test_config as conf
+
+FEED_URI = 'https://www.google.com/m8/feeds/contacts/default/full'
+
+
+class FakeContactsServer(object):
+    """Serves a contacts feed and executes batch requests against it."""
+
+    def __init__(self):
+        self.contacts = {}
+        self.clock = 0
+        self.queries = []
+        self.batch_sizes = []
+        # Ids of the contacts whose batch operations fail with 503.
+        self.unavailable = set()
+        # The number of batch requests still to be refused with 500.
+        self.failing_batches = 0
+
+    def _time(self):
+        self.clock += 1
+        return '2012-01-01T00:00:%02d.000Z' % self.clock
+
+    def save(self, contact_id, email=None, phone=None, group=None,
+             deleted=False):
+        contact = gdata.contacts.data.ContactEntry(
+            id=atom.data.Id(text=contact_id))
+        contact.link.append(atom.data.Link(rel='self', href=contact_id))
+        if email:
+            contact.email.append(gdata.data.Email(address=email))
+        if phone:
+            contact.phone_number.append(gdata.data.PhoneNumber(text=phone))
+        if group:
+            contact.group_membership_info.append(
+                gdata.contacts.data.GroupMembershipInfo(href=group))
+        if deleted:
+            contact.deleted = gdata.contacts.data.Deleted()
+        self._stamp(contact)
+        self.contacts[contact_id] = contact
+        return contact
+
+    def _stamp(self, contact):
+        contact.updated = atom.data.Updated(text=self._time())
+        contact.etag = '"%s"' % self.clock
+
+    def _response(self, feed):
+        return atom.http_core.HttpResponse(
+            200, 'OK', {}, io.BytesIO(feed.to_string().encode('utf-8')))
+
+    def request(self, http_request):
+        if http_request.method == 'GET':
+            return self._get(http_request)
+        request_feed = atom.core.parse(
+            http_request._body_parts[0].encode('utf-8'),
+            gdata.contacts.data.ContactsFeed)
+        self.batch_sizes.append(len(request_feed.entry))
+        if self.failing_batches:
+            self.failing_batches -= 1
+            return atom.http_core.HttpResponse(
+                500, 'Internal Server Error', {}, io.BytesIO(b''))
+        response_feed = gdata.contacts.data.ContactsFeed()
+        for entry in request_feed.entry:
+            operation = entry.batch_operation.type
+            current = None
+            if entry.id is not None:
+                current = self.contacts.get(entry.id.text)
+            if entry.id is not None and entry.id.text in self.unavailable:
+                code = 503
+            elif operation == 'insert':
+                entry.id = atom.data.Id(
+                    text='%s/new%s' % (FEED_URI, len(self.contacts)))
+                self.contacts[entry.id.text] = entry
+                code = 201
+            elif current is None or current.deleted is not None:
+                code = 404
+            elif current.etag != entry.etag:
+                code = 412
+            elif operation == 'delete':
+                self.save(entry.id.text, deleted=True)
+                code = 200
+            else:
+                self.contacts[entry.id.text] = entry
+                code = 200
+            if code < 300 and operation != 'delete':
+                entry.batch_operation = None
+                self._stamp(entry)
+            entry.batch_status = gdata.data.BatchStatus(
+                code=str(code), reason='reason')
+            response_feed.entry.append(entry)
+        return self._response(response_feed)
+
+    def _get(self, http_request):
+        contact = self.contacts.get(str(http_request.uri))
+        if contact is not None:
+            return self._response(contact)
+        query = http_request.uri.query
+        self.queries.append(dict(query))
+        updated_min = query.get('updated-min')
+        feed = gdata.contacts.data.ContactsFeed(
+            updated=atom.data.Updated(text=self._time()))
+        for contact in sorted(self.contacts.values(),
+                              key=lambda c: c.updated.text):
+            if updated_min is not None and contact.updated.text < updated_min:
+                continue
+            if contact.deleted is not None and not query.get('showdeleted'):
+                continue
+            feed.entry.append(contact)
+        return self._response(feed)
+
+
+class ContactSyncTest(unittest.TestCase):
+    def setUp(self):
+        self.server = FakeContactsServer()
+        self.server.save(FEED_URI + '/liz', email='Liz@Example.com',
+                         phone='+1 (650) 555-0100', group='groups/friends')
+        self.server.save(FEED_URI + '/bob', email='bob@example.com',
+                         group='groups/friends')
+        self.client = gdata.contacts.client.ContactsClient()
+        self.client.http_client = self.server
+        self.temp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.temp_dir, 'contacts.json')
+        self.store = gdata.contacts.sync.ContactStore(self.path)
+        self.sync = gdata.contacts.sync.ContactSync(
+            self.client, self.store, batch_size=2)
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def testNormalizePhone(self):
+        self.assertEqual(
+            gdata.contacts.sync.normalize_phone('+1 (650) 555-0100 x12'),
+            '+16505550100')
+        self.assertEqual(
+            gdata.contacts.sync.normalize_phone('tel:650.555.0100'),
+            '6505550100')
+
+    def testIncrementalPull(self):
+        result = self.sync.pull()
+        self.assertEqual(len(result.updated), 2)
+        self.assertFalse('updated-min' in self.server.queries[0])
+        self.assertEqual(
+            [c.id.text for c in self.store.find_by_email('liz@example.COM')],
+            [FEED_URI + '/liz'])
+        self.assertEqual(len(self.store.find_by_phone('+16505550100')), 1)
+        self.assertEqual(
+            len(self.store.get_group_members('groups/friends')), 2)
+
+        self.server.save(FEED_URI + '/bob', deleted=True)
+        self.server.save(FEED_URI + '/liz', email='liz@new.example.com')
+        result = self.sync.pull()
+        self.assertEqual(self.server.queries[-1]['showdeleted'], 'true')
+        self.assertEqual(result.deleted, [FEED_URI + '/bob'])
+        self.assertEqual(result.updated, [FEED_URI + '/liz'])
+        self.assertEqual(len(self.store), 1)
+        self.assertEqual(self.store.find_by_email('liz@example.com'), [])
+        self.assertEqual(len(self.store.find_by_email('liz@new.example.com')),
+                         1)
+        self.assertEqual(self.store.get_group_members('groups/friends'), [])
+
+    def testPushIsConditionalAndChunked(self):
+        self.sync.pull()
+        liz = self.store.get(FEED_URI + '/liz')
+        liz.email[0].address = 'elizabeth@example.com'
+        self.store.update(liz)
+        self.store.delete(self.store.get(FEED_URI + '/bob'))
+        new = gdata.contacts.data.ContactEntry()
+        new.email.append(gdata.data.Email(address='new@example.com'))
+        self.store.insert(new)
+        # Bob changes on the server after the pull.
+        self.server.save(FEED_URI + '/bob', email='bob@other.example.com')
+
+        result = self.sync.push()
+        self.assertEqual(self.server.batch_sizes, [2, 1])
+        self.assertEqual(len(result.updated), 2)
+        self.assertEqual([c.id.text for c in result.conflicts],
+                         [FEED_URI + '/bob'])
+        # The delete of Bob stays queued with the server's etag.
+        self.assertEqual(list(self.store.pending_deletes), [FEED_URI + '/bob'])
+        self.assertEqual(self.store.pending_deletes[FEED_URI + '/bob'].etag,
+                         self.server.contacts[FEED_URI + '/bob'].etag)
+        self.assertFalse(self.store.pending_inserts)
+        self.assertFalse(self.store.pending_updates)
+        self.assertEqual(self.store.find_by_email('liz@example.com'), [])
+        stored = self.store.find_by_email('elizabeth@example.com')[0]
+        self.assertEqual(
+            stored.etag, self.server.contacts[FEED_URI + '/liz'].etag)
+        self.assertEqual(len(self.store.find_by_email('new@example.com')), 1)
+
+    def testConflictingUpdateIsAppliedAgain(self):
+        self.sync.pull()
+        liz = self.store.get(FEED_URI + '/liz')
+        liz.email[0].address = 'elizabeth@example.com'
+        self.store.update(liz)
+        self.server.save(FEED_URI + '/liz', email='liz@new.example.com')
+
+        result = self.sync.push()
+        self.assertEqual(result.conflicts, [liz])
+        self.assertEqual(list(self.store.pending_updates), [FEED_URI + '/liz'])
+        pulled, pushed = self.sync.sync()
+        self.assertEqual(pulled.conflicts, [])
+        self.assertEqual(pushed.updated, [FEED_URI + '/liz'])
+        self.assertFalse(self.store.has_pending())
+        self.assertEqual(
+            self.server.contacts[FEED_URI + '/liz'].email[0].address,
+            'elizabeth@example.com')
+
+    def testFailedOperationsStayQueued(self):
+        self.sync.pull()
+        liz = self.store.get(FEED_URI + '/liz')
+        liz.email[0].address = 'elizabeth@example.com'
+        self.store.update(liz)
+        bob = self.store.get(FEED_URI + '/bob')
+        bob.email[0].address = 'robert@example.com'
+        self.store.update(bob)
+        for address in ('new@example.com', 'other@example.com'):
+            new = gdata.contacts.data.ContactEntry()
+            new.email.append(gdata.data.Email(address=address))
+            self.store.insert(new)
+        self.server.unavailable.add(FEED_URI + '/liz')
+        self.server.failing_batches = 1
+
+        result = self.sync.push()
+        # The first chunk fails as a whole, the second is still sent.
+        self.assertEqual(self.server.batch_sizes, [2, 2])
+        self.assertEqual(
+            sorted((code, contact.email[0].address)
+                   for contact, code, reason in result.failures),
+            [(500, 'new@example.com'), (500, 'other@example.com'),
+             (503, 'elizabeth@example.com')])
+        self.assertEqual(result.updated, [FEED_URI + '/bob'])
+        self.assertEqual(len(self.store.pending_inserts), 2)
+        self.assertEqual(list(self.store.pending_updates), [FEED_URI + '/liz'])
+
+        self.server.unavailable.clear()
+        result = self.sync.push()
+        self.assertEqual(len(result.updated), 3)
+        self.assertEqual(result.failures, [])
+        self.assertFalse(self.store.has_pending())
+
+    def testSaveAndLoadPendingChanges(self):
+        self.sync.pull()
+        liz = self.store.get(FEED_URI + '/liz')
+        liz.email[0].address = 'elizabeth@example.com'
+        self.store.update(liz)
+        self.store.save()
+
+        store = gdata.contacts.sync.ContactStore(self.path)
+        self.assertEqual(store.updated_min, self.store.updated_min)
+        self.assertEqual(len(store), 2)
+        self.assertEqual(list(store.pending_updates), [FEED_URI + '/liz'])
+        pulled, pushed = gdata.contacts.sync.ContactSync(
+            self.client, store).sync()
+        self.assertEqual(pulled.updated, [])
+        self.assertEqual(pushed.updated, [FEED_URI + '/liz'])
+        self.assertEqual(
+            self.server.contacts[FEED_URI + '/liz'].email[0].address,
+            'elizabeth@example.com')
+
+
+def suite():
+    return conf.build_suite([ContactSyncTest])
+
+
+if __name__ == '__main__':
+    unittest.main()
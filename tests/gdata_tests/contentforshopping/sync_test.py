@@ -0,0 +1,209 @@
+#
+# Licensed under the Apache License 2.0;
+
+
+import io
+import json
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+import urllib.parse
+
+import atom.core
+import atom.data
+import atom.http_core
+import gdata.data
+import gdata.contentforshopping.client
+import gdata.contentforshopping.data
+import gdata.contentforshopping.sync
+import gdata.test_config as conf
+from gdata.contentforshopping.data import ProductEntry
+from gdata.contentforshopping.data import ProductFeed
+
+NEXT_LINK = ('https://content.googleapis.com/content/v1/1234/items/products/'
+             'schema?start-token=%s')
+
+
+def make_product(product_id, title, country='US', language='en'):
+    return ProductEntry(
+        product_id=gdata.contentforshopping.data.ProductId(product_id),
+        title=atom.data.Title(title),
+        target_country=gdata.contentforshopping.data.TargetCountry(country),
+        content_language=gdata.contentforshopping.data.ContentLanguage(
+            language))
+
+
+class FakeMerchantServer(object):
+    """Holds the products of one account and answers batch requests.
+
+    refused lists the product ids answered with 400 Bad Request.
+    """
+
+    def __init__(self):
+        self.products = {}
+        self.batches = []
+        self.refused = []
+        self.lock = threading.Lock()
+
+    def request(self, http_request):
+        if http_request.method == 'GET':
+            return self._list(dict(http_request.uri.query))
+        feed = atom.core.parse(http_request._body_parts[0].encode('utf-8'),
+                               ProductFeed)
+        response = ProductFeed()
+        with self.lock:
+            self.batches.append([(entry.batch_operation.type,
+                                  entry.batch_id.text) for entry in feed.entry])
+            for entry in feed.entry:
+                operation = entry.batch_operation.type
+                if operation == 'delete':
+                    key = urllib.parse.unquote(entry.id.text.split('/')[-1])
+                else:
+                    key = gdata.contentforshopping.sync.product_key(entry)
+                code = 200
+                if operation == 'insert':
+                    code = 201
+                if operation != 'delete' and (entry.product_id.text
+                                              in self.refused):
+                    code = 400
+                elif operation != 'insert' and key not in self.products:
+                    code = 404
+                elif operation == 'delete':
+                    del self.products[key]
+                else:
+                    self.products[key] = entry.title.text
+                response.entry.append(ProductEntry(
+                    batch_id=entry.batch_id,
+                    batch_status=gdata.data.BatchStatus(
+                        code=str(code), reason='reason %s' % code)))
+        return atom.http_core.HttpResponse(
+            200, 'OK', {}, io.BytesIO(response.to_string().encode('utf-8')))
+
+    def _list(self, query):
+        size = int(query['max-results'])
+        start = int(query.get('start-token', 0))
+        keys = sorted(self.products)
+        feed = ProductFeed()
+        for key in keys[start:start + size]:
+            channel, language, country, product_id = key.split(':')
+            feed.entry.append(make_product(product_id, self.products[key],
+                                           country, language))
+        if start + size < len(keys):
+            feed.link.append(atom.data.Link(rel='next',
+                                            href=NEXT_LINK % (start + size)))
+        return atom.http_core.HttpResponse(
+            200, 'OK', {}, io.BytesIO(feed.to_string().encode('utf-8')))
+
+
+class ContentHashTest(unittest.TestCase):
+    def testKeyAndHash(self):
+        entry = make_product('sku1', 'Shoe', 'GB')
+        self.assertEqual(gdata.contentforshopping.sync.product_key(entry),
+                         'online:en:GB:sku1')
+        digest = gdata.contentforshopping.sync.content_hash(entry)
+        entry.batch_operation = gdata.data.BatchOperation(type='insert')
+        self.assertEqual(gdata.contentforshopping.sync.content_hash(entry),
+                         digest)
+        self.assertEqual(entry.batch_operation.type, 'insert')
+        entry.title.text = 'Boot'
+        self.assertNotEqual(gdata.contentforshopping.sync.content_hash(entry),
+                            digest)
+
+
+class CatalogSyncTest(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.temp_dir, 'catalog.json')
+        self.server = FakeMerchantServer()
+        self.client = gdata.contentforshopping.client.ContentForShoppingClient(
+            account_id='1234')
+        self.client.http_client = self.server
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def catalog(self, titles):
+        return (make_product('sku%s' % number, title)
+                for number, title in enumerate(titles))
+
+    def sync(self, titles, **kwargs):
+        sync = gdata.contentforshopping.sync.CatalogSync(
+            self.client, gdata.contentforshopping.sync.ProductSnapshot(
+                self.path), max_workers=2, chunk_size=3)
+        return sync.sync(self.catalog(titles), **kwargs)
+
+    def testOnlyChangesAreSent(self):
+        titles = ['product %s' % number for number in range(10)]
+        self.server.refused = ['sku4']
+        chunks = []
+        result = self.sync(titles, progress=lambda result, chunk:
+                           chunks.append(len(chunk)))
+        self.assertEqual(sorted(chunks), [1, 3, 3, 3])
+        self.assertEqual(result.inserted, 9)
+        self.assertEqual([(operation.key, operation.status)
+                          for operation in result.failed],
+                         [('online:en:US:sku4', 400)])
+        self.assertEqual(result.requests, 4)
+        with open(self.path) as snapshot_file:
+            self.assertEqual(len(json.load(snapshot_file)), 9)
+
+        # The refused product and the changed ones are sent, and products
+        # missing from the source are deleted.
+        self.server.refused = []
+        self.server.batches = []
+        titles[2] = 'renamed'
+        result = self.sync(titles[:8], delete_missing=True)
+        self.assertEqual((result.inserted, result.updated, result.deleted,
+                          result.unchanged), (1, 1, 2, 6))
+        self.assertEqual(result.failed, [])
+        self.assertEqual(sorted(operation for batch in self.server.batches
+                                for operation, batch_id in batch),
+                         ['delete', 'delete', 'insert', 'update'])
+        self.assertEqual(self.server.products['online:en:US:sku2'],
+                         'renamed')
+        self.assertEqual(len(self.server.products), 8)
+
+        result = self.sync(titles[:8], delete_missing=True)
+        self.assertEqual(result.get_sent(), 0)
+        self.assertEqual(result.unchanged, 8)
+        self.assertEqual(result.requests, 0)
+
+    def testStaleSnapshot(self):
+        self.sync(['a', 'b', 'c'])
+        # The products change on the server behind the snapshot's back.
+        del self.server.products['online:en:US:sku0']
+        self.server.products['online:en:US:sku9'] = 'other'
+
+        snapshot = gdata.contentforshopping.sync.ProductSnapshot(self.path)
+        snapshot.record('online:en:US:sku0', 'stale')
+        result = gdata.contentforshopping.sync.CatalogSync(
+            self.client, snapshot).sync(self.catalog(['x', 'b', 'c']))
+        # The update of the missing product was sent again as an insert.
+        self.assertEqual((result.inserted, result.updated, result.requests),
+                         (1, 0, 2))
+        self.assertEqual(self.server.products['online:en:US:sku0'], 'x')
+
+        self.assertEqual(gdata.contentforshopping.sync.reconcile_snapshot(
+            self.client, snapshot, page_size=2), (1, 0))
+        self.assertEqual(snapshot.get('online:en:US:sku9', 'missing'), None)
+        self.assertEqual(len(gdata.contentforshopping.sync.ProductSnapshot(
+            self.path)), 4)
+
+    def testDryRunKeepsSnapshot(self):
+        sync = gdata.contentforshopping.sync.CatalogSync(
+            self.client, gdata.contentforshopping.sync.ProductSnapshot(
+                self.path), dry_run=True)
+        result = sync.sync(self.catalog(['a', 'b']))
+        self.assertEqual(result.inserted, 2)
+        self.assertEqual(len(sync.snapshot), 0)
+        self.assertFalse(os.path.exists(self.path))
+
+
+def suite():
+    return conf.build_suite([ContentHashTest, CatalogSyncTest])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,174 @@
+#
+# Licensed under the Apache License 2.0;
+
+
+import hashlib
+import http.client
+import io
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+import atom.data
+import atom.http_core
+import gdata.docs.client
+import gdata.docs.data
+import gdata.docs.download
+import gdata.test_config as conf
+
+CONTENT_URI = 'https://doc-content.example.com/files/%s?id=1'
+
+
+class FakeContentServer(object):
+    """Serves file contents by path, counting concurrent requests."""
+
+    def __init__(self, contents):
+        self.contents = contents
+        self.requested = []
+        self.active = 0
+        self.max_active = 0
+        self.lock = threading.Lock()
+
+    def request(self, http_request):
+        name = http_request.uri.path.split('/')[-1]
+        with self.lock:
+            self.requested.append(name)
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+        try:
+            time.sleep(0.005)
+            if name == 'broken':
+                raise http.client.IncompleteRead(b'partial')
+            if name not in self.contents:
+                return atom.http_core.HttpResponse(
+                    404, 'Not Found', {}, io.BytesIO(b'missing'))
+            return atom.http_core.HttpResponse(
+                200, 'OK', {}, io.BytesIO(self.contents[name]))
+        finally:
+            with self.lock:
+                self.active -= 1
+
+
+def make_file(name, etag, content=None):
+    entry = gdata.docs.data.Resource(type='file', title=name)
+    entry.id = atom.data.Id(text='id:' + name)
+    entry.etag = etag
+    entry.content = atom.data.Content(src=CONTENT_URI % name)
+    if content is not None:
+        entry.md5_checksum = gdata.docs.data.Md5Checksum(
+            text=hashlib.md5(content).hexdigest())
+    return entry
+
+
+class BulkDownloaderTest(unittest.TestCase):
+    def setUp(self):
+        self.contents = {'a': b'a' * 1000, 'b': b'b' * 10, 'c': b'a' * 1000}
+        self.server = FakeContentServer(self.contents)
+        self.client = gdata.docs.client.DocsClient()
+        self.client.http_client = self.server
+        self.temp_dir = tempfile.mkdtemp()
+        self.manifest_path = os.path.join(self.temp_dir, 'manifest.json')
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def items(self, *entries):
+        return [gdata.docs.download.DownloadItem(
+                    entry, os.path.join(self.temp_dir,
+                                        entry.title.text + '.bin'))
+                for entry in entries]
+
+    def read(self, name):
+        with open(os.path.join(self.temp_dir, name + '.bin'), 'rb') as f:
+            return f.read()
+
+    def testDownloadStreamsAndDedupes(self):
+        downloader = gdata.docs.download.BulkDownloader(
+            self.client, gdata.docs.download.DownloadManifest(
+                self.manifest_path), max_workers=1, chunk_size=64)
+        stats = downloader.download(self.items(
+            make_file('a', '"1"'), make_file('b', '"1"'),
+            make_file('c', '"1"')))
+        self.assertEqual(stats.count(gdata.docs.download.DOWNLOADED), 2)
+        self.assertEqual(stats.count(gdata.docs.download.LINKED), 1)
+        self.assertEqual(stats.bytes, 2010)
+        self.assertTrue(stats.throughput > 0)
+        for name in 'abc':
+            self.assertEqual(self.read(name), self.contents[name])
+        self.assertFalse(any(name.endswith('.part')
+                             for name in os.listdir(self.temp_dir)))
+
+    def testSkipUnchangedAndLinkByChecksum(self):
+        manifest = gdata.docs.download.DownloadManifest(self.manifest_path)
+        downloader = gdata.docs.download.BulkDownloader(self.client, manifest)
+        downloader.download(self.items(make_file('a', '"1"', b'a' * 1000)))
+        self.server.requested = []
+
+        # A new manifest reads the saved one.
+        downloader = gdata.docs.download.BulkDownloader(
+            self.client,
+            gdata.docs.download.DownloadManifest(self.manifest_path))
+        stats = downloader.download(self.items(
+            make_file('a', '"1"'), make_file('c', '"7"', b'a' * 1000),
+            make_file('b', '"1"')))
+        self.assertEqual(stats.results['id:a'], gdata.docs.download.SKIPPED)
+        self.assertEqual(stats.results['id:c'], gdata.docs.download.LINKED)
+        self.assertEqual(stats.results['id:b'],
+                         gdata.docs.download.DOWNLOADED)
+        self.assertEqual(self.server.requested, ['b'])
+        self.assertEqual(self.read('c'), self.contents['c'])
+
+    def testPerHostLimitAndFailures(self):
+        for index in range(10):
+            self.contents['f%s' % index] = ('x%s' % index).encode('utf-8')
+        entries = [make_file('f%s' % index, '"1"') for index in range(10)]
+        entries.append(make_file('missing', '"1"'))
+        downloader = gdata.docs.download.BulkDownloader(
+            self.client, max_workers=8, per_host=2)
+        stats = downloader.download(self.items(*entries))
+        self.assertTrue(self.server.max_active <= 2)
+        self.assertEqual(stats.results['id:missing'],
+                         gdata.docs.download.FAILED)
+        self.assertEqual(stats.errors['id:missing'].status, 404)
+        self.assertEqual(stats.count(gdata.docs.download.DOWNLOADED), 10)
+        self.assertEqual(len(downloader.manifest), 10)
+
+    def testTransportErrorKeepsManifest(self):
+        downloader = gdata.docs.download.BulkDownloader(
+            self.client, gdata.docs.download.DownloadManifest(
+                self.manifest_path), max_workers=2)
+        stats = downloader.download(iter(self.items(
+            make_file('a', '"1"'), make_file('broken', '"1"'),
+            make_file('b', '"1"'))))
+        self.assertEqual(stats.results['id:broken'],
+                         gdata.docs.download.FAILED)
+        self.assertTrue(isinstance(stats.errors['id:broken'],
+                                   http.client.IncompleteRead))
+        self.assertEqual(stats.count(gdata.docs.download.DOWNLOADED), 2)
+        self.assertEqual(len(gdata.docs.download.DownloadManifest(
+            self.manifest_path)), 2)
+
+    def testReplacedContentIsNotLinked(self):
+        manifest = gdata.docs.download.DownloadManifest(self.manifest_path)
+        path = os.path.join(self.temp_dir, 'a.bin')
+        with open(path, 'wb') as f:
+            f.write(b'new content')
+        manifest.record('id:a', '"1"', 'old', path)
+        self.assertEqual(manifest.find_content('old'), path)
+        # The same file is downloaded again with other content.
+        manifest.record('id:a', '"2"', 'new', path)
+        self.assertEqual(manifest.find_content('old'), None)
+        manifest.save()
+        manifest = gdata.docs.download.DownloadManifest(self.manifest_path)
+        self.assertEqual(manifest.find_content('old'), None)
+
+
+def suite():
+    return conf.build_suite([BulkDownloaderTest])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,241 @@
+#
+# Licensed under the Apache License 2.0;
+
+
+import io
+import os
+import shutil
+import tempfile
+import unittest
+
+import atom.data
+import atom.http_core
+import gdata.docs.client
+import gdata.docs.data
+import gdata.docs.sync
+import gdata.test_config as conf
+
+FULL_URI = 'https://docs.google.com/feeds/default/private/full/'
+
+
+def make_change(changestamp, resource_id, title=None, parents=(),
+                removed=False):
+    change = gdata.docs.data.Change(
+        resource_id=gdata.docs.data.ResourceId(text=resource_id),
+        changestamp=gdata.docs.data.Changestamp(value=str(changestamp)))
+    change.etag = '"etag-%s"' % changestamp
+    change.title = atom.data.Title(text=title or resource_id)
+    for parent in parents:
+        change.link.append(atom.data.Link(
+            rel=gdata.docs.data.PARENT_LINK_REL,
+            href=FULL_URI + parent.replace(':', '%3A')))
+    if removed:
+        change.removed = gdata.docs.data.Removed()
+    return change
+
+
+class FakeChangeServer(object):
+    """Serves the change feed for a list of changes, page by page."""
+
+    def __init__(self, changes):
+        self.changes = changes
+        self.requests = []
+
+    def request(self, http_request):
+        query = http_request.uri.query
+        self.requests.append(dict(query))
+        start = int(query.get('start-index', 1))
+        page_size = int(query.get('max-results', 100))
+        pending = [change for change in self.changes
+                   if int(change.changestamp.value) >= start]
+        feed = gdata.docs.data.ChangeFeed()
+        feed.entry = pending[:page_size]
+        if len(pending) > page_size:
+            next_start = int(pending[page_size].changestamp.value)
+            feed.link.append(atom.data.Link(
+                rel='next', href='%s?start-index=%s&max-results=%s' % (
+                    gdata.docs.client.CHANGE_FEED_URI, next_start,
+                    page_size)))
+        return atom.http_core.HttpResponse(
+            200, 'OK', {}, io.BytesIO(feed.to_string().encode('utf-8')))
+
+
+class ChangeSyncTest(unittest.TestCase):
+    def setUp(self):
+        self.changes = [
+            make_change(1, 'folder:a', 'A'),
+            make_change(2, 'folder:b', 'B'),
+            make_change(3, 'document:x', 'X', parents=['folder:a']),
+            make_change(4, 'document:y', 'Y', parents=['folder:a']),
+        ]
+        self.server = FakeChangeServer(self.changes)
+        self.client = gdata.docs.client.DocsClient()
+        self.client.http_client = self.server
+        self.temp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.temp_dir, 'index.json')
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def testInitialSyncReadsAllPages(self):
+        sync = gdata.docs.sync.ChangeSync(self.client, page_size=3)
+        result = sync.sync()
+        self.assertEqual(result.pages, 2)
+        self.assertEqual(result.changestamp, 4)
+        self.assertEqual(len(sync.index), 4)
+        document = sync.index.get('document:x')
+        self.assertEqual(document.title, 'X')
+        self.assertEqual(document.parents, ['folder:a'])
+        self.assertEqual(document.etag, '"etag-3"')
+
+    def testMoveAndRemove(self):
+        sync = gdata.docs.sync.ChangeSync(self.client)
+        sync.sync()
+        self.changes.append(
+            make_change(5, 'document:x', 'X2', parents=['folder:b']))
+        self.changes.append(make_change(6, 'document:y', removed=True))
+        result = sync.sync()
+        self.assertEqual(str(self.server.requests[-1]['start-index']), '5')
+        self.assertEqual(result.changed, {'document:x'})
+        self.assertEqual(result.removed, {'document:y'})
+        self.assertEqual(sync.index.get('document:x').parents, ['folder:b'])
+        self.assertTrue('document:y' not in sync.index)
+
+        changed, removed = sync.index.changed_since(4)
+        self.assertEqual([r.resource_id for r in changed], ['document:x'])
+        self.assertEqual(removed, ['document:y'])
+        self.assertEqual(sync.index.changed_since(6), ([], []))
+
+    def testCheckpointResume(self):
+        sync = gdata.docs.sync.ChangeSync(
+            self.client, path=self.path, page_size=2, checkpoint_pages=1)
+        saved = []
+        sync.sync(progress=lambda s, r: saved.append(
+            gdata.docs.sync.ResourceIndex.load(self.path).changestamp))
+        self.assertEqual(saved, [2, 4])
+
+        self.changes.append(make_change(5, 'folder:c', 'C'))
+        resumed = gdata.docs.sync.ChangeSync(self.client, path=self.path)
+        self.assertEqual(resumed.index.changestamp, 4)
+        self.assertEqual(resumed.index.get('document:y').parents,
+                         ['folder:a'])
+        result = resumed.sync()
+        self.assertEqual(result.changed, {'folder:c'})
+        self.assertEqual(
+            gdata.docs.sync.ResourceIndex.load(self.path).changestamp, 5)
+
+
+class FakeResourceServer(object):
+    """Serves a resource feed in pages of two entries."""
+
+    def __init__(self, entries):
+        self.entries = entries
+        self.requests = []
+
+    def request(self, http_request):
+        self.requests.append(http_request.uri)
+        page = int(http_request.uri.query.get('page', 0))
+        feed = gdata.docs.data.ResourceFeed()
+        feed.entry = self.entries[page * 2:page * 2 + 2]
+        if len(self.entries) > page * 2 + 2:
+            feed.link.append(atom.data.Link(
+                rel='next', href='https://docs.google.com%s?page=%s' % (
+                    gdata.docs.client.RESOURCE_FEED_URI, page + 1)))
+        return atom.http_core.HttpResponse(
+            200, 'OK', {}, io.BytesIO(feed.to_string().encode('utf-8')))
+
+
+def make_resource(resource_id, title, parents=()):
+    entry = gdata.docs.data.Resource(
+        resource_id=gdata.docs.data.ResourceId(text=resource_id),
+        title=atom.data.Title(text=title))
+    for parent in parents:
+        entry.link.append(atom.data.Link(
+            rel=gdata.docs.data.PARENT_LINK_REL,
+            href=FULL_URI + parent.replace(':', '%3A')))
+    return entry
+
+
+class CollectionTreeTest(unittest.TestCase):
+    def setUp(self):
+        self.tree = gdata.docs.sync.CollectionTree()
+        self.tree.add('folder:a', 'Projects', ['folder:root'])
+        self.tree.add('folder:b', '2012', ['folder:a'])
+        self.tree.add('document:x', 'report', ['folder:b', 'folder:root'])
+        self.tree.add('document:y', 'notes', ['folder:a'])
+        self.tree.add('document:shared', 'shared')
+
+    def testLookups(self):
+        self.assertEqual(self.tree.get_parents('document:x'),
+                         ['folder:b', 'folder:root'])
+        self.assertEqual(self.tree.get_children('folder:a'),
+                         {'folder:b', 'document:y'})
+        self.assertEqual(set(self.tree.iter_subtree('folder:a')),
+                         {'folder:b', 'document:y', 'document:x'})
+        self.assertEqual(self.tree.get_paths('document:x'),
+                         [('Projects', '2012', 'report'), ('report',)])
+        self.assertEqual(self.tree.get_path('folder:b'), '/Projects/2012')
+        self.assertEqual(self.tree.get_path('document:shared'), None)
+        self.assertEqual(self.tree.resolve('/Projects/2012/report'),
+                         {'document:x'})
+        self.assertEqual(self.tree.resolve('/Projects/missing'), set())
+
+    def testMoveAndRemove(self):
+        self.tree.add('document:y', 'notes', ['folder:b'])
+        self.assertEqual(self.tree.get_children('folder:a'), {'folder:b'})
+        self.assertEqual(self.tree.resolve('/Projects/2012/notes'),
+                         {'document:y'})
+        self.tree.remove('folder:b')
+        self.assertEqual(self.tree.resolve('/Projects/2012/report'), set())
+        self.assertEqual(self.tree.get_path('document:x'), '/report')
+        self.tree.add('folder:b', '2013', ['folder:a'])
+        self.assertEqual(self.tree.resolve('/Projects/2013/notes'),
+                         {'document:y'})
+
+    def testCycleTerminates(self):
+        self.tree.add('folder:a', 'Projects', ['folder:b'])
+        self.assertEqual(self.tree.get_paths('folder:b'), [])
+        self.assertEqual(set(self.tree.iter_subtree('folder:a')),
+                         {'folder:b', 'document:x', 'document:y'})
+
+    def testBuildFromResourceFeed(self):
+        server = FakeResourceServer([
+            make_resource('folder:a', 'Projects', ['folder:root']),
+            make_resource('folder:b', '2012', ['folder:a']),
+            make_resource('document:x', 'report', ['folder:b']),
+        ])
+        client = gdata.docs.client.DocsClient()
+        client.http_client = server
+        tree = gdata.docs.sync.CollectionTree.build(client)
+        self.assertEqual(len(server.requests), 2)
+        self.assertEqual(server.requests[0].query['showfolders'], 'true')
+        self.assertEqual(tree.get_path('document:x'), '/Projects/2012/report')
+
+    def testApplySyncResult(self):
+        changes = [
+            make_change(1, 'folder:a', 'A', parents=['folder:root']),
+            make_change(2, 'document:x', 'X', parents=['folder:a']),
+        ]
+        client = gdata.docs.client.DocsClient()
+        client.http_client = FakeChangeServer(changes)
+        sync = gdata.docs.sync.ChangeSync(client)
+        sync.sync()
+        tree = gdata.docs.sync.CollectionTree.from_index(sync.index)
+        self.assertEqual(tree.get_path('document:x'), '/A/X')
+        changes.append(make_change(3, 'folder:b', 'B',
+                                   parents=['folder:root']))
+        changes.append(make_change(4, 'document:x', 'X',
+                                   parents=['folder:b']))
+        changes.append(make_change(5, 'folder:a', removed=True))
+        tree.apply(sync.index, sync.sync())
+        self.assertEqual(tree.get_path('document:x'), '/B/X')
+        self.assertTrue('folder:a' not in tree)
+        self.assertEqual(tree.get_children('folder:root'), {'folder:b'})
+
+
+def suite():
+    return conf.build_suite([ChangeSyncTest, CollectionTreeTest])
+
+
+if __name__ == '__main__':
+    unittest.main()
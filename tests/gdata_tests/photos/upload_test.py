@@ -0,0 +1,313 @@
+#
+# Licensed under the Apache License 2.0;
+
+
+import datetime
+import hashlib
+import io
+import os
+import shutil
+import struct
+import tempfile
+import threading
+import unittest
+
+import atom
+import gdata.photos
+import gdata.photos.service
+import gdata.photos.upload
+import gdata.test_config as conf
+
+ALBUM_URI = ('https://picasaweb.google.com/data/feed/api/user/default'
+             '/albumid/1')
+ALBUM_CATEGORY = ('<category scheme="http://schemas.google.com/g/2005#kind" '
+                  'term="http://schemas.google.com/photos/2007#album"/>')
+
+
+def build_ifd(entries, offset):
+    """Packs big-endian TIFF fields, values longer than 4 bytes after them."""
+    data_offset = offset + 2 + 12 * len(entries) + 4
+    head = struct.pack('>H', len(entries))
+    data = b''
+    for tag, field_type, count, payload in entries:
+        if len(payload) <= 4:
+            head += struct.pack('>HHI', tag, field_type, count)
+            head += payload.ljust(4, b'\x00')
+        else:
+            head += struct.pack('>HHII', tag, field_type, count,
+                                data_offset + len(data))
+            data += payload
+    return head + b'\x00\x00\x00\x00' + data
+
+
+def rationals(*values):
+    return b''.join(struct.pack('>II', numerator, denominator)
+                    for numerator, denominator in values)
+
+
+def make_jpeg(make=b'Canon', taken=b'2011:07:04 18:30:00', gps=None,
+              image=b'pixels'):
+    """Builds a small JPEG file with an EXIF segment."""
+    exif_entries = [
+        (0x829A, 5, 1, rationals((1, 250))),
+        (0x829D, 5, 1, rationals((28, 10))),
+        (0x8827, 3, 1, struct.pack('>H', 400)),
+        (0x9003, 2, len(taken) + 1, taken + b'\x00'),
+        (0x9209, 3, 1, struct.pack('>H', 0x19)),
+    ]
+    gps_entries = []
+    if gps:
+        gps_entries = [
+            (1, 2, 2, gps[0] + b'\x00'),
+            (2, 5, 3, rationals(*gps[1])),
+            (3, 2, 2, gps[2] + b'\x00'),
+            (4, 5, 3, rationals(*gps[3])),
+        ]
+
+    def ifd0(exif_offset, gps_offset):
+        entries = [(0x010F, 2, len(make) + 1, make + b'\x00'),
+                   (0x8769, 4, 1, struct.pack('>I', exif_offset))]
+        if gps:
+            entries.append((0x8825, 4, 1, struct.pack('>I', gps_offset)))
+        return build_ifd(entries, 8)
+
+    exif_offset = 8 + len(ifd0(0, 0))
+    exif = build_ifd(exif_entries, exif_offset)
+    gps_offset = exif_offset + len(exif)
+    tiff = b'MM\x00\x2a' + struct.pack('>I', 8) + ifd0(exif_offset,
+                                                       gps_offset) + exif
+    if gps:
+        tiff += build_ifd(gps_entries, gps_offset)
+    return wrap_tiff(tiff, image)
+
+
+def wrap_tiff(tiff, image=b'pixels'):
+    """Builds a JPEG file with the TIFF data as its EXIF segment."""
+    app1 = b'Exif\x00\x00' + tiff
+    return (b'\xff\xd8' + b'\xff\xe0' + struct.pack('>H', 4) + b'JF'
+            + b'\xff\xe1' + struct.pack('>H', len(app1) + 2) + app1
+            + b'\xff\xda' + struct.pack('>H', 2) + image + b'\xff\xd9')
+
+
+class FakeResponse(object):
+    def __init__(self, status, body=b''):
+        self.status = status
+        self.reason = 'reason %s' % status
+        self.body = body
+
+    def read(self):
+        return self.body
+
+    def getheader(self, name, default=None):
+        return default
+
+
+class FakePhotosServer(object):
+    """Stores the photos posted to one album.
+
+    failures maps a photo title to the statuses to answer its next posts
+    with, as (status, stored) pairs where stored tells whether the photo is
+    kept anyway.
+    """
+
+    def __init__(self):
+        self.photos = []
+        self.posts = []
+        self.searches = 0
+        self.failures = {}
+        self.lock = threading.Lock()
+
+    def request(self, operation, url, data=None, headers=None):
+        if operation == 'GET':
+            with self.lock:
+                self.searches += 1
+                entries = ''.join(photo.ToString() for photo in self.photos)
+            return FakeResponse(200, ('<feed xmlns="http://www.w3.org/2005/'
+                                      'Atom">%s%s</feed>' % (
+                                          ALBUM_CATEGORY, entries)).encode())
+        body = b''
+        for part in data:
+            if isinstance(part, str):
+                part = part.encode('utf-8')
+            elif hasattr(part, 'read'):
+                part = part.read()
+            body += part
+        assert int(headers['Content-Length']) == len(body)
+        entry = gdata.photos.PhotoEntryFromString(data[1])
+        title = entry.title.text.decode('utf-8')
+        with self.lock:
+            self.posts.append((title, entry, data[3].name))
+            status, stored = 201, True
+            if self.failures.get(title):
+                status, stored = self.failures[title].pop(0)
+            if stored:
+                entry.id = atom.Id(text='%s/photoid/%s' % (
+                    ALBUM_URI, len(self.photos)))
+                self.photos.append(entry)
+        if status != 201:
+            return FakeResponse(status, b'Server error')
+        return FakeResponse(201, entry.ToString().encode('utf-8'))
+
+
+class ReadExifTest(unittest.TestCase):
+    def testReadExif(self):
+        path = os.path.join(tempfile.mkdtemp(), 'photo.jpg')
+        try:
+            with open(path, 'wb') as image:
+                image.write(make_jpeg(gps=(b'S', [(33, 1), (52, 1), (30, 1)],
+                                           b'E', [(151, 1), (12, 1),
+                                                  (36, 1)])))
+            with open(path, 'rb') as image:
+                fields = gdata.photos.upload.ReadExif(image)
+        finally:
+            shutil.rmtree(os.path.dirname(path))
+        self.assertEqual(fields['make'], 'Canon')
+        self.assertEqual(fields['time'], 1309804200000)
+        self.assertEqual(fields['exposure'], 0.004)
+        self.assertEqual(fields['fstop'], 2.8)
+        self.assertEqual(fields['iso'], 400)
+        self.assertTrue(fields['flash'])
+        self.assertAlmostEqual(fields['latitude'], -33.875)
+        self.assertAlmostEqual(fields['longitude'], 151.21)
+        tags = gdata.photos.upload.BuildExifTags(fields)
+        self.assertEqual(tags.fstop.text, '2.8')
+        self.assertEqual(tags.flash.text, 'true')
+
+    def testTimezone(self):
+        zone = datetime.timezone(datetime.timedelta(hours=2))
+        fields = gdata.photos.upload.ReadExif(io.BytesIO(make_jpeg()), zone)
+        self.assertEqual(fields['time'], 1309804200000 - 2 * 3600 * 1000)
+
+    def testBrokenIfdPointer(self):
+        # An EXIF IFD pointer with two values is ignored.
+        tiff = b'MM\x00\x2a' + struct.pack('>I', 8) + build_ifd(
+            [(0x010F, 2, 6, b'Canon\x00'),
+             (0x8769, 4, 2, struct.pack('>II', 8, 8))], 8)
+        self.assertEqual(
+            gdata.photos.upload.ReadExif(io.BytesIO(wrap_tiff(tiff))),
+            {'make': 'Canon'})
+        # A truncated directory reads as no metadata.
+        self.assertEqual(
+            gdata.photos.upload.ReadExif(io.BytesIO(wrap_tiff(tiff[:20]))),
+            {})
+
+    def testNotJpeg(self):
+        with tempfile.TemporaryFile() as image:
+            image.write(b'\x89PNG\r\n')
+            image.seek(0)
+            self.assertEqual(gdata.photos.upload.ReadExif(image), {})
+
+
+class AlbumUploaderTest(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.photo_dir = os.path.join(self.temp_dir, 'photos')
+        os.makedirs(os.path.join(self.photo_dir, 'trip'))
+        self.files = {
+            'a.jpg': make_jpeg(image=b'a' * 1000,
+                               gps=(b'N', [(48, 1), (51, 1), (30, 1)],
+                                    b'W', [(2, 1), (21, 1), (0, 1)])),
+            'b.JPG': make_jpeg(make=b'Nikon', image=b'b' * 2000),
+            os.path.join('trip', 'c.png'): b'\x89PNG\r\n' + b'c' * 300,
+            'notes.txt': b'not a photo',
+        }
+        for name, content in self.files.items():
+            with open(os.path.join(self.photo_dir, name), 'wb') as image:
+                image.write(content)
+        self.server = FakePhotosServer()
+        self.service = gdata.photos.service.PhotosService()
+        self.service.http_client = self.server
+        self.manifest_path = os.path.join(self.temp_dir, 'manifest.json')
+        self.sleeps = []
+        self.uploader = gdata.photos.upload.AlbumUploader(
+            self.service,
+            gdata.photos.upload.UploadManifest(self.manifest_path),
+            max_workers=2, sleep=self.sleeps.append)
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def testUploadDirectory(self):
+        results = []
+        stats = self.uploader.Upload(
+            ALBUM_URI, gdata.photos.upload.IterDirectory(self.photo_dir),
+            progress=lambda item, result, stats: results.append(result))
+        self.assertEqual(stats.Count(gdata.photos.upload.UPLOADED), 3)
+        self.assertEqual(results, [gdata.photos.upload.UPLOADED] * 3)
+        self.assertEqual(stats.bytes, sum(
+            len(content) for name, content in self.files.items()
+            if not name.endswith('.txt')))
+        posts = dict((title, entry) for title, entry, name
+                     in self.server.posts)
+        self.assertEqual(sorted(posts), ['a.jpg', 'b.JPG', 'c.png'])
+        entry = posts['a.jpg']
+        self.assertEqual(entry.geo.Point.pos.text, b'48.858333333333334 '
+                                                   b'-2.35')
+        self.assertEqual(entry.exif.make.text, b'Canon')
+        self.assertEqual(entry.timestamp.text, b'1309804200000')
+        self.assertEqual(
+            entry.checksum.text.decode('utf-8'),
+            hashlib.sha1(self.files['a.jpg']).hexdigest())
+        self.assertEqual(posts['b.JPG'].exif.model, None)
+        self.assertEqual(posts['c.png'].exif.make, None)
+
+        # Unchanged files are not uploaded again.
+        uploader = gdata.photos.upload.AlbumUploader(
+            self.service,
+            gdata.photos.upload.UploadManifest(self.manifest_path))
+        stats = uploader.Upload(
+            ALBUM_URI, gdata.photos.upload.IterDirectory(self.photo_dir))
+        self.assertEqual(stats.Count(gdata.photos.upload.SKIPPED), 3)
+        self.assertEqual(len(self.server.posts), 3)
+
+    def testInterruptedUploadSavesManifest(self):
+        def Stop(item, result, stats):
+            raise KeyboardInterrupt
+
+        self.assertRaises(
+            KeyboardInterrupt, self.uploader.Upload, ALBUM_URI,
+            gdata.photos.upload.IterDirectory(self.photo_dir), Stop)
+        manifest = gdata.photos.upload.UploadManifest(self.manifest_path)
+        self.assertTrue(len(manifest) >= 1)
+
+    def testUploadItemsAndRetries(self):
+        self.server.failures = {'lost': [(500, False)],
+                                'stored': [(503, True)],
+                                'refused': [(400, False)]}
+        items = []
+        for title in ('lost', 'stored', 'refused'):
+            path = os.path.join(self.temp_dir, title + '.jpg')
+            with open(path, 'wb') as image:
+                image.write(make_jpeg(image=title.encode() * 100))
+            items.append(gdata.photos.upload.UploadItem(
+                path, title=title, tags=['paris', 'trip'],
+                location=(1.5, 2.5)))
+        stats = self.uploader.Upload(ALBUM_URI, items)
+        self.assertEqual([stats.results[item.GetKey()] for item in items],
+                         [gdata.photos.upload.UPLOADED,
+                          gdata.photos.upload.FOUND,
+                          gdata.photos.upload.FAILED])
+        self.assertTrue(isinstance(
+            stats.errors[items[2].GetKey()],
+            gdata.photos.service.GooglePhotosException))
+        self.assertEqual(stats.retries, 2)
+        self.assertEqual(self.sleeps, [1.0, 1.0])
+        # Both retries searched the album before posting again.
+        self.assertEqual(self.server.searches, 2)
+        self.assertEqual(
+            sorted(title for title, entry, name in self.server.posts),
+            ['lost', 'lost', 'refused', 'stored'])
+        self.assertEqual(
+            sorted(entry.title.text for entry in self.server.photos),
+            [b'lost', b'stored'])
+        entry = self.server.posts[0][1]
+        self.assertEqual(entry.media.keywords.text, b'paris,trip')
+        self.assertEqual(entry.geo.Point.pos.text, b'1.5 2.5')
+
+
+def suite():
+    return conf.build_suite([ReadExifTest, AlbumUploaderTest])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -11,10 +11,13 @@
 
 # __author__ = 'e.bidelman@google.com (Eric Bidelman)'
 
+import io
 import os
+import tempfile
 import unittest
 
 import atom.data
+import atom.http_core
 import gdata.client
 import gdata.data
 import gdata.docs.client
@@ -115,8 +118,108 @@ class ResumableUploadTestCase(unittest.TestCase):
         self.client.Delete(entry, force=True)
 
 
+class FakeResumableServer(object):
+    """Stores the chunks PUT to an upload URI, optionally failing midway."""
+
+    def __init__(self, fail_at_byte=None, store_at_most=None):
+        self.data = b''
+        self.sessions = 0
+        self.fail_at_byte = fail_at_byte
+        self.store_at_most = store_at_most
+        self.ranges = []
+
+    def request(self, http_request):
+        if http_request.method == 'POST' and 'Content-Range' not in (
+                http_request.headers):
+            self.sessions += 1
+            self.data = b''
+            return atom.http_core.HttpResponse(
+                200, 'OK', {'Location': 'http://example.com/upload/%d' %
+                                        self.sessions})
+        content_range = http_request.headers['Content-Range']
+        total = int(content_range.split('/')[1])
+        if http_request.method == 'PUT':
+            start = int(content_range.split(' ')[1].split('-')[0])
+            self.ranges.append(content_range)
+            if self.fail_at_byte is not None and start >= self.fail_at_byte:
+                self.fail_at_byte = None
+                raise IOError('Connection reset')
+            chunk = http_request._body_parts[0]
+            if self.store_at_most is not None:
+                chunk = chunk[:self.store_at_most]
+                self.store_at_most = None
+            self.data = self.data[:start] + bytes(chunk)
+        if len(self.data) >= total:
+            return atom.http_core.HttpResponse(201, 'Created', {}, io.BytesIO(
+                gdata.data.GDEntry(id=atom.data.Id('done')).to_string().encode()))
+        headers = {}
+        if self.data:
+            headers['Range'] = 'bytes=0-%d' % (len(self.data) - 1)
+        return atom.http_core.HttpResponse(308, 'Resume Incomplete', headers,
+                                           io.BytesIO(b''))
+
+
+class ResumableUploaderUnitTest(unittest.TestCase):
+    def setUp(self):
+        self.content = os.urandom(3 * 262144 + 1000)
+        self.client = gdata.client.GDClient()
+        self.server = FakeResumableServer()
+        self.client.http_client = self.server
+
+    def uploader(self, file_handle, **kwargs):
+        return gdata.client.ResumableUploader(
+            self.client, file_handle, 'application/octet-stream',
+            len(self.content), chunk_size=262144, **kwargs)
+
+    def test_upload_in_chunks(self):
+        entry = self.uploader(io.BytesIO(self.content)).upload_file(
+            'http://example.com/create')
+        self.assertEqual(entry.id.text, 'done')
+        self.assertEqual(self.server.data, self.content)
+        self.assertEqual(len(self.server.ranges), 4)
+
+    def test_resend_partially_stored_chunk(self):
+        self.server.store_at_most = 1000
+        self.uploader(io.BytesIO(self.content)).upload_file(
+            'http://example.com/create')
+        self.assertEqual(self.server.data, self.content)
+        self.assertEqual(self.server.ranges[1].split('-')[0], 'bytes 1000')
+
+    def test_resume_persisted_session(self):
+        directory = tempfile.mkdtemp()
+        path = os.path.join(directory, 'upload.bin')
+        with open(path, 'wb') as upload_file:
+            upload_file.write(self.content)
+        store_path = os.path.join(directory, 'sessions.json')
+        self.server.fail_at_byte = 2 * 262144
+
+        with open(path, 'rb') as upload_file:
+            store = gdata.client.FileUploadSessionStore(store_path)
+            self.assertRaises(IOError, self.uploader(
+                upload_file, session_store=store).upload_file,
+                              'http://example.com/create')
+
+        # A new process finds the session on disk and only sends the rest.
+        with open(path, 'rb') as upload_file:
+            store = gdata.client.FileUploadSessionStore(store_path)
+            entry = self.uploader(upload_file, session_store=store).upload_file(
+                'http://example.com/create')
+        self.assertEqual(entry.id.text, 'done')
+        self.assertEqual(self.server.sessions, 1)
+        self.assertEqual(self.server.data, self.content)
+        self.assertEqual(gdata.client.FileUploadSessionStore(store_path)._sessions,
+                         {})
+
+    def test_adapt_chunk_size(self):
+        uploader = self.uploader(io.BytesIO(self.content), adapt_chunk_size=True)
+        uploader._adapt_chunk_size(262144, 0.1)
+        self.assertEqual(uploader.chunk_size, 2 * 262144)
+        uploader._adapt_chunk_size(262144, 1000)
+        self.assertEqual(uploader.chunk_size, uploader.MIN_CHUNK_SIZE)
+
+
 def suite():
-    return conf.build_suite([ResumableUploadTestCase])
+    return conf.build_suite([ResumableUploadTestCase, ResumableUploaderUnitTest])
 
 
 if __name__ == '__main__':
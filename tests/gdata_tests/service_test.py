@@ -8,6 +8,7 @@
 
 import getpass
 import os.path
+import time
 import unittest
 
 import atom
@@ -484,6 +485,73 @@ class GetNextPageInFeedTest(unittest.TestCase):
         self.assertTrue(feed2.__class__ == feed.__class__)
 
 
+class EntryGeneratorTest(unittest.TestCase):
+    def setUp(self):
+        self.member_string_encoding = atom.MEMBER_STRING_ENCODING
+        atom.MEMBER_STRING_ENCODING = str
+        self.gd_client = gdata.service.GDataService()
+        self.pages = {}
+        self.requested = []
+        for i in range(3):
+            page = gdata.GDataFeed(entry=[
+                gdata.GDataEntry(title=atom.Title(text='%d-%d' % (i, j)))
+                for j in range(2)])
+            if i < 2:
+                page.link.append(atom.Link(rel='next',
+                                           href='http://example.com/%d' % (i + 1)))
+            self.pages['http://example.com/%d' % i] = page.ToString()
+
+        def GetWithRetries(uri, converter=None, **kwargs):
+            self.requested.append(uri)
+            return converter(self.pages[uri])
+
+        self.gd_client.GetWithRetries = GetWithRetries
+        self.first_page = gdata.GDataFeedFromString(
+            self.pages['http://example.com/0'])
+
+    def tearDown(self):
+        atom.MEMBER_STRING_ENCODING = self.member_string_encoding
+
+    def testYieldsEntriesOfAllPages(self):
+        for prefetch in (True, False):
+            self.requested = []
+            titles = [entry.title.text for entry in
+                      self.gd_client.GetEntryGeneratorFromLinkFinder(
+                          self.first_page, gdata.GDataFeedFromString,
+                          prefetch=prefetch)]
+            self.assertEqual(titles, ['0-0', '0-1', '1-0', '1-1', '2-0', '2-1'])
+            self.assertEqual(self.requested, ['http://example.com/1',
+                                              'http://example.com/2'])
+
+    def testClosingWaitsForPrefetch(self):
+        started = []
+        finished = []
+        get_with_retries = self.gd_client.GetWithRetries
+
+        def SlowGetWithRetries(uri, converter=None, **kwargs):
+            started.append(uri)
+            time.sleep(0.05)
+            page = get_with_retries(uri, converter=converter, **kwargs)
+            finished.append(uri)
+            return page
+
+        self.gd_client.GetWithRetries = SlowGetWithRetries
+        generator = self.gd_client.GetEntryGeneratorFromLinkFinder(
+            self.first_page, gdata.GDataFeedFromString)
+        self.assertEqual(next(generator).title.text, '0-0')
+        generator.close()
+        # The prefetch was cancelled or ran to its end, it is not left
+        # running in the background.
+        self.assertEqual(finished, started)
+
+    def testStopsFetchingWhenClosed(self):
+        generator = self.gd_client.GetEntryGeneratorFromLinkFinder(
+            self.first_page, gdata.GDataFeedFromString, prefetch=False)
+        self.assertEqual(next(generator).title.text, '0-0')
+        generator.close()
+        self.assertEqual(self.requested, [])
+
+
 class ScopeLookupTest(unittest.TestCase):
     def testLookupScopes(self):
         scopes = gdata.service.lookup_scopes('cl')
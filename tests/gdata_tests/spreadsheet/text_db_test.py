@@ -5,9 +5,13 @@
 
 
 import getpass
+import threading
 import time
 import unittest
 
+import atom
+import gdata
+import gdata.spreadsheet
 import gdata.spreadsheet.service
 import gdata.spreadsheet.text_db
 
@@ -186,6 +190,263 @@ class TableTest(unittest.TestCase):
         self.assertEqual(existing_table.fields, ['a', 'b', 'cd', 'a_2', 'de'])
 
 
+class FakeSpreadsheetsService(object):
+    """Records the calls text_db makes instead of contacting the server."""
+
+    server = 'spreadsheets.google.com'
+
+    def __init__(self):
+        self.calls = []
+        self.rows = {}
+        self.etags = {}
+        self.updated = {}
+        self.clock = 0
+        self.lock = threading.Lock()
+
+    def _Touch(self, row_id):
+        self.clock += 1
+        self.updated[row_id] = '2009-01-01T00:00:%02d.000Z' % self.clock
+
+    def _Row(self, row_id, data):
+        entry = gdata.spreadsheet.SpreadsheetsList(
+            atom_id=atom.Id(text='https://spreadsheets.google.com/feeds/list/'
+                                 'k/w/private/full/%s' % row_id),
+            link=[atom.Link(rel='edit', href='edit/%s' % row_id)])
+        for column, value in data.items():
+            entry.custom[column] = gdata.spreadsheet.Custom(column=column,
+                                                            text=value)
+        entry.extension_attributes[gdata.spreadsheet.text_db.GD_ETAG] = (
+            self.etags[row_id])
+        return entry
+
+    def GetCellsFeed(self, key, wksht_id='default', cell=None, query=None):
+        self.calls.append(('GetCellsFeed', query.max_col))
+        feed = gdata.spreadsheet.SpreadsheetsCellsFeed()
+        for col in range(1, int(query.max_col) + 1):
+            feed.entry.append(gdata.spreadsheet.SpreadsheetsCell(
+                atom_id=atom.Id(text='R1C%s' % col),
+                cell=gdata.spreadsheet.Cell(row='1', col=str(col))))
+        return feed
+
+    def ExecuteBatch(self, batch_feed, url=None, spreadsheet_key=None,
+                     worksheet_id=None):
+        self.calls.append(('ExecuteBatch', [
+            entry.cell.inputValue for entry in batch_feed.entry]))
+        return gdata.spreadsheet.SpreadsheetsCellsFeed()
+
+    def InsertRow(self, row_data, key, wksht_id='default'):
+        with self.lock:
+            row_id = 'r%s' % (len(self.rows) + 1)
+            self.calls.append(('InsertRow', row_data['name']))
+            self.rows[row_id] = dict(row_data)
+            self.etags[row_id] = '"1"'
+            self._Touch(row_id)
+            return self._Row(row_id, row_data)
+
+    def UpdateRow(self, entry, new_row_data):
+        row_id = entry.id.text.split('/')[-1]
+        with self.lock:
+            self.calls.append(('UpdateRow', new_row_data['name']))
+            self.rows[row_id] = dict(new_row_data)
+            self.etags[row_id] = '"%s"' % (int(self.etags[row_id][1:-1]) + 1)
+            self._Touch(row_id)
+            return self._Row(row_id, new_row_data)
+
+    def GetListFeed(self, key, wksht_id='default', row_id=None, query=None):
+        self.calls.append(('GetListFeed', row_id))
+        if row_id is not None:
+            return self._Row(row_id, self.rows[row_id])
+        row_ids = sorted(self.rows, key=lambda row_id: int(row_id[1:]))
+        if query.updated_min:
+            row_ids = [row_id for row_id in row_ids
+                       if self.updated[row_id] >= query.updated_min]
+        if query.max_results:
+            row_ids = row_ids[:int(query.max_results)]
+        return gdata.spreadsheet.SpreadsheetsListFeed(
+            updated=atom.Updated(text=max(self.updated.values())),
+            total_results=gdata.TotalResults(text=str(len(self.rows))),
+            entry=[self._Row(row_id, self.rows[row_id]) for row_id in row_ids])
+
+    def Get(self, uri, extra_headers=None, converter=None):
+        row_id = uri.split('/')[-1]
+        self.calls.append(('Get', row_id))
+        if extra_headers.get('If-None-Match') == self.etags[row_id]:
+            raise gdata.service.RequestError({'status': 304, 'reason': '',
+                                              'body': ''})
+        return self._Row(row_id, self.rows[row_id])
+
+
+class FakeDatabaseClient(object):
+    def __init__(self):
+        self.service = FakeSpreadsheetsService()
+
+    def _GetSpreadsheetsClient(self):
+        return self.service
+
+
+class UnitOfWorkTest(unittest.TestCase):
+    def setUp(self):
+        self.client = FakeDatabaseClient()
+        self.service = self.client.service
+        self.db = gdata.spreadsheet.text_db.Database(
+            database_client=self.client)
+        self.db.spreadsheet_key = 'k'
+
+    def NewTable(self, fields=None):
+        return gdata.spreadsheet.text_db.Table(
+            name='t', worksheet_entry=gdata.spreadsheet.SpreadsheetsWorksheet(
+                atom_id=atom.Id(text='https://spreadsheets.google.com/feeds/'
+                                     'worksheets/k/private/full/w')),
+            database_client=self.client, spreadsheet_key='k', fields=fields,
+            database=self.db)
+
+    def testSetFieldsUsesOneBatch(self):
+        self.NewTable(['name', 'email', 'phone'])
+        self.assertEqual(self.service.calls, [
+            ('GetCellsFeed', '3'), ('ExecuteBatch', ['name', 'email', 'phone'])])
+
+    def testChangesAreSentOnFlush(self):
+        table = self.NewTable()
+        existing = table.AddRecord({'name': 'Bob'})
+        del self.service.calls[:]
+        with self.db.BeginWork() as work:
+            table.SetFields(['name'])
+            first = table.AddRecord({'name': 'Ann'})
+            second = table.AddRecord({'name': 'Cy'})
+            second.content['name'] = 'Cyd'
+            second.Push()
+            existing.content['name'] = 'Rob'
+            existing.Push()
+            existing.Push()
+            self.assertEqual(self.service.calls, [])
+            self.assertTrue(first.row_id is None)
+        self.assertTrue(self.db.unit_of_work is None)
+        self.assertEqual(self.service.calls[:2], [
+            ('GetCellsFeed', '1'), ('ExecuteBatch', ['name'])])
+        self.assertEqual(
+            sorted(self.service.calls[2:]),
+            [('InsertRow', 'Ann'), ('InsertRow', 'Cyd'), ('UpdateRow', 'Rob')])
+        inserts = [call for call in self.service.calls if call[0] == 'InsertRow']
+        self.assertEqual(inserts, [('InsertRow', 'Ann'), ('InsertRow', 'Cyd')])
+        self.assertEqual(first.row_id, 'r2')
+        self.assertEqual(self.service.rows['r3'], {'name': 'Cyd'})
+
+    def testFailedChangesAreKept(self):
+        table = self.NewTable()
+        work = table.BeginWork()
+        record = table.AddRecord({'name': 'Ann'})
+        self.service.InsertRow = None
+        self.assertRaises(TypeError, work.Flush)
+        self.assertEqual(work.inserts, [record])
+        del self.service.InsertRow
+        work.Flush()
+        self.assertEqual(record.row_id, 'r1')
+        self.assertEqual(work.inserts, [])
+
+    def testRowCacheValidatesEtag(self):
+        table = self.NewTable()
+        record = table.AddRecord({'name': 'Ann'})
+        del self.service.calls[:]
+        cached = table.GetRecord(row_id=record.row_id)
+        self.assertEqual(cached.content, {'name': 'Ann'})
+        self.assertEqual(self.service.calls, [('Get', 'r1')])
+        self.assertTrue(cached.entry is table.row_cache['r1'])
+        self.service.rows['r1'] = {'name': 'Bea'}
+        self.service.etags['r1'] = '"5"'
+        record.Pull()
+        self.assertEqual(record.content, {'name': 'Bea'})
+        self.assertEqual(table.row_cache['r1'].custom['name'].text, 'Bea')
+
+
+class ReplicaTest(unittest.TestCase):
+    def setUp(self):
+        self.client = FakeDatabaseClient()
+        self.service = self.client.service
+        self.table = gdata.spreadsheet.text_db.Table(
+            name='t', worksheet_entry=gdata.spreadsheet.SpreadsheetsWorksheet(
+                atom_id=atom.Id(text='https://spreadsheets.google.com/feeds/'
+                                     'worksheets/k/private/full/w')),
+            database_client=self.client, spreadsheet_key='k')
+        for row in ({'name': '1', 'b': '2', 'cd': '3', 'de': '5'},
+                    {'name': 'hi', 'b': '2', 'cd': '20', 'de': '5'},
+                    {'name': '2', 'b': '2', 'cd': '3'},
+                    {'name': '2', 'b': '2', 'cd': '15', 'de': '7'},
+                    {'name': 'hi hi hi', 'b': '2', 'cd': '15', 'de': '7'},
+                    {'name': '"5"', 'b': '5', 'cd': '15', 'de': '7'},
+                    {'name': '5', 'b': '5', 'cd': '15.0', 'de': '7'}):
+            self.service.InsertRow(row, 'k', 'w')
+        self.table.EnableReplica()
+        del self.service.calls[:]
+
+    def Names(self, records):
+        return [record.content['name'] for record in records]
+
+    def testFindRecordsLocally(self):
+        self.assertEqual(self.Names(self.table.FindRecords('name == 1')), ['1'])
+        self.assertEqual(self.Names(self.table.FindRecords('name = 5')), ['5'])
+        self.assertEqual(
+            self.Names(self.table.FindRecords('name > 1 && cd < 20')),
+            ['2', '2', 'hi hi hi', '5'])
+        self.assertEqual(
+            self.Names(self.table.FindRecords('cd == 15 and name != "hi hi hi"')),
+            ['2', '"5"', '5'])
+        self.assertEqual(
+            self.Names(self.table.FindRecords('(cd < 10 or de >= 7) && b <> 5')),
+            ['1', '2', '2', 'hi hi hi'])
+        self.assertEqual(self.Names(self.table.FindRecords('de < cd')),
+                         ['hi', '2', '2', 'hi hi hi', '"5"', '5'])
+        self.assertEqual(self.Names(self.table.FindRecords('de == ""')), ['2'])
+        self.assertEqual(self.service.calls, [])
+        self.assertRaises(gdata.spreadsheet.text_db.QueryError,
+                          self.table.FindRecords, 'name == (1')
+
+    def testGetRecordsLocally(self):
+        records = self.table.GetRecords(2, 3)
+        self.assertEqual(self.Names(records), ['hi', '2'])
+        self.assertTrue(records.GetNext() is None)
+        self.assertEqual(self.service.calls, [])
+
+    def testLocalWritesUpdateReplica(self):
+        record = self.table.AddRecord({'name': 'new', 'cd': '1'})
+        self.assertEqual(self.Names(self.table.FindRecords('cd == 1')), ['new'])
+        record.content['cd'] = '2'
+        record.Push()
+        self.assertEqual(self.Names(self.table.FindRecords('cd <= 2')), ['new'])
+
+    def testIndexesArePatched(self):
+        self.table.FindRecords('cd < 10 and name == 2')
+        hash_index = self.table.replica._hash_indexes['name']
+        sorted_index = self.table.replica._sorted_indexes['cd']
+        self.table.FindRecords('cd > 10 or name == hi')
+        self.assertTrue(self.table.replica._hash_indexes['name'] is hash_index)
+        self.assertTrue(
+            self.table.replica._sorted_indexes['cd'] is sorted_index)
+        record = self.table.FindRecords('name == 1')[0]
+        record.content['name'] = '2'
+        record.content['cd'] = '30'
+        record.Push()
+        self.assertTrue(self.table.replica._hash_indexes['name'] is hash_index)
+        self.assertEqual(self.Names(self.table.FindRecords('name == 1')), [])
+        self.assertEqual(self.Names(self.table.FindRecords('cd < 10')), ['2'])
+        self.assertEqual(
+            self.Names(self.table.FindRecords('cd > 15 and name == 2')), ['2'])
+        self.table.replica.Remove(record.row_id)
+        self.assertEqual(self.Names(self.table.FindRecords('cd > 15')), ['hi'])
+
+    def testRefresh(self):
+        self.service.rows['r2'] = {'name': 'changed'}
+        self.service._Touch('r2')
+        self.table.replica.Refresh()
+        self.assertEqual(self.service.calls,
+                         [('GetListFeed', None), ('GetListFeed', None)])
+        self.assertEqual(self.Names(self.table.GetRecords(2, 2)), ['changed'])
+        del self.service.rows['r3']
+        self.table.replica.Refresh()
+        self.assertEqual(len(self.service.calls), 5)
+        self.assertEqual(len(self.table.replica.row_ids), 6)
+        self.assertEqual(self.Names(self.table.GetRecords(3, 3)), ['2'])
+
+
 if __name__ == '__main__':
     if not username:
         username = input('Spreadsheets API | Text DB Tests\n'
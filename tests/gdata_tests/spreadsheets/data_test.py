@@ -11,9 +11,17 @@
 
 # __author__ = 'j.s@google.com (Jeff Scudder)'
 
+import csv
+import io
+import threading
+import time
 import unittest
 
 import atom.core
+import atom.http_core
+import atom.mock_http_core
+import gdata.data
+import gdata.spreadsheets.client
 import gdata.spreadsheets.data
 import gdata.test_config as conf
 
@@ -484,6 +492,244 @@ BATCH_CELLS = """<feed xmlns="http://www.w3.org/2005/Atom"
   </entry>
 </feed>"""
 
+GRID_PAGE = """<feed xmlns="http://www.w3.org/2005/Atom"
+    xmlns:gs="http://schemas.google.com/spreadsheets/2006">
+  <id>https://spreadsheets.google.com/feeds/cells/k/w/private/full</id>
+  %s
+  <gs:rowCount>100</gs:rowCount>
+  <gs:colCount>3</gs:colCount>
+  %s
+</feed>"""
+
+GRID_CELL = """<entry>
+    <id>https://spreadsheets.google.com/feeds/cells/k/w/private/full/R%sC%s</id>
+    <link rel="self" type="application/atom+xml"
+      href="https://spreadsheets.google.com/feeds/cells/k/w/private/full/R1C1"/>
+    <gs:cell row="%s" col="%s" inputValue="%s"%s>%s</gs:cell>
+  </entry>"""
+
+
+def grid_cell(row, col, value, input_value=None, numeric_value=None):
+    numeric = ''
+    if numeric_value is not None:
+        numeric = ' numericValue="%s"' % numeric_value
+    return GRID_CELL % (row, col, row, col, input_value or value, numeric,
+                        value)
+
+
+class CellGridTest(unittest.TestCase):
+    def test_set_and_get_cells(self):
+        grid = gdata.spreadsheets.data.CellGrid(min_row=2, min_col=3)
+        grid.set_cell(2, 3, 'a')
+        grid.set_cell(4, 4, '5', '=2+3', '5.0')
+        self.assertEqual((grid.row_count, grid.col_count), (3, 2))
+        self.assertEqual((grid.max_row, grid.max_col), (4, 4))
+        self.assertEqual(grid.get_value(2, 3), 'a')
+        self.assertEqual(grid.get_input_value(4, 4), '=2+3')
+        self.assertEqual(grid.get_numeric_value(4, 4), 5.0)
+        self.assertTrue(grid.get_numeric_value(2, 3) is None)
+        self.assertTrue(grid.get_value(3, 3) is None)
+        self.assertTrue(grid.get_value(1, 1) is None)
+        self.assertEqual(list(grid.iter_rows()),
+                         [['a', None], [None, None], [None, '5']])
+        self.assertRaises(IndexError, grid.set_cell, 1, 3, 'x')
+        # Overwriting a number with text drops the old number.
+        grid.set_cell(4, 4, 'five')
+        self.assertTrue(grid.get_numeric_value(4, 4) is None)
+
+    def test_read_cells_streams_page(self):
+        page = GRID_PAGE % (
+            '<link rel="next" href="https://example.com/next"/>',
+            grid_cell(1, 1, 'Name') + grid_cell(1, 2, 'Hours')
+            + grid_cell(2, 2, '5', '=FLOOR(2.5*2)', '5.0')
+            + grid_cell(3, 4, 'ignored'))
+        grid = gdata.spreadsheets.data.CellGrid()
+        next_link = gdata.spreadsheets.data.read_cells_into_grid(
+            io.BytesIO(page.encode('utf-8')), grid, max_col=3)
+        self.assertEqual(next_link, 'https://example.com/next')
+        self.assertEqual((grid.row_count, grid.col_count), (2, 3))
+        self.assertEqual(grid.get_row(1), ['Name', 'Hours', None])
+        self.assertEqual(grid.get_input_value(2, 2), '=FLOOR(2.5*2)')
+        self.assertEqual(grid.get_numeric_value(2, 2), 5.0)
+        self.assertTrue(grid.get_value(3, 4) is None)
+
+    def test_get_grid_follows_next_links(self):
+        client = gdata.spreadsheets.client.SpreadsheetsClient()
+        client.http_client = atom.mock_http_core.MockHttpClient()
+        first_uri = atom.http_core.Uri.parse_uri(
+            gdata.spreadsheets.client.CELLS_URL % ('k', 'w'))
+        first_uri.query['min-row'] = '1'
+        first_uri.query['max-row'] = '4'
+        next_uri = ('https://spreadsheets.google.com/feeds/cells/k/w/private/'
+                    'full/next?start-index=3')
+        client.http_client.add_response(
+            atom.http_core.HttpRequest(first_uri, 'GET'), 200, 'OK',
+            body=(GRID_PAGE % ('<link rel="next" href="%s"/>' % next_uri,
+                               grid_cell(1, 1, 'x') + grid_cell(1, 3, 'y'))
+                  ).encode('utf-8'))
+        client.http_client.add_response(
+            atom.http_core.HttpRequest(next_uri, 'GET'), 200, 'OK',
+            body=(GRID_PAGE % ('', grid_cell(2, 2, '7', '7', '7'))
+                  ).encode('utf-8'))
+        grid = client.get_grid('k', 'w', min_row=1, max_row=4)
+        self.assertEqual((grid.row_count, grid.col_count), (4, 3))
+        self.assertEqual(list(grid.iter_rows()),
+                         [['x', None, 'y'], [None, '7', None],
+                          [None, None, None], [None, None, None]])
+        self.assertEqual(grid.get_numeric_value(2, 2), 7.0)
+
+
+class FakeCellsBatchServer(object):
+    """Answers cell batch requests, failing the listed cells."""
+
+    def __init__(self, fail_once=(), always_fail=(), interrupt_after=None):
+        self.fail_once = set(fail_once)
+        self.always_fail = set(always_fail)
+        self.interrupt_after = interrupt_after
+        self.requests = []
+        self.lock = threading.Lock()
+
+    def request(self, http_request):
+        feed = atom.core.parse(bytes(http_request._body_parts[0]),
+                               gdata.spreadsheets.data.CellsFeed)
+        with self.lock:
+            self.requests.append(
+                [(entry.cell.row, entry.cell.col, entry.cell.input_value)
+                 for entry in feed.entry])
+            response = gdata.spreadsheets.data.CellsFeed()
+            for entry in feed.entry[:self.interrupt_after]:
+                code = '200'
+                if entry.batch_id.text in self.fail_once:
+                    self.fail_once.remove(entry.batch_id.text)
+                    code = '409'
+                elif entry.batch_id.text in self.always_fail:
+                    code = '409'
+                response.entry.append(gdata.spreadsheets.data.CellEntry(
+                    batch_id=gdata.data.BatchId(text=entry.batch_id.text),
+                    batch_status=gdata.data.BatchStatus(code=code,
+                                                        reason='r')))
+            self.interrupt_after = None
+        return atom.http_core.HttpResponse(
+            200, 'OK', {}, io.BytesIO(response.to_string().encode('utf-8')))
+
+
+class UpdateCellsTest(unittest.TestCase):
+    def setUp(self):
+        self.client = gdata.spreadsheets.client.SpreadsheetsClient()
+
+    def test_build_batch_request(self):
+        body = gdata.spreadsheets.data.build_batch_cells_request(
+            'k', 'w', [(1, 2, 'a<b'), (3, 1, '=A1\n"x"')])
+        feed = atom.core.parse(body, gdata.spreadsheets.data.CellsFeed)
+        self.assertEqual(feed.id.text, 'https://spreadsheets.google.com/feeds'
+                                       '/cells/k/w/private/full')
+        self.assertEqual(len(feed.entry), 2)
+        self.assertEqual(feed.entry[0].batch_id.text, 'R1C2')
+        self.assertEqual(feed.entry[0].batch_operation.type, 'update')
+        self.assertEqual(feed.entry[0].cell.input_value, 'a<b')
+        self.assertEqual(feed.entry[1].id.text, feed.id.text + '/R3C1')
+        self.assertEqual(feed.entry[1].find_edit_link(), feed.id.text + '/R3C1')
+        self.assertEqual(feed.entry[1].cell.input_value, '=A1\n"x"')
+
+    def test_only_changed_cells_are_sent(self):
+        server = FakeCellsBatchServer()
+        self.client.http_client = server
+        current = gdata.spreadsheets.data.CellGrid()
+        current.set_cell(1, 1, 'a', 'a')
+        current.set_cell(2, 2, '2', '=1+1', '2')
+        current.set_cell(3, 1, '9', '9', '9')
+        current.set_cell(3, 2, '4', '4', '4')
+        failures = self.client.update_cells(
+            'k', 'w', [['a', 'b'], [None, '=1+1'], [3, '=A1']],
+            current=current, batch_size=2)
+        self.assertEqual(failures, {})
+        sent = sorted(cell for batch in server.requests for cell in batch)
+        self.assertEqual(sent, [('1', '2', 'b'), ('3', '1', '3'),
+                                ('3', '2', '=A1')])
+        self.assertEqual(len(server.requests), 2)
+        self.assertEqual(current.get_input_value(1, 2), 'b')
+        self.assertEqual(current.get_value(3, 1), '3')
+        self.assertEqual(current.get_numeric_value(3, 1), 3.0)
+        # The value of a formula is only known once it is read again.
+        self.assertEqual(current.get_input_value(3, 2), '=A1')
+        self.assertTrue(current.get_value(3, 2) is None)
+        self.assertTrue(current.get_numeric_value(3, 2) is None)
+
+    def test_failed_cells_are_retried(self):
+        server = FakeCellsBatchServer(fail_once=['R1C2'], interrupt_after=2)
+        self.client.http_client = server
+        failures = self.client.update_cells(
+            'k', 'w', [['a', 'b', 'c', 'd']], min_row=1, batch_size=10,
+            retry_delay=0)
+        self.assertEqual(failures, {})
+        self.assertEqual(len(server.requests), 2)
+        self.assertEqual(server.requests[1],
+                         [('1', '2', 'b'), ('1', '3', 'c'), ('1', '4', 'd')])
+
+    def test_persistent_failures_are_reported(self):
+        server = FakeCellsBatchServer(always_fail=['R2C1'])
+        self.client.http_client = server
+        started = time.time()
+        failures = self.client.update_cells(
+            'k', 'w', [['x']], min_row=2, num_retries=2, retry_delay=0.02)
+        self.assertEqual(failures, {(2, 1): (409, 'r')})
+        self.assertEqual(len(server.requests), 3)
+        # The retries waited 0.02 then 0.04 seconds.
+        self.assertTrue(time.time() - started >= 0.06)
+
+
+LIST_PAGE = """<feed xmlns="http://www.w3.org/2005/Atom"
+    xmlns:gsx="http://schemas.google.com/spreadsheets/2006/extended">
+  <id>https://spreadsheets.google.com/feeds/list/k/w/private/full</id>
+  %s
+  %s
+</feed>"""
+
+LIST_ROW = """<entry>
+    <id>https://spreadsheets.google.com/feeds/list/k/w/private/full/%s</id>
+    <title type="text">%s</title>
+    <gsx:name>%s</gsx:name>
+    <gsx:hours>%s</gsx:hours>
+  </entry>"""
+
+
+class ListColumnsTest(unittest.TestCase):
+    def test_columns_with_converters(self):
+        page = LIST_PAGE % ('', LIST_ROW % ('r1', 'Bingley', 'Bingley', '10')
+                            + LIST_ROW % ('r2', 'Darcy', 'Darcy', ''))
+        columns = gdata.spreadsheets.data.ListColumns({'hours': float})
+        next_link = gdata.spreadsheets.data.read_list_rows(
+            io.BytesIO(page.encode('utf-8')), columns)
+        self.assertTrue(next_link is None)
+        self.assertEqual(columns.names, ['name', 'hours'])
+        self.assertEqual(columns.row_count, 2)
+        self.assertEqual(columns.columns, {'name': ['Bingley', 'Darcy'],
+                                           'hours': [10.0, None]})
+
+    def test_get_list_columns_writes_sink(self):
+        client = gdata.spreadsheets.client.SpreadsheetsClient()
+        client.http_client = atom.mock_http_core.MockHttpClient()
+        next_uri = ('https://spreadsheets.google.com/feeds/list/k/w/private/'
+                    'full/next?start-index=2')
+        client.http_client.add_response(
+            atom.http_core.HttpRequest(
+                gdata.spreadsheets.client.LISTS_URL % ('k', 'w'), 'GET'),
+            200, 'OK', body=(LIST_PAGE % (
+                '<link rel="next" href="%s"/>' % next_uri,
+                LIST_ROW % ('r1', 'Jane', 'Jane', '3'))).encode('utf-8'))
+        client.http_client.add_response(
+            atom.http_core.HttpRequest(next_uri, 'GET'), 200, 'OK',
+            body=(LIST_PAGE % ('', LIST_ROW % ('r2', 'Lydia', 'Lydia', '4'))
+                  ).encode('utf-8'))
+        output = io.StringIO()
+        columns = client.get_list_columns(
+            'k', 'w', sink=csv.writer(output, delimiter='\t',
+                                      lineterminator='\n'))
+        self.assertEqual(output.getvalue(),
+                         'name\thours\nJane\t3\nLydia\t4\n')
+        self.assertEqual(columns.row_count, 2)
+        self.assertEqual(columns.columns, {})
+
 
 class SpreadsheetEntryTest(unittest.TestCase):
     def setUp(self):
@@ -658,7 +904,8 @@ class DataClassSanityTest(unittest.TestCase):
 
 def suite():
     return conf.build_suite([SpreadsheetEntryTest, DataClassSanityTest,
-                             ListEntryTest, RecordEntryTest])
+                             ListEntryTest, RecordEntryTest, CellGridTest,
+                             UpdateCellsTest, ListColumnsTest])
 
 
 if __name__ == '__main__':
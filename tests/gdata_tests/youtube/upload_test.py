@@ -0,0 +1,282 @@
+#
+# Licensed under the Apache License 2.0;
+
+
+import io
+import os
+import re
+import shutil
+import tempfile
+import threading
+import unittest
+
+import atom
+import atom.data
+import atom.http_core
+import gdata.client
+import gdata.youtube
+import gdata.youtube.client
+import gdata.youtube.data
+import gdata.youtube.service
+import gdata.youtube.upload
+import gdata.test_config as conf
+
+SESSION_URI = 'https://uploads.gdata.youtube.com/session/%s'
+V1_APP_NAMESPACE = 'http://purl.org/atom/app#'
+V2_APP_NAMESPACE = 'http://www.w3.org/2007/app'
+
+
+class FakeResponse(object):
+    def __init__(self, status, headers=None, body=b''):
+        self.status = status
+        self.reason = 'reason %s' % status
+        self.headers = headers or {}
+        self.body = body
+
+    def read(self):
+        return self.body
+
+    def getheader(self, name, default=None):
+        return self.headers.get(name.lower(), default)
+
+    def getheaders(self):
+        return list(self.headers.items())
+
+
+class FakeUploadServer(object):
+    """Accepts resumable uploads and reports the processing of the videos.
+
+    failures lists the (title, chunk number) pairs of the chunks answered
+    with 503, counting the chunks of each upload from 1. statuses maps a
+    video title to the upload states reported by successive status checks,
+    the video is published after the last one.
+    """
+
+    def __init__(self, app_namespace):
+        self.app_namespace = app_namespace
+        self.sessions = []
+        self.videos = {}
+        self.requests = []
+        self.chunks = 0
+        self.failures = []
+        self.statuses = {}
+        self.lock = threading.Lock()
+
+    def handle(self, method, uri, headers, body):
+        with self.lock:
+            self.requests.append((method, uri))
+            if method == 'GET':
+                return self._video(uri.split('/')[-1])
+            if '/resumable/' in uri:
+                title = re.search(r'<(?:\w+:)?title[^>]*>([^<]*)<',
+                                  body.decode('utf-8')).group(1)
+                self.sessions.append({'title': title, 'slug': headers['Slug'],
+                                      'data': b'', 'id': None,
+                                      'chunks': 0})
+                return FakeResponse(200, {'location': SESSION_URI % (
+                    len(self.sessions) - 1)})
+            session = self.sessions[int(uri.split('/')[-1])]
+            start, end, total = re.match(r'bytes (\d+|\*)-?(\d*)/(\d+)',
+                                         headers['Content-Range']).groups()
+            if start != '*':
+                self.chunks += 1
+                session['chunks'] += 1
+                if (session['title'], session['chunks']) in self.failures:
+                    return FakeResponse(503, body=b'Backend error')
+                assert int(start) == len(session['data'])
+                assert int(end) - int(start) + 1 == len(body)
+                session['data'] += body
+            if len(session['data']) < int(total):
+                headers = {}
+                if session['data']:
+                    headers['range'] = 'bytes=0-%s' % (
+                        len(session['data']) - 1)
+                return FakeResponse(308, headers)
+            if session['id'] is None:
+                session['id'] = 'video%s' % len(self.videos)
+                self.videos[session['id']] = session
+            return FakeResponse(201, body=self._entry(session))
+
+    def _entry(self, session, state=None):
+        control = ''
+        if state is not None:
+            control = ('<app:control xmlns:app="%s"><app:draft>yes</app:draft>'
+                       '<yt:state name="%s">%s details</yt:state>'
+                       '</app:control>' % (self.app_namespace, state, state))
+        return ('<entry xmlns="http://www.w3.org/2005/Atom" '
+                'xmlns:yt="http://gdata.youtube.com/schemas/2007">'
+                '<id>tag:youtube.com,2008:video:%s</id><title>%s</title>%s'
+                '</entry>' % (session['id'], session['title'],
+                              control)).encode('utf-8')
+
+    def _video(self, video_id):
+        session = self.videos[video_id]
+        states = self.statuses.get(session['title'])
+        state = None
+        if states:
+            state = states.pop(0)
+        return FakeResponse(200, body=self._entry(session, state))
+
+
+class V1Transport(object):
+    def __init__(self, server):
+        self.server = server
+
+    def request(self, operation, url, data=None, headers=None):
+        if data is None:
+            data = b''
+        return self.server.handle(operation, str(url), headers, bytes(data))
+
+
+class V2Transport(object):
+    def __init__(self, server):
+        self.server = server
+
+    def request(self, http_request):
+        body = b''
+        for part in http_request._body_parts:
+            if isinstance(part, str):
+                part = part.encode('utf-8')
+            body += bytes(part)
+        response = self.server.handle(http_request.method,
+                                      str(http_request.uri),
+                                      http_request.headers, body)
+        return atom.http_core.HttpResponse(
+            response.status, response.reason, response.headers,
+            io.BytesIO(response.body))
+
+
+class BandwidthLimiterTest(unittest.TestCase):
+    def testSharedBudget(self):
+        now = [0.0]
+        sleeps = []
+
+        def sleep(seconds):
+            sleeps.append(seconds)
+            now[0] += seconds
+
+        limiter = gdata.youtube.upload.BandwidthLimiter(
+            100, burst=200, clock=lambda: now[0], sleep=sleep)
+        self.assertEqual(limiter.bytes_per_second, 100)
+        self.assertEqual(limiter.acquire(150), 0)
+        self.assertEqual(limiter.acquire(100), 0.5)
+        # The bucket refills with time, up to the burst.
+        now[0] += 10
+        self.assertEqual(limiter.acquire(200), 0)
+        self.assertEqual(limiter.acquire(50), 0.5)
+        self.assertEqual(sleeps, [0.5, 0.5])
+
+
+class UploadTest(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.store_path = os.path.join(self.temp_dir, 'sessions.json')
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def write_video(self, name, size):
+        path = os.path.join(self.temp_dir, name)
+        with open(path, 'wb') as video:
+            video.write(os.urandom(size))
+        return path
+
+    def read(self, path):
+        with open(path, 'rb') as video:
+            return video.read()
+
+    def testServiceResumesAfterFailure(self):
+        server = FakeUploadServer(V1_APP_NAMESPACE)
+        server.failures = [('Holiday', 2)]
+        server.statuses = {'Holiday': ['processing']}
+        service = gdata.youtube.service.YouTubeService()
+        service.http_client = V1Transport(server)
+        path = self.write_video('holiday.mov', 600000)
+        entry = gdata.youtube.YouTubeVideoEntry(
+            title=atom.Title(text='Holiday'))
+
+        store = gdata.client.FileUploadSessionStore(self.store_path)
+        try:
+            service.InsertVideoEntryResumable(
+                entry, path, session_store=store, chunk_size=262144)
+            self.fail('The second chunk should have failed')
+        except gdata.youtube.service.YouTubeError as error:
+            self.assertEqual(error.args[0]['status'], 503)
+        self.assertEqual(len(server.sessions[0]['data']), 262144)
+
+        # A new process finds the session in the file and resumes it.
+        store = gdata.client.FileUploadSessionStore(self.store_path)
+        uploaded = service.InsertVideoEntryResumable(
+            entry, path, session_store=store, chunk_size=262144)
+        self.assertTrue(isinstance(uploaded,
+                                   gdata.youtube.YouTubeVideoEntry))
+        self.assertEqual(gdata.youtube.upload.get_video_id(uploaded),
+                         'video0')
+        self.assertEqual(len(server.sessions), 1)
+        self.assertEqual(server.sessions[0]['slug'], 'holiday.mov')
+        self.assertEqual(server.sessions[0]['data'], self.read(path))
+        self.assertEqual(gdata.client.FileUploadSessionStore(
+            self.store_path)._sessions, {})
+        self.assertEqual(server.chunks, 4)
+
+        self.assertEqual(service.CheckUploadStatus(video_id='video0'),
+                         ('processing', 'processing details'))
+        self.assertEqual(service.CheckUploadStatus(video_id='video0'), None)
+
+    def testParallelUploadsWithClient(self):
+        server = FakeUploadServer(V2_APP_NAMESPACE)
+        server.statuses = {'first': ['processing', 'processing'],
+                           'second': ['rejected']}
+        server.failures = [('first', 2)]
+        client = gdata.youtube.client.YouTubeClient()
+        client.http_client = V2Transport(server)
+        now = [0.0]
+        delays = []
+        limiter = gdata.youtube.upload.BandwidthLimiter(
+            100000, clock=lambda: now[0], sleep=delays.append)
+        sleeps = []
+        uploader = gdata.youtube.upload.ParallelVideoUploader(
+            client, gdata.client.UploadSessionStore(), limiter=limiter,
+            max_workers=2, chunk_size=262144, poll_interval=5,
+            sleep=sleeps.append)
+        uploads = []
+        for title, size in (('first', 300000), ('second', 1000),
+                            ('third', 1000)):
+            uploads.append(gdata.youtube.upload.VideoUpload(
+                gdata.youtube.data.VideoEntry(
+                    title=atom.data.Title(text=title)),
+                self.write_video(title + '.mov', size)))
+        done = []
+        uploader.upload(uploads, progress=done.append)
+        self.assertEqual(sorted(done, key=uploads.index), uploads)
+        failed = [upload for upload in uploads if upload.error is not None]
+        self.assertEqual(len(failed), 1)
+        self.assertEqual(failed[0].error.status, 503)
+
+        # Running again resumes the failed upload.
+        failed[0].error = None
+        uploader.upload(failed)
+        for upload in uploads:
+            self.assertEqual(upload.error, None)
+            session = server.videos[upload.video_id]
+            self.assertEqual(session['title'], upload.entry.title.text)
+            self.assertEqual(session['data'], self.read(upload.path))
+        # Every chunk sent went through the shared budget, the failed one
+        # twice.
+        self.assertEqual(max(delays), (339856 - 100000) / 100000.0)
+
+        self.assertEqual(uploader.wait_for_processing(uploads), [])
+        self.assertEqual([(upload.state, upload.message)
+                          for upload in uploads],
+                         [('published', None),
+                          ('rejected', 'rejected details'),
+                          ('published', None)])
+        self.assertEqual(sleeps, [5, 5])
+
+
+def suite():
+    return conf.build_suite([BandwidthLimiterTest, UploadTest])
+
+
+if __name__ == '__main__':
+    unittest.main()